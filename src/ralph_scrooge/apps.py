@@ -6,3 +6,7 @@ from django.utils.translation import ugettext_lazy as _
 class ScroogeAppConfig(AppConfig):
     name = 'ralph_scrooge'
     verbose_name = _('Scrooge')
+
+    def ready(self):
+        # connect signals maintaining daily usages totals
+        from ralph_scrooge.utils import usage_totals  # noqa
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ralph_scrooge.models import DailyCost, DailyCostStaging
+from ralph_scrooge.utils.bulk_writer import BULK_WRITERS, get_bulk_writer
+
+# rows are saved (and then removed) in staging table with this date
+BENCHMARK_DATE = date(1970, 1, 1)
+
+
+def generate_daily_costs(count):
+    """
+    Generate count of (synthetic) DailyCost namedtuples, in the same form as
+    built by `DailyCost._build_tree`.
+    """
+    for i in xrange(count):
+        depth = i % 3
+        yield DailyCost.namedtuple(
+            path='/'.join(str(i + d) for d in range(depth + 1)),
+            depth=depth,
+            pricing_object_id=i % 1000 or None,
+            service_environment_id=i % 100 + 1,
+            type_id=i % 50 + 1,
+            value=float(i % 7),
+            cost=Decimal(i).scaleb(-6) * 3,
+            forecast=True,
+            date=BENCHMARK_DATE,
+        )
+
+
+class Command(BaseCommand):
+    """
+    Compare speed (rows per second) of daily costs bulk writers.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            dest='rows',
+            default=100000,
+            help='Number of rows saved by every writer',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=None,
+            help='Batch size (DAILY_COST_CREATE_BATCH_SIZE by default)',
+        )
+        parser.add_argument(
+            '--writer',
+            dest='writers',
+            action='append',
+            choices=sorted(BULK_WRITERS),
+            help='Writer to test (all by default)',
+        )
+
+    def handle(self, *args, **options):
+        rows = list(generate_daily_costs(options['rows']))
+        for name in options['writers'] or sorted(BULK_WRITERS):
+            writer = get_bulk_writer(
+                DailyCostStaging, name, batch_size=options['batch_size']
+            )
+            start = time.time()
+            with transaction.atomic():
+                count = writer.write(rows)
+            elapsed = time.time() - start
+            DailyCostStaging.objects.filter(
+                date=BENCHMARK_DATE, forecast=True
+            ).delete()
+            self.stdout.write('{}: {} rows in {:.2f}s ({:.0f} rows/s)'.format(
+                name, count, elapsed, count / elapsed if elapsed else 0,
+            ))
@@ -9,10 +9,15 @@ import argparse
 import logging
 from datetime import date, datetime, timedelta
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils.translation import ugettext_lazy as _
 
-from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.collector import (
+    BOTH_FORECASTS,
+    Collector,
+    get_forecasts,
+)
 from ralph_scrooge.models import (
     CostDateStatus,
     PricingService,
@@ -78,6 +83,16 @@ class Command(BaseCommand):
             action='store_true',
             help=_('Use forecast prices and costs')
         )
+        parser.add_argument(
+            '--with-forecast',
+            dest='with_forecast',
+            default=False,
+            action='store_true',
+            help=_(
+                'Calculate real and forecast costs (in single pass). '
+                "Overrides '--forecast' option."
+            )
+        )
         parser.add_argument(
             '--force',
             dest='force',
@@ -98,6 +113,16 @@ class Command(BaseCommand):
                 'Pricing Service name(s) to which calculate daily costs for'
             )
         )
+        parser.add_argument(
+            '--workers',
+            dest='workers',
+            type=int,
+            default=settings.SCROOGE_COSTS_WORKERS,
+            help=_(
+                "Number of processes calculating daily costs of date range "
+                "in parallel."
+            )
+        )
 
     def _has_calculated_costs(self, date_, forecast):
         return CostDateStatus.objects.filter(
@@ -111,9 +136,7 @@ class Command(BaseCommand):
             **{'forecast_accepted' if forecast else 'accepted': True}
         ).exists()
 
-    def _calculate_costs(self, date_, forecast, pricing_service_names, force):
-        collector = Collector()
-
+    def _get_plugins(self, collector, pricing_service_names):
         # By default, take all PricingServices that are active and have fixed
         # price...
         query_params = {
@@ -147,7 +170,13 @@ class Command(BaseCommand):
                 "No Pricing Service(s) that are both active and have fixed "
                 "price. Aborting."
             )
-            return
+            return []
+        return [
+            p for p in collector.get_plugins()
+            if p.name in pricing_service_names_verified
+        ]
+
+    def _can_calculate_costs(self, date_, forecast, force):
         if self._has_accepted_costs(date_, forecast):
             msg = (
                 "The costs for the selected date and pricing service are "
@@ -158,20 +187,42 @@ class Command(BaseCommand):
                     (msg, "'--force' option can't be used here.")
                 )
             logger.error(" ".join((msg, "Aborting.")))
-            return
+            return False
         if not force and self._has_calculated_costs(date_, forecast):
             logger.error(
                 "The costs for the selected date and pricing service are "
                 "already calculated. If you need to re-calculate them, use "
                 "'--force' option. Aborting."
             )
-            return
+            return False
+        return True
 
-        plugins = [
-            p for p in collector.get_plugins()
-            if p.name in pricing_service_names_verified
+    def _calculate_costs(
+        self, dates, forecast, pricing_service_names, force, workers,
+    ):
+        collector = Collector()
+        plugins = self._get_plugins(collector, pricing_service_names)
+        if not plugins:
+            return
+        dates = [
+            date_ for date_ in dates
+            if all(
+                self._can_calculate_costs(date_, flag, force)
+                for flag in get_forecasts(forecast)
+            )
         ]
-        collector.calculate_daily_costs_for_day(date_, forecast, plugins)
+        for date_, success in collector.process_days(
+            dates,
+            forecast,
+            workers=workers,
+            save=True,
+            force=force,
+            plugins=plugins,
+        ):
+            if not success:
+                logger.error(
+                    "Costs for {} could not be calculated.".format(date_)
+                )
 
     def handle(self, *args, **options):
         date_start = options['date_start']
@@ -191,10 +242,13 @@ class Command(BaseCommand):
         else:
             dates = [options['date']]
 
-        for date_ in dates:
-            self._calculate_costs(
-                date_,
-                options['forecast'],
-                options['pricing_service_names'],
-                options['force'],
-            )
+        forecast = options['forecast']
+        if options['with_forecast']:
+            forecast = BOTH_FORECASTS
+        self._calculate_costs(
+            dates,
+            forecast,
+            options['pricing_service_names'],
+            options['force'],
+            options['workers'],
+        )
@@ -19,7 +19,6 @@ from django.db.models import Sum
 from django.template.loader import render_to_string
 
 from ralph_scrooge.models import (
-    DailyUsage,
     ServiceUsageTypes,
     UsageAnomalyAck,
     UsageType,
@@ -30,6 +29,7 @@ from ralph_scrooge.rest_api.public.v0_10.service_environment_costs import (
     date_range,
 )
 from ralph_scrooge.utils.common import validate_date
+from ralph_scrooge.utils.usage_totals import get_usages_model
 
 
 class UnknownUsageTypeUploadFreqError(Exception):
@@ -109,7 +109,7 @@ def _get_usage_values_for_month(usage_types, end_date):
             ).next()
         results[ut] = {}
         daily_usages = dict(
-            DailyUsage.objects.filter(
+            get_usages_model().objects.filter(
                 date__gte=start_date, date__lte=end_date, type=ut
             ).values_list('date').annotate(Sum('value'))
         )
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ralph_scrooge.models import TeamBillingType
+from ralph_scrooge.utils.benchmark import (
+    DEFAULT_PRICING_OBJECT_TYPES,
+    DEFAULT_TEAMS,
+    generate_dataset,
+    run_benchmark,
+    STAGES,
+)
+
+# dataset is generated for days starting with this date
+BENCHMARK_START = date(1971, 1, 1)
+
+
+def _team(value):
+    """
+    Parse team billing type and count (ex. "time=2").
+    """
+    billing_type, _, count = value.partition('=')
+    if not hasattr(TeamBillingType, billing_type):
+        raise CommandError('Unknown team billing type: {}'.format(
+            billing_type
+        ))
+    return billing_type, int(count or 1)
+
+
+class Command(BaseCommand):
+    """
+    Benchmark costs calculation pipeline (see
+    `ralph_scrooge.utils.benchmark`) using synthetic dataset. Dataset is
+    generated (and benchmark is run) in transaction, which is rolled back
+    at the end (unless --keep is passed).
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--services',
+            type=int,
+            default=10,
+            help='Number of services (and service environments).',
+        )
+        parser.add_argument(
+            '--pricing-objects',
+            type=int,
+            default=5,
+            help='Number of pricing objects of every type per service.',
+        )
+        parser.add_argument(
+            '--pricing-object-type',
+            dest='pricing_object_types',
+            action='append',
+            help='Type of pricing objects (default: {}).'.format(
+                ', '.join(DEFAULT_PRICING_OBJECT_TYPES)
+            ),
+        )
+        parser.add_argument(
+            '--usage-types',
+            type=int,
+            default=3,
+            help='Number of usage types.',
+        )
+        parser.add_argument(
+            '--pricing-services',
+            type=int,
+            default=2,
+            help='Number of pricing services.',
+        )
+        parser.add_argument(
+            '--fanout',
+            type=int,
+            default=1,
+            help='Number of pricing services used by every pricing service.',
+        )
+        parser.add_argument(
+            '--team',
+            dest='teams',
+            type=_team,
+            action='append',
+            help='Team billing type and number of teams (ex. "time=2"; '
+                 'default: {}).'.format(', '.join(
+                     '{}={}'.format(*team) for team in DEFAULT_TEAMS.items()
+                 )),
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=1,
+            help='Number of days.',
+        )
+        parser.add_argument(
+            '--stage',
+            dest='stages',
+            action='append',
+            choices=list(STAGES),
+            help='Stage to run (all by default).',
+        )
+        parser.add_argument(
+            '--forecast',
+            action='store_true',
+            default=False,
+            help='Calculate forecast costs.',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            default=False,
+            help='Keep generated dataset (and costs) in database.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            dataset = generate_dataset(
+                BENCHMARK_START,
+                BENCHMARK_START + timedelta(days=options['days'] - 1),
+                services=options['services'],
+                pricing_objects=options['pricing_objects'],
+                pricing_object_types=(
+                    options['pricing_object_types'] or
+                    DEFAULT_PRICING_OBJECT_TYPES
+                ),
+                usage_types=options['usage_types'],
+                pricing_services=options['pricing_services'],
+                pricing_services_fanout=options['fanout'],
+                teams=OrderedDict(options['teams'] or DEFAULT_TEAMS),
+            )
+            profiles = run_benchmark(
+                dataset, options['stages'], options['forecast']
+            )
+            if not options['keep']:
+                transaction.set_rollback(True)
+        self.stdout.write('\t'.join([
+            'stage', 'time [s]', 'items', 'items/s', 'queries',
+            'queries time [s]', 'RSS delta [kB]',
+        ]))
+        for profile in profiles:
+            self.stdout.write('\t'.join([
+                profile.name,
+                '{:.2f}'.format(profile.wall_time),
+                str(profile.entries),
+                '{:.0f}'.format(
+                    profile.entries / profile.wall_time
+                    if profile.wall_time else 0
+                ),
+                str(profile.queries.count),
+                '{:.2f}'.format(profile.queries.time),
+                str(profile.rss_delta),
+            ]))
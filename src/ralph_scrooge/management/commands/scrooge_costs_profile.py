@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+
+from ralph_scrooge.models import CostCalculationRun
+from ralph_scrooge.utils.common import validate_date
+
+# columns of plugins profiles which could be used for ordering
+ORDER_BY = OrderedDict([
+    ('wall_time', 'time [s]'),
+    ('queries_count', 'queries'),
+    ('queries_time', 'queries time [s]'),
+    ('entries', 'entries'),
+    ('rss_delta', 'RSS delta [kB]'),
+])
+
+
+def get_plugins_stats(runs):
+    """
+    Returns sum of profiles of every plugin (by name) in every run (and
+    number of runs in which plugin was profiled).
+
+    :rtype: dict
+    """
+    stats = {}
+    for run in runs:
+        for profile in json.loads(run.plugins):
+            plugin_stats = stats.setdefault(
+                profile['name'], dict.fromkeys(list(ORDER_BY) + ['runs'], 0)
+            )
+            plugin_stats['runs'] += 1
+            for column in ORDER_BY:
+                plugin_stats[column] += profile[column]
+    return stats
+
+
+class Command(BaseCommand):
+    """
+    Print slowest cost plugins (summed over costs calculation runs - see
+    `CostCalculationRun`).
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-s',
+            type=validate_date,
+            dest='start_date',
+            default=None,
+            help="First day of runs (default: first day with runs).",
+        )
+        parser.add_argument(
+            '-e',
+            type=validate_date,
+            dest='end_date',
+            default=None,
+            help="Last day of runs (default: last day with runs).",
+        )
+        parser.add_argument(
+            '-f',
+            '--forecast',
+            dest='forecast',
+            action='store_true',
+            default=False,
+            help="Show runs of forecast costs calculation.",
+        )
+        parser.add_argument(
+            '-n',
+            type=int,
+            dest='limit',
+            default=20,
+            help="Number of plugins to show.",
+        )
+        parser.add_argument(
+            '--order-by',
+            dest='order_by',
+            choices=list(ORDER_BY),
+            default='wall_time',
+            help="Order plugins by (default: wall time).",
+        )
+
+    def handle(self, start_date, end_date, forecast, limit, order_by, *args,
+               **options):
+        runs = CostCalculationRun.objects.filter(forecast=forecast)
+        if start_date:
+            runs = runs.filter(date__gte=start_date)
+        if end_date:
+            runs = runs.filter(date__lte=end_date)
+        runs = list(runs)
+        if not runs:
+            self.stdout.write('No costs calculation runs')
+            return
+        self.stdout.write(
+            '{} runs in {:.2f}s ({} SQL queries in {:.2f}s)'.format(
+                len(runs),
+                sum(run.wall_time for run in runs),
+                sum(run.queries_count for run in runs),
+                sum(run.queries_time for run in runs),
+            )
+        )
+        stats = sorted(
+            get_plugins_stats(runs).items(),
+            key=lambda item: item[1][order_by],
+            reverse=True,
+        )[:limit]
+        self.stdout.write('\t'.join(['plugin', 'runs'] + ORDER_BY.values()))
+        for name, plugin_stats in stats:
+            self.stdout.write('\t'.join(
+                [name, str(plugin_stats['runs'])] + [
+                    '{:.2f}'.format(plugin_stats[column])
+                    if isinstance(plugin_stats[column], float)
+                    else str(plugin_stats[column])
+                    for column in ORDER_BY
+                ]
+            ))
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ralph_scrooge.utils.worker_job import get_jobs_stats, WAIT_TIMES_COUNT
+
+
+class Command(BaseCommand):
+    """
+    Print depth of every RQ queue and statistics of jobs of every job class
+    (number of running jobs and wait times of recent jobs - see
+    `ralph_scrooge.utils.worker_job.get_jobs_stats`).
+    """
+    def handle(self, *args, **options):
+        queues, jobs = get_jobs_stats()
+        self.stdout.write('\t'.join(['queue', 'depth']))
+        for name, depth in queues.items():
+            self.stdout.write('\t'.join([name, str(depth)]))
+        self.stdout.write('')
+        self.stdout.write('\t'.join([
+            'job', 'running',
+            'wait avg [s] (last {})'.format(WAIT_TIMES_COUNT),
+            'wait median [s]', 'wait max [s]',
+        ]))
+        for name, stats in jobs.items():
+            self.stdout.write('\t'.join([
+                name,
+                str(stats['running']),
+                '{:.2f}'.format(stats['wait_avg']),
+                '{:.2f}'.format(stats['wait_median']),
+                '{:.2f}'.format(stats['wait_max']),
+            ]))
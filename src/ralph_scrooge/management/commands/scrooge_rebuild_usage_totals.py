@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from ralph_scrooge.models import DailyUsage
+from ralph_scrooge.utils.common import validate_date
+from ralph_scrooge.utils.usage_totals import refresh_daily_usage_totals
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Rebuild daily usages totals (see `DailyUsageTotal`) between start and end
+    date (by default for all days with daily usages).
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-s',
+            type=validate_date,
+            dest='start_date',
+            default=None,
+            help="First day to rebuild (default: first day with usages).",
+        )
+        parser.add_argument(
+            '-e',
+            type=validate_date,
+            dest='end_date',
+            default=None,
+            help="Last day to rebuild (default: last day with usages).",
+        )
+
+    def handle(self, start_date, end_date, *args, **options):
+        dates = DailyUsage.objects.aggregate(
+            start=Min('date'),
+            end=Max('date'),
+        )
+        start_date = start_date or dates['start']
+        end_date = end_date or dates['end']
+        if not start_date or not end_date:
+            logger.info('No daily usages to rebuild totals')
+            return
+        day = start_date
+        while day <= end_date:
+            # every day is rebuilt in separate transaction
+            refresh_daily_usage_totals(day)
+            logger.info('Daily usages totals rebuilt for {}'.format(day))
+            day += timedelta(days=1)
@@ -15,6 +15,7 @@ from django.conf import settings
 
 from ralph_scrooge.models import SyncStatus
 from ralph_scrooge.plugins import plugin_runner
+from ralph_scrooge.utils.usage_totals import defer_daily_usage_totals
 
 
 logger = logging.getLogger(__name__)
@@ -50,11 +51,14 @@ def _run_plugin(name, today):
     success, message = False, None
     sync_status = SyncStatus.objects.get_or_create(plugin=name, date=today)[0]
     try:
-        success, message = plugin_runner.run_plugin(
-            'scrooge',
-            name,
-            today=today,
-        )
+        # totals of daily usages saved by plugin are recalculated once, after
+        # plugin is finished
+        with defer_daily_usage_totals():
+            success, message = plugin_runner.run_plugin(
+                'scrooge',
+                name,
+                today=today,
+            )
         if not success:
             raise PluginError(message)
     except Exception as e:
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 21:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ralph_scrooge', '0018_dailycoststaging'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='costdatestatus',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40, verbose_name='fingerprint'),
+        ),
+        migrations.AddField(
+            model_name='costdatestatus',
+            name='forecast_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40, verbose_name='forecast fingerprint'),
+        ),
+    ]
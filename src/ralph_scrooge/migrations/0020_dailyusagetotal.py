@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 21:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ralph_scrooge', '0019_costdatestatus_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUsageTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('value', models.FloatField(default=0, verbose_name='value')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='daily usages count')),
+                ('service_environment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ralph_scrooge.ServiceEnvironment', verbose_name='service environment')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ralph_scrooge.UsageType', verbose_name='usage type')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ralph_scrooge.Warehouse', verbose_name='warehouse')),
+            ],
+            options={
+                'verbose_name': 'daily usage total',
+                'verbose_name_plural': 'daily usages totals',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyusagetotal',
+            unique_together=set([('type', 'date', 'warehouse', 'service_environment')]),
+        ),
+        # fill totals with existing daily usages
+        migrations.RunSQL(
+            """
+            INSERT INTO ralph_scrooge_dailyusagetotal
+                (date, type_id, warehouse_id, service_environment_id, value,
+                count)
+            SELECT date, type_id, warehouse_id, service_environment_id,
+                SUM(value), COUNT(*)
+            FROM ralph_scrooge_dailyusage
+            GROUP BY date, type_id, warehouse_id, service_environment_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 22:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ralph_scrooge', '0020_dailyusagetotal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPricingServiceCost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('forecast', models.BooleanField(default=False, verbose_name='forecast')),
+                ('cost', models.DecimalField(decimal_places=6, default=0, max_digits=16, verbose_name='cost')),
+                ('max_depth', models.PositiveSmallIntegerField(default=0, verbose_name='max depth')),
+                ('hierarchy', models.TextField(verbose_name='hierarchy')),
+            ],
+            options={
+                'verbose_name': 'daily pricing service cost',
+                'verbose_name_plural': 'daily pricing services costs',
+            },
+        ),
+        migrations.AddField(
+            model_name='pricingservice',
+            name='costs_depth',
+            field=models.PositiveSmallIntegerField(blank=True, default=None, help_text='maximum depth of saved hierarchy of pricing service costs (0 - only pricing service cost). Deeper costs are calculated on demand. Leave empty to use default depth', null=True, verbose_name='costs depth'),
+        ),
+        migrations.AddField(
+            model_name='dailypricingservicecost',
+            name='pricing_service',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ralph_scrooge.PricingService', verbose_name='pricing service'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailypricingservicecost',
+            unique_together=set([('pricing_service', 'date', 'forecast')]),
+        ),
+    ]
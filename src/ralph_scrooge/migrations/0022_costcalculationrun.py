@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 22:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ralph_scrooge', '0021_pricing_service_costs_depth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostCalculationRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='date')),
+                ('forecast', models.BooleanField(default=False, verbose_name='forecast')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('wall_time', models.FloatField(default=0, verbose_name='wall time')),
+                ('queries_count', models.PositiveIntegerField(default=0, verbose_name='queries count')),
+                ('queries_time', models.FloatField(default=0, verbose_name='queries time')),
+                ('entries', models.PositiveIntegerField(default=0, verbose_name='entries')),
+                ('rss_delta', models.PositiveIntegerField(default=0, verbose_name='RSS delta')),
+                ('plugins', models.TextField(default='[]', verbose_name='plugins')),
+            ],
+            options={
+                'verbose_name': 'cost calculation run',
+                'verbose_name_plural': 'cost calculation runs',
+            },
+        ),
+    ]
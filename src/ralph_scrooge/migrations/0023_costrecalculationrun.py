@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 22:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ralph_scrooge', '0022_costcalculationrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostRecalculationCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('fingerprint', models.CharField(blank=True, default='', editable=False, max_length=40, verbose_name='fingerprint')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+            ],
+            options={
+                'verbose_name': 'cost recalculation checkpoint',
+                'verbose_name_plural': 'cost recalculation checkpoints',
+            },
+        ),
+        migrations.CreateModel(
+            name='CostRecalculationRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateField(verbose_name='start')),
+                ('end', models.DateField(verbose_name='end')),
+                ('forecast', models.BooleanField(default=False, verbose_name='forecast')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('finished', models.DateTimeField(blank=True, default=None, editable=False, null=True, verbose_name='finished')),
+            ],
+            options={
+                'verbose_name': 'cost recalculation run',
+                'verbose_name_plural': 'cost recalculation runs',
+            },
+        ),
+        migrations.AddField(
+            model_name='costrecalculationcheckpoint',
+            name='run',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='ralph_scrooge.CostRecalculationRun', verbose_name='run'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='costrecalculationcheckpoint',
+            unique_together=set([('run', 'date')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 23:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ralph_scrooge', '0023_costrecalculationrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPricingServiceCostStaging',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('forecast', models.BooleanField(default=False)),
+                ('cost', models.DecimalField(decimal_places=6, default=0, max_digits=16)),
+                ('max_depth', models.PositiveSmallIntegerField(default=0)),
+                ('hierarchy', models.TextField()),
+                ('pricing_service', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ralph_scrooge.PricingService')),
+            ],
+            options={
+                'verbose_name': 'daily pricing service cost (staging)',
+                'verbose_name_plural': 'daily pricing services costs (staging)',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailypricingservicecoststaging',
+            unique_together=set([('pricing_service', 'date', 'forecast')]),
+        ),
+    ]
@@ -1,6 +1,15 @@
 from ralph_scrooge.models.base import BaseUsage, BaseUsageType
 
-from ralph_scrooge.models.cost import CostDateStatus, DailyCost
+from ralph_scrooge.models.cost import (
+    CostCalculationRun,
+    CostDateStatus,
+    CostRecalculationCheckpoint,
+    CostRecalculationRun,
+    DailyCost,
+    DailyCostStaging,
+    DailyPricingServiceCost,
+    DailyPricingServiceCostStaging,
+)
 
 from ralph_scrooge.models.extra_cost import (
     DynamicExtraCost,
@@ -68,6 +77,7 @@ from ralph_scrooge.models.team import (
 
 from ralph_scrooge.models.usage import (
     DailyUsage,
+    DailyUsageTotal,
     UsagePrice,
     UsageType,
     UsageAnomalyAck,
@@ -84,14 +94,21 @@ __all__ = [
     'BaseUsage',
     'BaseUsageType',
     'BusinessLine',
+    'CostCalculationRun',
     'CostDateStatus',
+    'CostRecalculationCheckpoint',
+    'CostRecalculationRun',
     'DailyAssetInfo',
     'DailyBackOfficeAssetInfo',
     'DailyCost',
+    'DailyCostStaging',
+    'DailyPricingServiceCost',
+    'DailyPricingServiceCostStaging',
     'DailyDatabaseInfo',
     'DailyPricingObject',
     'DailyTenantInfo',
     'DailyUsage',
+    'DailyUsageTotal',
     'DailyVIPInfo',
     'DailyVirtualInfo',
     'DatabaseInfo',
@@ -6,6 +6,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from django.db import models as db
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from ralph_scrooge.models._tree import MultiPathNode, MultiPathNodeQuerySet
@@ -96,6 +97,126 @@ class DailyCost(MultiPathNode, db.Model):
         return True
 
 
+class DailyCostStaging(MultiPathNode, db.Model):
+    """
+    Staging area for recalculated daily costs. Costs of every day are saved
+    here as soon as they're calculated and then whole period is published
+    (moved to DailyCost) at once (see `Collector.publish_staged_costs`).
+
+    Table has exactly the same columns as DailyCost table.
+    """
+    _path_field = 'type_id'
+    objects = db.Manager.from_queryset(MultiPathNodeQuerySet)()
+
+    pricing_object = db.ForeignKey(
+        'PricingObject',
+        null=True,
+        blank=True,
+        related_name='+',
+        db_constraint=False,
+    )
+    service_environment = db.ForeignKey(
+        'ServiceEnvironment',
+        related_name='+',
+        db_constraint=False,
+    )
+    type = db.ForeignKey(
+        'BaseUsage',
+        related_name='+',
+        db_constraint=False,
+    )
+    warehouse = db.ForeignKey(
+        'Warehouse',
+        null=True,
+        blank=True,
+        related_name='+',
+        db_constraint=False,
+    )
+    value = db.FloatField(default=0)
+    cost = db.DecimalField(
+        max_digits=PRICE_DIGITS,
+        decimal_places=PRICE_PLACES,
+        default=0,
+    )
+    forecast = db.BooleanField(default=False)
+    date = db.DateField()
+
+    class Meta:
+        verbose_name = _("daily cost (staging)")
+        verbose_name_plural = _("daily costs (staging)")
+        app_label = 'ralph_scrooge'
+
+
+class DailyPricingServiceCost(db.Model):
+    """
+    Hierarchy of costs of pricing service in single day (as calculated by
+    pricing service plugin), saved when daily costs of pricing service are
+    saved only to limited depth (see `PricingService.costs_depth`). Deeper
+    costs are calculated from hierarchy on demand (see
+    `ralph_scrooge.utils.costs_hierarchy`).
+    """
+    pricing_service = db.ForeignKey(
+        'PricingService',
+        verbose_name=_("pricing service"),
+        related_name='+',
+    )
+    date = db.DateField(verbose_name=_("date"))
+    forecast = db.BooleanField(verbose_name=_("forecast"), default=False)
+    cost = db.DecimalField(
+        verbose_name=_("cost"),
+        max_digits=PRICE_DIGITS,
+        decimal_places=PRICE_PLACES,
+        default=0,
+    )
+    # depth to which daily costs of pricing service were saved
+    max_depth = db.PositiveSmallIntegerField(
+        verbose_name=_("max depth"),
+        default=0,
+    )
+    # costs hierarchy (see `ralph_scrooge.utils.costs_hierarchy`)
+    hierarchy = db.TextField(verbose_name=_("hierarchy"))
+
+    class Meta:
+        verbose_name = _("daily pricing service cost")
+        verbose_name_plural = _("daily pricing services costs")
+        unique_together = ('pricing_service', 'date', 'forecast')
+        app_label = 'ralph_scrooge'
+
+    def __unicode__(self):
+        return '{} ({})'.format(self.pricing_service_id, self.date)
+
+
+class DailyPricingServiceCostStaging(db.Model):
+    """
+    Staging area for hierarchies of pricing services costs. Hierarchies are
+    saved here when costs of day are calculated and published (moved to
+    DailyPricingServiceCost) together with staged daily costs (see
+    `ralph_scrooge.utils.costs_hierarchy.publish_hierarchies`).
+
+    Table has exactly the same columns as DailyPricingServiceCost table.
+    """
+    pricing_service = db.ForeignKey(
+        'PricingService',
+        related_name='+',
+        db_constraint=False,
+    )
+    date = db.DateField()
+    forecast = db.BooleanField(default=False)
+    cost = db.DecimalField(
+        max_digits=PRICE_DIGITS,
+        decimal_places=PRICE_PLACES,
+        default=0,
+    )
+    max_depth = db.PositiveSmallIntegerField(default=0)
+    hierarchy = db.TextField()
+
+    class Meta:
+        verbose_name = _("daily pricing service cost (staging)")
+        verbose_name_plural = _("daily pricing services costs (staging)")
+        unique_together = ('pricing_service', 'date', 'forecast')
+        app_label = 'ralph_scrooge'
+
+
 class CostDateStatus(db.Model):
     date = db.DateField(
         verbose_name=_('date'),
@@ -121,8 +242,131 @@ class CostDateStatus(db.Model):
         default=False,
         editable=False,
     )
+    # fingerprints of inputs of last successful calculation (see
+    # `ralph_scrooge.plugins.cost.fingerprint`)
+    fingerprint = db.CharField(
+        verbose_name=_("fingerprint"),
+        max_length=40,
+        blank=True,
+        default='',
+        editable=False,
+    )
+    forecast_fingerprint = db.CharField(
+        verbose_name=_("forecast fingerprint"),
+        max_length=40,
+        blank=True,
+        default='',
+        editable=False,
+    )
 
     class Meta:
         verbose_name = _("cost date status")
         verbose_name_plural = _("costs date status")
         app_label = 'ralph_scrooge'
+
+
+class CostCalculationRun(db.Model):
+    """
+    Profile of costs calculation of single day (see
+    `ralph_scrooge.plugins.cost.profiling`).
+    """
+    date = db.DateField(verbose_name=_("date"), db_index=True)
+    forecast = db.BooleanField(verbose_name=_("forecast"), default=False)
+    created = db.DateTimeField(
+        verbose_name=_("created"),
+        default=timezone.now,
+        editable=False,
+    )
+    # wall time and time of SQL queries in seconds
+    wall_time = db.FloatField(verbose_name=_("wall time"), default=0)
+    queries_count = db.PositiveIntegerField(
+        verbose_name=_("queries count"),
+        default=0,
+    )
+    queries_time = db.FloatField(verbose_name=_("queries time"), default=0)
+    entries = db.PositiveIntegerField(verbose_name=_("entries"), default=0)
+    # growth of peak memory (RSS) of process in kilobytes
+    rss_delta = db.PositiveIntegerField(
+        verbose_name=_("RSS delta"),
+        default=0,
+    )
+    # JSON list of profiles of plugins
+    plugins = db.TextField(verbose_name=_("plugins"), default='[]')
+
+    class Meta:
+        verbose_name = _("cost calculation run")
+        verbose_name_plural = _("cost calculation runs")
+        app_label = 'ralph_scrooge'
+
+    def __unicode__(self):
+        return '{} ({:.2f}s)'.format(self.date, self.wall_time)
+
+
+class CostRecalculationRun(db.Model):
+    """
+    Recalculation of costs of period (by master job - see `MonthlyCosts`).
+    Costs of every day are staged and checkpointed (see
+    `CostRecalculationCheckpoint`) as soon as they're calculated, so
+    interrupted recalculation of the same period could be resumed. Costs are
+    published only when all days of period are calculated.
+    """
+    start = db.DateField(verbose_name=_("start"))
+    end = db.DateField(verbose_name=_("end"))
+    forecast = db.BooleanField(verbose_name=_("forecast"), default=False)
+    created = db.DateTimeField(
+        verbose_name=_("created"),
+        default=timezone.now,
+        editable=False,
+    )
+    # set when costs of period are published
+    finished = db.DateTimeField(
+        verbose_name=_("finished"),
+        null=True,
+        blank=True,
+        default=None,
+        editable=False,
+    )
+
+    class Meta:
+        verbose_name = _("cost recalculation run")
+        verbose_name_plural = _("cost recalculation runs")
+        app_label = 'ralph_scrooge'
+
+    def __unicode__(self):
+        return '{} - {}'.format(self.start, self.end)
+
+
+class CostRecalculationCheckpoint(db.Model):
+    """
+    Day of recalculation run, which costs are already staged.
+    """
+    run = db.ForeignKey(
+        CostRecalculationRun,
+        verbose_name=_("run"),
+        related_name='checkpoints',
+    )
+    date = db.DateField(verbose_name=_("date"))
+    # fingerprint of inputs of calculation (see
+    # `ralph_scrooge.plugins.cost.fingerprint`) - staged costs are reused
+    # only if inputs were not changed since then
+    fingerprint = db.CharField(
+        verbose_name=_("fingerprint"),
+        max_length=40,
+        blank=True,
+        default='',
+        editable=False,
+    )
+    created = db.DateTimeField(
+        verbose_name=_("created"),
+        default=timezone.now,
+        editable=False,
+    )
+
+    class Meta:
+        verbose_name = _("cost recalculation checkpoint")
+        verbose_name_plural = _("cost recalculation checkpoints")
+        app_label = 'ralph_scrooge'
+        unique_together = ('run', 'date')
+
+    def __unicode__(self):
+        return '{} ({})'.format(self.date, self.run)
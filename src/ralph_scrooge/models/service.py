@@ -228,6 +228,18 @@ class PricingService(BaseUsage):
         )
     )
 
+    costs_depth = db.PositiveSmallIntegerField(
+        verbose_name=_('costs depth'),
+        blank=True,
+        null=True,
+        default=None,
+        help_text=_(
+            'maximum depth of saved hierarchy of pricing service costs (0 - '
+            'only pricing service cost). Deeper costs are calculated on '
+            'demand. Leave empty to use default depth'
+        ),
+    )
+
     objects_admin = db.Manager()
     objects = BaseUsageManager()
 
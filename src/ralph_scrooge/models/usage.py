@@ -297,3 +297,42 @@ class DailyUsage(db.Model):
             self.date,
             self.value,
         )
+
+
+class DailyUsageTotal(db.Model):
+    """
+    Rollup of daily usages - total value (and number) of daily usages of
+    usage type per day, warehouse and service environment. Totals are
+    maintained on every change of daily usages (see
+    `ralph_scrooge.utils.usage_totals`).
+    """
+    date = db.DateField()
+    type = db.ForeignKey(
+        UsageType,
+        related_name='+',
+        verbose_name=_("usage type"),
+    )
+    warehouse = db.ForeignKey(
+        'Warehouse',
+        related_name='+',
+        verbose_name=_("warehouse"),
+    )
+    service_environment = db.ForeignKey(
+        'ServiceEnvironment',
+        related_name='+',
+        verbose_name=_("service environment"),
+    )
+    value = db.FloatField(verbose_name=_("value"), default=0)
+    count = db.PositiveIntegerField(
+        verbose_name=_("daily usages count"),
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = _("daily usage total")
+        verbose_name_plural = _("daily usages totals")
+        app_label = 'ralph_scrooge'
+        unique_together = ('type', 'date', 'warehouse', 'service_environment')
+
+    def __unicode__(self):
+        return '{0} ({1}) {2}'.format(self.type, self.date, self.value)
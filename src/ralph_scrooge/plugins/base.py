@@ -8,7 +8,7 @@ from __future__ import unicode_literals
 import abc
 import re
 
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.utils.calculation_context import cached
 
 from ralph_scrooge.plugins import plugin_runner
 from ralph_scrooge.models import Warehouse
@@ -55,7 +55,7 @@ class BasePlugin(object):
         pass
 
     @classmethod
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def get_warehouses(cls, show_in_report=True):
         """
         Returns available warehouses
@@ -21,6 +21,7 @@ from ralph_scrooge.models import (
     UsageType,
     Warehouse
 )
+from ralph_scrooge.utils.usage_totals import delete_daily_usages
 
 
 logger = logging.getLogger(__name__)
@@ -190,10 +191,10 @@ class OpenStackBasePlugin(object):
         Remove previously saved records for given date from DB.
         """
         logger.debug('Clearing previous records for {}'.format(date))
-        DailyUsage.objects.filter(
+        delete_daily_usages(DailyUsage.objects.filter(
             type__symbol__startswith=self.metric_tmpl.format(''),
             date=date,
-        ).delete()
+        ))
 
     def run_plugin(self, sites, today, **kwargs):
         """
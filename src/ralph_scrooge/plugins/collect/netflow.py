@@ -21,6 +21,7 @@ from ralph_scrooge.models import (
     UsageType,
 )
 from ralph_scrooge.plugins import plugin_runner
+from ralph_scrooge.utils.usage_totals import delete_daily_usages, mark_changed
 
 
 logger = logging.getLogger(__name__)
@@ -306,6 +307,9 @@ def update(
     """
     Create or update daily usage
 
+    New daily usages are saved in bulk (totals of usage type are refreshed
+    once - see `mark_changed`).
+
     :param dict network_usages: Usages per IP
     :param object usage_type: UsageType object
     :param datetime date: Date for which dailyusage will be update
@@ -314,6 +318,14 @@ def update(
     """
     logger.debug('Saving usages as a daily usages per service')
     new = updated = total = 0
+    daily_usages = {
+        daily_usage.daily_pricing_object_id: daily_usage
+        for daily_usage in DailyUsage.objects.filter(
+            date=date,
+            type=usage_type,
+        )
+    }
+    new_daily_usages = []
     for ip, value in _group_by_ip(network_usages).iteritems():
         if value < settings.NFSEN_MIN_VALUE:
             logger.info('Skipping {} for IP {} (lower than min value)'.format(
@@ -335,31 +347,37 @@ def update(
                 service_environment=pricing_object.service_environment,
             )
         )[0]
-        daily_usage, usage_created = DailyUsage.objects.get_or_create(
-            date=date,
-            type=usage_type,
-            daily_pricing_object=daily_pricing_object,
-            defaults=dict(
-                service_environment=daily_pricing_object.service_environment,
-            ),
-        )
+        daily_usage = daily_usages.get(daily_pricing_object.id)
+        if daily_usage is None:
+            daily_usage = daily_usages[daily_pricing_object.id] = DailyUsage(
+                date=date,
+                type=usage_type,
+                daily_pricing_object=daily_pricing_object,
+                value=0,
+            )
+            new_daily_usages.append(daily_usage)
         daily_usage.service_environment = (
             daily_pricing_object.service_environment
         )
         daily_usage.value += value
-        daily_usage.save()
+        if daily_usage.pk is not None:
+            daily_usage.save()
         if created:
             logger.warning(
                 'Unknown ip address {} (usage: {})'.format(ip, value)
             )
         new += created
         updated += not created
+    DailyUsage.objects.bulk_create(new_daily_usages)
+    mark_changed(date, [usage_type])
     return (new, updated, total)
 
 
 def delete_previous_usages(date):
     usage_type = get_usage_type()
-    DailyUsage.objects.filter(type=usage_type, date=date).delete()
+    delete_daily_usages(
+        DailyUsage.objects.filter(type=usage_type, date=date)
+    )
 
 
 @plugin_runner.register(chain='scrooge', requires=['service'])
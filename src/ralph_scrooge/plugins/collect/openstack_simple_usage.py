@@ -12,6 +12,7 @@ from novaclient.v1_1 import client as nova_client
 
 from ralph_scrooge.models import DailyUsage, TenantInfo, UsageType, Warehouse
 from ralph_scrooge.plugins import plugin_runner
+from ralph_scrooge.utils.usage_totals import delete_daily_usages
 
 logger = logging.getLogger(__name__)
 
@@ -49,10 +50,10 @@ def save_usage(usage, date, usage_types, warehouse):
 
 def clear_openstack_simple_usages(date):
     logger.debug('Clearing OpenStack simple usages for {}'.format(date))
-    DailyUsage.objects.filter(
+    delete_daily_usages(DailyUsage.objects.filter(
         type__symbol__startswith=USAGE_SYMBOL_TMPL.format(''),
         date=date,
-    ).delete()
+    ))
 
 
 def get_usage_types():
@@ -10,10 +10,16 @@ import logging
 from decimal import Decimal as D
 
 from django.db.models import Sum
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.utils.calculation_context import cached, make_key
 
 from ralph_scrooge.models import DailyUsage
 from ralph_scrooge.plugins.base import BasePlugin
+from ralph_scrooge.plugins.cost import usages_snapshot
+from ralph_scrooge.plugins.cost.costs_index import CostsIndex
+from ralph_scrooge.plugins.cost.pricing_service_engine import (
+    get_active_engine,
+)
+from ralph_scrooge.utils.usage_totals import get_usages_model
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +47,10 @@ class BaseCostPlugin(BasePlugin):
     This class provides base methods for costs calculation, such as generating
     usages (for given date) per service environment, pricing object etc.
     """
+    # if True, totals of costs of plugin are shared with pricing services
+    # calculated in other shards of the same day (see `_get_costs_totals`)
+    share_costs_totals = True
+
     def run(self, type='costs', *args, **kwargs):
         # find method with name the same as type param
         if hasattr(self, type):
@@ -55,12 +65,27 @@ class BaseCostPlugin(BasePlugin):
         filtered by passed service environments (if passed - otherwise it's
         simple proxt to _costs method, which should be cached).
         """
-        costs = self._costs(*args, **kwargs)
-        # filter by service environments if specified
-        if service_environments is not None:
-            se_ids = set([se.id for se in service_environments])
-            costs = {k: v for (k, v) in costs.iteritems() if k in se_ids}
-        return costs
+        if service_environments is None:
+            costs = self._costs(*args, **kwargs)
+            engine = self._get_totals_engine(kwargs)
+            if engine is not None:
+                engine.get_or_calculate(
+                    self._get_totals_key(args, kwargs),
+                    lambda: CostsIndex(costs).get_totals(),
+                )
+            return costs
+        # filter by service environments using index (see `CostsIndex`)
+        return self._costs_index(*args, **kwargs).filter(service_environments)
+
+    @cached(skip_first=True)
+    def _costs_index(self, *args, **kwargs):
+        """
+        Returns index of costs returned by `_costs` (cached in calculation
+        context together with costs, so it's built once per plugin call).
+
+        :rtype: ralph_scrooge.plugins.cost.costs_index.CostsIndex
+        """
+        return CostsIndex(self._costs(*args, **kwargs))
 
     @abc.abstractmethod
     def _costs(self, *args, **kwargs):
@@ -78,14 +103,46 @@ class BaseCostPlugin(BasePlugin):
         }
         """
 
-    def total_cost(self, *args, **kwargs):
+    def total_cost(self, service_environments=None, *args, **kwargs):
+        """
+        By default total cost is just sum of all costs from `costs` method
+        (calculated using per service environment totals of `CostsIndex`).
+        """
+        return self._get_costs_totals(*args, **kwargs).total(
+            service_environments
+        )
+
+    def _get_costs_totals(self, *args, **kwargs):
         """
-        By default total cost is just sum of all costs from `costs` method.
+        Returns total cost of every service environment (of costs returned by
+        `_costs`).
+
+        If pricing services engine is active for date, totals are kept in it,
+        so they're dumped together with results of engine and pricing
+        services calculated in shards of next levels (see
+        `Collector.process_shard`) are not calculating costs again.
+
+        :rtype: ralph_scrooge.plugins.cost.costs_index.CostsTotals
         """
-        costs = self.costs(*args, **kwargs)
-        return sum([sum([s['cost'] for s in c]) for c in costs.values()])
+        engine = self._get_totals_engine(kwargs)
+        if engine is None:
+            return self._costs_index(*args, **kwargs)
+        return engine.get_or_calculate(
+            self._get_totals_key(args, kwargs),
+            lambda: self._costs_index(*args, **kwargs).get_totals(),
+        )
 
-    @memoize(skip_first=True)
+    def _get_totals_engine(self, kwargs):
+        if not self.share_costs_totals:
+            return None
+        return get_active_engine(
+            kwargs.get('date'), kwargs.get('forecast', False)
+        )
+
+    def _get_totals_key(self, args, kwargs):
+        return (self.func_name, 'costs_totals', make_key((args, kwargs)))
+
+    @cached(skip_first=True)
     def _get_price_from_cost(
         self,
         usage_price,
@@ -116,8 +173,45 @@ class BaseCostPlugin(BasePlugin):
             price = cost / D(total_usage)
         return D(price)
 
-    def _get_daily_usages_in_period(
+    def _get_usages_snapshot(
+        self,
+        usage_type,
+        date=None,
+        start=None,
+        end=None,
+        **kwargs
+    ):
+        """
+        Returns active daily usages snapshot if it could be used to answer
+        query about usages for date (or period between start and end).
+        Otherwise None is returned and usages should be taken from database.
+        """
+        snapshot = usages_snapshot.get_active_snapshot()
+        if snapshot is not None and snapshot.covers(date, start, end):
+            return snapshot
+        return None
+
+    def _get_daily_usages_in_period(self, *args, **kwargs):
+        """
+        Filter daily usages based on passed params
+        """
+        return self._filter_usages(
+            DailyUsage.objects.all(), *args, **kwargs
+        ).select_related('daily_pricing_object')
+
+    def _get_usages_totals_in_period(self, *args, **kwargs):
+        """
+        Filter daily usages (or their totals, if `USE_DAILY_USAGE_TOTALS` is
+        enabled) based on passed params. Result should be used only to sum
+        usages.
+        """
+        return self._filter_usages(
+            get_usages_model().objects.all(), *args, **kwargs
+        )
+
+    def _filter_usages(
         self,
+        daily_usages,
         usage_type,
         date=None,
         start=None,
@@ -127,10 +221,7 @@ class BaseCostPlugin(BasePlugin):
         excluded_services=None,
         excluded_services_environments=None
     ):
-        """
-        Filter daily usages based on passed params
-        """
-        daily_usages = DailyUsage.objects.filter(
+        daily_usages = daily_usages.filter(
             type=usage_type,
         )
         if start and end:
@@ -152,9 +243,9 @@ class BaseCostPlugin(BasePlugin):
             daily_usages = daily_usages.exclude(
                 service_environment__in=excluded_services_environments
             )
-        return daily_usages.select_related('daily_pricing_object')
+        return daily_usages
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _get_total_usage(self, *args, **kwargs):
         """
         Calculates total usage of usage type in period of time (between start
@@ -163,7 +254,10 @@ class BaseCostPlugin(BasePlugin):
 
         :rtype: float
         """
-        daily_usages = self._get_daily_usages_in_period(*args, **kwargs)
+        snapshot = self._get_usages_snapshot(*args, **kwargs)
+        if snapshot is not None:
+            return snapshot.get_total_usage(*args, **kwargs)
+        daily_usages = self._get_usages_totals_in_period(*args, **kwargs)
         return daily_usages.aggregate(
             total=Sum('value')
         ).get('total') or 0
@@ -177,7 +271,10 @@ class BaseCostPlugin(BasePlugin):
 
         :rtype: list
         """
-        daily_usages = self._get_daily_usages_in_period(*args, **kwargs)
+        snapshot = self._get_usages_snapshot(*args, **kwargs)
+        if snapshot is not None:
+            return snapshot.get_usages_per_service_environment(*args, **kwargs)
+        daily_usages = self._get_usages_totals_in_period(*args, **kwargs)
         return list(daily_usages.values('service_environment').annotate(
             usage=Sum('value'),
         ).order_by('service_environment'))
@@ -191,7 +288,10 @@ class BaseCostPlugin(BasePlugin):
 
         :rtype: list
         """
-        daily_usages = self._get_daily_usages_in_period(*args, **kwargs)
+        snapshot = self._get_usages_snapshot(*args, **kwargs)
+        if snapshot is not None:
+            return snapshot.get_usages_per_service(*args, **kwargs)
+        daily_usages = self._get_usages_totals_in_period(*args, **kwargs)
         return list(
             daily_usages.values('service_environment__service').annotate(
                 usage=Sum('value'),
@@ -208,3 +308,46 @@ class BaseCostPlugin(BasePlugin):
         """
         daily_usages = self._get_daily_usages_in_period(*args, **kwargs)
         return daily_usages
+
+    def _get_pricing_objects_usages(self, *args, **kwargs):
+        """
+        Returns list of (service environment id, pricing object id, value)
+        for every daily usage matching passed params (see
+        `_get_daily_usages_in_period` for list of available params).
+
+        :rtype: list
+        """
+        snapshot = self._get_usages_snapshot(*args, **kwargs)
+        if snapshot is not None:
+            return snapshot.get_pricing_objects_usages(*args, **kwargs)
+        daily_usages = self._get_daily_usages_in_period(*args, **kwargs)
+        return list(daily_usages.values_list(
+            'service_environment',
+            'daily_pricing_object__pricing_object',
+            'value',
+        ))
+
+    def _get_usages_per_pricing_object_and_service_environment(
+        self,
+        *args,
+        **kwargs
+    ):
+        """
+        Returns list of (pricing object id, service environment id, usage)
+        with usages summed by pricing object and service environment.
+
+        :rtype: list
+        """
+        snapshot = self._get_usages_snapshot(*args, **kwargs)
+        if snapshot is not None:
+            return (
+                snapshot.get_usages_per_pricing_object_and_service_environment(
+                    *args, **kwargs
+                )
+            )
+        return list(self._get_usages_per_pricing_object(
+            *args, **kwargs
+        ).values_list(
+            'daily_pricing_object__pricing_object',
+            'service_environment',
+        ).annotate(usage=Sum('value')))
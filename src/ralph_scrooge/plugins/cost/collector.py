@@ -6,15 +6,22 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import logging
-from collections import defaultdict
+import multiprocessing
+from collections import OrderedDict
+from datetime import datetime
 from dateutil import rrule
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
-from django.db import connection
+from django.db import connection, connections, transaction
+from django.utils import timezone
 
 from ralph_scrooge.models import (
     CostDateStatus,
+    CostRecalculationCheckpoint,
+    CostRecalculationRun,
     DailyCost,
+    DailyCostStaging,
     DynamicExtraCostType,
     ExtraCostType,
     PricingService,
@@ -27,16 +34,92 @@ from ralph_scrooge.plugins.cost.base import (
     NoPriceCostError,
     MultiplePriceCostError,
 )
-from ralph_scrooge.plugins.validations import DataForReportValidator
-from ralph_scrooge.utils.common import memoize, AttributeDict
+from ralph_scrooge.plugins.cost.cost_tree import as_cost_tree, CostTree
+from ralph_scrooge.plugins.cost.fingerprint import get_fingerprint
+from ralph_scrooge.plugins.cost.publishing import (
+    check_swap_supported,
+    dailycost_lock,
+    get_dailycost_columns,
+    swap_staged_costs,
+    SwapNotSupportedError,
+)
+from ralph_scrooge.plugins.cost.pricing_service_engine import (
+    activate as activate_pricing_services_engine,
+    PricingServicesEngine,
+)
+from ralph_scrooge.plugins.cost.profiling import CalculationProfile
+from ralph_scrooge.plugins.cost.usages_snapshot import (
+    activate as activate_usages_snapshot,
+    DailyUsagesSnapshot,
+    get_active_snapshot,
+)
+from ralph_scrooge.plugins.validations import (
+    DataForReportValidationError,
+    DataForReportValidator,
+)
+from ralph_scrooge.utils.bulk_writer import get_bulk_writer
+from ralph_scrooge.utils.cache import clear_memoize_caches
+from ralph_scrooge.utils.calculation_context import (
+    activate_context,
+    calculation_context,
+    get_active_context,
+)
+from ralph_scrooge.utils.common import (
+    AttributeDict,
+    chunks,
+    group_consecutive_days,
+    memoize,
+)
+from ralph_scrooge.utils.costs_hierarchy import (
+    clear_staged_hierarchies,
+    publish_hierarchies,
+    save_hierarchies,
+)
 
 logger = logging.getLogger(__name__)
 
+# pass as forecast to calculate real and forecast costs in single pass (see
+# `Collector.process_dual`)
+BOTH_FORECASTS = 'both'
+
+
+def get_forecasts(forecast):
+    """
+    Returns forecast flags calculated for forecast (which could be
+    `BOTH_FORECASTS`).
+    """
+    return (False, True) if forecast == BOTH_FORECASTS else (forecast,)
+
 
 class VerifiedDailyCostsExistsError(Exception):
     pass
 
 
+def _as_date(day):
+    return day.date() if isinstance(day, datetime) else day
+
+
+def _init_worker():
+    """
+    Initialize worker process of collector pool.
+    """
+    clear_memoize_caches()
+
+
+def _process_day(args):
+    """
+    Process costs for single day in worker process of collector pool.
+    """
+    day, forecast, kwargs = args
+    collector = Collector()
+    for result in collector._process_days([day], forecast, **kwargs):
+        # fingerprints and validation errors of day are passed back to
+        # collector
+        return result + (
+            collector._fingerprints, collector.validation_errors
+        )
+
+
 class Collector(object):
     """
     Costs collector
@@ -86,29 +169,238 @@ class Collector(object):
                 ]
             },
     }
+
+    or as `CostTree` (see `ralph_scrooge.plugins.cost.cost_tree`). Results
+    of every plugin are converted to `CostTree` as soon as plugin is finished
+    and merged into single `CostTree` for the whole day (which is returned
+    by `process`).
     """
+    def __init__(self):
+        # days skipped in calculation (with reason of skipping)
+        self.skipped_days = {}
+        # errors of validation of data of days which calculation failed (see
+        # `calculate_days`)
+        self.validation_errors = {}
+        # fingerprints of inputs of days (and forecast flag) to calculate
+        self._fingerprints = {}
+        # fingerprints of inputs of days (the same for both forecast flags)
+        self._days_fingerprints = {}
+        # profiles of calculated days (see
+        # `ralph_scrooge.plugins.cost.profiling`) per (date, forecast)
+        self.profiles = {}
+        # profile of currently calculated day
+        self._profile = None
+
     def process_period(
         self,
         start,
         end,
         forecast,
         force_recalculation=False,
+        workers=None,
+        save=False,
         **kwargs
     ):
+        """
+        Process costs for every day between start and end. See `process_days`
+        for details.
+        """
         # calculate costs only if were not calculated for some date, unless
         # force_recalculation is True
         dates = self._get_dates(start, end, forecast, force_recalculation)
-        for day in dates:
-            try:
-                self.process(
-                    day,
-                    forecast=forecast,
-                    **kwargs
+        return self.process_days(
+            dates,
+            forecast,
+            workers=workers,
+            save=save,
+            force=force_recalculation,
+            **kwargs
+        )
+
+    def process_days(
+        self, days, forecast, workers=None, save=False, force=False, **kwargs
+    ):
+        """
+        Process costs for every day in days. Yields (day, success) for every
+        processed day.
+
+        If save is True, costs of every successfully processed day are saved
+        in database (see `save_period_costs`). Then (if `SKIP_UNCHANGED_DAYS`
+        is enabled and recalculation is not forced) days, which inputs were
+        not changed since last calculation, are skipped (see
+        `get_unchanged_days`) - they're reported in `skipped_days`.
+
+        If forecast is `BOTH_FORECASTS`, real and forecast costs of every day
+        are calculated in single pass (see `process_dual`).
+        """
+        if save and settings.SKIP_UNCHANGED_DAYS and not force:
+            unchanged = self.get_unchanged_days(
+                days, forecast, kwargs.get('plugins')
+            )
+            days = [day for day in days if day not in unchanged]
+        for day, success, costs in self.calculate_days(
+            days, forecast, workers=workers, **kwargs
+        ):
+            if success and save:
+                if forecast != BOTH_FORECASTS:
+                    costs = {forecast: costs}
+                for costs_forecast, forecast_costs in costs.items():
+                    self.save_period_costs(
+                        day,
+                        day,
+                        costs_forecast,
+                        self._create_daily_costs(
+                            day, forecast_costs, costs_forecast
+                        ),
+                    )
+            yield day, success
+
+    def get_unchanged_days(self, days, forecast, plugins=None):
+        """
+        Returns days (from days), for which costs were already calculated
+        and inputs of calculation were not changed since then (fingerprint of
+        inputs is the same as stored in last successful calculation - see
+        `ralph_scrooge.plugins.cost.fingerprint`). Returned days are also
+        saved in `skipped_days` (together with reason of skipping).
+
+        Fingerprints of days are remembered and saved together with their
+        costs (see `_update_status`).
+
+        If forecast is `BOTH_FORECASTS`, day is unchanged only if it's
+        unchanged for real and forecast costs.
+
+        :rtype: dict
+        :returns: dict with day as key and reason of skipping as value
+        """
+        plugins = plugins or self.get_plugins()
+        unchanged = None
+        for flag in get_forecasts(forecast):
+            flag_unchanged = self._get_unchanged_days(days, flag, plugins)
+            if unchanged is None:
+                unchanged = flag_unchanged
+            else:
+                unchanged = {
+                    day: reason for day, reason in unchanged.items()
+                    if day in flag_unchanged
+                }
+        for day, reason in sorted(unchanged.items()):
+            logger.info('Skipping costs calculation for {}: {}'.format(
+                day, reason
+            ))
+        self.skipped_days.update(unchanged)
+        return unchanged
+
+    def _get_unchanged_days(self, days, forecast, plugins):
+        prefix = 'forecast_' if forecast else ''
+        statuses = {
+            status['date']: status
+            for status in CostDateStatus.objects.filter(
+                date__in=[_as_date(day) for day in days],
+            ).values('date', prefix + 'calculated', prefix + 'fingerprint')
+        }
+        unchanged = {}
+        for day in days:
+            fingerprint = self.get_fingerprint(day, forecast, plugins)
+            status = statuses.get(_as_date(day))
+            if (
+                status and
+                status[prefix + 'calculated'] and
+                status[prefix + 'fingerprint'] == fingerprint
+            ):
+                unchanged[day] = (
+                    'inputs not changed since last calculation '
+                    '(fingerprint {})'.format(fingerprint[:10])
                 )
-                yield day, True
+        return unchanged
+
+    def forget_fingerprint(self, day, forecast):
+        """
+        Forget fingerprint of day (ex. when calculation failed), so it won't
+        be saved with costs.
+        """
+        self._fingerprints.pop((_as_date(day), forecast), None)
+
+    def remember_fingerprint(self, day, forecast, fingerprint):
+        """
+        Remember fingerprint of day calculated elsewhere (ex. in subjob), so
+        it's saved together with costs (see `checkpoint` and
+        `_update_status`).
+        """
+        self._fingerprints[(_as_date(day), forecast)] = fingerprint
+
+    def calculate_days(self, days, forecast, workers=None, **kwargs):
+        """
+        Calculate costs for every day in days. Yields (day, success, costs)
+        for every calculated day (costs are None if calculation failed).
+
+        Days are independent, so if workers is greater than 1, they are
+        calculated in parallel in pool of worker processes (every process is
+        using its own database connection and memoize caches). Results are
+        streamed back to this process in order of calculation.
+
+        If fingerprints is True, fingerprint of every day is calculated
+        (before its costs, in the same process) and remembered by this
+        collector (see `get_fingerprint`). Errors of validation of data of
+        days which failed (when perform_validation is True) are saved in
+        `validation_errors`.
+        """
+        days = list(days)
+        if workers and workers > 1 and len(days) > 1:
+            return self._process_days_in_pool(
+                days, forecast, workers, **kwargs
+            )
+        return self._process_days(days, forecast, **kwargs)
+
+    def _process_days(self, days, forecast, fingerprints=False, **kwargs):
+        for day in days:
+            try:
+                if fingerprints:
+                    for flag in get_forecasts(forecast):
+                        self.get_fingerprint(day, flag, kwargs.get('plugins'))
+                if forecast == BOTH_FORECASTS:
+                    costs = self.process_dual(day, **kwargs)
+                else:
+                    costs = self.process(
+                        day,
+                        forecast=forecast,
+                        **kwargs
+                    )
+                yield day, True, costs
+            except DataForReportValidationError as e:
+                logger.exception(e)
+                self.validation_errors[day] = e.errors
+                yield day, False, None
             except Exception as e:
                 logger.exception(e)
-                yield day, False
+                yield day, False, None
+
+    def _process_days_in_pool(self, days, forecast, workers, **kwargs):
+        logger.info('Processing {} days using {} workers'.format(
+            len(days), workers,
+        ))
+        # every worker has to open its own database connection (connection
+        # inherited after fork can't be shared between processes)
+        connections.close_all()
+        pool = multiprocessing.Pool(
+            processes=min(workers, len(days)),
+            initializer=_init_worker,
+        )
+        try:
+            for (
+                day, success, costs, fingerprints, validation_errors
+            ) in pool.imap_unordered(
+                _process_day,
+                [(day, forecast, kwargs) for day in days],
+            ):
+                self._fingerprints.update(fingerprints)
+                self.validation_errors.update(validation_errors)
+                yield day, success, costs
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
     def _get_dates(self, start, end, forecast, force_recalculation):
         """
@@ -122,12 +414,20 @@ class Collector(object):
         )]
         if force_recalculation:
             return days
-        else:
-            return sorted(set(days) - set(CostDateStatus.objects.filter(
+        # with BOTH_FORECASTS day is calculated only when real and forecast
+        # costs are calculated
+        calculated = None
+        for flag in get_forecasts(forecast):
+            flag_calculated = set(CostDateStatus.objects.filter(
                 date__gte=start,
                 date__lte=end,
-                **{'forecast_calculated' if forecast else 'calculated': True}
-            ).values_list('date', flat=True)))
+                **{'forecast_calculated' if flag else 'calculated': True}
+            ).values_list('date', flat=True))
+            if calculated is None:
+                calculated = flag_calculated
+            else:
+                calculated &= flag_calculated
+        return sorted(set(days) - calculated)
 
     def process(
         self,
@@ -157,25 +457,374 @@ class Collector(object):
         if settings.ENABLE_DATA_FOR_REPORT_VALIDATION and perform_validation:
             logger.info('Performing validation of data for costs calculation.')
             DataForReportValidator(date, forecast=forecast).validate()
-        costs = self._collect_costs(
-            date=date,
-            forecast=forecast,
-            plugins=plugins,
-        )
+        # values cached by plugins are valid only for this date
+        with calculation_context():
+            costs = self._collect_costs(
+                date=date,
+                forecast=forecast,
+                plugins=plugins,
+            )
         logger.info('Costs calculated for date {}'.format(date))
         return costs
 
+    def process_dual(
+        self,
+        date,
+        delete_verified=False,
+        plugins=None,
+        perform_validation=False,
+    ):
+        """
+        Process real and forecast costs for single date in single pass.
+
+        Real and forecast costs differ only in prices and costs read by
+        plugins (ex. `UsagePrice.price` vs `forecast_price`), so both are
+        calculated using the same daily usages snapshot, calculation context
+        (values cached by plugins, which don't depend on forecast flag, ex.
+        usages per service environment or teams cores counts, are calculated
+        once) and levels of pricing services charging graph.
+
+        Costs which were already accepted (and delete_verified is False) are
+        not calculated.
+
+        :returns: dict with forecast flag as key and costs as value
+        :rtype: OrderedDict
+        """
+        forecasts = []
+        for forecast in (False, True):
+            try:
+                self._verify_accepted_costs(date, forecast, delete_verified)
+            except VerifiedDailyCostsExistsError:
+                logger.warning(
+                    'Costs (forecast: {}) for date {} are already '
+                    'accepted'.format(forecast, date)
+                )
+            else:
+                forecasts.append(forecast)
+        if not forecasts:
+            raise VerifiedDailyCostsExistsError()
+        logger.info('Calculating costs (forecast: {}) for date {}'.format(
+            ', '.join(map(str, forecasts)),
+            date,
+        ))
+        result = OrderedDict()
+        engine = None
+        with calculation_context():
+            with activate_usages_snapshot(DailyUsagesSnapshot.load(date)):
+                for forecast in forecasts:
+                    if (
+                        settings.ENABLE_DATA_FOR_REPORT_VALIDATION and
+                        perform_validation
+                    ):
+                        DataForReportValidator(
+                            date, forecast=forecast
+                        ).validate()
+                    if engine is None:
+                        engine = PricingServicesEngine(date, forecast)
+                    else:
+                        engine = engine.for_forecast(forecast)
+                    result[forecast] = self._collect_costs(
+                        date=date,
+                        forecast=forecast,
+                        plugins=plugins,
+                        engine=engine,
+                    )
+        logger.info('Costs calculated for date {}'.format(date))
+        return result
+
+    def get_plugins_shards(
+        self, date, forecast, shards, plugins=None, engine=None
+    ):
+        """
+        Split plugins into shards, which could be calculated independently
+        (ex. by separate workers). Plugins are split by levels (see
+        `_get_plugins_levels`) - every level is split into (at most) `shards`
+        shards and every shard depends only on shards of previous levels.
+
+        :returns: list of levels (every level is list of shards - lists of
+            indexes of plugins)
+        :rtype: list
+        """
+        plugins = plugins or self.get_plugins()
+        engine = engine or PricingServicesEngine(date, forecast)
+        result = []
+        for level in self._get_plugins_levels(plugins, engine):
+            count = min(shards, len(level))
+            result.append([level[i::count] for i in range(count)])
+        return result
+
+    def process_shard(
+        self,
+        date,
+        forecast,
+        level,
+        shard,
+        shards,
+        engine_results=(),
+        plugins=None,
+        perform_validation=False,
+    ):
+        """
+        Process costs of single shard of plugins (see `get_plugins_shards`)
+        for single date.
+
+        Results of pricing services engines of shards of previous levels
+        (see `PricingServicesEngine.dump_results`) are loaded, so costs of
+        pricing services calculated there are not calculated again (missing
+        results are simply calculated once more).
+
+        :returns: costs of shard and pricing services engine used to
+            calculate them (with results of this shard)
+        :rtype: tuple
+        """
+        self._verify_accepted_costs(date, forecast, False)
+        if settings.ENABLE_DATA_FOR_REPORT_VALIDATION and perform_validation:
+            DataForReportValidator(date, forecast=forecast).validate()
+        plugins = plugins or self.get_plugins()
+        engine = PricingServicesEngine(date, forecast)
+        for results in engine_results:
+            engine.load_results(results)
+        indexes = self.get_plugins_shards(
+            date, forecast, shards, plugins, engine
+        )[level][shard]
+        logger.info(
+            'Calculating costs (forecast: {}) of shard {}/{} of level {} '
+            'for date {}'.format(forecast, shard + 1, shards, level, date)
+        )
+        with calculation_context():
+            costs = self._collect_costs(
+                date=date,
+                forecast=forecast,
+                plugins=[plugins[i] for i in indexes],
+                engine=engine,
+            )
+        return costs, engine
+
     def save_period_costs(self, start, end, forecast, costs):
         """
         Save costs for period of time.
 
         :param costs: list of DailyCost instances
         """
-        self._delete_daily_period_costs(start, end, forecast)
-        self._save_costs(costs)
-        self._update_status_period(start, end, forecast)
+        if self._can_swap(start, end, forecast):
+            # hierarchies of pricing services costs are already staged
+            self._clear_staged_daily_costs(start, end, forecast)
+            self._save_costs(costs, model=DailyCostStaging)
+            self.publish_staged_costs(start, end, forecast)
+            return
+        # lock is held until transaction is committed
+        with dailycost_lock(), transaction.atomic():
+            self._delete_daily_period_costs(start, end, forecast)
+            self._save_costs(costs)
+            publish_hierarchies(start, end, forecast)
+            self._update_status_period(start, end, forecast)
         logger.info('Costs saved for dates {}-{}'.format(start, end))
 
+    def _can_swap(self, start, end, forecast):
+        """
+        Returns True if costs of period could be published by swapping
+        subpartitions of DailyCost table (ex. period is the whole month,
+        when DailyCost is partitioned by month) - costs of shorter periods
+        are inserted directly, without staging them first.
+        """
+        if settings.DAILY_COSTS_PUBLISH_MODE != 'swap':
+            return False
+        try:
+            check_swap_supported(start, end, forecast)
+        except SwapNotSupportedError as e:
+            logger.info('Costs will be inserted ({})'.format(e))
+            return False
+        return True
+
+    def stage_costs(self, date, costs, forecast):
+        """
+        Save costs of single day (result of `process`) in staging area. Daily
+        costs are created lazily and saved in chunks of
+        `DAILY_COST_CREATE_BATCH_SIZE`, so (almost) only costs returned by
+        plugins are kept in memory.
+
+        Staged costs are not visible until they're published (see
+        `publish_staged_costs`).
+
+        :returns: number of saved daily costs
+        :rtype: int
+        """
+        count = get_bulk_writer(DailyCostStaging).write(
+            self._iter_daily_costs(date, costs, forecast)
+        )
+        logger.info('{} costs staged for date {}'.format(count, date))
+        return count
+
+    def get_fingerprint(self, day, forecast, plugins=None):
+        """
+        Returns fingerprint of inputs of calculation of day (see
+        `ralph_scrooge.plugins.cost.fingerprint`). Fingerprint is remembered
+        and saved together with costs of day (see `_update_status`).
+
+        Inputs of calculation of real and forecast costs are the same, so
+        fingerprint of day is calculated once for both forecast flags.
+
+        :rtype: str
+        """
+        key = (_as_date(day), forecast)
+        if key not in self._fingerprints:
+            plugins = plugins or self.get_plugins()
+            day_key = (_as_date(day), tuple(sorted(
+                (plugin.plugin_name, plugin.name) for plugin in plugins
+            )))
+            if day_key not in self._days_fingerprints:
+                self._days_fingerprints[day_key] = get_fingerprint(
+                    _as_date(day), plugins
+                )
+            self._fingerprints[key] = self._days_fingerprints[day_key]
+        return self._fingerprints[key]
+
+    def start_recalculation(self, start, end, forecast, days, resume=True):
+        """
+        Start (or resume) recalculation of costs of period between start and
+        end, which costs are staged (see `stage_costs`) and checkpointed (see
+        `checkpoint`) day by day.
+
+        If previous recalculation of the same period was not finished (and
+        resume is True), it's resumed - staged costs of days (from days) are
+        reused, if inputs of their calculation were not changed since then
+        (fingerprint is the same). Otherwise unfinished recalculations of the
+        period are dropped. Staged costs of all other days of period are
+        removed.
+
+        :returns: recalculation run and resumed days (from days)
+        :rtype: tuple
+        """
+        runs = CostRecalculationRun.objects.filter(
+            start=_as_date(start),
+            end=_as_date(end),
+            forecast=forecast,
+            finished=None,
+        )
+        run = runs.order_by('-created').first() if resume else None
+        resumed = []
+        if run is None:
+            runs.delete()
+            run = CostRecalculationRun.objects.create(
+                start=_as_date(start), end=_as_date(end), forecast=forecast,
+            )
+        else:
+            checkpoints = {
+                checkpoint.date: checkpoint
+                for checkpoint in run.checkpoints.all()
+            }
+            plugins = self.get_plugins()
+            for day in days:
+                checkpoint = checkpoints.pop(_as_date(day), None)
+                if checkpoint is None:
+                    continue
+                if checkpoint.fingerprint and checkpoint.fingerprint == (
+                    self.get_fingerprint(day, forecast, plugins)
+                ):
+                    resumed.append(day)
+                else:
+                    checkpoints[checkpoint.date] = checkpoint
+            run.checkpoints.filter(date__in=list(checkpoints)).delete()
+            logger.info(
+                'Resuming recalculation from {} to {} ({} days staged)'.format(
+                    start, end, len(resumed),
+                )
+            )
+        resumed_dates = set(_as_date(day) for day in resumed)
+        for range_start, range_end in group_consecutive_days([
+            _as_date(day)
+            for day in rrule.rrule(rrule.DAILY, dtstart=start, until=end)
+            if _as_date(day) not in resumed_dates
+        ]):
+            self.clear_staged_costs(range_start, range_end, forecast)
+        return run, resumed
+
+    def checkpoint(self, run, date, forecast):
+        """
+        Mark costs of date as staged in recalculation run (together with
+        fingerprint of inputs, if it was calculated before costs).
+        """
+        CostRecalculationCheckpoint.objects.create(
+            run=run,
+            date=_as_date(date),
+            fingerprint=self._fingerprints.get((_as_date(date), forecast), ''),
+        )
+
+    def finish_recalculation(self, run):
+        """
+        Mark recalculation run as finished (costs of period are published).
+        """
+        run.finished = timezone.now()
+        run.save()
+
+    def clear_staged_costs(self, start, end, forecast):
+        """
+        Delete costs (and hierarchies of pricing services costs) staged
+        between start and end (including forecast flag).
+        """
+        self._clear_staged_daily_costs(start, end, forecast)
+        clear_staged_hierarchies(start, end, forecast)
+
+    def _clear_staged_daily_costs(self, start, end, forecast):
+        DailyCostStaging.objects.filter(
+            date__gte=start,
+            date__lte=end,
+            forecast=forecast,
+        ).delete()
+
+    def publish_staged_costs(self, start, end, forecast):
+        """
+        Replace costs between start and end with costs from staging area and
+        mark days as calculated.
+
+        Depending on `DAILY_COSTS_PUBLISH_MODE` costs are replaced by
+        swapping (sub)partitions of DailyCost table with shadow table (see
+        `ralph_scrooge.plugins.cost.publishing`) or by deleting and inserting
+        them in single transaction.
+        """
+        if settings.DAILY_COSTS_PUBLISH_MODE == 'swap':
+            try:
+                swap_staged_costs(start, end, forecast)
+            except SwapNotSupportedError as e:
+                logger.warning(
+                    'Could not swap costs ({}), inserting them instead'.format(
+                        e
+                    )
+                )
+            else:
+                with transaction.atomic():
+                    publish_hierarchies(start, end, forecast)
+                    self.clear_staged_costs(start, end, forecast)
+                    self._update_status_period(start, end, forecast)
+                logger.info('Costs swapped for dates {}-{}'.format(
+                    start, end
+                ))
+                return
+        self._insert_staged_costs(start, end, forecast)
+
+    def _insert_staged_costs(self, start, end, forecast):
+        # lock is held until transaction is committed
+        with dailycost_lock(), transaction.atomic():
+            self._delete_daily_period_costs(start, end, forecast)
+            columns = get_dailycost_columns()
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                INSERT INTO {dailycost} ({columns})
+                SELECT {columns} FROM {staging}
+                WHERE date>=%s and date<=%s and forecast=%s
+                """.format(
+                    dailycost=DailyCost._meta.db_table,
+                    staging=DailyCostStaging._meta.db_table,
+                    columns=columns,
+                ),
+                [start, end, forecast]
+            )
+            publish_hierarchies(start, end, forecast)
+            self.clear_staged_costs(start, end, forecast)
+            self._update_status_period(start, end, forecast)
+        logger.info('Costs published for dates {}-{}'.format(start, end))
+
     def _delete_daily_period_costs(self, start, end, forecast):
         """
         Delete previously saved costs between start and end (including forecast
@@ -211,29 +860,25 @@ class Collector(object):
         save it in database.
         """
         logger.info('Creating daily costs instances for {}'.format(date))
-        daily_costs = []
-        for service_environment, se_costs in costs.iteritems():
-            # use _build_tree directly, to collect DailyCosts for all services
-            # and save all at the end
-            daily_costs.extend(DailyCost._build_tree(
-                tree=se_costs,
-                date=date,
-                service_environment_id=service_environment,
-                forecast=forecast,
-            ))
-        return daily_costs
+        return list(self._iter_daily_costs(date, costs, forecast))
 
-    def _save_costs(self, daily_costs):
+    def _iter_daily_costs(self, date, costs, forecast):
+        """
+        Generate DailyCost instances (namedtuples) from costs (CostTree or
+        costs in legacy format).
+        """
+        return as_cost_tree(costs).iter_rows(date, forecast)
+
+    def _save_costs(self, daily_costs, model=DailyCost):
         """
         Save daily_costs in database.
 
         :param daily_costs: list instances of DailyCost
+        :param model: model (table) in which costs are saved (DailyCost or
+            DailyCostStaging)
         """
         logger.info('Saving {} costs'.format(len(daily_costs)))
-        DailyCost.objects.bulk_create(
-            daily_costs,
-            batch_size=settings.DAILY_COST_CREATE_BATCH_SIZE,
-        )
+        get_bulk_writer(model).write(daily_costs)
 
     def _update_status(self, date, forecast):
         """
@@ -242,10 +887,15 @@ class Collector(object):
         """
         # update status to created
         status, created = CostDateStatus.objects.get_or_create(date=date)
+        # fingerprint is known only if it was calculated before costs (see
+        # `get_unchanged_days`)
+        fingerprint = self._fingerprints.pop((_as_date(date), forecast), '')
         if forecast:
             status.forecast_calculated = True
+            status.forecast_fingerprint = fingerprint
         else:
             status.calculated = True
+            status.fingerprint = fingerprint
         status.save()
 
     def _update_status_period(self, start, end, forecast):
@@ -260,52 +910,207 @@ class Collector(object):
         self,
         date,
         forecast=False,
-        plugins=None
+        plugins=None,
+        engine=None,
     ):
         """
         Collects costs from all plugins and stores them per service environment
+
+        All daily usages for date are loaded once (as usages snapshot, unless
+        snapshot for date is already active) and shared by all plugins. Costs
+        of pricing services are calculated once per day (by pricing services
+        engine) and reused by every dependant.
+
+        Calculation (and every plugin) is profiled - profile is saved in
+        `profiles` (and as `CostCalculationRun`, if
+        `SAVE_COSTS_CALCULATION_RUNS` is enabled).
         """
         logger.debug("Getting report date")
-        old_queries_count = len(connection.queries)
-        data = defaultdict(list)
-        for i, plugin in enumerate(plugins or self.get_plugins()):
+        profile = self._profile = CalculationProfile(date, forecast)
+        try:
+            with profile.total.measure():
+                data = self._collect_profiled_costs(
+                    date, forecast, plugins, engine
+                )
+        finally:
+            self._profile = None
+        profile.total.entries = len(data)
+        self.profiles[(_as_date(date), forecast)] = profile
+        logger.debug(
+            'Costs calculated in {:.2f}s with {} SQL queries ({:.2f}s)'.format(
+                profile.total.wall_time,
+                profile.total.queries.count,
+                profile.total.queries.time,
+            )
+        )
+        if settings.SAVE_COSTS_CALCULATION_RUNS:
+            profile.save()
+        return data
+
+    def _collect_profiled_costs(self, date, forecast, plugins, engine):
+        engine = engine or PricingServicesEngine(date, forecast)
+        snapshot = get_active_snapshot()
+        if snapshot is None or not snapshot.covers(date):
+            snapshot = DailyUsagesSnapshot.load(date)
+        with activate_usages_snapshot(snapshot):
+            with activate_pricing_services_engine(engine):
+                data = self._run_plugins(date, forecast, plugins, engine)
+        # hierarchies of pricing services costs saved only to limited depth
+        # (deeper costs are calculated from them on demand) are staged and
+        # published together with costs
+        if engine.hierarchies:
+            save_hierarchies(date, forecast, engine.hierarchies)
+        return data
+
+    def _get_plugins_levels(self, plugins, engine=None):
+        """
+        Returns indexes of plugins grouped in levels - plugins from single
+        level are independent on each other and depend only on plugins from
+        previous levels.
+
+        Pricing services plugins are depending on all other plugins (ex. usage
+        types, teams), so they are put on the next levels, in topological order
+        of pricing services charging graph (if engine is passed), so every
+        pricing service is calculated after pricing services charging it.
+        Order of plugins in level remains unchanged.
+        """
+        pricing_services_plugins = {}
+        levels = [[]]
+        for i, plugin in enumerate(plugins):
+            pricing_service = plugin['plugin_kwargs'].get('pricing_service')
+            if pricing_service is not None and engine is not None:
+                pricing_services_plugins.setdefault(
+                    pricing_service.id, []
+                ).append(i)
+            else:
+                levels[0].append(i)
+        if pricing_services_plugins:
+            for pricing_services_level in engine.levels:
+                plugins_level = []
+                for pricing_service in pricing_services_level:
+                    plugins_level.extend(
+                        pricing_services_plugins.pop(pricing_service.id, [])
+                    )
+                levels.append(plugins_level)
+            # pricing services not known to engine (ex. created in the
+            # meantime)
+            levels.append([
+                i for indexes in sorted(pricing_services_plugins.values())
+                for i in indexes
+            ])
+        return [level for level in levels if level]
+
+    def _get_plugins_order(self, plugins, engine=None):
+        """
+        Returns indexes of plugins in order in which they should be run (see
+        `_get_plugins_levels` for details).
+        """
+        return [
+            i for level in self._get_plugins_levels(plugins, engine)
+            for i in level
+        ]
+
+    def _run_plugins(self, date, forecast, plugins=None, engine=None):
+        """
+        Run every plugin for date and merge results per service environment
+
+        By default plugins are run one by one. If
+        `SCROOGE_COSTS_PLUGINS_CONCURRENCY` is greater than 1, plugins from
+        every level (see `_get_plugins_levels`) are run concurrently (using
+        at most that many threads).
+
+        Results are merged in order of plugins (regardless of order in which
+        plugins were run), so they are deterministic.
+        """
+        plugins = plugins or self.get_plugins()
+        reports = {}
+        concurrency = settings.SCROOGE_COSTS_PLUGINS_CONCURRENCY
+        if concurrency > 1:
+            # calculation context, usages snapshot and pricing services
+            # engine are active only in current thread - they have to be
+            # passed to threads explicitly
+            context = get_active_context()
+            snapshot = get_active_snapshot()
+            pool = ThreadPool(concurrency)
             try:
-                plugin_old_queries_count = len(connection.queries)
-                plugin_report = plugin_runner.run_plugin(
+                for level in self._get_plugins_levels(plugins, engine):
+                    reports.update(zip(level, pool.map(
+                        lambda i: self._run_plugin_in_thread(
+                            date, forecast, plugins[i], context, snapshot,
+                            engine,
+                        ),
+                        level,
+                    )))
+            finally:
+                pool.terminate()
+        else:
+            for i in self._get_plugins_order(plugins, engine):
+                reports[i] = self._run_plugin(date, forecast, plugins[i])
+        data = CostTree()
+        for i in range(len(plugins)):
+            data.merge(reports.pop(i))
+        return data
+
+    def _run_plugin_in_thread(
+        self, date, forecast, plugin, context=None, snapshot=None, engine=None
+    ):
+        """
+        Run single plugin in worker thread (see `_run_plugin`), in calculation
+        context (and with usages snapshot and pricing services engine) of
+        calling thread.
+        """
+        try:
+            with activate_context(context), activate_usages_snapshot(
+                snapshot
+            ), activate_pricing_services_engine(engine):
+                return self._run_plugin(date, forecast, plugin)
+        finally:
+            # every thread is using its own database connection
+            connection.close()
+
+    def _run_plugin(self, date, forecast, plugin):
+        """
+        Run single plugin for date. Returns costs as CostTree (empty, if
+        plugin could not calculate costs).
+
+        Plugin is profiled in profile of currently calculated day.
+        """
+        profile = self._profile or CalculationProfile(date, forecast)
+        try:
+            with profile.measure_plugin(plugin.name) as plugin_profile:
+                plugin_report = as_cost_tree(plugin_runner.run_plugin(
                     'scrooge_costs',
                     plugin.plugin_name,
                     date=date,
                     forecast=forecast,
                     type='costs',
                     **{str(k): v for (k, v) in plugin['plugin_kwargs'].items()}
+                ))
+                plugin_profile.entries = len(plugin_report)
+            logger.debug(
+                'Plugin {} calculated {} costs in {:.2f}s with {} SQL '
+                'queries'.format(
+                    plugin.name,
+                    plugin_profile.entries,
+                    plugin_profile.wall_time,
+                    plugin_profile.queries.count,
                 )
-                for service_id, service_usage in plugin_report.iteritems():
-                    data[service_id].extend(service_usage)
-                plugin_queries_count = (
-                    len(connection.queries) - plugin_old_queries_count
-                )
-                if settings.DEBUG:
-                    logger.debug('Plugin SQL queries: {0}\n'.format(
-                        plugin_queries_count
-                    ))
-            except KeyError:
-                logger.warning(
-                    "Usage '{0}' has no usage plugin\n".format(plugin.name)
-                )
-            except NoPriceCostError:
-                logger.warning('No costs defined\n')
-            except MultiplePriceCostError:
-                logger.warning('Multiple costs defined\n')
-            except Exception as e:
-                logger.exception(
-                    "Error while generating the report: {0}\n".format(e)
-                )
-                raise
-
-        queries_count = len(connection.queries) - old_queries_count
-        if settings.DEBUG:
-            logger.debug('Total SQL queries: {0}'.format(queries_count))
-        return data
+            )
+            return plugin_report
+        except KeyError:
+            logger.warning(
+                "Usage '{0}' has no usage plugin\n".format(plugin.name)
+            )
+        except NoPriceCostError:
+            logger.warning('No costs defined\n')
+        except MultiplePriceCostError:
+            logger.warning('Multiple costs defined\n')
+        except Exception as e:
+            logger.exception(
+                "Error while generating the report: {0}\n".format(e)
+            )
+            raise
+        return CostTree()
 
     def calculate_daily_costs_for_day(self, day, forecast, plugins):
         """"
@@ -316,6 +1121,76 @@ class Collector(object):
         start = end = day
         self.save_period_costs(start, end, forecast, daily_costs)
 
+    def replace_plugins_costs(self, day, forecast, plugins, types):
+        """
+        Recalculate costs of day using only plugins and replace costs
+        subtrees (rooted in one of types - types of costs calculated by
+        plugins) with recalculated ones. Other costs of the day are left
+        intact.
+
+        Fingerprint of inputs of the day is cleared, so next calculation of
+        the day won't be skipped (see `get_unchanged_days`).
+
+        If forecast is `BOTH_FORECASTS`, real and forecast costs are
+        recalculated in single pass (see `process_dual`) - costs which were
+        already accepted are left intact.
+
+        :returns: number of saved daily costs
+        :rtype: int
+        """
+        if forecast == BOTH_FORECASTS:
+            costs = self.process_dual(day, plugins=plugins)
+        else:
+            costs = {forecast: self.process(day, forecast, plugins=plugins)}
+        count = 0
+        for costs_forecast, forecast_costs in costs.items():
+            count += self._replace_costs_subtrees(
+                day, costs_forecast, forecast_costs, types
+            )
+        logger.info('{} costs of {} plugins replaced for date {}'.format(
+            count, len(plugins), day,
+        ))
+        return count
+
+    def _replace_costs_subtrees(self, day, forecast, costs, types):
+        # lock is held until transaction is committed
+        with dailycost_lock(), transaction.atomic():
+            self._delete_daily_costs_subtrees(day, forecast, types)
+            count = get_bulk_writer(DailyCost).write(
+                self._iter_daily_costs(day, costs, forecast)
+            )
+            publish_hierarchies(
+                day, day, forecast,
+                pricing_services=[type_.id for type_ in types],
+            )
+            CostDateStatus.objects.filter(date=day).update(**{
+                'forecast_fingerprint' if forecast else 'fingerprint': ''
+            })
+        return count
+
+    def _delete_daily_costs_subtrees(self, day, forecast, types):
+        """
+        Delete previously saved costs (of day, including forecast flag) in
+        subtrees rooted in one of types.
+        """
+        link = DailyCost._path_link
+        for batch in chunks(types, settings.DAILY_COST_CREATE_BATCH_SIZE):
+            conditions = []
+            params = [day, forecast]
+            for type_ in batch:
+                conditions.append('path=%s OR path LIKE %s')
+                params.extend([str(type_.id), str(type_.id) + link + '%'])
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                DELETE FROM {}
+                WHERE date=%s and forecast=%s and ({})
+                """.format(
+                    DailyCost._meta.db_table, ' OR '.join(conditions)
+                ),
+                params
+            )
+
     @classmethod
     def _get_services_environments(cls):
         """
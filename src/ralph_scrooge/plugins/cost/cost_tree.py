@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar (array-backed) representation of costs of single day.
+
+Instead of (millions of) small dicts with nested `_children` lists (see
+`Collector` for legacy format), every cost is stored as single position in
+parallel arrays of service environment ids, type ids, pricing object ids,
+warehouse ids, values, costs (in micro-units), flags, parent indexes and
+depths.
+Parent is always stored before its children (pre-order), so costs could be
+converted directly to database rows (see `CostTree.iter_rows`), without
+recursion.
+
+Plugins could append costs to `CostTree` directly or return costs in legacy
+format, which are converted using `as_cost_tree`.
+
+Costs of single day are passed from subtask (RQ job) to master job as
+`PackedCostTree` - columns of `CostTree` narrowed to the smallest integer type
+which fits their values (parents are stored as distance to parent, which is
+usually small), compressed using zlib. Packed costs could be spilled to local
+file (when subtasks and master share filesystem - see
+`COSTS_RESULT_SPILL_DIR`), so only path to it is passed through Redis. Costs
+are unpacked lazily, when master uses them (see `as_cost_tree`).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from collections import OrderedDict
+
+from django.conf import settings
+
+from ralph_scrooge.models import DailyCost
+from ralph_scrooge.utils.money import from_micro, to_micro
+
+# missing (NULL) pricing object or warehouse is stored as 0
+NULL_ID = 0
+NO_PARENT = -1
+# flags of cost: cost was passed (costs without it are saved as 0) and cost
+# is not equal to 0 (even if it's rounded to 0 micro-units) - only costs
+# passed explicitly as 0 are skipped when costs are saved (see `iter_rows`)
+HAS_COST = 1
+NONZERO_COST = 2
+
+_COLUMNS = (
+    ('service_environments', str('l')),
+    ('types', str('l')),
+    ('pricing_objects', str('l')),
+    ('warehouses', str('l')),
+    ('values', str('d')),
+    ('costs', str('l')),
+    ('flags', str('B')),
+    ('parents', str('l')),
+    ('depths', str('H')),
+)
+
+# header of packed costs: magic, version and number of costs
+_PACKED_MAGIC = b'SCT'
+_PACKED_VERSION = 2
+_PACKED_HEADER = struct.Struct(str('<3sBI'))
+# header of every column of packed costs: typecode and size of item
+_PACKED_COLUMN_HEADER = struct.Struct(str('<cB'))
+# integer types to which columns are narrowed (from the smallest one)
+_NARROW_TYPECODES = {
+    True: tuple(str(typecode) for typecode in 'bhil'),  # signed
+    False: tuple(str(typecode) for typecode in 'BHIL'),  # unsigned
+}
+
+
+def _get_id(node, field):
+    """
+    Returns id of related object from legacy cost node (by `<field>_id` key
+    or `<field>` key with object or id as value).
+    """
+    value = node.get(field + '_id')
+    if value is None:
+        value = node.get(field)
+        if value is not None and not isinstance(value, (int, long)):
+            value = value.pk
+    return value
+
+
+class CostTree(object):
+    """
+    Costs of single day stored in parallel arrays (see module docstring).
+    """
+    __slots__ = tuple(name for name, _ in _COLUMNS)
+
+    def __init__(self):
+        for name, typecode in _COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name, _ in _COLUMNS)
+
+    def __setstate__(self, state):
+        for (name, _), column in zip(_COLUMNS, state):
+            setattr(self, name, column)
+
+    def append(
+        self,
+        service_environment_id,
+        type_id,
+        cost=None,
+        value=0,
+        pricing_object_id=None,
+        warehouse_id=None,
+        parent=NO_PARENT,
+    ):
+        """
+        Append single cost.
+
+        :param cost: cost (None if cost is missing)
+        :param parent: index of parent cost (returned by `append`)
+        :returns: index of appended cost
+        :rtype: int
+        """
+        self.service_environments.append(service_environment_id)
+        self.types.append(type_id)
+        self.pricing_objects.append(pricing_object_id or NULL_ID)
+        self.warehouses.append(warehouse_id or NULL_ID)
+        self.values.append(value or 0)
+        if cost is None:
+            self.costs.append(0)
+            self.flags.append(0)
+        else:
+            self.costs.append(to_micro(cost))
+            self.flags.append(HAS_COST | (NONZERO_COST if cost != 0 else 0))
+        self.parents.append(parent)
+        self.depths.append(
+            self.depths[parent] + 1 if parent != NO_PARENT else 0
+        )
+        return len(self.types) - 1
+
+    def add_legacy(self, service_environment_id, costs, parent=NO_PARENT):
+        """
+        Append costs of service environment in legacy format (list of dicts
+        with nested `_children`).
+        """
+        for node in costs:
+            index = self.append(
+                service_environment_id,
+                _get_id(node, 'type'),
+                cost=node.get('cost'),
+                value=node.get('value'),
+                pricing_object_id=_get_id(node, 'pricing_object'),
+                warehouse_id=_get_id(node, 'warehouse'),
+                parent=parent,
+            )
+            children = node.get('_children')
+            if children:
+                self.add_legacy(service_environment_id, children, index)
+
+    @classmethod
+    def from_legacy(cls, costs):
+        """
+        Create CostTree from costs in legacy format (dict with service
+        environment id as key and list of costs as value).
+        """
+        tree = cls()
+        for service_environment_id, se_costs in costs.iteritems():
+            tree.add_legacy(service_environment_id, se_costs)
+        return tree
+
+    def merge(self, other):
+        """
+        Append all costs from other CostTree.
+        """
+        offset = len(self)
+        for name, _ in _COLUMNS:
+            if name != 'parents':
+                getattr(self, name).extend(getattr(other, name))
+        self.parents.extend(array(str('l'), [
+            parent + offset if parent != NO_PARENT else NO_PARENT
+            for parent in other.parents
+        ]))
+
+    def to_legacy(self):
+        """
+        Returns costs in legacy format (dict with service environment id as
+        key and list of costs - dicts with nested `_children` - as value).
+        """
+        result = OrderedDict()
+        nodes = []
+        for i in xrange(len(self)):
+            node = {
+                'type_id': self.types[i],
+                'value': self.values[i],
+            }
+            if self.flags[i] & HAS_COST:
+                node['cost'] = from_micro(self.costs[i])
+            if self.pricing_objects[i] != NULL_ID:
+                node['pricing_object_id'] = self.pricing_objects[i]
+            if self.warehouses[i] != NULL_ID:
+                node['warehouse_id'] = self.warehouses[i]
+            parent = self.parents[i]
+            if parent == NO_PARENT:
+                result.setdefault(self.service_environments[i], []).append(
+                    node
+                )
+            else:
+                nodes[parent].setdefault('_children', []).append(node)
+            nodes.append(node)
+        return result
+
+    def iter_rows(self, date, forecast, model=DailyCost):
+        """
+        Generate rows (namedtuples of model, ex. DailyCost) ready to save in
+        database, with the same content as `MultiPathNode._build_tree`
+        (costs passed as 0 are skipped together with their children, missing
+        costs are saved as 0).
+        """
+        row = model.namedtuple
+        link = model._path_link
+        paths = []
+        for i in xrange(len(self)):
+            parent = self.parents[i]
+            if self.flags[i] == HAS_COST or (
+                parent != NO_PARENT and paths[parent] is None
+            ):
+                paths.append(None)
+                continue
+            path = str(self.types[i])
+            if parent != NO_PARENT:
+                path = paths[parent] + link + path
+            paths.append(path)
+            yield row(
+                path=path,
+                depth=self.depths[i],
+                pricing_object_id=self.pricing_objects[i] or None,
+                service_environment_id=self.service_environments[i],
+                type_id=self.types[i],
+                warehouse_id=self.warehouses[i] or None,
+                value=self.values[i],
+                cost=from_micro(self.costs[i]),
+                forecast=forecast,
+                date=date,
+            )
+
+
+def _narrow(column):
+    """
+    Returns integer column as array of the smallest type which fits all of
+    its values (floats are returned without change).
+    """
+    if column.typecode == 'd' or not column:
+        return column
+    low, high = min(column), max(column)
+    signed = column.typecode.islower()
+    for typecode in _NARROW_TYPECODES[signed]:
+        bits = array(typecode).itemsize * 8
+        if signed and -2 ** (bits - 1) <= low and high < 2 ** (bits - 1):
+            break
+        if not signed and high < 2 ** bits:
+            break
+    if typecode == column.typecode:
+        return column
+    return array(typecode, column)
+
+
+def _to_distances(parents):
+    return array(str('l'), [
+        i - parent if parent != NO_PARENT else 0
+        for i, parent in enumerate(parents)
+    ])
+
+
+def _from_distances(distances):
+    return array(str('l'), [
+        i - distance if distance else NO_PARENT
+        for i, distance in enumerate(distances)
+    ])
+
+
+def pack_cost_tree(tree, level=None):
+    """
+    Returns CostTree packed to compact binary format (see module docstring).
+
+    :param level: zlib compression level (default:
+        `COSTS_RESULT_COMPRESS_LEVEL` setting)
+    :rtype: bytes
+    """
+    chunks = []
+    for name, _ in _COLUMNS:
+        column = getattr(tree, name)
+        if name == 'parents':
+            column = _to_distances(column)
+        column = _narrow(column)
+        if sys.byteorder == 'big':
+            column = array(column.typecode, column)
+            column.byteswap()
+        chunks.append(_PACKED_COLUMN_HEADER.pack(
+            column.typecode.encode('ascii'), column.itemsize
+        ))
+        chunks.append(column.tostring())
+    if level is None:
+        level = settings.COSTS_RESULT_COMPRESS_LEVEL
+    return _PACKED_HEADER.pack(
+        _PACKED_MAGIC, _PACKED_VERSION, len(tree)
+    ) + zlib.compress(b''.join(chunks), level)
+
+
+def unpack_cost_tree(data):
+    """
+    Returns CostTree from data packed by `pack_cost_tree`.
+
+    :rtype: CostTree
+    """
+    magic, version, length = _PACKED_HEADER.unpack_from(data)
+    if magic != _PACKED_MAGIC or version != _PACKED_VERSION:
+        raise ValueError('Invalid packed costs (version {})'.format(version))
+    body = zlib.decompress(data[_PACKED_HEADER.size:])
+    offset = 0
+    tree = CostTree()
+    for name, typecode in _COLUMNS:
+        packed_typecode, itemsize = _PACKED_COLUMN_HEADER.unpack_from(
+            body, offset
+        )
+        offset += _PACKED_COLUMN_HEADER.size
+        column = array(str(packed_typecode.decode('ascii')))
+        if column.itemsize != itemsize:
+            raise ValueError(
+                'Invalid size of packed column {} ({} instead of {})'.format(
+                    name, itemsize, column.itemsize,
+                )
+            )
+        column.fromstring(body[offset:offset + length * itemsize])
+        offset += length * itemsize
+        if sys.byteorder == 'big':
+            column.byteswap()
+        if name == 'parents':
+            column = _from_distances(column)
+        elif column.typecode != typecode:
+            column = array(typecode, column)
+        setattr(tree, name, column)
+    return tree
+
+
+class PackedCostTree(object):
+    """
+    CostTree packed to compact binary format (see `pack_cost_tree`), which is
+    passed from subtask to master job. Packed data is kept in memory or
+    spilled to local file (removed when it's read for the first time). Costs
+    are unpacked on demand (see `unpack`).
+    """
+    __slots__ = ('data', 'path', 'length')
+
+    def __init__(self, data=None, path=None, length=0):
+        self.data = data
+        self.path = path
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getstate__(self):
+        return self.data, self.path, self.length
+
+    def __setstate__(self, state):
+        self.data, self.path, self.length = state
+
+    @classmethod
+    def pack(cls, tree, spill_dir=None):
+        """
+        Pack CostTree (or costs in legacy format). If `spill_dir` is passed
+        (`COSTS_RESULT_SPILL_DIR` setting by default), packed data is saved in
+        file in this directory.
+        """
+        tree = as_cost_tree(tree)
+        data = pack_cost_tree(tree)
+        if spill_dir is None:
+            spill_dir = settings.COSTS_RESULT_SPILL_DIR
+        if not spill_dir:
+            return cls(data=data, length=len(tree))
+        fd, path = tempfile.mkstemp(
+            prefix='scrooge_costs_', suffix='.sct', dir=spill_dir
+        )
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return cls(path=path, length=len(tree))
+
+    def unpack(self):
+        """
+        Returns unpacked CostTree.
+
+        :rtype: CostTree
+        """
+        if self.data is None and self.path is not None:
+            with open(self.path, 'rb') as f:
+                self.data = f.read()
+            os.remove(self.path)
+            self.path = None
+        return unpack_cost_tree(self.data)
+
+
+def as_cost_tree(costs):
+    """
+    Returns costs as CostTree (costs in legacy format are converted, packed
+    costs are unpacked).
+    """
+    if isinstance(costs, CostTree):
+        return costs
+    if isinstance(costs, PackedCostTree):
+        return costs.unpack()
+    return CostTree.from_legacy(costs or {})
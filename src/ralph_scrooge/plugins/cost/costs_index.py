@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Index of costs calculated by single cost plugin (for single day).
+
+Every pricing service is asking every usage type, team and extra cost plugin
+for costs (or total cost) restricted to its own service environments. Costs
+of plugin are calculated only once (see `BaseCostPlugin._costs`), but without
+index every such call was scanning all service environments of plugin result
+and summing nested lists of costs again.
+
+Index keeps total cost of every service environment (calculated once, when
+index is built), so total cost of any subset of service environments is
+simple gather-sum of per-service-environment totals (proportional to the
+size of subset, not to the size of plugin result). Totals are additionally
+remembered per subset of service environments, because the same subsets
+(ex. service environments of pricing service) are asked by many plugins.
+
+When pricing services engine is active, totals (without costs) are kept in
+it (see `BaseCostPlugin._get_costs_totals`), so shards of next levels of
+calculation of the same day are not calculating costs of plugin again.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+
+class CostsTotals(object):
+    """
+    Total cost of every service environment (of costs of single plugin).
+    """
+    def __init__(self, totals):
+        self.totals = totals
+        self._subsets_totals = {}
+
+    def _get_ids(self, service_environments):
+        return frozenset(se.id for se in service_environments)
+
+    def total(self, service_environments=None):
+        """
+        Returns total cost of service_environments (or of all service
+        environments if service_environments is None).
+
+        :rtype: decimal.Decimal
+        """
+        if service_environments is None:
+            se_ids = None
+        else:
+            se_ids = self._get_ids(service_environments)
+        try:
+            return self._subsets_totals[se_ids]
+        except KeyError:
+            pass
+        if se_ids is None:
+            total = sum(self.totals.itervalues())
+        else:
+            totals = self.totals
+            total = sum([totals[se_id] for se_id in se_ids if se_id in totals])
+        self._subsets_totals[se_ids] = total
+        return total
+
+
+class CostsIndex(CostsTotals):
+    """
+    Costs of plugin (costs per service environment, in format returned by
+    `BaseCostPlugin._costs`) with total cost of every service environment.
+    """
+    def __init__(self, costs):
+        super(CostsIndex, self).__init__(dict(
+            (se_id, sum([c['cost'] for c in se_costs]))
+            for se_id, se_costs in costs.iteritems()
+        ))
+        self.costs = costs
+
+    def filter(self, service_environments):
+        """
+        Returns costs of service_environments only.
+
+        :rtype: dict
+        """
+        costs = self.costs
+        return dict(
+            (se_id, costs[se_id])
+            for se_id in self._get_ids(service_environments)
+            if se_id in costs
+        )
+
+    def get_totals(self):
+        """
+        Returns totals of service environments without costs (small enough
+        to be passed between shards of calculation of day).
+
+        :rtype: CostsTotals
+        """
+        return CostsTotals(self.totals)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Index of dependencies between usage types, costs plugins and pricing services
+for single day.
+
+When usages of some usage type are changed, only costs calculated by plugins
+depending on this usage type have to be recalculated:
+
+* usage type plugin of (base or regular) usage type
+* teams plugins, when usage type is used to distribute teams costs
+  (physical cpu cores)
+* dynamic extra costs plugins, which costs are divided using usage type
+* pricing services plugins of pricing services having usage type as service
+  usage type or having service environments using usage type
+* and every pricing service charging (directly or indirectly) any of
+  affected pricing services (see `_get_pricing_services_graph`)
+
+Every plugin is calculating costs of single type (ex. usage type or pricing
+service), which is the type of root of every costs subtree returned by
+plugin, so costs of affected plugins could be replaced without touching
+other costs of the day (see `Collector.replace_plugins_costs`).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+from collections import defaultdict
+
+from ralph_scrooge.models import (
+    DailyUsage,
+    DynamicExtraCostDivision,
+    ServiceEnvironment,
+    ServiceUsageTypes,
+)
+from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.utils.cycle_detector import _get_pricing_services_graph
+
+logger = logging.getLogger(__name__)
+
+# usage type used by teams plugins to distribute costs
+TEAMS_USAGE_TYPE_SYMBOL = 'physical_cpu_cores'
+
+# keys of plugin kwargs with type of costs calculated by plugin
+PLUGIN_TYPE_KWARGS = (
+    'usage_type',
+    'pricing_service',
+    'team',
+    'extra_cost_type',
+    'dynamic_extra_cost_type',
+)
+
+
+def get_plugin_type(plugin):
+    """
+    Returns type of costs calculated by plugin (type of roots of costs
+    subtrees) or None, if plugin is not calculating costs of single type
+    (ex. support plugin).
+    """
+    for key in PLUGIN_TYPE_KWARGS:
+        value = plugin['plugin_kwargs'].get(key)
+        if value is not None:
+            return value
+    return None
+
+
+class CostsDependencyIndex(object):
+    """
+    Dependencies between usage types, plugins and pricing services for date.
+    """
+    def __init__(self, date, plugins=None):
+        self.date = date
+        self.plugins = plugins or Collector.get_plugins()
+        # usage type id -> ids of pricing services, which costs depend on
+        # usage type
+        self.usage_type_pricing_services = defaultdict(set)
+        # pricing service id -> ids of pricing services charged by it
+        self.charged_pricing_services = defaultdict(set)
+        # usage type id -> ids of dynamic extra cost types divided by it
+        self.usage_type_dynamic_extra_costs = defaultdict(set)
+        self._load()
+
+    def _load(self):
+        for sut in ServiceUsageTypes.objects.filter(
+            start__lte=self.date,
+            end__gte=self.date,
+        ).values('usage_type_id', 'pricing_service_id'):
+            self.usage_type_pricing_services[sut['usage_type_id']].add(
+                sut['pricing_service_id']
+            )
+        for usage in DailyUsage.objects.filter(
+            date=self.date,
+            service_environment__service__pricing_service__isnull=False,
+        ).values(
+            'type_id',
+            'service_environment__service__pricing_service_id',
+        ).distinct():
+            self.usage_type_pricing_services[usage['type_id']].add(
+                usage['service_environment__service__pricing_service_id']
+            )
+        for cost_division in DynamicExtraCostDivision.objects.values(
+            'usage_type_id', 'dynamic_extra_cost_type_id'
+        ):
+            self.usage_type_dynamic_extra_costs[
+                cost_division['usage_type_id']
+            ].add(cost_division['dynamic_extra_cost_type_id'])
+        for pricing_service, charged in _get_pricing_services_graph(
+            self.date
+        ).items():
+            self.charged_pricing_services[pricing_service.id].update(
+                ps.id for ps in charged
+            )
+
+    def add_usages(self, usage_type, service_environments):
+        """
+        Register usages of usage_type by service_environments, which are not
+        saved in database yet (or were deleted already), so pricing services
+        of these service environments are treated as depending on usage type.
+        """
+        self.usage_type_pricing_services[usage_type.id].update(
+            ServiceEnvironment.objects.filter(
+                id__in=[se.id for se in service_environments],
+                service__pricing_service__isnull=False,
+            ).values_list('service__pricing_service_id', flat=True)
+        )
+
+    def get_affected_pricing_services(self, pricing_services_ids):
+        """
+        Returns ids of pricing_services_ids together with ids of all pricing
+        services charged by them (directly or indirectly).
+
+        :rtype: set
+        """
+        result = set()
+        to_visit = list(pricing_services_ids)
+        while to_visit:
+            pricing_service_id = to_visit.pop()
+            if pricing_service_id in result:
+                continue
+            result.add(pricing_service_id)
+            to_visit.extend(
+                self.charged_pricing_services[pricing_service_id]
+            )
+        return result
+
+    def get_affected_plugins(self, usage_types):
+        """
+        Returns plugins (in order of `plugins`), which costs depend on
+        usages of any of usage_types.
+        """
+        usage_types_ids = set(ut.id for ut in usage_types)
+        teams_affected = any(
+            ut.symbol == TEAMS_USAGE_TYPE_SYMBOL for ut in usage_types
+        )
+        dynamic_extra_costs_ids = set()
+        pricing_services_ids = set()
+        for usage_type_id in usage_types_ids:
+            dynamic_extra_costs_ids.update(
+                self.usage_type_dynamic_extra_costs[usage_type_id]
+            )
+            pricing_services_ids.update(
+                self.usage_type_pricing_services[usage_type_id]
+            )
+        if teams_affected or dynamic_extra_costs_ids:
+            # teams and dynamic extra costs are distributed between all
+            # service environments, so costs of every pricing service could
+            # change
+            pricing_services_ids.update(
+                plugin['plugin_kwargs']['pricing_service'].id
+                for plugin in self.plugins
+                if 'pricing_service' in plugin['plugin_kwargs']
+            )
+        pricing_services_ids = self.get_affected_pricing_services(
+            pricing_services_ids
+        )
+        affected = {
+            'usage_type': usage_types_ids,
+            'pricing_service': pricing_services_ids,
+            'dynamic_extra_cost_type': dynamic_extra_costs_ids,
+        }
+        result = []
+        for plugin in self.plugins:
+            kwargs = plugin['plugin_kwargs']
+            if 'team' in kwargs:
+                is_affected = teams_affected
+            else:
+                is_affected = any(
+                    key in kwargs and kwargs[key].id in ids
+                    for key, ids in affected.items()
+                )
+            if is_affected:
+                result.append(plugin)
+        logger.info(
+            'Plugins depending on usage types {}: {}'.format(
+                ', '.join(sorted(ut.symbol for ut in usage_types)),
+                ', '.join(plugin.name for plugin in result) or '-',
+            )
+        )
+        return result
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Kernel distributing hierarchy of (pricing service) costs between pricing
+objects.
+
+Every pricing object gets the same fraction (share factor) of every node of
+costs hierarchy - fraction depends only on pricing object usages of pricing
+service usage types (and their percentage division), not on the node itself.
+Because of that, costs hierarchy is flattened once (to parallel lists, see
+`FlatHierarchy`), share factor is calculated once per pricing object and
+cost of every node is then allocated between all pricing objects (in
+micro-units, see `ralph_scrooge.utils.money.allocate`), so allocated costs
+are summing up exactly to the cost of node. Share factors are quantised to
+integer weights once (see `ralph_scrooge.utils.money.to_weights`), so only
+integer arithmetic is done for every node. Result tree (dicts with
+`_children`) is built only at the end, for every pricing object.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from decimal import Decimal as D
+
+from ralph_scrooge.utils.money import (
+    allocate,
+    from_micro,
+    to_micro,
+    to_weights,
+    WEIGHT_UNITS,
+)
+
+
+class FlatHierarchy(object):
+    """
+    Costs hierarchy (dict with base usage id as key and tuple (cost, children
+    hierarchy) as value) stored as parallel lists in pre-order (parent is
+    always before its children). Costs are stored in micro-units.
+
+    Only nodes up to max_depth (or only top-level nodes, if with_children is
+    False) are stored (all nodes if max_depth is None).
+    """
+    __slots__ = ('types', 'costs', 'parents', 'depths')
+
+    def __init__(self, hierarchy, with_children=True, max_depth=None):
+        self.types = []
+        self.costs = []
+        self.parents = []
+        self.depths = []
+        if not with_children:
+            max_depth = 0
+        self._add(hierarchy, -1, 0, max_depth)
+
+    def _add(self, hierarchy, parent, depth, max_depth):
+        for base_usage, (cost, children) in hierarchy.items():
+            index = len(self.types)
+            self.types.append(base_usage)
+            self.costs.append(to_micro(cost))
+            self.parents.append(parent)
+            self.depths.append(depth)
+            if children and (max_depth is None or depth < max_depth):
+                self._add(children, index, depth + 1, max_depth)
+
+    def __len__(self):
+        return len(self.types)
+
+
+def get_hierarchy_depth(hierarchy):
+    """
+    Returns depth of the deepest node of costs hierarchy (0 if there are only
+    top-level nodes).
+
+    :rtype: int
+    """
+    depth = 0
+    for cost, children in hierarchy.values():
+        if children:
+            depth = max(depth, get_hierarchy_depth(children) + 1)
+    return depth
+
+
+def get_share_factor(usages):
+    """
+    Returns fraction of pricing service costs, which should be allocated to
+    pricing object.
+
+    :param usages: list of (pricing object usage, total usage, percent) for
+        every pricing service usage type used by pricing object.
+    :rtype: Decimal
+    """
+    factor = D(0)
+    for usage, total, percent in usages:
+        if total != 0:
+            factor += (D(usage) / D(total)) * (D(percent) / 100)
+        else:
+            factor = D(0)
+    return factor
+
+
+def distribute_hierarchy(pricing_objects_usages, flat_hierarchy):
+    """
+    Distribute (flattened) costs hierarchy between pricing objects
+    proportionally to their usages (see `get_share_factor`).
+
+    :param pricing_objects_usages: list of (pricing object id, usages) where
+        usages are passed to `get_share_factor`
+    :type pricing_objects_usages: list
+    :rtype: list
+    :returns: list of costs hierarchies (list of costs with `_children`) of
+        every pricing object (in order of pricing_objects_usages)
+    """
+    weights = to_weights(
+        get_share_factor(usages) for _, usages in pricing_objects_usages
+    )
+    # costs of every node allocated between all pricing objects
+    allocations = [
+        allocate(cost, weights, total_weight=WEIGHT_UNITS)
+        for cost in flat_hierarchy.costs
+    ]
+    result = []
+    for i, (pricing_object_id, usages) in enumerate(pricing_objects_usages):
+        # add value if there is only one usage type defined for pricing
+        # service (only on whole pricing service level - depth 0)
+        value = usages[0][0] if len(usages) == 1 else None
+        nodes = []
+        pricing_object_result = []
+        for type_id, node_allocations, parent, depth in zip(
+            flat_hierarchy.types,
+            allocations,
+            flat_hierarchy.parents,
+            flat_hierarchy.depths,
+        ):
+            node = {
+                'type_id': type_id,
+                'pricing_object_id': pricing_object_id,
+                'cost': from_micro(node_allocations[i]),
+            }
+            if depth == 0:
+                if value is not None:
+                    node['value'] = value
+                pricing_object_result.append(node)
+            else:
+                nodes[parent].setdefault('_children', []).append(node)
+            nodes.append(node)
+        result.append(pricing_object_result)
+    return result
@@ -11,7 +11,7 @@ from ralph_scrooge.models import DynamicExtraCost
 from ralph_scrooge.plugins.base import register
 from ralph_scrooge.plugins.cost.base import NoPriceCostError
 from ralph_scrooge.plugins.cost.pricing_service import PricingServiceBasePlugin
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.utils.calculation_context import cached
 
 logger = logging.getLogger(__name__)
 
@@ -22,13 +22,27 @@ class DynamicExtraCostPlugin(PricingServiceBasePlugin):
         service_costs = self.costs(*args, **kwargs)
         return self._get_total_costs_from_costs(service_costs)
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _costs(
         self,
         dynamic_extra_cost_type,
         date,
         forecast=False,
         **kwargs
+    ):
+        return self._calculate_once(
+            'costs',
+            self._calculate_costs,
+            dynamic_extra_cost_type,
+            date=date,
+            forecast=forecast,
+        )
+
+    def _calculate_costs(
+        self,
+        dynamic_extra_cost_type,
+        date,
+        forecast=False,
     ):
         logger.info("Calculating dynamic extra costs: {0}".format(
             dynamic_extra_cost_type.name,
@@ -11,7 +11,8 @@ from collections import defaultdict
 from ralph_scrooge.models import ExtraCost
 from ralph_scrooge.plugins.base import register
 from ralph_scrooge.plugins.cost.base import BaseCostPlugin
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.utils.calculation_context import cached
+from ralph_scrooge.utils.money import allocate, from_micro, to_micro
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +24,7 @@ class ExtraCostPlugin(BaseCostPlugin):
     cost model.
     """
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _costs(
         self,
         date,
@@ -61,9 +62,15 @@ class ExtraCostPlugin(BaseCostPlugin):
         usages = defaultdict(list)
         for extra_cost in extra_costs:
             cost = extra_cost.forecast_cost if forecast else extra_cost.cost
+            # split cost equally between all days of extra cost period (daily
+            # costs are summing up exactly to the cost)
+            daily_costs = allocate(
+                to_micro(cost),
+                [1] * ((extra_cost.end - extra_cost.start).days + 1),
+            )
             usages[extra_cost.service_environment_id].append({
-                'cost': (cost / (
-                    (extra_cost.end - extra_cost.start).days + 1)
+                'cost': from_micro(
+                    daily_costs[(date - extra_cost.start).days]
                 ),
                 'type': extra_cost_type,
             })
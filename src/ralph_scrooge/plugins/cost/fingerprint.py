@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprint of inputs of costs calculation for single day.
+
+Fingerprint is a hash of aggregate checksums of every input of costs
+calculation valid for the day - daily usages and pricing objects, usage
+prices, teams costs and their division, extra costs, support costs, dynamic
+extra costs and usage types division of pricing services - and of
+configuration of costs calculation (usage types, teams, pricing services,
+services environments and their exclusions), together with names of plugins
+used to calculate costs and version of Scrooge.
+
+Checksums are aggregated in database (single query per input, see
+`get_aggregates`): number of rows, sums of numeric columns (including
+foreign keys), sums of them weighted by primary key (so moving value between
+rows, ex. daily usage to another service environment, is detected), sums of
+primary keys of rows with every choice of choice columns, ranges of dates
+and time of last modification (if model is tracking it). Floats and decimals
+(and products of numeric columns and primary keys) are summed as exact
+decimals, so change of single value is never lost in rounding of (big,
+weighted) sum and sums don't depend on order of rows.
+
+Prices of usage types charged by cost and costs of teams billed by assets
+and cores depend on usages of whole period of usage price (team cost), so
+checksums of usages of these periods are included too.
+
+When fingerprint of the day is the same as fingerprint stored with
+`CostDateStatus` in last successful calculation, costs of the day don't
+have to be recalculated (see `Collector.get_unchanged_days`).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Func,
+    IntegerField,
+    Max,
+    Min,
+    Q,
+    Sum,
+    When,
+)
+
+from ralph_scrooge import VERSION
+from ralph_scrooge.models import (
+    BaseUsage,
+    DailyPricingObject,
+    DailyUsage,
+    DynamicExtraCost,
+    DynamicExtraCostDivision,
+    DynamicExtraCostType,
+    ExtraCost,
+    PRICING_OBJECT_TYPES,
+    PricingService,
+    Service,
+    ServiceEnvironment,
+    ServiceUsageTypes,
+    SupportCost,
+    Team,
+    TeamBillingType,
+    TeamCost,
+    TeamServiceEnvironmentPercent,
+    UsagePrice,
+    UsageType,
+)
+
+# change it when the way of costs calculation is changed (to invalidate all
+# stored fingerprints)
+FINGERPRINT_VERSION = 4
+
+
+def _single_day(day):
+    return Q(date=day)
+
+
+def _date_range(day):
+    return Q(start__lte=day, end__gte=day)
+
+
+def _open_date_range(day):
+    return (
+        (Q(start__lte=day) | Q(start__isnull=True)) &
+        (Q(end__gte=day) | Q(end__isnull=True))
+    )
+
+
+def _team_cost_date_range(day):
+    return Q(team_cost__start__lte=day, team_cost__end__gte=day)
+
+
+def _all(day):
+    return Q()
+
+
+# (model, filter for day)
+INPUTS = (
+    (DailyUsage, _single_day),
+    (DailyPricingObject, _single_day),
+    (UsagePrice, _date_range),
+    (TeamCost, _date_range),
+    (TeamServiceEnvironmentPercent, _team_cost_date_range),
+    (ExtraCost, _open_date_range),
+    (SupportCost, _open_date_range),
+    (DynamicExtraCost, _open_date_range),
+    (DynamicExtraCostDivision, _all),
+    (ServiceUsageTypes, _date_range),
+    # configuration of costs calculation
+    (BaseUsage, _all),
+    (UsageType, _all),
+    (UsageType.excluded_services.through, _all),
+    (Team, _all),
+    (Team.excluded_services.through, _all),
+    (PricingService, _all),
+    (PricingService.excluded_services.through, _all),
+    (PricingService.excluded_base_usage_types.through, _all),
+    (PricingService.regular_usage_types.through, _all),
+    (DynamicExtraCostType, _all),
+    (DynamicExtraCostType.excluded_services.through, _all),
+    (Service, _all),
+    (ServiceEnvironment, _all),
+)
+
+# fields, which are not affecting costs (ex. timestamps of modification -
+# time of last modification is checked separately, see `get_aggregates`)
+IGNORED_FIELDS = frozenset([
+    'created', 'modified', 'cache_version', 'created_by', 'modified_by',
+])
+NUMERIC_FIELDS = frozenset([
+    'AutoField',
+    'DecimalField',
+    'FloatField',
+    'ForeignKey',
+    'IntegerField',
+    'OneToOneField',
+    'PositiveIntegerField',
+    'PositiveSmallIntegerField',
+])
+# numeric fields, which are cast to exact decimal before summing (see
+# `_Decimal`)
+EXACT_FIELDS = frozenset(['DecimalField', 'FloatField'])
+# precision of decimals to which numeric columns are cast and of their sums
+DECIMAL_PLACES = 10
+MAX_DIGITS = 38
+SUM_MAX_DIGITS = 65
+# usages of resources of teams billed by assets and cores (see `TeamPlugin`)
+CORES_USAGE_TYPE_SYMBOL = 'physical_cpu_cores'
+RESOURCES_BILLING_TYPES = [
+    TeamBillingType.assets.id, TeamBillingType.assets_cores.id,
+]
+
+
+class _Decimal(Func):
+    """
+    Cast expression to (exact) decimal. `Cast` of Django is casting to
+    NUMERIC type, which is not supported by CAST of MySQL.
+    """
+    template = 'CAST(%(expressions)s AS DECIMAL({}, {}))'.format(
+        MAX_DIGITS, DECIMAL_PLACES
+    )
+
+    def __init__(self, expression):
+        super(_Decimal, self).__init__(expression, output_field=DecimalField(
+            max_digits=MAX_DIGITS, decimal_places=DECIMAL_PLACES,
+        ))
+
+
+def _decimal_sum(expression):
+    return Sum(ExpressionWrapper(expression, output_field=DecimalField(
+        max_digits=SUM_MAX_DIGITS, decimal_places=DECIMAL_PLACES,
+    )))
+
+
+def _weighted_by_pk(expression, model):
+    return _decimal_sum(_Decimal(expression) * F(model._meta.pk.attname))
+
+
+def get_aggregates(model):
+    """
+    Returns list of aggregates, which are checksum of rows of model (see
+    module docstring).
+
+    :rtype: list
+    """
+    pk = model._meta.pk.attname
+    aggregates = [Count(pk), Sum(pk)]
+    for field in model._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        if field.name == 'modified':
+            aggregates.append(Max(field.attname))
+        if field.name in IGNORED_FIELDS:
+            continue
+        internal_type = field.get_internal_type()
+        column = field.attname
+        if internal_type in NUMERIC_FIELDS:
+            aggregates.append(
+                _decimal_sum(_Decimal(F(column)))
+                if internal_type in EXACT_FIELDS else Sum(column)
+            )
+            aggregates.append(_weighted_by_pk(F(column), model))
+        elif internal_type == 'BooleanField':
+            aggregates.append(Sum(Case(
+                When(**{column: True, 'then': F(pk)}),
+                default=0,
+                output_field=IntegerField(),
+            )))
+        elif internal_type == 'DateField':
+            aggregates.extend([Min(column), Max(column)])
+        elif field.choices:
+            aggregates.extend(
+                Sum(Case(
+                    When(**{column: value, 'then': F(pk)}),
+                    default=0,
+                    output_field=IntegerField(),
+                ))
+                for value, _ in field.flatchoices
+            )
+    return aggregates
+
+
+def get_checksum(queryset):
+    """
+    Returns aggregate checksum of rows of queryset, calculated in database
+    (see `get_aggregates`).
+
+    :rtype: tuple
+    """
+    aggregates = get_aggregates(queryset.model)
+    result = queryset.order_by().aggregate(**{
+        'a{}'.format(i): aggregate for i, aggregate in enumerate(aggregates)
+    })
+    return tuple(result['a{}'.format(i)] for i in range(len(aggregates)))
+
+
+def _get_periods_querysets(day):
+    """
+    Returns querysets of usages of whole periods, from which prices or costs
+    valid for day are calculated - usages of usage types charged by cost in
+    period of usage price and assets and cores in period of team cost (of
+    team billed by assets or cores).
+    """
+    querysets = []
+    usage_prices = UsagePrice.objects.filter(
+        _date_range(day), type__by_cost=True,
+    ).values_list(
+        'type_id', 'type__by_warehouse', 'warehouse_id', 'start', 'end',
+    ).order_by('type_id', 'warehouse_id', 'start')
+    for type_id, by_warehouse, warehouse_id, start, end in usage_prices:
+        usages = DailyUsage.objects.filter(
+            type_id=type_id, date__gte=start, date__lte=end,
+        )
+        if by_warehouse and warehouse_id:
+            usages = usages.filter(warehouse_id=warehouse_id)
+        querysets.append(usages)
+    periods = TeamCost.objects.filter(
+        _date_range(day), team__billing_type__in=RESOURCES_BILLING_TYPES,
+    ).values_list('start', 'end').distinct().order_by('start', 'end')
+    for start, end in periods:
+        querysets.append(DailyPricingObject.objects.filter(
+            date__gte=start,
+            date__lte=end,
+            pricing_object__type_id=PRICING_OBJECT_TYPES.ASSET.id,
+        ))
+        querysets.append(DailyUsage.objects.filter(
+            date__gte=start,
+            date__lte=end,
+            type__symbol=CORES_USAGE_TYPE_SYMBOL,
+        ))
+    return querysets
+
+
+def get_inputs_checksums(day):
+    """
+    Returns checksums (see `get_checksum`) of every input of costs
+    calculation for day and of usages of periods of prices and costs valid
+    for the day.
+
+    :rtype: list of tuples
+    """
+    result = [
+        (model._meta.label, get_checksum(
+            model._base_manager.filter(day_filter(day))
+        ))
+        for model, day_filter in INPUTS
+    ]
+    result.extend(
+        ('period', get_checksum(queryset))
+        for queryset in _get_periods_querysets(day)
+    )
+    return result
+
+
+def get_fingerprint(day, plugins):
+    """
+    Returns fingerprint of inputs of costs calculation for day using plugins.
+
+    :param plugins: list of plugins (see `Collector.get_plugins`)
+    :rtype: str
+    """
+    data = [
+        FINGERPRINT_VERSION,
+        VERSION,
+        sorted((plugin.plugin_name, plugin.name) for plugin in plugins),
+        get_inputs_checksums(day),
+    ]
+    return hashlib.sha1(repr(data)).hexdigest()
@@ -10,9 +10,6 @@ import itertools
 from collections import defaultdict
 from decimal import Decimal as D
 
-from django.conf import settings
-from django.db.models import Sum
-
 from ralph_scrooge.models import (
     DynamicExtraCostType,
     ExtraCostType,
@@ -22,7 +19,16 @@ from ralph_scrooge.models import (
 from ralph_scrooge.plugins import plugin_runner as plugin_runner
 from ralph_scrooge.plugins.base import register
 from ralph_scrooge.plugins.cost.base import BaseCostPlugin
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.plugins.cost.distribution import (
+    distribute_hierarchy,
+    FlatHierarchy,
+    get_hierarchy_depth,
+)
+from ralph_scrooge.plugins.cost.pricing_service_engine import (
+    get_active_engine,
+)
+from ralph_scrooge.utils.calculation_context import cached
+from ralph_scrooge.utils.costs_hierarchy import get_costs_depth
 
 
 logger = logging.getLogger(__name__)
@@ -34,6 +40,9 @@ class PricingServiceBasePlugin(BaseCostPlugin):
     * costs - tree of costs for pricing service
     * total_cost - returns total cost of service
     """
+    # results of pricing services are kept in engine (see `_calculate_once`)
+    share_costs_totals = False
+
     def total_cost(self, for_all_service_environments=False, *args, **kwargs):
         """
         Returns total cost of pricing service
@@ -68,13 +77,32 @@ class PricingServiceBasePlugin(BaseCostPlugin):
             service_costs = self.costs(*args, **kwargs)
             return self._get_total_costs_from_costs(service_costs)
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _costs(
         self,
         pricing_service,
         date,
         forecast=False,
         **kwargs
+    ):
+        """
+        Returns usages and costs of pricing service usages per service
+        environment (calculated once per day when pricing services engine is
+        active).
+        """
+        return self._calculate_once(
+            'costs',
+            self._calculate_costs,
+            pricing_service,
+            date=date,
+            forecast=forecast,
+        )
+
+    def _calculate_costs(
+        self,
+        pricing_service,
+        date,
+        forecast=False,
     ):
         """
         Calculates usages and costs of pricing service usages per service
@@ -100,6 +128,18 @@ class PricingServiceBasePlugin(BaseCostPlugin):
         )
         percentage = self._get_percentage(date, pricing_service)
         excluded_services = self._get_excluded_services(pricing_service)
+        # costs deeper than costs depth of pricing service are not saved -
+        # their hierarchy is saved instead (once for the day, by collector)
+        max_depth = get_costs_depth(pricing_service)
+        engine = get_active_engine(date, forecast)
+        if engine is not None:
+            truncated = (
+                max_depth is not None and
+                get_hierarchy_depth(costs) > max_depth
+            )
+            engine.set_hierarchy(
+                pricing_service.id, costs if truncated else None, max_depth
+            )
         # distribute total cost between every service_environment
         # proportionally to pricing_service usages
         return self._distribute_costs(
@@ -111,6 +151,29 @@ class PricingServiceBasePlugin(BaseCostPlugin):
         )
 
     # HELPERS
+    def _calculate_once(
+        self, name, func, base_usage, date, forecast, **kwargs
+    ):
+        """
+        Returns result (named `name`) of func for base usage (ex. pricing
+        service).
+
+        If pricing services engine is active for date, result is calculated
+        only once and then reused (ex. by every pricing service charged by
+        this base usage).
+        """
+        engine = get_active_engine(date, forecast)
+        if engine is None:
+            return func(base_usage, date=date, forecast=forecast, **kwargs)
+        return engine.get_or_calculate(
+            (self.func_name, name, base_usage.id),
+            func,
+            base_usage,
+            date=date,
+            forecast=forecast,
+            **kwargs
+        )
+
     def _get_excluded_services(self, pricing_service):
         """
         Return all excluded services for pricing services (services, on which
@@ -148,40 +211,6 @@ class PricingServiceBasePlugin(BaseCostPlugin):
             add_costs(se_costs, result)
         return result
 
-    def _add_hierarchy_costs(self, po, po_usages, hierarchy, depth=0):
-        """
-        For every record in hierarchy, add record to result with cost
-        proportional to pricing object usage of pricing service resource.
-        """
-        subresult = []
-        for base_usage, (cost, children) in hierarchy.items():
-            base_usage_result = {
-                'type_id': base_usage,
-                'pricing_object_id': po,
-                'cost': D(0),
-            }
-            for usage, total, percent in po_usages:
-                if total != 0:
-                    base_usage_result['cost'] += (
-                        D(cost) * (D(usage) / D(total)) * (D(percent) / 100)
-                    )
-                else:
-                    base_usage_result['cost'] = D(0)
-            # add value if there is only one usage type defined for pricing
-            # service and depth is 0 (whole pricing service level)
-            if len(po_usages) == 1 and depth == 0:
-                base_usage_result['value'] = po_usages[0][0]
-
-            if children and not settings.SAVE_ONLY_FIRST_DEPTH_COSTS:
-                base_usage_result['_children'] = self._add_hierarchy_costs(
-                    po,
-                    po_usages,
-                    children,
-                    depth+1,
-                )
-            subresult.append(base_usage_result)
-        return subresult
-
     def _distribute_costs(
         self,
         date,
@@ -192,8 +221,9 @@ class PricingServiceBasePlugin(BaseCostPlugin):
     ):
         """
         Distribute pricing service costs (in general: hierarchy of pricing
-        service costs) between services (pricing objects) according to daily
-        usages of pricing service resources (and its percentage division).
+        service costs, up to its costs depth) between services (pricing
+        objects) according to daily usages of pricing service resources (and
+        its percentage division).
 
         :rtype: dict
         :returns: dict with costs per service environment (and pricing object
@@ -246,14 +276,13 @@ class PricingServiceBasePlugin(BaseCostPlugin):
             service_excluded = excluded_services.union(
                 service_usage_type.usage_type.excluded_services.all()
             )
-            usages_per_pricing_object = self._get_usages_per_pricing_object(
-                usage_type=service_usage_type.usage_type,
-                date=date,
-                excluded_services=service_excluded,
-            ).values_list(
-                'daily_pricing_object__pricing_object',
-                'service_environment',
-            ).annotate(usage=Sum('value'))
+            usages_per_pricing_object = (
+                self._get_usages_per_pricing_object_and_service_environment(
+                    usage_type=service_usage_type.usage_type,
+                    date=date,
+                    excluded_services=service_excluded,
+                )
+            )
             usage_type_id = service_usage_type.usage_type_id
             for (
                 pricing_object, service_environment, usage
@@ -268,28 +297,53 @@ class PricingServiceBasePlugin(BaseCostPlugin):
                 excluded_services=service_excluded,
             )
             percentage[usage_type_id] = service_usage_type.percent
-        # create hierarchy basing on usages
-        for (
-            (pricing_object, service_environment),
-            pricing_object_usages
-        ) in usages.items():
-            pricing_object_usages_info = [
-                (value, total_usages[usage_type_id], percentage[usage_type_id])
-                for usage_type_id, value in pricing_object_usages.items()  # noqa: F812,E501
-            ]
-            result[service_environment].extend(
-                self._add_hierarchy_costs(
-                    pricing_object, pricing_object_usages_info, costs_hierarchy
-                )
-            )
+        # create hierarchy basing on usages (hierarchy is flattened only once
+        # and then allocated to every pricing object)
+        flat_hierarchy = FlatHierarchy(
+            costs_hierarchy,
+            max_depth=get_costs_depth(pricing_service),
+        )
+        usages = usages.items()
+        pricing_objects_costs = distribute_hierarchy(
+            [
+                (pricing_object, [
+                    (value, total_usages[ut_id], percentage[ut_id])
+                    for ut_id, value in pricing_object_usages.items()
+                ])
+                for (pricing_object, _), pricing_object_usages in usages
+            ],
+            flat_hierarchy,
+        )
+        for ((_, service_environment), _), pricing_object_costs in zip(
+            usages, pricing_objects_costs
+        ):
+            result[service_environment].extend(pricing_object_costs)
         return result
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _get_pricing_service_costs(
         self,
         date,
         pricing_service,
         forecast,
+    ):
+        """
+        Returns total cost of pricing service (for one day) - see
+        `_calculate_pricing_service_costs` for details.
+        """
+        return self._calculate_once(
+            'pricing_service_costs',
+            self._calculate_pricing_service_costs,
+            pricing_service,
+            date=date,
+            forecast=forecast,
+        )
+
+    def _calculate_pricing_service_costs(
+        self,
+        pricing_service,
+        date,
+        forecast,
     ):
         """
         Calculates total cost of pricing service (for one day).
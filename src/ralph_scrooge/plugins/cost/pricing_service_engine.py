@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Engine calculating pricing services costs for single day.
+
+Pricing service cost is the sum of costs of its base and regular usage types,
+teams, extra costs and costs of other pricing services charging it
+(dependent services). Without the engine every pricing service was
+calculating (recursively) costs of all its dependent pricing services, which
+were calculating their own dependent services etc.
+
+Engine evaluates pricing services in topological order of charging graph for
+the date (see `get_pricing_services_levels`) and keeps calculated costs of
+every pricing service, so dependants are reusing them instead of calculating
+them again. Thanks to that, cost of every pricing service (and its costs
+hierarchy) is calculated exactly once per day.
+
+Engine also collects hierarchies of pricing services costs, which are not
+saved completely as daily costs (see `ralph_scrooge.utils.costs_hierarchy`).
+
+When calculation of single day is split into shards (see
+`Collector.process_shard`), results calculated by engine of every shard are
+dumped (see `dump_results`) and loaded by engines of shards of next levels,
+so costs of pricing services are still calculated once per day. Engine keeps
+also totals of costs of usage types, teams and extra costs (see
+`BaseCostPlugin._get_costs_totals`), so shards of pricing services are not
+calculating them again.
+
+Engine is active only in the thread which activated it (see `activate`) -
+threads running cost plugins concurrently have to activate it explicitly.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import logging
+import threading
+import zlib
+from contextlib import contextmanager
+
+from ralph_scrooge.utils.cycle_detector import get_pricing_services_levels
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class PricingServicesEngine(object):
+    """
+    Keeps costs of pricing services (calculated by pricing services plugins)
+    for single day.
+    """
+    def __init__(self, date, forecast):
+        self.date = date
+        self.forecast = forecast
+        self._results = {}
+        # keys of results loaded from other engines (see `load_results`)
+        self._loaded = set()
+        self._levels = None
+        # pricing service id -> (costs hierarchy or None, max depth)
+        self.hierarchies = {}
+
+    def covers(self, date, forecast):
+        """
+        Returns True if engine is storing costs for date and forecast.
+        """
+        return self.date == date and self.forecast == forecast
+
+    def for_forecast(self, forecast):
+        """
+        Returns new engine for the same date and forecast flag. Levels of
+        charging graph don't depend on forecast flag, so they're shared with
+        this engine.
+        """
+        engine = PricingServicesEngine(self.date, forecast)
+        engine._levels = self._levels
+        return engine
+
+    @property
+    def levels(self):
+        """
+        Pricing services grouped in levels of charging graph.
+        """
+        if self._levels is None:
+            self._levels = get_pricing_services_levels(self.date)
+        return self._levels
+
+    def get_pricing_services_order(self):
+        """
+        Returns ids of pricing services in order in which they should be
+        calculated.
+        """
+        return [ps.id for level in self.levels for ps in level]
+
+    def get_or_calculate(self, key, func, *args, **kwargs):
+        """
+        Returns result stored for key. If there is no result for key yet, it's
+        calculated using func and stored.
+
+        Notice that when plugins are run concurrently, result for the same key
+        could be (rarely) calculated more than once - every calculation gives
+        the same result, so the last one is simply kept.
+        """
+        try:
+            return self._results[key]
+        except KeyError:
+            result = func(*args, **kwargs)
+            self._results[key] = result
+            return result
+
+    def set_hierarchy(self, pricing_service_id, hierarchy, max_depth):
+        """
+        Store hierarchy of pricing service costs, which daily costs are saved
+        only up to max_depth (hierarchy is None if daily costs are saved
+        completely).
+        """
+        self.hierarchies[pricing_service_id] = (hierarchy, max_depth)
+
+    def __contains__(self, key):
+        return key in self._results
+
+    def dump_results(self):
+        """
+        Returns results calculated by this engine (without results loaded
+        from other engines) - pickled and compressed.
+
+        :rtype: bytes
+        """
+        return zlib.compress(pickle.dumps(
+            {
+                key: result for key, result in self._results.items()
+                if key not in self._loaded
+            },
+            pickle.HIGHEST_PROTOCOL,
+        ))
+
+    def load_results(self, data):
+        """
+        Load results dumped by other engine (see `dump_results`), calculated
+        for the same date and forecast.
+        """
+        results = pickle.loads(zlib.decompress(data))
+        self._results.update(results)
+        self._loaded.update(results)
+
+
+def get_active_engine(date, forecast):
+    """
+    Returns pricing services engine active in current thread, if it's
+    calculating costs for date and forecast. Otherwise None is returned.
+    """
+    engine = getattr(_local, 'engine', None)
+    if engine is not None and engine.covers(date, forecast):
+        return engine
+    return None
+
+
+@contextmanager
+def activate(engine):
+    """
+    Make engine active (visible for pricing services plugins) in context (in
+    current thread).
+    """
+    previous = getattr(_local, 'engine', None)
+    _local.engine = engine
+    try:
+        yield engine
+    finally:
+        _local.engine = previous
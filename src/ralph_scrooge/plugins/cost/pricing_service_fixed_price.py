@@ -12,7 +12,7 @@ from decimal import Decimal as D
 from ralph_scrooge.plugins import plugin_runner as plugin_runner
 from ralph_scrooge.plugins.base import register
 from ralph_scrooge.plugins.cost.pricing_service import PricingServiceBasePlugin
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.utils.calculation_context import cached
 
 logger = logging.getLogger(__name__)
 
@@ -28,13 +28,27 @@ class PricingServiceFixedPricePlugin(PricingServiceBasePlugin):
         service_costs = self.costs(*args, **kwargs)
         return self._get_total_costs_from_costs(service_costs)
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _costs(
         self,
         pricing_service,
         date,
         forecast=False,
         **kwargs
+    ):
+        return self._calculate_once(
+            'costs',
+            self._calculate_costs,
+            pricing_service,
+            date=date,
+            forecast=forecast,
+        )
+
+    def _calculate_costs(
+        self,
+        pricing_service,
+        date,
+        forecast=False,
     ):
         logger.info(
             (
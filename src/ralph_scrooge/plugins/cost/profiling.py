@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling of costs calculation.
+
+Every cost plugin run by collector (see `Collector._run_plugin`) and the
+whole calculation of single day are profiled:
+* wall time,
+* number and time of SQL queries - queries are counted by wrapping cursors
+  of database connection of current thread (see `count_queries`), so
+  counting doesn't require `DEBUG` (and doesn't keep queries in memory),
+* number of costs entries calculated (by plugin or for the whole day),
+* growth of peak memory (RSS) of process.
+
+Profile of every calculated day is remembered by collector (see
+`Collector.profiles`), saved in meta of `DailyCostsJob` and (if
+`SAVE_COSTS_CALCULATION_RUNS` is enabled) saved as `CostCalculationRun`.
+Slowest plugins could be then listed using `scrooge_costs_profile` command.
+
+Peak RSS is measured for the whole process, so when plugins are run
+concurrently (see `SCROOGE_COSTS_PLUGINS_CONCURRENCY`), growth of memory is
+assigned to every plugin running when it happened.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from ralph_scrooge.models import CostCalculationRun
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+# name of connection attribute with list of stats of queries counted in
+# current thread
+_STATS_ATTR = '_scrooge_queries_stats'
+
+
+def get_peak_rss():
+    """
+    Returns peak memory (RSS) used by current process (in kilobytes; 0 if
+    it's not available).
+
+    :rtype: int
+    """
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class QueriesStats(object):
+    """
+    Number and total time (in seconds) of SQL queries. Stats could be
+    updated concurrently by many threads.
+    """
+    __slots__ = ('count', 'time', '_lock')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, count, duration):
+        with self._lock:
+            self.count += count
+            self.time += duration
+
+
+class _CountingCursor(object):
+    """
+    Cursor counting executed queries (and their time) in every stats.
+    """
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def _count(self, func, *args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            duration = time.time() - start
+            for stats in self.stats:
+                stats.add(1, duration)
+
+    def execute(self, sql, params=None):
+        return self._count(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._count(self.cursor.executemany, sql, param_list)
+
+
+@contextmanager
+def count_queries(*stats):
+    """
+    Count SQL queries executed (using default database connection) by
+    current thread in context in every (`QueriesStats`) of stats. Contexts
+    could be nested - every query is counted once in every active stats.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    active = connection.__dict__.get(_STATS_ATTR)
+    if active is None:
+        active = []
+        setattr(connection, _STATS_ATTR, active)
+        cursor = type(connection).cursor
+        connection.cursor = lambda: _CountingCursor(cursor(connection), active)
+    added = [s for s in stats if s not in active]
+    active.extend(added)
+    try:
+        yield
+    finally:
+        for s in added:
+            active.remove(s)
+        if not active:
+            del connection.cursor
+            delattr(connection, _STATS_ATTR)
+
+
+class Profile(object):
+    """
+    Profile of single plugin (or of the whole day).
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.queries = QueriesStats()
+        self.entries = 0
+        self.rss_delta = 0
+
+    @contextmanager
+    def measure(self, *parents):
+        """
+        Measure wall time, queries and memory in context. Queries are counted
+        in queries stats of parents too.
+        """
+        rss = get_peak_rss()
+        start = time.time()
+        try:
+            with count_queries(
+                self.queries, *[parent.queries for parent in parents]
+            ):
+                yield self
+        finally:
+            self.wall_time += time.time() - start
+            self.rss_delta += max(get_peak_rss() - rss, 0)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'wall_time': self.wall_time,
+            'queries_count': self.queries.count,
+            'queries_time': self.queries.time,
+            'entries': self.entries,
+            'rss_delta': self.rss_delta,
+        }
+
+
+class CalculationProfile(object):
+    """
+    Profile of costs calculation of single day - profile of the whole
+    calculation (`total`) and profiles of every plugin.
+    """
+    def __init__(self, date, forecast):
+        self.date = date
+        self.forecast = forecast
+        self.total = Profile('total')
+        self.plugins = []
+
+    @contextmanager
+    def measure_plugin(self, name):
+        """
+        Measure single plugin in context (could be run in another thread
+        than the whole calculation).
+        """
+        profile = Profile(name)
+        self.plugins.append(profile)
+        with profile.measure(self.total):
+            yield profile
+
+    def get_slowest_plugins(self, count=None):
+        """
+        Returns profiles of count (all by default) slowest plugins.
+
+        :rtype: list
+        """
+        return sorted(
+            self.plugins, key=lambda p: p.wall_time, reverse=True
+        )[:count]
+
+    def as_dict(self):
+        result = self.total.as_dict()
+        result.update(
+            date=str(self.date),
+            forecast=self.forecast,
+            plugins=[profile.as_dict() for profile in self.plugins],
+        )
+        return result
+
+    def save(self):
+        """
+        Save profile as `CostCalculationRun`.
+
+        :rtype: CostCalculationRun
+        """
+        return CostCalculationRun.objects.create(
+            date=self.date,
+            forecast=self.forecast,
+            wall_time=self.total.wall_time,
+            queries_count=self.total.queries.count,
+            queries_time=self.total.queries.time,
+            entries=self.total.entries,
+            rss_delta=self.total.rss_delta,
+            plugins=json.dumps(
+                [profile.as_dict() for profile in self.plugins]
+            ),
+        )
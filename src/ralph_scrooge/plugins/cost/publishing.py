@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Publishing staged daily costs by swapping tables (instead of deleting costs
+from DailyCost table and inserting new ones).
+
+For every subpartition of (partitioned, MySQL) DailyCost table touched by
+published period, shadow table with identical structure is filled with staged
+costs of this subpartition, and then it's swapped with subpartition using
+`ALTER TABLE ... EXCHANGE PARTITION`. Only staged costs are written (no
+costs are copied from DailyCost table), so swap is supported only when
+published period covers whole subpartitions (ex. the whole month, when
+DailyCost is partitioned by month). Otherwise (or when DailyCost table is
+not partitioned, or database is not MySQL, ex. SQLite in tests) costs should
+be inserted instead.
+
+Readers see costs of the whole (sub)partition replaced at once and no rows
+are deleted from DailyCost table (no huge undo logs, long locks and
+replication lag).
+
+Every writer replacing costs of period holds DailyCost lock (see
+`dailycost_lock`), so costs written concurrently are not lost by swap.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+from dateutil import rrule
+
+from django.conf import settings
+from django.db import connection
+
+from ralph_scrooge.models import DailyCost, DailyCostStaging
+
+logger = logging.getLogger(__name__)
+
+SHADOW_SUFFIX = '_shadow'
+
+
+class SwapNotSupportedError(Exception):
+    pass
+
+
+class DailyCostLockError(Exception):
+    pass
+
+
+@contextmanager
+def dailycost_lock():
+    """
+    Hold (MySQL named) lock of DailyCost table while costs of period are
+    replaced, so concurrent writers (ex. two recalculations of costs) are
+    not overwriting each other's costs. Lock is not transactional - it could
+    be taken in or outside of transaction. It's no-op on other databases
+    (SQLite is serializing writes anyway).
+    """
+    if connection.vendor != 'mysql':
+        yield
+        return
+    name = '{}.{}'.format(
+        connection.settings_dict['NAME'], DailyCost._meta.db_table
+    )
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT GET_LOCK(%s, %s)',
+        [name, settings.DAILY_COSTS_LOCK_TIMEOUT]
+    )
+    if not cursor.fetchone()[0]:
+        raise DailyCostLockError('Could not acquire lock {}'.format(name))
+    try:
+        yield
+    finally:
+        cursor.execute('SELECT RELEASE_LOCK(%s)', [name])
+
+
+def get_dailycost_columns():
+    """
+    Returns (comma separated) columns of DailyCost table (without id).
+    """
+    return ', '.join(
+        field.column for field in DailyCost._meta.concrete_fields
+        if not field.primary_key
+    )
+
+
+def _create_table_like(cursor, table, new_table):
+    """
+    Create (empty) new_table with the same structure (columns, indexes and
+    partitioning) as table.
+    """
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(new_table))
+    cursor.execute('CREATE TABLE {} LIKE {}'.format(new_table, table))
+
+
+def _fill_shadow_table(cursor, shadow, start, end, forecast):
+    """
+    Fill shadow table with staged costs between start and end (with
+    forecast flag).
+    """
+    # continue ids of DailyCost table
+    cursor.execute('SELECT MAX(id) FROM {}'.format(DailyCost._meta.db_table))
+    cursor.execute('ALTER TABLE {} AUTO_INCREMENT={}'.format(
+        shadow, (cursor.fetchone()[0] or 0) + 1
+    ))
+    cursor.execute(
+        """
+        INSERT INTO {shadow} ({columns})
+        SELECT {columns} FROM {staging}
+        WHERE date>=%s and date<=%s and forecast=%s
+        """.format(
+            shadow=shadow,
+            staging=DailyCostStaging._meta.db_table,
+            columns=get_dailycost_columns(),
+        ),
+        [start, end, forecast]
+    )
+
+
+def _get_subpartitions(cursor, table):
+    """
+    Returns mapping from name of subpartition as reported by EXPLAIN
+    (`<partition>_<subpartition>`) to subpartition name for every
+    subpartition of table. Returns empty dict if table is not partitioned.
+    """
+    if connection.vendor != 'mysql':
+        return {}
+    cursor.execute(
+        """
+        SELECT partition_name, subpartition_name
+        FROM INFORMATION_SCHEMA.PARTITIONS
+        WHERE
+            table_schema=DATABASE() AND
+            table_name=%s AND
+            subpartition_name IS NOT NULL
+        """,
+        [table]
+    )
+    return {
+        '{}_{}'.format(partition, subpartition): subpartition
+        for partition, subpartition in cursor.fetchall()
+    }
+
+
+def _get_subpartition(cursor, table, subpartitions, day, forecast):
+    """
+    Returns name of subpartition, in which costs of day (and forecast flag)
+    are stored (using partition pruning of EXPLAIN), or None if day is not
+    stored in any subpartition.
+    """
+    cursor.execute(
+        'EXPLAIN SELECT id FROM {} WHERE date=%s and forecast=%s'.format(
+            table
+        ),
+        [day, forecast]
+    )
+    columns = [column[0].lower() for column in cursor.description]
+    if 'partitions' not in columns:
+        raise SwapNotSupportedError('Partitions are not reported by EXPLAIN')
+    pruned = cursor.fetchone()[columns.index('partitions')]
+    if not pruned:
+        return None
+    pruned = pruned.split(',')
+    if len(pruned) != 1 or pruned[0] not in subpartitions:
+        raise SwapNotSupportedError(
+            'Could not find subpartition for {}'.format(day)
+        )
+    return subpartitions[pruned[0]]
+
+
+def group_by_subpartition(cursor, table, subpartitions, start, end, forecast):
+    """
+    Split period between start and end into periods stored in single
+    subpartition (partitions are ranges of dates, so all days stored in
+    single subpartition are next to each other).
+
+    :returns: dict with subpartition name as key and (start, end) of period
+        stored in subpartition as value
+    :rtype: OrderedDict
+    """
+    result = OrderedDict()
+    for day in rrule.rrule(rrule.DAILY, dtstart=start, until=end):
+        day = day.date()
+        subpartition = _get_subpartition(
+            cursor, table, subpartitions, day, forecast
+        )
+        if subpartition is None:
+            raise SwapNotSupportedError(
+                'Could not find subpartition for {}'.format(day)
+            )
+        result[subpartition] = (result.get(subpartition, (day,))[0], day)
+    return result
+
+
+def _check_whole_subpartitions(
+    cursor, table, subpartitions, periods, forecast
+):
+    """
+    Check that every subpartition stores only costs of its period (and
+    forecast flag), so it could be swapped without copying other costs.
+
+    :raises SwapNotSupportedError: when any subpartition stores costs of
+        other days (or other forecast flag) too
+    """
+    one_day = timedelta(days=1)
+    for subpartition, (period_start, period_end) in periods.items():
+        # days stored in subpartition are next to each other and costs of
+        # other forecast flag are stored in (the same) sibling subpartition
+        # for all of them, if it's different one
+        neighbours = [
+            (period_start - one_day, forecast),
+            (period_end + one_day, forecast),
+            (period_start, not forecast),
+        ]
+        for day, day_forecast in neighbours:
+            if _get_subpartition(
+                cursor, table, subpartitions, day, day_forecast
+            ) == subpartition:
+                raise SwapNotSupportedError(
+                    'Subpartition {} is not covered by period {} - {} '
+                    '(forecast: {})'.format(
+                        subpartition, period_start, period_end, forecast
+                    )
+                )
+
+
+def _exchange_partitions(cursor, table, periods, forecast):
+    shadow = table + SHADOW_SUFFIX
+    for subpartition, (period_start, period_end) in periods.items():
+        logger.info('Exchanging subpartition {} ({} - {})'.format(
+            subpartition, period_start, period_end,
+        ))
+        _create_table_like(cursor, table, shadow)
+        cursor.execute('ALTER TABLE {} REMOVE PARTITIONING'.format(shadow))
+        _fill_shadow_table(
+            cursor, shadow, period_start, period_end, forecast
+        )
+        cursor.execute(
+            'ALTER TABLE {} EXCHANGE PARTITION {} WITH TABLE {}'.format(
+                table, subpartition, shadow
+            )
+        )
+        cursor.execute('DROP TABLE {}'.format(shadow))
+
+
+def _get_swapped_periods(cursor, table, start, end, forecast):
+    if connection.vendor == 'mysql' and connection.in_atomic_block:
+        # ALTER TABLE (and RENAME TABLE) are implicitly committing current
+        # transaction in MySQL
+        raise SwapNotSupportedError('Could not swap tables in transaction')
+    subpartitions = _get_subpartitions(cursor, table)
+    if not subpartitions:
+        raise SwapNotSupportedError('{} is not partitioned'.format(table))
+    periods = group_by_subpartition(
+        cursor, table, subpartitions, start, end, forecast
+    )
+    _check_whole_subpartitions(cursor, table, subpartitions, periods, forecast)
+    return periods
+
+
+def check_swap_supported(start, end, forecast):
+    """
+    Check if costs between start and end (with forecast flag) could be
+    replaced by swapping subpartitions of DailyCost table (see
+    `swap_staged_costs`).
+
+    :raises SwapNotSupportedError: when costs should be inserted instead
+    """
+    _get_swapped_periods(
+        connection.cursor(), DailyCost._meta.db_table, start, end, forecast
+    )
+
+
+def swap_staged_costs(start, end, forecast):
+    """
+    Replace costs between start and end (with forecast flag) with staged
+    costs by exchanging subpartitions of DailyCost table with shadow table.
+
+    :raises SwapNotSupportedError: when DailyCost table is not partitioned
+        or period doesn't cover whole subpartitions (costs should be
+        inserted instead)
+    """
+    table = DailyCost._meta.db_table
+    cursor = connection.cursor()
+    with dailycost_lock():
+        periods = _get_swapped_periods(cursor, table, start, end, forecast)
+        _exchange_partitions(cursor, table, periods, forecast)
@@ -11,7 +11,7 @@ from collections import defaultdict, namedtuple
 from ralph_scrooge.models import ExtraCostType, SupportCost
 from ralph_scrooge.plugins.base import register
 from ralph_scrooge.plugins.cost.base import BaseCostPlugin
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.utils.calculation_context import cached
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +36,7 @@ class SupportPlugin(BaseCostPlugin):
     cost model.
     """
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _costs(
         self,
         date,
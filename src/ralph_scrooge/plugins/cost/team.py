@@ -43,6 +43,8 @@ parts of cost for other teams.
 * Average
 This model is using other teams and use average of percent of other teams costs
 distribution between service environments.
+
+Costs of all teams in a day are calculated together (once) by `TeamsEngine`.
 """
 from __future__ import absolute_import
 from __future__ import division
@@ -50,19 +52,13 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import logging
-from collections import defaultdict
-from decimal import Decimal as D
 
 from django.db.models import Sum, Count
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.utils.calculation_context import cached
 
 from ralph_scrooge.models import (
-    DailyUsage,
     DailyPricingObject,
     PRICING_OBJECT_TYPES,
-    ServiceEnvironment,
-    Team as TeamModel,
-    TeamBillingType,
     TeamCost,
     UsageType,
 )
@@ -71,6 +67,9 @@ from ralph_scrooge.plugins.cost.base import (
     BaseCostPlugin,
     NoPriceCostError
 )
+from ralph_scrooge.plugins.cost.team_engine import TeamsEngine
+from ralph_scrooge.utils.money import allocate, from_micro, to_micro
+from ralph_scrooge.utils.usage_totals import get_usages_model
 
 logger = logging.getLogger(__name__)
 PERCENT_PRECISION = 4
@@ -78,89 +77,23 @@ PERCENT_PRECISION = 4
 
 @register(chain='scrooge_costs')
 class TeamPlugin(BaseCostPlugin):
-    @memoize(skip_first=True)
-    def _costs(self, team, **kwargs):
+    @cached(skip_first=True)
+    def _costs(self, team, date, forecast=False, **kwargs):
         """
         Calculates teams costs.
         """
         logger.info("Calculating team costs: {0}".format(team.name))
-        return self._get_team_cost_per_service_environment(team, **kwargs)
-
-    def _get_team_cost_per_service_environment(self, team, *args, **kwargs):
-        """
-        Call proper function to calculate team cost, based on team billing type
-        """
-        functions = {
-            TeamBillingType.time: (
-                self._get_team_time_cost_per_service_environment
-            ),
-            TeamBillingType.distribute: (
-                self._get_team_distributed_cost_per_service_environment
-            ),
-            TeamBillingType.assets_cores: (
-                self._get_team_assets_cores_cost_per_service_environment
-            ),
-            TeamBillingType.assets: (
-                self._get_team_assets_cost_per_service_environment
-            ),
-            TeamBillingType.average: (
-                self._get_team_average_cost_per_service_environment
-            ),
-        }
-        func = functions.get(team.billing_type)
-        if func:
-            return func(team=team, *args, **kwargs)
-        logger.warning('No handle method for billing type {0}'.format(
-            team.billing_type
-        ))
-        return {}
-
-    @memoize(skip_first=True)
-    def _get_teams(self):
-        """
-        Returns all available teams, that should be visible on report
-        """
-        return TeamModel.objects.all()
-
-    @memoize(skip_first=True)
-    def _get_teams_not_distributes_to_others(self):
-        """
-        Returns all teams that have billing type different than DISTRIBUTE and
-        AVERAGE
-        """
-        return TeamModel.objects.exclude(
-            billing_type__in=(
-                TeamBillingType.distribute,
-                TeamBillingType.average,
-            ),
-        )
-
-    @memoize(skip_first=True)
-    def _get_teams_not_average(self):
-        """
-        Returns all teams that have billing type different than AVERAGE
-        """
-        return TeamModel.objects.exclude(
-            billing_type=TeamBillingType.average,
-        )
+        return self._get_engine(date, forecast).get_costs(team)
 
-    def _get_teams_members_count(self, date, teams):
+    @cached(skip_first=True)
+    def _get_engine(self, date, forecast):
         """
-        Returns members count for given date and teams.
-
-        :rtype: dict (key: team id, value: members count)
+        Returns engine calculating costs of all teams in date (see
+        `TeamsEngine`).
         """
-        team_costs = TeamCost.objects.filter(
-            start__lte=date,
-            end__gte=date,
-            team__in=teams,
-        )
-        result = {}
-        for team_cost in team_costs:
-            result[team_cost.team.id] = team_cost.members_count
-        return result
+        return TeamsEngine(self, date, forecast)
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _get_assets_count_by_service_environment(
         self,
         date,
@@ -189,7 +122,7 @@ class TeamPlugin(BaseCostPlugin):
         ])
         return result
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _get_total_assets_count(
         self,
         date,
@@ -219,7 +152,21 @@ class TeamPlugin(BaseCostPlugin):
             symbol="physical_cpu_cores",
         )[0]
 
-    @memoize(skip_first=True)
+    def _get_cores_usages(self, date, excluded_service_environments):
+        """
+        Returns cores usages (daily usages or their totals - see
+        `get_usages_model`) of date, excluding excluded_service_environments.
+        """
+        return get_usages_model().objects.filter(
+            type=self._get_cores_usage_type(),
+            date=date,
+        ).exclude(
+            service_environment__isnull=True
+        ).exclude(
+            service_environment__in=excluded_service_environments,
+        )
+
+    @cached(skip_first=True)
     def _get_cores_count_by_service_environment(
         self,
         date,
@@ -232,13 +179,8 @@ class TeamPlugin(BaseCostPlugin):
 
         :rtype: dict (key: service_environment, value: cores count)
         """
-        cores_query = DailyUsage.objects.filter(
-            type=self._get_cores_usage_type(),
-            date=date,
-        ).exclude(
-            service_environment__isnull=True
-        ).exclude(
-            service_environment__in=excluded_service_environments,
+        cores_query = self._get_cores_usages(
+            date, excluded_service_environments
         )
         count = cores_query.values('service_environment').annotate(
             count=Sum('value')
@@ -248,7 +190,7 @@ class TeamPlugin(BaseCostPlugin):
         ])
         return result
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _get_total_cores_count(
         self,
         date,
@@ -260,311 +202,31 @@ class TeamPlugin(BaseCostPlugin):
 
         :rtype: int
         """
-        cores_query = DailyUsage.objects.filter(
-            type=self._get_cores_usage_type(),
-            date=date,
-        ).exclude(
-            service_environment__isnull=True
-        ).exclude(
-            service_environment__in=excluded_service_environments,
+        cores_query = self._get_cores_usages(
+            date, excluded_service_environments
         )
         return cores_query.aggregate(
             cores_count=Sum('value')
         ).get('cores_count', 0)
 
-    def _get_team_daily_cost(self, team, date, forecast, daily_cost=None):
-        try:
-            team_cost = team.teamcost_set.get(start__lte=date, end__gte=date)
-        except TeamCost.DoesNotExist:
-            raise NoPriceCostError()
+    def _get_team_daily_cost(
+        self, team, date, forecast, daily_cost=None, team_cost=None
+    ):
+        if team_cost is None:
+            try:
+                team_cost = team.teamcost_set.get(
+                    start__lte=date, end__gte=date
+                )
+            except TeamCost.DoesNotExist:
+                raise NoPriceCostError()
 
-        # calculate daily cost if not provided
+        # calculate daily cost if not provided (cost is split equally between
+        # all days of team cost period, without rounding drift)
         team_cost_days = (team_cost.end - team_cost.start).days + 1
         if not daily_cost:
             cost = team_cost.forecast_cost if forecast else team_cost.cost
-            daily_cost = cost / team_cost_days
+            daily_cost = from_micro(allocate(
+                to_micro(cost), [1] * team_cost_days
+            )[(date - team_cost.start).days])
 
         return team_cost_days, daily_cost, team_cost
-
-    def _get_team_time_cost_per_service_environment(
-        self,
-        team,
-        date,
-        forecast=False,
-        daily_cost=None,
-        **kwargs
-    ):
-        """
-        Calculates cost of teams, that are billed by spent time for each
-        service environment. If daily_cost is passed, it's used instead of
-        calculated daily cost from total cost.
-
-        Main idea:
-        for every period in which cost is defined for team
-            for every not-overlaping daterange of percent per team
-                calculate cost of team time per service environment in this
-                period of time
-
-        Notice that:
-        * total cost is treated as sum of equal daily cost (assumed, that in
-            period of time daily cost is the same)
-        * assumed, that in period of time percent of time spent to service
-            environment is equal for each day
-        """
-
-        result = defaultdict(list)
-        team_cost_days, daily_cost, team_cost = self._get_team_daily_cost(
-            team,
-            date,
-            forecast,
-            daily_cost,
-        )
-
-        percentage = dict(team_cost.percentage.values_list(
-            'service_environment__id',
-            'percent',
-        ))
-        for service_environment, percent in percentage.items():
-            result[service_environment].append({
-                'cost': D(daily_cost) * D(percent) / 100,
-                'type': team,
-                'percent': D(percent) / 100,
-            })
-
-        return result
-
-    def _get_team_func_cost_per_service_environment(
-        self,
-        team,
-        date,
-        forecast=False,
-        daily_cost=None,
-        funcs=None,
-        **kwargs
-    ):
-        """
-        Calculates cost of used resources (i.e. assets, cores) for each
-        service environment in period of time. If daily_cost is passed, it's
-        used instead of calculated daily cost from total cost.
-
-        Main idea:
-        for every period in which cost is defined for team:
-            calculate daily cost
-            for every resource:
-                get total count of resource usage per service_environment
-                calculate service_environment cost based od cost in period of
-                 time andresource usage
-
-        Passed functions (funcs) should be 3-elements tuple:
-        (
-            resource_usage_per_service_environment_function,
-            resource_total_usage_function,
-            result_dict_key (to store usages of service_environment)
-        ).
-
-        Notice that:
-        * if there is more than one funcs (resources), that total cost is
-            distributed in equal parts to all resources (1/n)
-        """
-        result = defaultdict(list)
-        funcs = funcs or []
-        excluded_service_environments = ServiceEnvironment.objects.filter(
-            service__in=team.excluded_services.all(),
-        )
-
-        team_cost_days, daily_cost, team_cost = self._get_team_daily_cost(
-            team,
-            date,
-            forecast,
-            daily_cost,
-        )
-        service_environments_costs = defaultdict(D)
-        for count_func, total_count_func in funcs:
-            count_per_service_environment = count_func(
-                date,
-                excluded_service_environments=excluded_service_environments,
-            )
-            total = total_count_func(
-                date,
-                excluded_service_environments=excluded_service_environments,
-            )
-            # if there is more than one resource, calculate 1/n of total
-            # cost
-            cost_part = D(daily_cost) / len(funcs)
-            for se, count in count_per_service_environment.items():
-                percent = D(count) / D(total) if total else D(0)
-                service_environments_costs[se] += D(cost_part * percent)
-
-        for service_environment, cost in service_environments_costs.items():
-            result[service_environment].append({
-                'cost': cost,
-                'type': team,
-                'percent': D(cost) / D(daily_cost) if daily_cost else 0,
-            })
-
-        return result
-
-    def _get_team_assets_cores_cost_per_service_environment(
-        self,
-        team,
-        *args,
-        **kwargs
-    ):
-        """
-        Calculates costs of assets and cores usage per service_environment.
-        """
-        return self._get_team_func_cost_per_service_environment(
-            team=team,
-            funcs=(
-                (
-                    self._get_assets_count_by_service_environment,
-                    self._get_total_assets_count,
-                ),
-                (
-                    self._get_cores_count_by_service_environment,
-                    self._get_total_cores_count,
-                ),
-            ),
-            *args,
-            **kwargs
-        )
-
-    def _get_team_assets_cost_per_service_environment(
-        self,
-        team,
-        *args,
-        **kwargs
-    ):
-        """
-        Calculates costs of assets usage per service_environment.
-        """
-        return self._get_team_func_cost_per_service_environment(
-            team=team,
-            funcs=(
-                (
-                    self._get_assets_count_by_service_environment,
-                    self._get_total_assets_count,
-                ),
-            ),
-            *args,
-            **kwargs
-        )
-
-    def _get_team_distributed_cost_per_service_environment(
-        self,
-        team,
-        date,
-        forecast=False,
-        **kwargs
-    ):
-        """
-        Calculates cost of team, which cost is based on service_environment
-        cost for other teams (proprotionally to members count of other teams).
-
-        Main idea:
-        for every period on which cost is defined for team
-            for every period of not-distributed teams members count in main
-            period
-                for every not-distributed team
-                    get team members count in period and it's % among all teams
-                    calculate % of distributed team total cost (daily)
-                    calculate cost for this team for all service_environments,
-                    proportionally to team cost (usage)
-
-        Not distributed team cost is calculated using functions defined for
-        such calculations. First of all, daily cost of distributed team is
-        calculated. Then, based on not distributed team members count, daily
-        cost of that team is calculated (distributed_team_daily_cost *
-        not_distributed_team_members_count / total_members). Then such daily
-        cost is passed to function for not distributed team and used to
-        calculate (part of) cost of distributed team.
-        """
-
-        result = defaultdict(list)
-        teams = self._get_teams_not_distributes_to_others()
-        teams_by_id = dict([(t.id, t) for t in teams])
-
-        team_cost_days, daily_cost, team_cost = self._get_team_daily_cost(
-            team,
-            date,
-            forecast,
-        )
-        teams_members = self._get_teams_members_count(date, teams)
-        total_members = sum(teams_members.values())
-
-        service_environments_costs = defaultdict(D)
-
-        for team_id, members_count in teams_members.items():
-            dependent_team = teams_by_id[team_id]
-            daily_team_cost = float(daily_cost) * members_count / total_members
-            for sei in self._costs(
-                team=dependent_team,
-                date=date,
-                daily_cost=daily_team_cost,
-                forecast=forecast,
-            ).items():
-                service_environments_costs[sei[0]] += sum(
-                    s['cost'] for s in sei[1]
-                )
-
-        for service_environment, cost in service_environments_costs.items():
-            se_info = {
-                'type': team,
-                'cost': cost,
-                'percent': cost / daily_cost
-            }
-            result[service_environment].append(se_info)
-
-        return result
-
-    def _get_team_average_cost_per_service_environment(
-        self,
-        team,
-        date,
-        forecast=False,
-        **kwargs
-    ):
-        """
-        Calculates team cost according to average of percents of other teams
-        costs per service_environments.
-
-        For every dependent team (every other, that has billing type different
-        than AVERAGE), in period of time for which cost is defined for current
-        team, there are costs and percentage division calculated for such a
-        dependent team. Calculated percentage division is then added to service
-        environment 'counter' and at the end, total cost of current team is
-        distributed according to service_environments 'counters' (of percent).
-        """
-        result = defaultdict(list)
-        teams = self._get_teams_not_average()
-        team_cost_days, daily_cost, team_cost = self._get_team_daily_cost(
-            team,
-            date,
-            forecast,
-        )
-
-        # calculate costs and percent of other teams per
-        # service_environment
-        service_environment_percent = defaultdict(D)
-        total_percent = len(teams)
-
-        for dependent_team in teams:
-            seis = self._costs(
-                team=dependent_team,
-                date=date,
-                forecast=forecast,
-            )
-            for sei in seis.items():
-                se = sei[0]
-                percent = sei[1][0]['percent']
-                service_environment_percent[se] += percent
-        # distribute cost of current team according to calculated percent
-        for se, percent in service_environment_percent.iteritems():
-            percent_scaled = percent / total_percent
-            result[se].append({
-                'cost': daily_cost * percent_scaled,
-                'percent': percent_scaled,
-                'type': team,
-            })
-
-        return result
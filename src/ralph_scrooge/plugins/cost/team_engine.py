@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Engine calculating costs of all teams for single day (see `TeamPlugin`).
+
+Without the engine every team was calculated separately - every distributed
+and average team was calculating (again) costs of every other team, and
+teams costs, time percentage and excluded services were fetched from
+database for every team.
+
+Engine loads teams costs, time percentage, excluded service environments and
+assets and cores counts for the day once and keeps allocation row of every
+time, assets and assets-cores team - list of (service environments, weights,
+total weight) components, between which cost of team is split in equal
+parts. Rows of all teams form teams x service environments allocation
+matrix:
+* cost of time, assets and assets-cores team is its daily cost allocated
+  using its row,
+* cost of distributed team is split between other teams proportionally to
+  members count and every part is allocated using row of the other team,
+* cost of average team is allocated proportionally to sum of percents of
+  (costs of) other teams.
+
+Costs of every team are calculated once (and then reused by distributed and
+average teams).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+from collections import defaultdict, OrderedDict
+from decimal import Decimal as D
+
+from ralph_scrooge.models import (
+    ServiceEnvironment,
+    Team,
+    TeamBillingType,
+    TeamCost,
+    TeamServiceEnvironmentPercent,
+)
+from ralph_scrooge.plugins.cost.base import NoPriceCostError
+from ralph_scrooge.utils.money import allocate, from_micro, to_micro
+
+logger = logging.getLogger(__name__)
+
+# resources used by teams billed by usage of resources - (per service
+# environment count function, total count function) of `TeamPlugin`
+RESOURCES = {
+    'assets': (
+        '_get_assets_count_by_service_environment',
+        '_get_total_assets_count',
+    ),
+    'cores': (
+        '_get_cores_count_by_service_environment',
+        '_get_total_cores_count',
+    ),
+}
+BILLING_TYPES_RESOURCES = {
+    TeamBillingType.assets_cores: ('assets', 'cores'),
+    TeamBillingType.assets: ('assets',),
+}
+
+
+class TeamsEngine(object):
+    """
+    Costs of all teams for single day (see module docstring).
+    """
+    def __init__(self, plugin, date, forecast):
+        self.plugin = plugin
+        self.date = date
+        self.forecast = forecast
+        self._team_costs = dict(
+            (team_cost.team_id, team_cost)
+            for team_cost in TeamCost.objects.filter(
+                start__lte=date,
+                end__gte=date,
+            )
+        )
+        self._teams = None
+        self._percentage = None
+        self._excluded = None
+        self._resources = {}
+        self._rows = {}
+        self._costs = {}
+
+    @property
+    def teams(self):
+        if self._teams is None:
+            self._teams = list(Team.objects.all())
+        return self._teams
+
+    def get_costs(self, team):
+        """
+        Returns costs of team per service environment (in format returned by
+        `TeamPlugin._costs`).
+        """
+        try:
+            return self._costs[team.id]
+        except KeyError:
+            pass
+        functions = {
+            TeamBillingType.time: self._get_time_costs,
+            TeamBillingType.distribute: self._get_distributed_costs,
+            TeamBillingType.assets_cores: self._get_resources_costs,
+            TeamBillingType.assets: self._get_resources_costs,
+            TeamBillingType.average: self._get_average_costs,
+        }
+        func = functions.get(team.billing_type)
+        if func:
+            costs = func(team)
+        else:
+            logger.warning('No handle method for billing type {0}'.format(
+                team.billing_type
+            ))
+            costs = {}
+        self._costs[team.id] = costs
+        return costs
+
+    def _get_daily_cost(self, team):
+        team_cost = self._team_costs.get(team.id)
+        if team_cost is None:
+            raise NoPriceCostError()
+        return self.plugin._get_team_daily_cost(
+            team,
+            self.date,
+            self.forecast,
+            team_cost=team_cost,
+        )[1]
+
+    def _get_percentage(self, team_cost):
+        """
+        Returns list of (service environment id, percent) of time spent by
+        team (in team_cost).
+        """
+        if self._percentage is None:
+            self._percentage = defaultdict(dict)
+            for team_cost_id, se_id, percent in (
+                TeamServiceEnvironmentPercent.objects.filter(
+                    team_cost__in=self._team_costs.values(),
+                ).values_list('team_cost', 'service_environment', 'percent')
+            ):
+                self._percentage[team_cost_id][se_id] = percent
+        return self._percentage[team_cost.id].items()
+
+    def _get_excluded_service_environments(self, team):
+        """
+        Returns ids of service environments of services excluded by team.
+        """
+        if self._excluded is None:
+            through = Team.excluded_services.through
+            teams_services = through.objects.values_list('team', 'service')
+            services_ses = defaultdict(set)
+            for service_id, se_id in ServiceEnvironment.objects.filter(
+                service__in=set(service for _, service in teams_services),
+            ).values_list('service', 'id'):
+                services_ses[service_id].add(se_id)
+            self._excluded = defaultdict(set)
+            for team_id, service_id in teams_services:
+                self._excluded[team_id].update(services_ses[service_id])
+        return self._excluded[team.id]
+
+    def _get_resource(self, name):
+        """
+        Returns (list of (service environment id, count), total count) of
+        resource (ex. assets) in the day.
+        """
+        if name not in self._resources:
+            count_func, total_count_func = [
+                getattr(self.plugin, func_name)
+                for func_name in RESOURCES[name]
+            ]
+            self._resources[name] = (
+                count_func(
+                    self.date, excluded_service_environments=()
+                ).items(),
+                total_count_func(
+                    self.date, excluded_service_environments=()
+                ) or 0,
+            )
+        return self._resources[name]
+
+    def _get_row(self, team):
+        """
+        Returns allocation row of time, assets or assets-cores team - list of
+        (service environments ids, weights, total weight) components.
+        """
+        try:
+            return self._rows[team.id]
+        except KeyError:
+            pass
+        if team.billing_type == TeamBillingType.time:
+            percentage = self._get_percentage(self._team_costs[team.id])
+            row = [(
+                [se_id for se_id, _ in percentage],
+                [percent for _, percent in percentage],
+                100,
+            )]
+        else:
+            excluded = self._get_excluded_service_environments(team)
+            row = []
+            for name in BILLING_TYPES_RESOURCES[team.billing_type]:
+                counts, total = self._get_resource(name)
+                if excluded:
+                    counts = [
+                        (se_id, count) for se_id, count in counts
+                        if se_id not in excluded
+                    ]
+                    total = sum(count for _, count in counts)
+                row.append((
+                    [se_id for se_id, _ in counts],
+                    [count for _, count in counts],
+                    total,
+                ))
+        self._rows[team.id] = row
+        return row
+
+    def _allocate(self, row, cost):
+        """
+        Allocate cost (in micro-units) using allocation row - cost is split
+        in equal parts between components of row.
+
+        :returns: dict with cost (in micro-units) per service environment id
+        :rtype: OrderedDict
+        """
+        result = OrderedDict()
+        parts = allocate(cost, [1] * len(row))
+        for (se_ids, weights, total_weight), part in zip(row, parts):
+            for se_id, se_cost in zip(
+                se_ids, allocate(part, weights, total_weight=total_weight)
+            ):
+                result[se_id] = result.get(se_id, 0) + se_cost
+        return result
+
+    def _get_time_costs(self, team):
+        daily_cost = self._get_daily_cost(team)
+        row = self._get_row(team)
+        se_ids, percents, _ = row[0]
+        costs = self._allocate(row, to_micro(daily_cost))
+        result = defaultdict(list)
+        for se_id, percent in zip(se_ids, percents):
+            result[se_id].append({
+                'cost': from_micro(costs[se_id]),
+                'type': team,
+                'percent': D(percent) / 100,
+            })
+        return result
+
+    def _get_resources_costs(self, team):
+        daily_cost = self._get_daily_cost(team)
+        costs = self._allocate(self._get_row(team), to_micro(daily_cost))
+        result = defaultdict(list)
+        for se_id, cost in costs.items():
+            cost = from_micro(cost)
+            result[se_id].append({
+                'cost': cost,
+                'type': team,
+                'percent': cost / D(daily_cost) if daily_cost else 0,
+            })
+        return result
+
+    def _get_distributed_costs(self, team):
+        daily_cost = self._get_daily_cost(team)
+        teams_members = [
+            (other, self._team_costs[other.id].members_count)
+            for other in self.teams
+            if other.billing_type not in (
+                TeamBillingType.distribute,
+                TeamBillingType.average,
+            ) and other.id in self._team_costs
+        ]
+        teams_costs = allocate(
+            to_micro(daily_cost),
+            [members_count for _, members_count in teams_members],
+            total_weight=sum(
+                members_count for _, members_count in teams_members
+            ),
+        )
+        costs = OrderedDict()
+        for (other, _), team_cost in zip(teams_members, teams_costs):
+            other_costs = self._allocate(self._get_row(other), team_cost)
+            for se_id, cost in other_costs.items():
+                costs[se_id] = costs.get(se_id, 0) + cost
+        result = defaultdict(list)
+        for se_id, cost in costs.items():
+            cost = from_micro(cost)
+            result[se_id].append({
+                'type': team,
+                'cost': cost,
+                'percent': cost / daily_cost if daily_cost else 0,
+            })
+        return result
+
+    def _get_average_costs(self, team):
+        daily_cost = self._get_daily_cost(team)
+        teams = [
+            other for other in self.teams
+            if other.billing_type != TeamBillingType.average
+        ]
+        se_percent = OrderedDict()
+        for other in teams:
+            for se_id, se_costs in self.get_costs(other).items():
+                se_percent[se_id] = (
+                    se_percent.get(se_id, D(0)) + se_costs[0]['percent']
+                )
+        total_percent = len(teams)
+        se_percent = se_percent.items()
+        costs = allocate(
+            to_micro(daily_cost),
+            [percent for _, percent in se_percent],
+            total_weight=total_percent,
+        )
+        result = defaultdict(list)
+        for (se_id, percent), cost in zip(se_percent, costs):
+            result[se_id].append({
+                'cost': from_micro(cost),
+                'percent': percent / total_percent,
+                'type': team,
+            })
+        return result
@@ -16,14 +16,15 @@ from ralph_scrooge.plugins.cost.base import (
     NoPriceCostError,
     MultiplePriceCostError,
 )
-from ralph_scrooge.utils.common import memoize
+from ralph_scrooge.utils.calculation_context import cached
+from ralph_scrooge.utils.money import from_micro, to_micro
 
 
 logger = logging.getLogger(__name__)
 
 
 class UsageTypeBasePlugin(BaseCostPlugin):
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _get_price_per_unit(
         self,
         date,
@@ -96,20 +97,17 @@ class UsageTypeBasePlugin(BaseCostPlugin):
                 warehouse=warehouse,
                 excluded_services_environments=excluded_services_envs,
             )
-            usages = self._get_usages_per_pricing_object(
+            usages = self._get_pricing_objects_usages(
                 date=date,
                 usage_type=usage_type,
                 warehouse=warehouse,
                 excluded_services_environments=excluded_services_envs,
             )
-            for v in usages:
-                service_environment = v.service_environment_id
+            for service_environment, pricing_object_id, value in usages:
                 pricing_object_cost = {
-                    'cost': D(v.value) * price_per_unit,
-                    'value': v.value,
-                    'pricing_object_id': (
-                        v.daily_pricing_object.pricing_object_id
-                    ),
+                    'cost': from_micro(to_micro(D(value) * price_per_unit)),
+                    'value': value,
+                    'pricing_object_id': pricing_object_id,
                     'type_id': usage_type.id,
                 }
                 if warehouse:
@@ -118,7 +116,7 @@ class UsageTypeBasePlugin(BaseCostPlugin):
 
         return result
 
-    @memoize(skip_first=True)
+    @cached(skip_first=True)
     def _costs(
         self,
         date,
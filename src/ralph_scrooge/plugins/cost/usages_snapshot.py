@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory snapshot of daily usages for single day.
+
+Cost plugins are asking for (aggregated) daily usages of the same day over and
+over again - usage type plugins for usages per pricing object, pricing services
+for usages of their service usage types, dynamic extra costs for their
+division etc. Every such question used to be separate query on `DailyUsage`
+table (which is the biggest table in Scrooge).
+
+Snapshot loads all daily usages for a day once (in single scan) and keeps them
+as compact arrays grouped by usage type (and indexed by service environment
+and warehouse, so usages of subset of service environments are gathered
+without scanning all usages of usage type). Every plugin could then ask
+snapshot instead of database about totals, usages per service environment,
+usages per pricing object etc. (with the same filters as
+`BaseCostPlugin._get_daily_usages_in_period`).
+
+Snapshot is activated by collector for the time of calculating costs of single
+day (see `activate`) - plugins are using it only if it's covering date for
+which they are asking (otherwise database is queried, as usual). Snapshot is
+active only in the thread which activated it (threads running cost plugins
+concurrently have to activate it explicitly), so calculations of different
+days in the same process are not mixed.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import threading
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models.query import QuerySet
+
+from ralph_scrooge.models import DailyUsage, ServiceEnvironment
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _get_ids(objects):
+    """
+    Returns set of ids of passed (model) objects. Objects could be passed
+    as queryset, any iterable of model instances or iterable of ids.
+    """
+    if isinstance(objects, QuerySet):
+        return set(objects.values_list('pk', flat=True))
+    return set(getattr(obj, 'pk', obj) for obj in objects)
+
+
+class _UsageTypeUsages(object):
+    """
+    Daily usages of single usage type stored as parallel arrays, indexed by
+    service environment and warehouse (index is mapping from id to array of
+    positions of its usages).
+    """
+    __slots__ = (
+        'service_environments', 'pricing_objects', 'warehouses', 'values',
+        'by_service_environment', 'by_warehouse',
+    )
+
+    def __init__(self):
+        self.service_environments = array(b'l')
+        self.pricing_objects = array(b'l')
+        self.warehouses = array(b'l')
+        self.values = array(b'd')
+        self.by_service_environment = defaultdict(lambda: array(b'l'))
+        self.by_warehouse = defaultdict(lambda: array(b'l'))
+
+    def append(self, service_environment_id, pricing_object_id, warehouse_id,
+               value):
+        position = len(self.values)
+        self.service_environments.append(service_environment_id)
+        self.pricing_objects.append(pricing_object_id)
+        self.warehouses.append(warehouse_id)
+        self.values.append(value or 0)
+        self.by_service_environment[service_environment_id].append(position)
+        self.by_warehouse[warehouse_id].append(position)
+
+    def get_positions(self, service_environment_ids=None, warehouse_id=None):
+        """
+        Returns (ordered) positions of usages of service environments (all
+        of them if service_environment_ids is None) and warehouse (any if
+        warehouse_id is None), gathered from indexes.
+        """
+        if service_environment_ids is not None:
+            positions = sorted(
+                position
+                for se_id in service_environment_ids
+                for position in self.by_service_environment.get(se_id, ())
+            )
+            if warehouse_id:
+                warehouses = self.warehouses
+                positions = [
+                    position for position in positions
+                    if warehouses[position] == warehouse_id
+                ]
+            return positions
+        if warehouse_id:
+            return self.by_warehouse.get(warehouse_id, ())
+        return xrange(len(self.values))
+
+    def __len__(self):
+        return len(self.values)
+
+
+class DailyUsagesSnapshot(object):
+    """
+    All daily usages for single day, grouped by usage type.
+
+    Every query method accepts the same params as
+    `BaseCostPlugin._get_daily_usages_in_period`.
+    """
+    def __init__(self, date):
+        self.date = date
+        self._usages = defaultdict(_UsageTypeUsages)
+        self._services = {}
+
+    @classmethod
+    def load(cls, date):
+        """
+        Load all daily usages for date (using single query).
+        """
+        snapshot = cls(date)
+        snapshot._services = dict(
+            ServiceEnvironment.objects.values_list('id', 'service_id')
+        )
+        daily_usages = DailyUsage.objects.filter(date=date).values_list(
+            'type_id',
+            'service_environment_id',
+            'daily_pricing_object__pricing_object',
+            'warehouse_id',
+            'value',
+        )
+        count = 0
+        for type_id, se_id, po_id, warehouse_id, value in (
+            daily_usages.iterator()
+        ):
+            snapshot._usages[type_id].append(se_id, po_id, warehouse_id, value)
+            count += 1
+        logger.info('Loaded {} daily usages of {} usage types for {}'.format(
+            count, len(snapshot._usages), date,
+        ))
+        return snapshot
+
+    def covers(self, date=None, start=None, end=None):
+        """
+        Returns True if snapshot could be used to answer query for date (or
+        period between start and end).
+        """
+        if start and end:
+            return start == end == self.date
+        return date == self.date
+
+    def _get_rows(
+        self,
+        usage_type,
+        date=None,
+        start=None,
+        end=None,
+        warehouse=None,
+        service_environments=None,
+        excluded_services=None,
+        excluded_services_environments=None,
+    ):
+        """
+        Generates (service environment id, pricing object id, value) for every
+        daily usage matching passed filters.
+        """
+        usages = self._usages.get(getattr(usage_type, 'pk', usage_type))
+        if not usages:
+            return
+        warehouse_id = getattr(warehouse, 'pk', warehouse)
+        se_ids = (
+            _get_ids(service_environments)
+            if service_environments is not None else None
+        )
+        excluded_service_ids = (
+            _get_ids(excluded_services) if excluded_services else None
+        )
+        excluded_se_ids = (
+            _get_ids(excluded_services_environments)
+            if excluded_services_environments else None
+        )
+        services = self._services
+        service_environments = usages.service_environments
+        pricing_objects = usages.pricing_objects
+        values = usages.values
+        for position in usages.get_positions(se_ids, warehouse_id):
+            se_id = service_environments[position]
+            if excluded_se_ids and se_id in excluded_se_ids:
+                continue
+            if (
+                excluded_service_ids and
+                services.get(se_id) in excluded_service_ids
+            ):
+                continue
+            yield se_id, pricing_objects[position], values[position]
+
+    def get_total_usage(self, *args, **kwargs):
+        """
+        Snapshot equivalent of `BaseCostPlugin._get_total_usage`.
+        """
+        return sum(
+            value for se_id, po_id, value in self._get_rows(*args, **kwargs)
+        ) or 0
+
+    def get_usages_per_service_environment(self, *args, **kwargs):
+        """
+        Snapshot equivalent of
+        `BaseCostPlugin._get_usages_per_service_environment`.
+        """
+        result = defaultdict(float)
+        for se_id, po_id, value in self._get_rows(*args, **kwargs):
+            result[se_id] += value
+        return [
+            {'service_environment': se_id, 'usage': usage}
+            for se_id, usage in sorted(result.items())
+        ]
+
+    def get_usages_per_service(self, *args, **kwargs):
+        """
+        Snapshot equivalent of `BaseCostPlugin._get_usages_per_service`.
+        """
+        result = defaultdict(float)
+        for se_id, po_id, value in self._get_rows(*args, **kwargs):
+            result[self._services.get(se_id)] += value
+        return [
+            {'service_environment__service': service_id, 'usage': usage}
+            for service_id, usage in sorted(result.items())
+        ]
+
+    def get_pricing_objects_usages(self, *args, **kwargs):
+        """
+        Returns list of (service environment id, pricing object id, value) for
+        every single daily usage.
+        """
+        return list(self._get_rows(*args, **kwargs))
+
+    def get_usages_per_pricing_object_and_service_environment(
+        self, *args, **kwargs
+    ):
+        """
+        Returns list of (pricing object id, service environment id, usage)
+        with usages summed by pricing object and service environment.
+        """
+        result = defaultdict(float)
+        for se_id, po_id, value in self._get_rows(*args, **kwargs):
+            result[(po_id, se_id)] += value
+        return [(po_id, se_id, usage) for (po_id, se_id), usage in (
+            result.iteritems()
+        )]
+
+
+def get_active_snapshot():
+    """
+    Returns usages snapshot active in current thread (or None if there is no
+    active snapshot).
+    """
+    return getattr(_local, 'snapshot', None)
+
+
+@contextmanager
+def activate(snapshot):
+    """
+    Make snapshot active (visible for cost plugins) in context (in current
+    thread).
+    """
+    previous = get_active_snapshot()
+    _local.snapshot = snapshot
+    try:
+        yield snapshot
+    finally:
+        _local.snapshot = previous
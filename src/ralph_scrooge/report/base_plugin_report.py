@@ -9,6 +9,7 @@ import logging
 from decimal import Decimal as D
 
 from ralph_scrooge.utils.common import memoize
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 
 from ralph_scrooge.models import (
@@ -39,14 +40,23 @@ class BasePluginReport(BaseReport):
         return []
 
     @classmethod
-    def calculate_costs(self, start, end, forecast=False):
+    def calculate_costs(self, start, end, forecast=False, workers=None):
         """
         Calculate costs between start and end (without forcing - when costs
         were calculated for single day, they will be not calculated again
         unless forcing it).
+
+        Days are calculated in parallel by `workers` processes (defaults to
+        `SCROOGE_COSTS_WORKERS` setting).
         """
         collector = Collector()
-        for day, status in collector.process_period(start, end, forecast):
+        for day, status in collector.process_period(
+            start,
+            end,
+            forecast,
+            workers=workers or settings.SCROOGE_COSTS_WORKERS,
+            save=True,
+        ):
             pass
 
     @classmethod
@@ -9,6 +9,11 @@ import logging
 
 from django.conf import settings
 
+from ralph_scrooge.utils.calculation_context import (
+    activate_context,
+    CalculationContext,
+    close_context,
+)
 from ralph_scrooge.utils.common import get_cache_name, get_queue_name
 from ralph_scrooge.utils.worker_job import WorkerJob
 
@@ -49,16 +54,31 @@ class BaseReport(WorkerJob):
 
     @classmethod
     def run(cls, **kwargs):
-        header = cls.get_header(**kwargs)
-        for finished, progress, data in cls.get_data(**kwargs):
-            # If calculation of report is not finished, max returned progress
-            # is 99.0. Since reports users are depending on progress (check if
-            # progress < 100) we need to make sure that only final yield
-            # from here will have progress set to 100%.
-            progress = min(progress, 99.0)
-            yield progress, (header, data)
-            if finished:
-                break
+        # values cached during report generation are valid only for this run
+        # - context is active only while report is calculated (not between
+        # yields), so it's never visible outside of this run (even if this
+        # generator is abandoned)
+        context = CalculationContext(settings.CALCULATION_CONTEXT_MAX_SIZE)
+        try:
+            with activate_context(context):
+                header = cls.get_header(**kwargs)
+                data_iter = iter(cls.get_data(**kwargs))
+            while True:
+                with activate_context(context):
+                    try:
+                        finished, progress, data = next(data_iter)
+                    except StopIteration:
+                        break
+                # If calculation of report is not finished, max returned
+                # progress is 99.0. Since reports users are depending on
+                # progress (check if progress < 100) we need to make sure that
+                # only final yield from here will have progress set to 100%.
+                progress = min(progress, 99.0)
+                yield progress, (header, data)
+                if finished:
+                    break
+        finally:
+            close_context(context)
         yield 100, (header, data)
         logger.info("Report generated")
 
@@ -5,6 +5,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import defaultdict
 from decimal import Decimal as D
 
 from django.db.models import Sum
@@ -15,11 +16,13 @@ from rest_framework.views import APIView
 
 from ralph_scrooge.models import (
     BaseUsage,
+    BaseUsageType,
     CostDateStatus,
     DailyCost,
     ServiceEnvironment,
 )
 from ralph_scrooge.rest_api.common import get_dates
+from ralph_scrooge.utils.costs_hierarchy import get_subcosts
 
 
 class CostCardContent(APIView):
@@ -35,6 +38,10 @@ class CostCardContent(APIView):
         :param month int: ordinal value of month
         :param year int: year
         :returns object: json response
+
+        If `subcosts` query param is passed, costs of every type contain
+        also their subcosts (saved or calculated from hierarchies of pricing
+        services costs).
         """
         first_day, last_day, days_in_month = get_dates(year, month)
         try:
@@ -80,13 +87,26 @@ class CostCardContent(APIView):
         )
         # call objects_admin to get not-actvie types too
         base_usages = {bu.id: bu.name for bu in BaseUsage.objects_admin.all()}
+        with_subcosts = bool(request.query_params.get('subcosts', False))
+        if with_subcosts:
+            subcosts = self._get_subcosts(
+                dates, service_environment, forecast
+            )
         total = D(0)
         results = []
         for monthly_cost in monthly_costs:
-            results.append({
+            result = {
                 'name': base_usages[monthly_cost['type']],
                 'cost': round(monthly_cost['sum_cost'], 2)
-            })
+            }
+            if with_subcosts:
+                result['subcosts'] = [
+                    {'name': base_usages[type_id], 'cost': round(cost, 2)}
+                    for type_id, cost in sorted(
+                        subcosts[monthly_cost['type']].items()
+                    )
+                ]
+            results.append(result)
             total += monthly_cost['sum_cost']
         results.append({
             'name': _('Total'),
@@ -97,3 +117,40 @@ class CostCardContent(APIView):
             "status": True,
             "results": results
         })
+
+    def _get_subcosts(self, dates, service_environment, forecast):
+        """
+        Returns sum of subcosts (costs at depth 1) of every type of cost -
+        subcosts of pricing services costs, which were not saved, are
+        calculated from hierarchies of pricing services costs (see
+        `ralph_scrooge.utils.costs_hierarchy`).
+
+        :rtype: dict
+        :returns: dict with type of cost as key and dict with sum of subcosts
+            per type of subcost as value
+        """
+        costs = DailyCost.objects_tree.filter(
+            date__in=dates,
+            service_environment=service_environment,
+            forecast=forecast,
+        )
+        result = defaultdict(lambda: defaultdict(D))
+        for subcost in costs.filter(depth=1).values('path', 'type').annotate(
+            sum_cost=Sum('cost')
+        ):
+            parent = int(subcost['path'].split(DailyCost._path_link)[0])
+            result[parent][subcost['type']] += subcost['sum_cost']
+        pricing_services_costs = costs.filter(
+            depth=0,
+            type__type=BaseUsageType.pricing_service,
+        ).values('date', 'type').annotate(sum_cost=Sum('cost'))
+        for (_date, path), subcosts in get_subcosts(
+            [
+                (c['date'], [c['type']], c['sum_cost'])
+                for c in pricing_services_costs
+            ],
+            forecast,
+        ).items():
+            for type_id, cost in subcosts:
+                result[path[0]][type_id] += cost
+        return result
@@ -6,11 +6,12 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import logging
-import time
+import uuid
 from dateutil import rrule
 
 from django.conf import settings
 from django.core.cache import caches as dj_caches
+from django.core.cache.backends.dummy import DummyCache
 from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 from rq import get_current_job
@@ -21,14 +22,45 @@ from rest_framework.response import Response
 
 from ralph_scrooge.models import CostDateStatus
 from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.cost_tree import (
+    as_cost_tree,
+    CostTree,
+    PackedCostTree,
+)
 from ralph_scrooge.plugins.validations import DataForReportValidationError
 from ralph_scrooge.rest_api.private.serializers import MonthlyCostsSerializer
-from ralph_scrooge.utils.common import get_cache_name, get_queue_name
-from ralph_scrooge.utils.worker_job import WorkerJob, _get_cache_key
+from ralph_scrooge.utils.common import (
+    get_cache_name,
+    get_queue_name,
+    group_consecutive_days,
+)
+from ralph_scrooge.utils.worker_job import (
+    BATCH,
+    INTERACTIVE,
+    WorkerJob,
+    _get_cache_key,
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _checkpoints_enabled():
+    return (
+        settings.DAILY_COSTS_STREAMING_SAVE and
+        settings.DAILY_COSTS_CHECKPOINTS
+    )
+
+
+def _fingerprints_enabled():
+    # fingerprints of days (saved with checkpoints) are calculated only when
+    # unchanged days are skipped or interrupted recalculations are resumed
+    # (staged costs are reused only if inputs of day were not changed - see
+    # `Collector.start_recalculation`)
+    return _checkpoints_enabled() and (
+        settings.DAILY_COSTS_RESUME or settings.SKIP_UNCHANGED_DAYS
+    )
+
+
 class AcceptMonthlyCosts(APIView):
 
     def post(self, request, *args, **kwargs):
@@ -66,6 +98,8 @@ class MonthlyCosts(APIView, WorkerJob):
     cache_name = get_cache_name('scrooge_costs_master', 'scrooge_costs')
     cache_section = 'scrooge_costs'
     cache_timeout = 60 * 60 * 24  # 24 hours (max time for plugin to run)
+    # master jobs are occupying workers until all days are calculated
+    max_running_jobs = 2
     # cache for main (master) job result
     cache_final_result_timeout = 60  # 1 minute
     # cache for partial results for each day when every job is done (costs
@@ -96,6 +130,7 @@ class MonthlyCosts(APIView, WorkerJob):
                 start=serializer.validated_data['start'],
                 end=serializer.validated_data['end'],
                 forecast=serializer.validated_data['forecast'],
+                force=serializer.validated_data['force'],
             )
             result['job_id'] = job.id
             result['message'] = _(
@@ -110,6 +145,8 @@ class MonthlyCosts(APIView, WorkerJob):
             **job.kwargs
         )
         validation_errors = meta.get('validation_errors', {})
+        skipped_days = meta.get('skipped_days', {})
+        unpublished = meta.get('unpublished')
         status = 'running'
         data = data or {}
         data_ = []
@@ -122,12 +159,38 @@ class MonthlyCosts(APIView, WorkerJob):
                 )
             )
         if job.is_finished:
-            status = 'finished'
+            # costs of period are not published when calculation of some
+            # day failed (they'll be published when it's resumed)
+            status = 'failed' if unpublished else 'finished'
         elif job.is_failed:
             status = 'failed'
-        return Response(
-            {'status': status, 'data': data_, 'progress': progress}
-        )
+        result = {
+            'status': status,
+            'data': data_,
+            'progress': progress,
+            'skipped': [
+                (str(day.date()), reason)
+                for day, reason in sorted(skipped_days.items())
+            ],
+        }
+        if unpublished:
+            result['message'] = _(
+                'Costs were not saved - calculation of some days failed. '
+                'Run recalculation again to calculate only these days.'
+            )
+        return Response(result)
+
+    @classmethod
+    def get_lane(cls, start, end, **kwargs):
+        """
+        Recalculation of period longer than
+        `SCROOGE_COSTS_INTERACTIVE_MAX_DAYS` is running in batch lane
+        (together with its subjobs).
+        """
+        days = (end - start).days + 1
+        if days > settings.SCROOGE_COSTS_INTERACTIVE_MAX_DAYS:
+            return BATCH
+        return INTERACTIVE
 
     @classmethod
     def forget_cache(cls, start, end, **kwargs):
@@ -148,9 +211,10 @@ class MonthlyCosts(APIView, WorkerJob):
 
     @classmethod
     @transaction.atomic
-    def _save_costs(self, data, start, end, forecast):
+    def _save_costs(self, data, start, end, forecast, collector=None):
         """
-        Save costs between start and end.
+        Save costs between start and end (using bulk writer selected by
+        `DAILY_COST_BULK_WRITER` setting).
 
         :param data: list of DailyCost instances
         :type data: list
@@ -160,19 +224,46 @@ class MonthlyCosts(APIView, WorkerJob):
         :type end: datetime.date
         :param forecast: True, if forecast costs
         :type forecast: bool
+        :param collector: collector used to calculate costs (with
+            fingerprints of calculated days)
         """
-        collector = Collector()
+        collector = collector or Collector()
         collector.save_period_costs(start, end, forecast, data)
 
+    @classmethod
+    def _stage_daily_result(
+        cls, data, date, forecast, collector=None, run=None
+    ):
+        """
+        Save results from subtask job (single day) in staging area (see
+        `Collector.stage_costs`) and checkpoint them in recalculation run (if
+        passed).
+
+        :param data: costs of single day
+        :type data: CostTree or PackedCostTree (unpacked here)
+        :param date: date for which process daily results
+        :type date: datetime.date
+        :param forecast: True, if forecast costs
+        :type forecast: bool
+        :param collector: collector used to calculate costs (with
+            fingerprints of calculated days)
+        :param run: recalculation run
+        :type run: ralph_scrooge.models.CostRecalculationRun
+        """
+        collector = collector or Collector()
+        with transaction.atomic():
+            collector.stage_costs(date, data, forecast)
+            if run is not None:
+                collector.checkpoint(run, date, forecast)
+
     @classmethod
     def _process_daily_result(self, data, date, forecast):
         """
         Process results from subtask jobs (single day) - create daily costs
         instances.
 
-        :param data: costs per service environments
-        :type data: dict of lists (key: service environment id, value: list of
-            costs of service environment)
+        :param data: costs of single day
+        :type data: CostTree or PackedCostTree (unpacked here)
         :param date: date for which process daily results
         :type date: datetime.date
         :param forecast: True, if forecast costs
@@ -182,42 +273,344 @@ class MonthlyCosts(APIView, WorkerJob):
         return collector._create_daily_costs(date, data, forecast)
 
     @classmethod
-    def run(cls, start, end, forecast=False, **kwargs):
+    def run(cls, start, end, forecast=False, force=False, **kwargs):
         """
         Run collecting costs between start and end.
 
         It's running as "master" worker, which delegate jobs for single date to
         subtask workers, collects results from them and process them and at the
         end it saves all costs to the database.
+
+        Subtasks notify master when they're done (see
+        `WorkerJob.notify_done`), so results of every day are processed as
+        soon as they're ready.
+
+        When running without RQ (dummy cache), days are calculated locally
+        (in pool of `SCROOGE_COSTS_WORKERS` processes) instead of subtask
+        workers. When only single day is calculated, it could be split into
+        `SCROOGE_COSTS_DAY_SHARDS` subtasks (see `_calculate_sharded`).
+
+        With `DAILY_COSTS_STREAMING_SAVE` enabled, costs of every day are
+        saved in staging area as soon as they're received and all of them are
+        published at the end (atomically), so only costs of single day are
+        kept in memory. With `DAILY_COSTS_CHECKPOINTS` enabled, every staged
+        day is checkpointed (see `Collector.start_recalculation`) and costs
+        are published only when all days are calculated (otherwise job is
+        reported as failed - see `_report_unpublished`). With
+        `DAILY_COSTS_RESUME` (or `SKIP_UNCHANGED_DAYS`) enabled too,
+        interrupted (or partially failed) recalculation of the same period
+        is resumed instead of calculating all days again - staged costs of
+        days are reused if their inputs were not changed (fingerprints of
+        days, saved with checkpoints, are calculated by subjobs).
+
+        Days which inputs were not changed since last calculation are skipped
+        (when `SKIP_UNCHANGED_DAYS` is enabled) and previous recalculation is
+        resumed, unless recalculation is forced.
         """
-        progress = 0
         statuses = {}
         processed_results = []  # list of DailyCost instances for whole period
+        streaming = settings.DAILY_COSTS_STREAMING_SAVE
         logger.info('Recalculating costs from {} to {}'.format(start, end))
-        while progress < 100:
-            progress, statuses, results = cls._check_subjobs(
+        collector = Collector()
+        days = list(rrule.rrule(rrule.DAILY, dtstart=start, until=end))
+        if settings.SKIP_UNCHANGED_DAYS and not force:
+            # days skipped are considered as successfully calculated
+            skipped_days = collector.get_unchanged_days(days, forecast)
+            statuses.update((day, True) for day in skipped_days)
+            cls._report_skipped_days(skipped_days)
+        checkpoints = _checkpoints_enabled()
+        run = None
+        if checkpoints:
+            # resume previous (interrupted) recalculation of the same period
+            # - staged costs of days which inputs were not changed are reused
+            # (forced recalculation is never resumed)
+            run, resumed_days = collector.start_recalculation(
+                start,
+                end,
+                forecast,
+                [day for day in days if day not in statuses],
+                resume=_fingerprints_enabled() and not force,
+            )
+            statuses.update((day, True) for day in resumed_days)
+        elif streaming:
+            # remove leftovers of previous (interrupted) recalculation
+            collector.clear_staged_costs(start, end, forecast)
+        days_to_calculate = [day for day in days if day not in statuses]
+        shards = settings.SCROOGE_COSTS_DAY_SHARDS
+        # subjobs are running in the same lane as master job
+        lane = cls.get_lane(start=start, end=end, forecast=forecast)
+        if isinstance(dj_caches[DailyCostsJob.cache_name], DummyCache):
+            subjobs = cls._calculate_in_pool(
+                statuses, start, end, forecast,
+                settings.SCROOGE_COSTS_WORKERS,
+                collector=collector,
+            )
+        elif shards > 1 and len(days_to_calculate) == 1:
+            subjobs = cls._calculate_sharded(
+                statuses, days_to_calculate[0], forecast, shards, lane,
+                collector=collector,
+            )
+        else:
+            subjobs = cls._wait_for_subjobs(
                 statuses,
                 start=start,
                 end=end,
                 forecast=forecast,
+                lane=lane,
+                collector=collector,
                 **kwargs
             )
+        for progress, statuses, results in subjobs:
             if results:
                 for day, day_results in results.iteritems():
-                    processed_results.extend(cls._process_daily_result(
-                        day_results,
-                        day,
-                        forecast,
-                    ))
+                    if streaming:
+                        cls._stage_daily_result(
+                            day_results, day, forecast, collector, run
+                        )
+                    else:
+                        processed_results.extend(cls._process_daily_result(
+                            day_results,
+                            day,
+                            forecast,
+                        ))
             if progress < 100:
                 yield progress, statuses
-                time.sleep(settings.SCROOGE_COSTS_MASTER_SLEEP)
-        # save all costs
-        cls._save_costs(processed_results, start, end, forecast)
+        if checkpoints and not all(statuses.values()):
+            # costs are published only when all days are calculated -
+            # recalculation of the same period will be resumed
+            failed_days = sorted(
+                day for day, success in statuses.items() if not success
+            )
+            logger.error(
+                'Costs from {} to {} not published - calculation of {} days '
+                'failed'.format(start, end, len(failed_days))
+            )
+            cls._report_unpublished(failed_days)
+            yield 100, statuses
+            return
+        for day, success in statuses.items():
+            if not success:
+                collector.forget_fingerprint(day, forecast)
+        # save all costs (of days which were not skipped)
+        ranges = group_consecutive_days(
+            [day for day in days if day not in collector.skipped_days]
+        )
+        for range_start, range_end in ranges:
+            if streaming:
+                collector.publish_staged_costs(
+                    range_start.date(), range_end.date(), forecast
+                )
+            else:
+                cls._save_costs(
+                    [
+                        cost for cost in processed_results
+                        if range_start <= cost.date <= range_end
+                    ] if len(ranges) > 1 else processed_results,
+                    range_start.date(),
+                    range_end.date(),
+                    forecast,
+                    collector=collector,
+                )
+        if run is not None:
+            collector.finish_recalculation(run)
         yield 100, statuses
 
     @classmethod
-    def _check_subjobs(cls, statuses, start, end, **kwargs):
+    def _report_skipped_days(cls, skipped_days):
+        """
+        Save days skipped in calculation (with reason of skipping) in meta of
+        current job.
+        """
+        job = get_current_job()
+        if job and skipped_days:
+            job.meta['skipped_days'] = skipped_days
+            job.save()
+
+    @classmethod
+    def _report_unpublished(cls, failed_days):
+        """
+        Mark current job as failed (in its meta) when costs of period were
+        not published, because calculation of failed_days failed.
+        """
+        job = get_current_job()
+        if job:
+            job.meta['unpublished'] = failed_days
+            job.save()
+
+    @classmethod
+    def _report_validation_errors(cls, day, validation_errors):
+        """
+        Pass validation errors of day from subjob(s) to master job.
+        """
+        job = get_current_job()
+        if job is None:
+            return
+        if not job.meta.get('validation_errors'):
+            job.meta['validation_errors'] = {}
+        job.meta['validation_errors'].setdefault(day, []).extend(
+            validation_errors
+        )
+        job.save()
+
+    @classmethod
+    def _remember_fingerprint(cls, collector, day, forecast, result):
+        """
+        Pass fingerprint of day calculated by subjob to collector (it's saved
+        with checkpoint of day).
+        """
+        if collector is not None and result.get('fingerprint'):
+            collector.remember_fingerprint(
+                day, forecast, result['fingerprint']
+            )
+
+    @classmethod
+    def _wait_for_subjobs(
+        cls, statuses, start, end, lane=None, collector=None, **kwargs
+    ):
+        """
+        Start subjobs (jobs for single day) and wait until all of them are
+        finished. Master blocks until any subjob notifies that it's done and
+        checks only this subjob. All (unfinished) subjobs are checked when
+        no notification was received in `SCROOGE_COSTS_MASTER_TIMEOUT`.
+        """
+        progress, statuses, results = cls._check_subjobs(
+            statuses, start, end, lane=lane, collector=collector, **kwargs
+        )
+        yield progress, statuses, results
+        while progress < 100:
+            done = DailyCostsJob.wait_for_done(
+                [
+                    dict(day=day, **kwargs)
+                    for day in rrule.rrule(
+                        rrule.DAILY, dtstart=start, until=end
+                    )
+                    if day not in statuses
+                ],
+                timeout=settings.SCROOGE_COSTS_MASTER_TIMEOUT,
+            )
+            progress, statuses, results = cls._check_subjobs(
+                statuses, start, end,
+                check_days=[done['day']] if done else None,
+                lane=lane,
+                collector=collector,
+                **kwargs
+            )
+            yield progress, statuses, results
+
+    @classmethod
+    def _calculate_sharded(
+        cls, statuses, day, forecast, shards, lane=None, collector=None
+    ):
+        """
+        Calculate costs of single day in shards of plugins (see
+        `Collector.get_plugins_shards`) running as subtasks. Shards of every
+        level are running in parallel, when all shards of previous levels are
+        finished. Costs of all shards are merged (in order of shards).
+
+        Fingerprint of day (calculated by first shard) is remembered by
+        collector (if passed).
+        """
+        plugins_shards = Collector().get_plugins_shards(day, forecast, shards)
+        step = 100.0 / (len(plugins_shards) + 1)
+        # results of shards of previous runs are not reused
+        run_id = uuid.uuid4().hex
+        costs = CostTree()
+        success = True
+        for level, level_shards in enumerate(plugins_shards):
+            for shard_success, result in cls._wait_for_shards(lane, [
+                dict(
+                    day=day,
+                    forecast=forecast,
+                    level=level,
+                    shard=shard,
+                    shards=shards,
+                    run_id=run_id,
+                )
+                for shard in range(len(level_shards))
+            ]):
+                success &= bool(shard_success)
+                # meta of job failed on worker has no result (only lane etc.)
+                if 'collector_result' in result:
+                    costs.merge(as_cost_tree(result['collector_result']))
+                    cls._report_validation_errors(
+                        day, result['validation_errors']
+                    )
+                    cls._remember_fingerprint(
+                        collector, day, forecast, result
+                    )
+            if not success:
+                break
+            yield (level + 1) * step, statuses, {}
+        statuses[day] = success
+        yield 100, statuses, {day: costs} if success else {}
+
+    @classmethod
+    def _wait_for_shards(cls, lane, kwargs_list):
+        """
+        Start shards (see `DailyCostsShardJob`) and wait until all of them
+        are finished (see `_wait_for_subjobs`).
+
+        :returns: list of (success, job meta) of every shard
+        :rtype: list
+        """
+        results = {}
+        to_check = range(len(kwargs_list))
+        while True:
+            for i in to_check:
+                progress, success, job, meta = (
+                    DailyCostsShardJob().run_on_worker(
+                        lane=lane, **kwargs_list[i]
+                    )
+                )
+                if progress == 100:
+                    results[i] = (success, meta)
+            pending = [
+                i for i in range(len(kwargs_list)) if i not in results
+            ]
+            if not pending:
+                return [results[i] for i in range(len(kwargs_list))]
+            done = DailyCostsShardJob.wait_for_done(
+                [kwargs_list[i] for i in pending],
+                timeout=settings.SCROOGE_COSTS_MASTER_TIMEOUT,
+            )
+            to_check = [kwargs_list.index(done)] if done else pending
+
+    @classmethod
+    def _calculate_in_pool(
+        cls, statuses, start, end, forecast, workers, collector=None
+    ):
+        """
+        Calculate costs for every day between start and end in pool of worker
+        processes (see `Collector.calculate_days`). Fingerprints of days are
+        calculated in worker processes too (when checkpoints and skipping of
+        unchanged days are enabled).
+        Validation errors of failed days are reported the same way as errors
+        from subjobs.
+        """
+        days = list(rrule.rrule(rrule.DAILY, dtstart=start, until=end))
+        step = 100.0 / len(days)
+        collector = collector or Collector()
+        for day, success, result in collector.calculate_days(
+            [day for day in days if day not in statuses],
+            forecast,
+            workers=workers,
+            perform_validation=True,
+            fingerprints=_fingerprints_enabled(),
+        ):
+            statuses[day] = success
+            if day in collector.validation_errors:
+                cls._report_validation_errors(
+                    day, collector.validation_errors[day]
+                )
+            yield len(statuses) * step, statuses, (
+                {day: result} if success else {}
+            )
+
+    @classmethod
+    def _check_subjobs(
+        cls, statuses, start, end, check_days=None, lane=None, collector=None,
+        **kwargs
+    ):
         """
         Check subjobs (jobs for single day) statuses.
 
@@ -228,6 +621,13 @@ class MonthlyCosts(APIView, WorkerJob):
         :type start: datetime.date
         :param end: end date
         :type end: datetime.date
+        :param check_days: days to check (all days between start and end by
+            default)
+        :type check_days: list
+        :param lane: priority lane of subjobs (see `WorkerJob.lane`)
+        :type lane: str
+        :param collector: collector remembering fingerprints of days
+            calculated by subjobs
         """
         days = (end - start).days + 1
         step = 100.0 / days
@@ -239,21 +639,25 @@ class MonthlyCosts(APIView, WorkerJob):
             if day in statuses:
                 total_progress += step
                 continue
+            if check_days is not None and day not in check_days:
+                continue
             dcj = DailyCostsJob()
             progress, success, job, result = dcj.run_on_worker(
-                day=day, **kwargs
+                day=day, lane=lane, **kwargs
             )
             if progress == 100:
                 total_progress += step
                 statuses[day] = success
-            if result:
+            # meta of job is returned for pending (and failed) jobs too, but
+            # only finished job has result
+            if progress == 100 and 'collector_result' in result:
                 results[day] = result['collector_result']
-                job = get_current_job()
-                # Pass errors from sub-job(s) to master job.
-                if not job.meta.get('validation_errors'):
-                    job.meta['validation_errors'] = {}
-                job.meta['validation_errors'][day] = result['validation_errors']  # noqa: E501
-                job.save()
+                cls._report_validation_errors(
+                    day, result['validation_errors']
+                )
+                cls._remember_fingerprint(
+                    collector, day, kwargs['forecast'], result
+                )
         # clear cache if all done
         if len(statuses) == days:
             cls.forget_cache(start, end, **kwargs)
@@ -271,6 +675,7 @@ class DailyCostsJob(WorkerJob):
     cache_timeout = 60 * 60 * 2  # 2 hours (max time for all plugins to run)
     cache_final_result_timeout = 60 * 60 * 2  # 2 hours
     _return_job_meta = True
+    notify_done = True
 
     @classmethod
     def run(cls, day, forecast):
@@ -280,7 +685,11 @@ class DailyCostsJob(WorkerJob):
         collector = Collector()
         result = {}
         validation_errors = []
+        fingerprint = ''
         try:
+            if _fingerprints_enabled():
+                # saved by master with checkpoint of day
+                fingerprint = collector.get_fingerprint(day, forecast)
             result = collector.process(day, forecast, perform_validation=True)
             success = True
         except DataForReportValidationError as e:
@@ -290,9 +699,96 @@ class DailyCostsJob(WorkerJob):
         except Exception as e:
             logger.exception(e)
             success = False
+        cls._save_result(
+            collector, result, success, validation_errors, fingerprint
+        )
+        yield 100, success
+
+    @classmethod
+    def _save_result(
+        cls, collector, result, success, validation_errors, fingerprint=''
+    ):
+        """
+        Save result of calculation (and its profile and fingerprint of inputs)
+        in meta of current job.
+        """
         job = get_current_job()
-        # save result to job meta to keep log clean
-        job.meta['collector_result'] = result
+        # save result to job meta to keep log clean (packed, to keep it small
+        # in Redis - it's unpacked by master only when it's saved)
+        job.meta['collector_result'] = (
+            PackedCostTree.pack(result) if success else {}
+        )
         job.meta['validation_errors'] = validation_errors
+        job.meta['fingerprint'] = fingerprint
+        # profile of calculation (see `ralph_scrooge.plugins.cost.profiling`)
+        job.meta['profiles'] = [
+            profile.as_dict() for profile in collector.profiles.values()
+        ]
         job.save()
+
+
+class DailyCostsShardJob(DailyCostsJob):
+    """
+    Job for single shard of plugins of single day (see
+    `Collector.process_shard`), running as "subtask".
+
+    Results of pricing services engine of every shard are saved in cache, so
+    they're used by shards of next levels.
+    """
+    cache_section = 'scrooge_costs_shard'
+
+    @classmethod
+    def _get_engine_results_key(cls, run_id, level, shard):
+        return _get_cache_key(
+            cls.cache_section + ':engine',
+            run_id=run_id,
+            level=level,
+            shard=shard,
+        )
+
+    @classmethod
+    def run(cls, day, forecast, level, shard, shards, run_id):
+        """
+        Run collecting costs of single shard of plugins for one day.
+        """
+        cache = dj_caches[cls.cache_name]
+        collector = Collector()
+        result = {}
+        validation_errors = []
+        fingerprint = ''
+        try:
+            if _fingerprints_enabled() and level == 0 and shard == 0:
+                fingerprint = collector.get_fingerprint(day, forecast)
+            # results of every shard of previous levels (missing results
+            # are calculated again)
+            engine_results = cache.get_many([
+                cls._get_engine_results_key(run_id, previous, i)
+                for previous in range(level)
+                for i in range(shards)
+            ]).values()
+            result, engine = collector.process_shard(
+                day,
+                forecast,
+                level,
+                shard,
+                shards,
+                engine_results=engine_results,
+                perform_validation=(level == 0 and shard == 0),
+            )
+            cache.set(
+                cls._get_engine_results_key(run_id, level, shard),
+                engine.dump_results(),
+                timeout=cls.cache_final_result_timeout,
+            )
+            success = True
+        except DataForReportValidationError as e:
+            logger.exception(e)
+            success = False
+            validation_errors = e.errors
+        except Exception as e:
+            logger.exception(e)
+            success = False
+        cls._save_result(
+            collector, result, success, validation_errors, fingerprint
+        )
         yield 100, success
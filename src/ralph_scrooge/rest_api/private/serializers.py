@@ -12,3 +12,4 @@ class MonthlyCostsSerializer(serializers.Serializer):
     start = serializers.DateField()
     end = serializers.DateField()
     forecast = serializers.BooleanField(default=False)
+    force = serializers.BooleanField(default=False)
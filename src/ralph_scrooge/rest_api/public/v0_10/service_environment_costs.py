@@ -21,6 +21,7 @@ from rest_framework.views import APIView
 
 from ralph_scrooge.models import (
     BaseUsage,
+    BaseUsageType,
     CostDateStatus,
     DailyCost,
     Service,
@@ -29,6 +30,7 @@ from ralph_scrooge.models import (
 )
 from ralph_scrooge.rest_api.public.auth import IsServiceOwner
 from ralph_scrooge.utils.cache import memoize
+from ralph_scrooge.utils.costs_hierarchy import get_subcosts
 
 logger = logging.getLogger(__name__)
 
@@ -359,6 +361,7 @@ def fetch_costs(
     # couple of separate queries, which would have negative impact on
     # performance.
     cost_trees = _create_trees(aggregated_costs, selector)
+    _add_calculated_subcosts(cost_trees, initial_qs, selector, forecast)
     cost_trees_ = _replace_path_with_type_symbol(cost_trees)
     cost_trees_filtered = _filter_by_types(cost_trees_, types)
 
@@ -481,6 +484,54 @@ def _create_trees(aggregated_costs, date_selector):
     return cost_trees
 
 
+def _add_calculated_subcosts(cost_trees, qs, date_selector, forecast):
+    """Add subcosts of pricing services costs (in `cost_trees` - see
+    `_create_trees`), which were not saved as daily costs, but are calculated
+    from saved hierarchies of pricing services costs (see
+    `ralph_scrooge.utils.costs_hierarchy`).
+
+    Subcosts are calculated for every day separately and then summed per
+    period given by `date_selector`.
+    """
+    values = ['date', 'type']
+    if date_selector != 'date':
+        values.append(date_selector)
+    pricing_services_costs = list(qs.filter(
+        depth=0,
+        type__type=BaseUsageType.pricing_service,
+    ).values(*values).annotate(cost_sum=Sum('cost')))
+    subcosts = get_subcosts(
+        [
+            (c['date'], [c['type']], c['cost_sum'])
+            for c in pricing_services_costs
+        ],
+        forecast,
+    )
+    if not subcosts:
+        return
+    types = {
+        bu['id']: bu for bu in BaseUsage.objects_admin.filter(
+            id__in=set(
+                type_id for costs in subcosts.values() for type_id, _ in costs
+            )
+        ).values('id', 'symbol', 'name')
+    }
+    for c in pricing_services_costs:
+        parent_path = str(c['type'])
+        parent = cost_trees[c[date_selector]][parent_path]
+        for type_id, cost in subcosts.get((c['date'], (c['type'],)), []):
+            subcost = parent.setdefault('subcosts', {}).setdefault(
+                '{}{}{}'.format(parent_path, DailyCost._path_link, type_id),
+                {
+                    '_type_symbol': types[type_id]['symbol'],
+                    'cost': 0,
+                    'usage_value': 0.0,
+                    'type': types[type_id]['name'],
+                }
+            )
+            subcost['cost'] += cost
+
+
 def _replace_path_with_type_symbol(cost_trees):
     """Having a dict with cost trees (for the description of its structure
     see `_create_trees` function`), replace `path` components (e.g. '484',
@@ -25,7 +25,6 @@ from rest_framework.response import Response
 from rest_framework.serializers import Serializer
 
 from ralph_scrooge.models import (
-    CostDateStatus,
     DailyUsage,
     PRICING_OBJECT_TYPES,
     PricingObject,
@@ -35,8 +34,21 @@ from ralph_scrooge.models import (
     ServiceEnvironment,
     UsageType,
 )
-from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.collector import (
+    BOTH_FORECASTS,
+    Collector,
+    VerifiedDailyCostsExistsError,
+)
+from ralph_scrooge.plugins.cost.dependencies import (
+    CostsDependencyIndex,
+    get_plugin_type,
+)
 from ralph_scrooge.rest_api.public.auth import TastyPieLikeTokenAuthentication
+from ralph_scrooge.utils.usage_totals import (
+    defer_daily_usage_totals,
+    delete_daily_usages,
+    mark_changed,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -428,9 +440,17 @@ def create_pricing_service_usages(request, *args, **kwargs):
 
 @transaction.atomic
 def _save_usages_and_recalculate_costs(ps_usage):
-    save_usages(ps_usage)
-    if settings.ENABLE_RECALCULATE_COSTS_ON_POST:
-        _recalculate_costs(ps_usage['pricing_service'], ps_usage['date'])
+    index = None
+    if (
+        settings.ENABLE_RECALCULATE_COSTS_ON_POST and
+        _is_recalculated_on_post(ps_usage['pricing_service'])
+    ):
+        # index is built before saving usages, to know pricing services of
+        # service environments, which usages are going to be deleted
+        index = CostsDependencyIndex(ps_usage['date'])
+    daily_usages = save_usages(ps_usage)
+    if index is not None:
+        _recalculate_costs(ps_usage['date'], daily_usages, index)
 
 
 def save_usages(ps_usage):
@@ -439,41 +459,68 @@ def save_usages(ps_usage):
        a data structure needed by next two steps.
     2) Removing previous usages associated with a given day.
     3) The actual save of the incoming usages.
+
+    Returns list of saved DailyUsage objects.
     """
     logger.info("Saving usages for pricing service {}".format(
         ps_usage['pricing_service']
     ))
     daily_usages, usages_daily_pricing_objects = get_usages_for_save(ps_usage)
-    remove_previous_daily_usages(
-        ps_usage['overwrite'],
-        ps_usage['date'],
-        usages_daily_pricing_objects,
-    )
-    DailyUsage.objects.bulk_create(daily_usages)
+    with defer_daily_usage_totals():
+        remove_previous_daily_usages(
+            ps_usage['overwrite'],
+            ps_usage['date'],
+            usages_daily_pricing_objects,
+        )
+        DailyUsage.objects.bulk_create(daily_usages)
+        # bulk_create is not sending signals updating totals
+        mark_changed(
+            ps_usage['date'], set(du.type_id for du in daily_usages)
+        )
+    return daily_usages
 
 
-def _recalculate_costs(ps_name, date):
-    pss = PricingService.objects.filter(
+def _is_recalculated_on_post(ps_name):
+    """
+    Costs are recalculated right after saving usages only for active fixed
+    price pricing services.
+    """
+    return PricingService.objects.filter(
+        name=ps_name,
         active=True,
         plugin_type=PricingServicePlugin.pricing_service_fixed_price_plugin.id,
-    ).values_list('name', flat=True)
-    if ps_name not in pss:
+    ).exists()
+
+
+def _recalculate_costs(date, daily_usages, index):
+    """
+    Recalculate costs depending on saved usages (see `CostsDependencyIndex`)
+    - only costs subtrees of plugins depending on usage types of saved usages
+    are replaced, other costs of the day are left intact. Real and forecast
+    costs are recalculated in single pass (sharing usages snapshot and
+    calculation context).
+    """
+    usages_by_type = defaultdict(list)
+    for daily_usage in daily_usages:
+        usages_by_type[daily_usage.type].append(
+            daily_usage.service_environment
+        )
+    for usage_type, service_environments in usages_by_type.items():
+        index.add_usages(usage_type, service_environments)
+    plugins = index.get_affected_plugins(usages_by_type.keys())
+    if not plugins:
         return
 
-    collector = Collector()
-    plugins = [p for p in collector.get_plugins() if p.name in pss]
-
-    for forecast in [False, True]:
-        if CostDateStatus.objects.filter(
-            date=date,
-            **{'forecast_accepted' if forecast else 'accepted': True}
-        ).exists():
-            logger.warning(
-                "Costs for {:%Y-%m-%d} are already accepted and won't be "
-                "recalculated (forecast={}).".format(date, forecast)
-            )
-            continue
-        collector.calculate_daily_costs_for_day(date, forecast, plugins)
+    types = [get_plugin_type(plugin) for plugin in plugins]
+    try:
+        Collector().replace_plugins_costs(
+            date, BOTH_FORECASTS, plugins, types
+        )
+    except VerifiedDailyCostsExistsError:
+        logger.warning(
+            "Costs for {:%Y-%m-%d} are already accepted and won't be "
+            "recalculated.".format(date)
+        )
 
 
 def get_usages_for_save(pricing_service_usage):
@@ -545,4 +592,6 @@ def remove_previous_daily_usages(overwrite, date, usages_dp_objs):
                 previous_usages = previous_usages.filter(
                     daily_pricing_object__in=dp_objs
                 )
-            previous_usages.delete()
+            # delete without fetching every usage and sending signals -
+            # totals of usage type are refreshed instead
+            delete_daily_usages(previous_usages)
@@ -198,9 +198,90 @@ ASSET_MODEL_TYPE_RALPH_ID = 2  # data center
 
 ADDITIONAL_PRICING_OBJECT_TYPES = {}
 
+# default costs depth of pricing services (see `PricingService.costs_depth`):
+# if True, only first level of pricing services costs is saved as daily costs
+# (deeper costs are calculated on demand from hierarchies of pricing services
+# costs), otherwise the whole hierarchy is saved
 SAVE_ONLY_FIRST_DEPTH_COSTS = True
 DAILY_COST_CREATE_BATCH_SIZE = 10000
-SCROOGE_COSTS_MASTER_SLEEP = 1
+# if True, costs of every day recalculated by master job are saved (in
+# staging table) as soon as they're calculated and the whole period is
+# published at the end, instead of keeping all costs of period in memory
+DAILY_COSTS_STREAMING_SAVE = True
+# if True (and costs are saved in staging table - see above), every staged day
+# is checkpointed and costs are published only when all days of period are
+# calculated
+DAILY_COSTS_CHECKPOINTS = True
+# if True (and checkpoints are enabled), interrupted recalculation of the
+# same period is resumed (unless it's forced) - staged days are reused only if
+# their inputs were not changed, so fingerprint of inputs (see
+# `SKIP_UNCHANGED_DAYS`) is calculated for every day; it's enabled together
+# with `SKIP_UNCHANGED_DAYS` too
+DAILY_COSTS_RESUME = False
+# how recalculated costs are published: 'insert' (delete previous costs and
+# insert new ones in single transaction) or 'swap' (exchange subpartitions of
+# DailyCost table with shadow table filled with new costs; costs are inserted
+# when DailyCost table is not partitioned or period doesn't cover whole
+# subpartitions, ex. it's shorter than month with monthly partitions)
+DAILY_COSTS_PUBLISH_MODE = 'insert'
+# how long (in seconds) to wait for lock of DailyCost table held while costs
+# of period are replaced (MySQL only)
+DAILY_COSTS_LOCK_TIMEOUT = 3600
+# writer used to save daily costs: 'orm' (Django bulk_create) or 'raw'
+# (LOAD DATA LOCAL INFILE on MySQL - requires `'OPTIONS': {'local_infile': 1}`
+# in database settings, raw executemany on other backends)
+DAILY_COST_BULK_WRITER = 'orm'
+# skip (re)calculation of days, which inputs (usages, prices, costs etc.)
+# were not changed since last calculation (see
+# `ralph_scrooge.plugins.cost.fingerprint`); forced recalculation is never
+# skipped
+SKIP_UNCHANGED_DAYS = False
+# sum usages (ex. to calculate price of usage type defined by cost) using
+# daily usages totals instead of daily usages (see
+# `ralph_scrooge.utils.usage_totals`)
+USE_DAILY_USAGE_TOTALS = True
+# max time (in seconds) for which master job blocks waiting for notification
+# from any subtask (single day) before it checks all of them (notifications of
+# failed subtasks are not sent)
+SCROOGE_COSTS_MASTER_TIMEOUT = 30
+# recalculation of costs of period longer than this number of days is running
+# in batch lane (see `ralph_scrooge.utils.worker_job.WorkerJob.lane`), behind
+# interactive jobs (ex. reports)
+SCROOGE_COSTS_INTERACTIVE_MAX_DAYS = 7
+# max number of running jobs per job class name (overrides
+# `WorkerJob.max_running_jobs`, ex. {'MonthlyCosts': 1}); when limit is
+# reached, job is deferred until one of running jobs is finished
+SCROOGE_JOBS_MAX_RUNNING = {}
+# running job is refreshing its slot (see `SCROOGE_JOBS_MAX_RUNNING`) every
+# third of this number of seconds; slots not refreshed for that long (ex. of
+# jobs killed together with worker) are released
+SCROOGE_JOBS_HEARTBEAT_TIMEOUT = 60
+# number of processes calculating costs of days in parallel (when costs are
+# recalculated without RQ workers, ex. by `calculate_dailycosts` command)
+SCROOGE_COSTS_WORKERS = 1
+# max number of subtasks (shards of plugins - see
+# `Collector.get_plugins_shards`) calculating costs of single day in parallel,
+# when only single day is recalculated by master job (1 means no sharding)
+SCROOGE_COSTS_DAY_SHARDS = 1
+# max number of threads running independent cost plugins for single day
+# concurrently (1 means that plugins are run one by one, in fixed order)
+SCROOGE_COSTS_PLUGINS_CONCURRENCY = 1
+# zlib compression level of costs of single day passed from subtask to master
+# job (see `ralph_scrooge.plugins.cost.cost_tree.PackedCostTree`)
+COSTS_RESULT_COMPRESS_LEVEL = 1
+# if set, costs of single day are saved by subtask in file in this directory
+# and only path to it is passed to master job (subtasks and master have to
+# share this directory)
+COSTS_RESULT_SPILL_DIR = None
+# save profile (wall time, SQL queries, memory etc. of every cost plugin) of
+# every calculated day as `CostCalculationRun` (see
+# `ralph_scrooge.plugins.cost.profiling`) - disabled by default, since runs
+# are never removed (enable it only for time of profiling, see
+# `scrooge_costs_profile` command)
+SAVE_COSTS_CALCULATION_RUNS = False
+# max number of values cached in single calculation context (ex. costs
+# calculation for single day)
+CALCULATION_CONTEXT_MAX_SIZE = 100000
 
 TESTING = 'test' in sys.argv
 
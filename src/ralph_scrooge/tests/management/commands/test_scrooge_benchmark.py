@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from StringIO import StringIO
+
+from django.core.management import call_command
+
+from ralph_scrooge.models import DailyCost, Service
+from ralph_scrooge.tests import ScroogeTestCase
+
+
+class TestScroogeBenchmarkCommand(ScroogeTestCase):
+    def test_benchmark_is_rolled_back(self):
+        out = StringIO()
+        call_command(
+            'scrooge_benchmark',
+            '--services=3',
+            '--pricing-objects=1',
+            '--team=time=2',
+            '--stage=collector',
+            '--stage=save',
+            stdout=out,
+        )
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            [line.split('\t')[0] for line in lines],
+            ['stage', 'collector', 'save'],
+        )
+        self.assertFalse(Service.objects.exists())
+        self.assertFalse(DailyCost.objects.exists())
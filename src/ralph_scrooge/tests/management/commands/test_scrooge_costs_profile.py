@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+from datetime import date
+from StringIO import StringIO
+
+from django.core.management import call_command
+
+from ralph_scrooge.models import CostCalculationRun
+from ralph_scrooge.tests import ScroogeTestCase
+
+
+class TestScroogeCostsProfileCommand(ScroogeTestCase):
+    def setUp(self):
+        for day, times in [(10, (1.0, 3.0)), (11, (2.0, 0.5))]:
+            CostCalculationRun.objects.create(
+                date=date(2013, 10, day),
+                wall_time=sum(times),
+                plugins=json.dumps([
+                    {
+                        'name': name,
+                        'wall_time': time,
+                        'queries_count': 1,
+                        'queries_time': 0.1,
+                        'entries': 10,
+                        'rss_delta': 0,
+                    }
+                    for name, time in zip(['plugin1', 'plugin2'], times)
+                ]),
+            )
+
+    def _call(self, *args):
+        out = StringIO()
+        call_command('scrooge_costs_profile', *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    def test_slowest_plugins(self):
+        lines = self._call()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('2 runs in 6.50s'))
+        self.assertEqual(
+            [line.split('\t')[:3] for line in lines[2:]],
+            [['plugin2', '2', '3.50'], ['plugin1', '2', '3.00']],
+        )
+
+    def test_slowest_plugins_in_period(self):
+        lines = self._call('-s', '2013-10-11', '-n', '1')
+        self.assertEqual(lines[2].split('\t')[:3], ['plugin1', '1', '2.00'])
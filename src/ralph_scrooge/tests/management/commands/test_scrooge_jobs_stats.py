@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from StringIO import StringIO
+
+import mock
+from django.core.management import call_command
+
+from ralph_scrooge.tests import ScroogeTestCase
+
+
+class TestScroogeJobsStatsCommand(ScroogeTestCase):
+    @mock.patch(
+        'ralph_scrooge.management.commands.scrooge_jobs_stats.get_jobs_stats'
+    )
+    def test_jobs_stats(self, get_jobs_stats_mock):
+        get_jobs_stats_mock.return_value = (
+            OrderedDict([('scrooge_costs', 2), ('scrooge_report', 0)]),
+            OrderedDict([('MonthlyCosts', {
+                'running': 1,
+                'count': 2,
+                'wait_avg': 1.5,
+                'wait_median': 2.0,
+                'wait_max': 2.0,
+            })]),
+        )
+        out = StringIO()
+        call_command('scrooge_jobs_stats', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[1:3], ['scrooge_costs\t2', 'scrooge_report\t0'])
+        self.assertEqual(lines[-1], 'MonthlyCosts\t1\t1.50\t2.00\t2.00')
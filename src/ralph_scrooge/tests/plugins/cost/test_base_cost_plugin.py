@@ -19,6 +19,7 @@ from ralph_scrooge.tests.utils.factory import (
     UsageTypeFactory,
     WarehouseFactory,
 )
+from ralph_scrooge.utils.calculation_context import calculation_context
 
 
 class SampleCostPlugin(BaseCostPlugin):
@@ -428,3 +429,37 @@ class TestBaseCostPlugin(ScroogeTestCase):
                 'service_environment': self.service_environment4.id,
             },
         ])
+
+    @mock.patch.object(SampleCostPlugin, '_costs')
+    def test_costs_and_total_cost_of_service_environments(self, costs_mock):
+        se1, se2, se3 = [
+            self.service_environment1,
+            self.service_environment2,
+            self.service_environment3,
+        ]
+        costs_mock.return_value = {
+            se1.id: [{'cost': D(10)}, {'cost': D(5)}],
+            se2.id: [{'cost': D(3)}],
+            se3.id: [],
+        }
+        with calculation_context():
+            self.assertEqual(
+                self.plugin.costs(service_environments=[se1, se3]),
+                {se1.id: [{'cost': D(10)}, {'cost': D(5)}], se3.id: []},
+            )
+            self.assertEqual(
+                self.plugin.total_cost(service_environments=[se1, se3]),
+                D(15),
+            )
+            self.assertEqual(
+                self.plugin.total_cost(
+                    service_environments=[se2, self.service_environment4]
+                ),
+                D(3),
+            )
+            self.assertEqual(self.plugin.total_cost(), D(18))
+            self.assertEqual(
+                self.plugin.total_cost(service_environments=[]), 0
+            )
+        # costs are calculated (and indexed) once in calculation context
+        self.assertEqual(costs_mock.call_count, 1)
@@ -7,15 +7,41 @@ from __future__ import unicode_literals
 
 from datetime import date, timedelta
 from dateutil import rrule
+from decimal import Decimal as D
 import mock
 
+from django.test.utils import override_settings
 
+from ralph_scrooge.models import (
+    CostCalculationRun,
+    CostDateStatus,
+    CostRecalculationCheckpoint,
+    CostRecalculationRun,
+    DailyCost,
+    DailyCostStaging,
+    DailyPricingServiceCost,
+    DailyPricingServiceCostStaging,
+)
 from ralph_scrooge.tests import ScroogeTestCase
-from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.collector import (
+    BOTH_FORECASTS,
+    Collector,
+    VerifiedDailyCostsExistsError,
+)
+from ralph_scrooge.plugins.cost.cost_tree import CostTree
+from ralph_scrooge.plugins.cost.usages_snapshot import DailyUsagesSnapshot
+from ralph_scrooge.plugins.validations import DataForReportValidationError
 from ralph_scrooge.tests.utils.factory import (
     CostDateStatusFactory,
+    DailyCostFactory,
+    DailyUsageFactory,
+    PricingServiceFactory,
     ServiceEnvironmentFactory,
+    UsagePriceFactory,
+    UsageTypeFactory,
 )
+from ralph_scrooge.utils.costs_hierarchy import save_hierarchies
+from ralph_scrooge.utils.money import to_micro
 
 
 class TestCollector(ScroogeTestCase):
@@ -92,4 +118,388 @@ class TestCollector(ScroogeTestCase):
             ))
         process_mock.assert_has_calls(calls)
 
+    @mock.patch('ralph_scrooge.plugins.cost.collector.Collector.process')
+    def test_process_days_in_pool(self, process_mock):
+        def process(day, **kwargs):
+            if day == self.dates1[1]:
+                raise Exception()
+            return {day.day: []}
+        process_mock.side_effect = process
+        result = self.collector.calculate_days(
+            self.dates1,
+            False,
+            workers=3,
+        )
+        self.assertEqual(
+            sorted(result),
+            [
+                (day, day != self.dates1[1], (
+                    {day.day: []} if day != self.dates1[1] else None
+                ))
+                for day in self.dates1
+            ]
+        )
+
+    @mock.patch('ralph_scrooge.plugins.cost.collector.Collector.process')
+    def test_process_days_saves_validation_errors(self, process_mock):
+        def process(day, **kwargs):
+            if day == self.dates1[1]:
+                raise DataForReportValidationError('invalid', ['error'])
+            return {}
+        process_mock.side_effect = process
+        for workers in [None, 3]:
+            collector = Collector()
+            result = collector.calculate_days(
+                self.dates1, False, workers=workers, perform_validation=True,
+            )
+            self.assertEqual(
+                sorted((day, success) for day, success, _ in result),
+                [(day, day != self.dates1[1]) for day in self.dates1],
+            )
+            self.assertEqual(
+                collector.validation_errors, {self.dates1[1]: ['error']}
+            )
+
+    @mock.patch('ralph_scrooge.plugins.cost.collector.Collector.save_period_costs')  # noqa
+    @mock.patch('ralph_scrooge.plugins.cost.collector.Collector.process')
+    def test_process_days_with_save(self, process_mock, save_mock):
+        process_mock.return_value = {}
+        result = list(self.collector.process_days(
+            self.dates1[:2],
+            True,
+            save=True,
+        ))
+        self.assertEqual(result, [(day, True) for day in self.dates1[:2]])
+        save_mock.assert_has_calls([
+            mock.call(day, day, True, []) for day in self.dates1[:2]
+        ])
+
+    @override_settings(DAILY_COST_CREATE_BATCH_SIZE=2)
+    def test_stage_and_publish_costs(self):
+        base_usage1, base_usage2 = UsageTypeFactory.create_batch(2)
+        se1, se2 = self.service_environments
+        previous_cost = DailyCostFactory(
+            date=self.today,
+            service_environment=se1,
+            cost=100,
+        )
+        costs = {
+            se1.id: [{
+                'type_id': base_usage1.id,
+                'cost': D(10),
+                '_children': [{'type_id': base_usage2.id, 'cost': D(10)}],
+            }],
+            se2.id: [{'type_id': base_usage2.id, 'cost': D(5)}],
+        }
+        tomorrow = self.today + timedelta(days=1)
+        for day in (self.today, tomorrow):
+            self.assertEqual(
+                self.collector.stage_costs(day, costs, False),
+                3,
+            )
+        self.assertEqual(DailyCostStaging.objects.count(), 6)
+        # staged costs are not visible until they're published
+        self.assertEqual(
+            list(DailyCost.objects_tree.all()),
+            [previous_cost],
+        )
+
+        self.collector.publish_staged_costs(self.today, tomorrow, False)
+        self.assertEqual(DailyCostStaging.objects.count(), 0)
+        self.assertEqual(DailyCost.objects_tree.count(), 6)
+        self.assertEqual(
+            sorted(DailyCost.objects.filter(date=self.today).values_list(
+                'service_environment', 'type', 'cost', 'path',
+            )),
+            sorted([
+                (se1.id, base_usage1.id, D(10), str(base_usage1.id)),
+                (se2.id, base_usage2.id, D(5), str(base_usage2.id)),
+            ])
+        )
+        self.assertEqual(
+            DailyCost.objects_tree.get(depth=1, date=tomorrow).path,
+            '{}/{}'.format(base_usage1.id, base_usage2.id),
+        )
+        self.assertTrue(all(
+            status.calculated for status in CostDateStatus.objects.filter(
+                date__in=[self.today, tomorrow]
+            )
+        ))
+
+    def test_publish_staged_costs_with_hierarchies(self):
+        pricing_service = PricingServiceFactory()
+        usage_type = UsageTypeFactory()
+        se1 = self.service_environments[0]
+        save_hierarchies(self.today, False, {
+            pricing_service.id: ({pricing_service.id: (D(10), {
+                usage_type.id: (D(10), {}),
+            })}, 0),
+        })
+        self.collector.stage_costs(self.today, {
+            se1.id: [{'type_id': pricing_service.id, 'cost': D(10)}],
+        }, False)
+        # hierarchies are not visible until costs are published
+        self.assertFalse(DailyPricingServiceCost.objects.exists())
+
+        self.collector.publish_staged_costs(self.today, self.today, False)
+        self.assertFalse(DailyPricingServiceCostStaging.objects.exists())
+        self.assertEqual(
+            list(DailyPricingServiceCost.objects.values_list(
+                'pricing_service', 'date', 'cost',
+            )),
+            [(pricing_service.id, self.today, D(10))],
+        )
+
+    @mock.patch.object(Collector, 'process')
+    def test_replace_plugins_costs(self, process_mock):
+        usage_type1, usage_type2, usage_type3 = UsageTypeFactory.create_batch(
+            3
+        )
+        se1, se2 = self.service_environments
+        CostDateStatusFactory(
+            date=self.today, calculated=True, fingerprint='abc'
+        )
+        self.collector.save_period_costs(
+            self.today,
+            self.today,
+            False,
+            self.collector._create_daily_costs(self.today, {
+                se1.id: [
+                    {
+                        'type_id': usage_type1.id,
+                        'cost': D(10),
+                        '_children': [
+                            {'type_id': usage_type2.id, 'cost': D(10)},
+                        ],
+                    },
+                    {'type_id': usage_type2.id, 'cost': D(3)},
+                ],
+                se2.id: [{'type_id': usage_type3.id, 'cost': D(5)}],
+            }, False),
+        )
+        process_mock.return_value = {
+            se2.id: [{
+                'type_id': usage_type1.id,
+                'cost': D(7),
+                '_children': [{'type_id': usage_type3.id, 'cost': D(7)}],
+            }],
+        }
+        self.assertEqual(
+            self.collector.replace_plugins_costs(
+                self.today, False, [], [usage_type1]
+            ),
+            2,
+        )
+        self.assertEqual(
+            sorted(DailyCost.objects_tree.values_list(
+                'service_environment', 'path', 'cost',
+            )),
+            sorted([
+                (se1.id, str(usage_type2.id), D(3)),
+                (se2.id, str(usage_type3.id), D(5)),
+                (se2.id, str(usage_type1.id), D(7)),
+                (se2.id, '{}/{}'.format(usage_type1.id, usage_type3.id), D(7)),
+            ])
+        )
+        status = CostDateStatus.objects.get(date=self.today)
+        self.assertTrue(status.calculated)
+        self.assertEqual(status.fingerprint, '')
+
+    @mock.patch.object(Collector, 'process')
+    @mock.patch.object(Collector, 'process_dual')
+    def test_replace_plugins_costs_both_forecasts(
+        self, process_dual_mock, process_mock
+    ):
+        usage_type = UsageTypeFactory()
+        se1 = self.service_environments[0]
+        process_dual_mock.return_value = {
+            flag: {se1.id: [{'type_id': usage_type.id, 'cost': D(cost)}]}
+            for flag, cost in [(False, 2), (True, 3)]
+        }
+        self.assertEqual(
+            self.collector.replace_plugins_costs(
+                self.today, BOTH_FORECASTS, [], [usage_type]
+            ),
+            2,
+        )
+        process_dual_mock.assert_called_once_with(self.today, plugins=[])
+        self.assertFalse(process_mock.called)
+        self.assertEqual(
+            sorted(DailyCost.objects.values_list('forecast', 'cost')),
+            [(False, D(2)), (True, D(3))],
+        )
+
+    def test_process_dual(self):
+        usage_type = UsageTypeFactory(usage_type='BU')
+        UsagePriceFactory(
+            type=usage_type,
+            start=self.today,
+            end=self.today,
+            price=2,
+            forecast_price=3,
+        )
+        for service_environment in self.service_environments:
+            DailyUsageFactory(
+                date=self.today,
+                type=usage_type,
+                service_environment=service_environment,
+                value=10,
+            )
+        plugins = Collector._get_base_usage_types_plugins()
+        with mock.patch.object(
+            DailyUsagesSnapshot, 'load', wraps=DailyUsagesSnapshot.load
+        ) as load_mock:
+            result = self.collector.process_dual(self.today, plugins=plugins)
+        self.assertEqual(load_mock.call_count, 1)
+        self.assertEqual(list(result), [False, True])
+        for forecast, costs in result.items():
+            self.assertEqual(
+                costs.__getstate__(),
+                self.collector.process(
+                    self.today, forecast, plugins=plugins
+                ).__getstate__(),
+            )
+        self.assertEqual(sum(result[True].costs), to_micro(60))
+
+    @override_settings(SAVE_COSTS_CALCULATION_RUNS=True)
+    def test_process_saves_profile(self):
+        usage_type = UsageTypeFactory(usage_type='BU')
+        UsagePriceFactory(
+            type=usage_type, start=self.today, end=self.today, price=2,
+        )
+        for service_environment in self.service_environments:
+            DailyUsageFactory(
+                date=self.today,
+                type=usage_type,
+                service_environment=service_environment,
+                value=10,
+            )
+        plugins = Collector._get_base_usage_types_plugins()
+        costs = self.collector.process(self.today, False, plugins=plugins)
+        profile = self.collector.profiles[(self.today, False)]
+        self.assertEqual(profile.total.entries, len(costs))
+        self.assertEqual(
+            [(p.name, p.entries) for p in profile.plugins],
+            [(usage_type.name, 2)],
+        )
+        self.assertGreater(profile.total.queries.count, 0)
+        self.assertGreaterEqual(
+            profile.total.queries.count, profile.plugins[0].queries.count
+        )
+        run = CostCalculationRun.objects.get(date=self.today)
+        self.assertEqual(run.queries_count, profile.total.queries.count)
+        with override_settings(SAVE_COSTS_CALCULATION_RUNS=False):
+            self.collector.process(self.today, False, plugins=plugins)
+        self.assertEqual(CostCalculationRun.objects.count(), 1)
+
+    @mock.patch('ralph_scrooge.plugins.cost.collector.get_fingerprint')
+    def test_resume_recalculation(self, get_fingerprint_mock):
+        get_fingerprint_mock.side_effect = lambda day, plugins: str(day.day)
+        usage_type = UsageTypeFactory()
+        tomorrow = self.today + timedelta(days=1)
+        costs = {
+            self.service_environments[0].id: [
+                {'type_id': usage_type.id, 'cost': D(10)},
+            ],
+        }
+        run, resumed = self.collector.start_recalculation(
+            self.today, tomorrow, False, [self.today, tomorrow]
+        )
+        self.assertEqual(resumed, [])
+        for day in (self.today, tomorrow):
+            self.collector.get_fingerprint(day, False)
+            self.collector.stage_costs(day, costs, False)
+            self.collector.checkpoint(run, day, False)
+        # inputs of tomorrow were changed in the meantime
+        get_fingerprint_mock.side_effect = lambda day, plugins: (
+            str(day.day) if day == self.today else 'changed'
+        )
+        collector = Collector()
+        resumed_run, resumed = collector.start_recalculation(
+            self.today, tomorrow, False, [self.today, tomorrow]
+        )
+        self.assertEqual(resumed_run, run)
+        self.assertEqual(resumed, [self.today])
+        self.assertEqual(
+            list(run.checkpoints.values_list('date', flat=True)),
+            [self.today],
+        )
+        self.assertEqual(
+            list(DailyCostStaging.objects.values_list('date', flat=True)),
+            [self.today],
+        )
+        collector.finish_recalculation(run)
+        # finished run is not resumed
+        new_run, resumed = collector.start_recalculation(
+            self.today, tomorrow, False, [self.today, tomorrow]
+        )
+        self.assertNotEqual(new_run, run)
+        self.assertEqual(resumed, [])
+        self.assertEqual(DailyCostStaging.objects.count(), 0)
+        self.assertEqual(CostRecalculationRun.objects.count(), 2)
+        self.assertEqual(CostRecalculationCheckpoint.objects.count(), 1)
+
+    def test_start_recalculation_without_resume(self):
+        usage_type = UsageTypeFactory()
+        costs = {
+            self.service_environments[0].id: [
+                {'type_id': usage_type.id, 'cost': D(10)},
+            ],
+        }
+        run, resumed = self.collector.start_recalculation(
+            self.today, self.today, False, [self.today]
+        )
+        self.collector.get_fingerprint(self.today, False)
+        self.collector.stage_costs(self.today, costs, False)
+        self.collector.checkpoint(run, self.today, False)
+        new_run, resumed = Collector().start_recalculation(
+            self.today, self.today, False, [self.today], resume=False
+        )
+        # unfinished run is dropped together with its staged costs
+        self.assertNotEqual(new_run, run)
+        self.assertEqual(resumed, [])
+        self.assertEqual(list(CostRecalculationRun.objects.all()), [new_run])
+        self.assertEqual(CostRecalculationCheckpoint.objects.count(), 0)
+        self.assertEqual(DailyCostStaging.objects.count(), 0)
+
+    def test_process_dual_skips_accepted_costs(self):
+        CostDateStatusFactory(date=self.today, accepted=True)
+        with mock.patch.object(Collector, '_run_plugins') as run_plugins_mock:
+            run_plugins_mock.return_value = CostTree()
+            self.assertEqual(
+                list(self.collector.process_dual(self.today, plugins=[])),
+                [True],
+            )
+        CostDateStatus.objects.update(forecast_accepted=True)
+        with self.assertRaises(VerifiedDailyCostsExistsError):
+            self.collector.process_dual(self.today, plugins=[])
+
+    @mock.patch.object(Collector, 'process_dual')
+    def test_process_days_both_forecasts(self, process_dual_mock):
+        usage_type = UsageTypeFactory()
+        se1 = self.service_environments[0]
+        process_dual_mock.return_value = {
+            False: {se1.id: [{'type_id': usage_type.id, 'cost': D(1)}]},
+            True: {se1.id: [{'type_id': usage_type.id, 'cost': D(2)}]},
+        }
+        self.assertEqual(
+            list(self.collector.process_days(
+                [self.today], BOTH_FORECASTS, save=True, plugins=[],
+            )),
+            [(self.today, True)],
+        )
+        self.assertEqual(
+            sorted(DailyCost.objects.values_list('forecast', 'cost')),
+            [(False, D(1)), (True, D(2))],
+        )
+        status = CostDateStatus.objects.get(date=self.today)
+        self.assertTrue(status.calculated)
+        self.assertTrue(status.forecast_calculated)
+        self.assertEqual(
+            self.collector._get_dates(
+                self.today, self.today, BOTH_FORECASTS, False
+            ),
+            [],
+        )
+
     # TODO: add more unit tests
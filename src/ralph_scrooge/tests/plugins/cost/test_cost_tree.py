@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import pickle
+import shutil
+import tempfile
+from datetime import date
+from decimal import Decimal as D
+
+from django.test.utils import override_settings
+
+from ralph_scrooge.models import DailyCost
+from ralph_scrooge.plugins.cost.cost_tree import (
+    as_cost_tree,
+    CostTree,
+    pack_cost_tree,
+    PackedCostTree,
+    unpack_cost_tree,
+)
+from ralph_scrooge.tests import ScroogeTestCase
+from ralph_scrooge.tests.utils.factory import UsageTypeFactory
+
+
+class TestCostTree(ScroogeTestCase):
+    def setUp(self):
+        self.usage_type = UsageTypeFactory()
+        self.today = date(2013, 10, 10)
+        self.costs = {
+            1: [
+                {
+                    'type': self.usage_type,
+                    'cost': D('10.5'),
+                    'value': 3,
+                    '_children': [
+                        {'type_id': 2, 'cost': D(4), 'pricing_object_id': 7},
+                        {
+                            'type_id': 3,
+                            'cost': D('6.5'),
+                            'warehouse_id': 5,
+                            '_children': [{'type_id': 4, 'cost': D(1)}],
+                        },
+                    ],
+                },
+            ],
+            2: [
+                {'type_id': 2, 'cost': D(3)},
+                # costs equal to 0 are skipped (with their children)
+                {
+                    'type_id': 3,
+                    'cost': D(0),
+                    '_children': [{'type_id': 4, 'cost': D(1)}],
+                },
+            ],
+        }
+
+    def test_from_legacy(self):
+        tree = CostTree.from_legacy(self.costs)
+        self.assertEqual(len(tree), 7)
+        self.assertEqual(
+            list(tree.service_environments), [1, 1, 1, 1, 2, 2, 2]
+        )
+        self.assertEqual(
+            list(tree.types),
+            [self.usage_type.id, 2, 3, 4, 2, 3, 4],
+        )
+        self.assertEqual(list(tree.parents), [-1, 0, 0, 2, -1, -1, 5])
+        self.assertEqual(list(tree.depths), [0, 1, 1, 2, 0, 0, 1])
+        self.assertEqual(list(tree.pricing_objects), [0, 7, 0, 0, 0, 0, 0])
+        self.assertEqual(tree.costs[0], 10500000)
+
+    def test_iter_rows_is_equal_to_build_tree(self):
+        expected = []
+        for service_environment, se_costs in self.costs.items():
+            expected.extend(DailyCost._build_tree(
+                tree=se_costs,
+                date=self.today,
+                service_environment_id=service_environment,
+                forecast=True,
+            ))
+        rows = list(
+            CostTree.from_legacy(self.costs).iter_rows(self.today, True)
+        )
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(sorted(rows), sorted(expected))
+
+    def test_iter_rows_keeps_missing_and_sub_micro_costs(self):
+        # only costs passed as 0 are skipped (as in `DailyCost._build_tree`)
+        costs = [
+            {
+                'type_id': 2,
+                '_children': [{'type_id': 3, 'cost': D('0.0000001')}],
+            },
+            {'type_id': 4, 'cost': 0, '_children': [{'type_id': 5}]},
+            {'type_id': 6, 'cost': -0.0000004},
+        ]
+        expected = DailyCost._build_tree(
+            tree=costs,
+            date=self.today,
+            service_environment_id=1,
+            forecast=False,
+        )
+        rows = list(
+            CostTree.from_legacy({1: costs}).iter_rows(self.today, False)
+        )
+        self.assertEqual(
+            [(row.path, row.depth) for row in rows],
+            [(row.path, row.depth) for row in expected],
+        )
+        self.assertEqual([row.path for row in rows], ['2', '2/3', '6'])
+        self.assertEqual([row.cost for row in rows], [0, 0, 0])
+
+    def test_to_legacy(self):
+        tree = CostTree.from_legacy(self.costs)
+        self.assertEqual(
+            CostTree.from_legacy(tree.to_legacy()).__getstate__(),
+            tree.__getstate__(),
+        )
+        self.assertEqual(tree.to_legacy()[1][0]['_children'][0], {
+            'type_id': 2,
+            'cost': D(4),
+            'value': 0,
+            'pricing_object_id': 7,
+        })
+        # missing cost is not added
+        tree.append(3, 2)
+        self.assertEqual(tree.to_legacy()[3], [{'type_id': 2, 'value': 0}])
+
+    def test_merge(self):
+        tree = CostTree.from_legacy({1: self.costs[1]})
+        tree.merge(CostTree.from_legacy({2: self.costs[2]}))
+        self.assertEqual(
+            tree.__getstate__(),
+            CostTree.from_legacy(self.costs).__getstate__(),
+        )
+
+    def test_pickle(self):
+        tree = CostTree.from_legacy(self.costs)
+        self.assertEqual(
+            pickle.loads(pickle.dumps(tree)).__getstate__(),
+            tree.__getstate__(),
+        )
+
+    def test_as_cost_tree(self):
+        tree = CostTree()
+        self.assertIs(as_cost_tree(tree), tree)
+        self.assertEqual(len(as_cost_tree({})), 0)
+        self.assertEqual(len(as_cost_tree(self.costs)), 7)
+
+    def test_pack(self):
+        tree = CostTree.from_legacy(self.costs)
+        tree.append(1, 2, cost=D('12345678.123456'), pricing_object_id=2 ** 40)
+        unpacked = unpack_cost_tree(pack_cost_tree(tree))
+        self.assertEqual(unpacked.__getstate__(), tree.__getstate__())
+        self.assertEqual(
+            unpack_cost_tree(pack_cost_tree(CostTree())).__getstate__(),
+            CostTree().__getstate__(),
+        )
+
+    def test_pack_invalid_data(self):
+        with self.assertRaises(ValueError):
+            unpack_cost_tree(b'XXX' + pack_cost_tree(CostTree())[3:])
+
+    def test_packed_cost_tree(self):
+        tree = CostTree.from_legacy(self.costs)
+        packed = pickle.loads(pickle.dumps(PackedCostTree.pack(self.costs)))
+        self.assertEqual(len(packed), 7)
+        self.assertEqual(
+            as_cost_tree(packed).__getstate__(), tree.__getstate__()
+        )
+
+    def test_packed_cost_tree_spill(self):
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir)
+        tree = CostTree.from_legacy(self.costs)
+        with override_settings(COSTS_RESULT_SPILL_DIR=spill_dir):
+            packed = PackedCostTree.pack(tree)
+        self.assertIsNone(packed.data)
+        self.assertTrue(os.path.exists(packed.path))
+        path = packed.path
+        self.assertEqual(packed.unpack().__getstate__(), tree.__getstate__())
+        # file is removed when it's read
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(packed.unpack().__getstate__(), tree.__getstate__())
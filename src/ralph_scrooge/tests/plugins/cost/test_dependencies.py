@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from datetime import date
+
+from ralph_scrooge.models import PricingServicePlugin
+from ralph_scrooge.plugins.cost.dependencies import (
+    CostsDependencyIndex,
+    get_plugin_type,
+)
+from ralph_scrooge.tests import ScroogeTestCase
+from ralph_scrooge.tests.utils.factory import (
+    DailyUsageFactory,
+    DynamicExtraCostDivisionFactory,
+    PricingServiceFactory,
+    ServiceEnvironmentFactory,
+    ServiceUsageTypesFactory,
+    TeamFactory,
+    UsageTypeFactory,
+)
+from ralph_scrooge.utils.common import AttributeDict
+
+
+def _plugin(name, **kwargs):
+    return AttributeDict(name=name, plugin_name=name, plugin_kwargs=kwargs)
+
+
+class TestCostsDependencyIndex(ScroogeTestCase):
+    def setUp(self):
+        self.today = date(2014, 10, 10)
+        # ps1 (fixed price) is charging ps2 (by service usage type)
+        self.ps1 = PricingServiceFactory(
+            plugin_type=(
+                PricingServicePlugin.pricing_service_fixed_price_plugin.id
+            ),
+        )
+        self.ps2 = PricingServiceFactory()
+        self.ps3 = PricingServiceFactory()
+        self.service_usage_type = UsageTypeFactory(usage_type='SU')
+        ServiceUsageTypesFactory(
+            usage_type=self.service_usage_type,
+            pricing_service=self.ps1,
+            start=date(2014, 10, 1),
+            end=date(2014, 10, 30),
+        )
+        self.se2 = ServiceEnvironmentFactory(
+            service__pricing_service=self.ps2
+        )
+        self.se3 = ServiceEnvironmentFactory(
+            service__pricing_service=self.ps3
+        )
+        DailyUsageFactory(
+            date=self.today,
+            type=self.service_usage_type,
+            service_environment=self.se2,
+        )
+        self.base_usage_type = UsageTypeFactory(usage_type='BU')
+        self.cores_usage_type = UsageTypeFactory(symbol='physical_cpu_cores')
+        self.division = DynamicExtraCostDivisionFactory()
+        self.team = TeamFactory()
+        self.plugins = [
+            _plugin('bu', usage_type=self.base_usage_type),
+            _plugin('team', team=self.team),
+            _plugin(
+                'dynamic',
+                dynamic_extra_cost_type=self.division.dynamic_extra_cost_type,
+            ),
+            _plugin('support'),
+            _plugin('ps1', pricing_service=self.ps1),
+            _plugin('ps2', pricing_service=self.ps2),
+            _plugin('ps3', pricing_service=self.ps3),
+        ]
+        self.index = CostsDependencyIndex(self.today, self.plugins)
+
+    def _get_affected_plugins(self, usage_types):
+        return [
+            plugin.name
+            for plugin in self.index.get_affected_plugins(usage_types)
+        ]
+
+    def test_service_usage_type(self):
+        self.assertEqual(
+            self._get_affected_plugins([self.service_usage_type]),
+            ['ps1', 'ps2'],
+        )
+
+    def test_base_usage_type(self):
+        self.assertEqual(
+            self._get_affected_plugins([self.base_usage_type]),
+            ['bu'],
+        )
+        self.index.add_usages(self.base_usage_type, [self.se3])
+        self.assertEqual(
+            self._get_affected_plugins([self.base_usage_type]),
+            ['bu', 'ps3'],
+        )
+
+    def test_usage_types_distributing_other_costs(self):
+        self.assertEqual(
+            self._get_affected_plugins([self.cores_usage_type]),
+            ['team', 'ps1', 'ps2', 'ps3'],
+        )
+        self.assertEqual(
+            self._get_affected_plugins([self.division.usage_type]),
+            ['dynamic', 'ps1', 'ps2', 'ps3'],
+        )
+
+    def test_get_plugin_type(self):
+        self.assertEqual(
+            [get_plugin_type(plugin) for plugin in self.plugins],
+            [
+                self.base_usage_type,
+                self.team,
+                self.division.dynamic_extra_cost_type,
+                None,
+                self.ps1,
+                self.ps2,
+                self.ps3,
+            ],
+        )
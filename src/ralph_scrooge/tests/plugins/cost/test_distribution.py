@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from decimal import Decimal as D
+
+from ralph_scrooge.plugins.cost.distribution import (
+    distribute_hierarchy,
+    FlatHierarchy,
+    get_hierarchy_depth,
+    get_share_factor,
+)
+from ralph_scrooge.tests import ScroogeTestCase
+
+
+class TestDistribution(ScroogeTestCase):
+    def setUp(self):
+        self.hierarchy = OrderedDict([
+            (1, (D(100), OrderedDict([
+                (2, (D(60), {})),
+                (3, (D(40), OrderedDict([
+                    (4, (D(40), {})),
+                ]))),
+            ]))),
+            (5, (D(30), {})),
+        ])
+
+    def test_flat_hierarchy(self):
+        flat = FlatHierarchy(self.hierarchy)
+        self.assertEqual(len(flat), 5)
+        self.assertEqual(flat.types, [1, 2, 3, 4, 5])
+        self.assertEqual(
+            flat.costs,
+            [100000000, 60000000, 40000000, 40000000, 30000000],
+        )
+        self.assertEqual(flat.parents, [-1, 0, 0, 2, -1])
+        self.assertEqual(flat.depths, [0, 1, 1, 2, 0])
+
+    def test_flat_hierarchy_without_children(self):
+        flat = FlatHierarchy(self.hierarchy, with_children=False)
+        self.assertEqual(flat.types, [1, 5])
+        self.assertEqual(flat.parents, [-1, -1])
+
+    def test_flat_hierarchy_with_max_depth(self):
+        flat = FlatHierarchy(self.hierarchy, max_depth=1)
+        self.assertEqual(flat.types, [1, 2, 3, 5])
+        self.assertEqual(flat.parents, [-1, 0, 0, -1])
+
+    def test_get_hierarchy_depth(self):
+        self.assertEqual(get_hierarchy_depth(self.hierarchy), 2)
+        self.assertEqual(get_hierarchy_depth({5: (D(30), {})}), 0)
+
+    def test_get_share_factor(self):
+        # 10/40 * 30% + 20/40 * 70%
+        self.assertEqual(
+            get_share_factor([(10, 40, 30), (20, 40, 70)]),
+            D('0.425'),
+        )
+
+    def test_get_share_factor_with_zero_total(self):
+        self.assertEqual(get_share_factor([(10, 40, 30), (0, 0, 70)]), D(0))
+
+    def test_distribute_hierarchy(self):
+        result = distribute_hierarchy(
+            [(11, [(10, 40, 50), (20, 40, 50)])],
+            FlatHierarchy(self.hierarchy),
+        )
+        self.assertEqual(result, [[
+            {
+                'type_id': 1,
+                'pricing_object_id': 11,
+                'cost': D('37.5'),
+                '_children': [
+                    {'type_id': 2, 'pricing_object_id': 11, 'cost': D('22.5')},
+                    {
+                        'type_id': 3,
+                        'pricing_object_id': 11,
+                        'cost': D('15'),
+                        '_children': [
+                            {
+                                'type_id': 4,
+                                'pricing_object_id': 11,
+                                'cost': D('15'),
+                            },
+                        ],
+                    },
+                ],
+            },
+            {'type_id': 5, 'pricing_object_id': 11, 'cost': D('11.25')},
+        ]])
+
+    def test_distribute_hierarchy_with_single_usage_type(self):
+        result = distribute_hierarchy(
+            [(11, [(1, 3, 100)]), (12, [(2, 3, 100)])],
+            FlatHierarchy(self.hierarchy, with_children=False),
+        )
+        self.assertEqual(result, [
+            [
+                {
+                    'type_id': 1,
+                    'pricing_object_id': 11,
+                    'cost': D('33.333333'),
+                    'value': 1,
+                },
+                {
+                    'type_id': 5,
+                    'pricing_object_id': 11,
+                    'cost': D('10'),
+                    'value': 1,
+                },
+            ],
+            [
+                {
+                    'type_id': 1,
+                    'pricing_object_id': 12,
+                    'cost': D('66.666667'),
+                    'value': 2,
+                },
+                {
+                    'type_id': 5,
+                    'pricing_object_id': 12,
+                    'cost': D('20'),
+                    'value': 2,
+                },
+            ],
+        ])
+
+    def test_distribute_hierarchy_is_conservative(self):
+        pricing_objects_usages = [(i, [(1, 7, 100)]) for i in range(7)]
+        result = distribute_hierarchy(
+            pricing_objects_usages,
+            FlatHierarchy(self.hierarchy, with_children=False),
+        )
+        self.assertEqual(
+            sum(costs[0]['cost'] for costs in result),
+            D(100),
+        )
+        self.assertEqual(
+            set(costs[0]['cost'] for costs in result),
+            set([D('14.285714'), D('14.285715')]),
+        )
@@ -61,3 +61,27 @@ class TestExtraCostPlugin(ScroogeTestCase):
                 }
             ]
         })
+
+    def test_costs_are_conservative(self):
+        service_environment = ServiceEnvironmentFactory()
+        models.ExtraCost(
+            extra_cost_type=self.extra_cost_type,
+            start=date(2013, 11, 1),
+            end=date(2013, 11, 3),
+            service_environment=service_environment,
+            cost=100,
+            forecast_cost=100,
+        ).save()
+        daily_costs = [
+            ExtraCostPlugin.costs(
+                date=date(2013, 11, day),
+                extra_cost_type=self.extra_cost_type,
+                forecast=False,
+            )[service_environment.id][0]['cost']
+            for day in (1, 2, 3)
+        ]
+        self.assertEqual(
+            daily_costs,
+            [D('33.333334'), D('33.333333'), D('33.333333')],
+        )
+        self.assertEqual(sum(daily_costs), D(100))
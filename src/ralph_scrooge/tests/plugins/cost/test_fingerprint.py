@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from datetime import date
+
+import mock
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from ralph_scrooge.models import (
+    CostDateStatus,
+    PRICING_OBJECT_TYPES,
+    TeamBillingType,
+)
+from ralph_scrooge.plugins.cost.collector import BOTH_FORECASTS, Collector
+from ralph_scrooge.plugins.cost.fingerprint import get_fingerprint, INPUTS
+from ralph_scrooge.tests import ScroogeTestCase
+from ralph_scrooge.tests.utils.factory import (
+    CostDateStatusFactory,
+    DailyPricingObjectFactory,
+    DailyUsageFactory,
+    PricingObjectFactory,
+    ServiceEnvironmentFactory,
+    TeamCostFactory,
+    TeamFactory,
+    UsagePriceFactory,
+    UsageTypeFactory,
+)
+from ralph_scrooge.utils.common import AttributeDict
+
+
+class TestFingerprint(ScroogeTestCase):
+    def setUp(self):
+        self.today = date(2014, 10, 10)
+        self.tomorrow = date(2014, 10, 11)
+        self.usage_price = UsagePriceFactory(price=10)
+        self.plugins = [
+            AttributeDict(name='UsageType1', plugin_name='usage_plugin'),
+        ]
+        self.collector = Collector()
+
+    def test_fingerprint_is_changed_with_inputs(self):
+        fingerprint = get_fingerprint(self.today, self.plugins)
+        self.assertEqual(
+            get_fingerprint(self.today, self.plugins),
+            fingerprint,
+        )
+        usage = DailyUsageFactory(date=self.today, value=10)
+        fingerprint2 = get_fingerprint(self.today, self.plugins)
+        self.assertNotEqual(fingerprint2, fingerprint)
+        usage.value = 20
+        usage.save()
+        fingerprint3 = get_fingerprint(self.today, self.plugins)
+        self.assertNotEqual(fingerprint3, fingerprint2)
+        self.usage_price.price = 20
+        self.usage_price.save()
+        self.assertNotEqual(
+            get_fingerprint(self.today, self.plugins),
+            fingerprint3,
+        )
+
+    def test_fingerprint_is_changed_with_foreign_keys(self):
+        usage = DailyUsageFactory(date=self.today, value=10)
+        fingerprint = get_fingerprint(self.today, self.plugins)
+        # the same value, usage moved to another service environment
+        usage.service_environment = ServiceEnvironmentFactory()
+        usage.save()
+        fingerprint2 = get_fingerprint(self.today, self.plugins)
+        self.assertNotEqual(fingerprint2, fingerprint)
+        # swapped prices of usage types
+        price2 = UsagePriceFactory(
+            start=self.usage_price.start, end=self.usage_price.end, price=20
+        )
+        fingerprint3 = get_fingerprint(self.today, self.plugins)
+        price2.type, self.usage_price.type = self.usage_price.type, price2.type
+        price2.save()
+        self.usage_price.save()
+        self.assertNotEqual(
+            get_fingerprint(self.today, self.plugins),
+            fingerprint3,
+        )
+
+    def test_fingerprint_is_changed_with_configuration(self):
+        team = TeamFactory()
+        fingerprint = get_fingerprint(self.today, self.plugins)
+        team.billing_type = TeamBillingType.assets
+        team.save()
+        fingerprint2 = get_fingerprint(self.today, self.plugins)
+        self.assertNotEqual(fingerprint2, fingerprint)
+        team.excluded_services.add(ServiceEnvironmentFactory().service)
+        self.assertNotEqual(
+            get_fingerprint(self.today, self.plugins),
+            fingerprint2,
+        )
+
+    def test_fingerprint_is_changed_with_small_change_of_big_usage(self):
+        DailyUsageFactory(date=self.today, value=10 ** 12)
+        usage = DailyUsageFactory(date=self.today, value=10 ** 12)
+        fingerprint = get_fingerprint(self.today, self.plugins)
+        usage.value += 0.5
+        usage.save()
+        self.assertNotEqual(
+            get_fingerprint(self.today, self.plugins),
+            fingerprint,
+        )
+
+    def test_fingerprint_is_changed_with_plugins(self):
+        self.assertNotEqual(
+            get_fingerprint(self.today, self.plugins),
+            get_fingerprint(self.today, self.plugins[:0]),
+        )
+
+    def test_fingerprint_of_other_day_is_not_changed(self):
+        # daily usage (and configuration - ex. its usage type) is created
+        # before fingerprint is calculated
+        usage = DailyUsageFactory(date=self.today, value=10)
+        fingerprint = get_fingerprint(self.tomorrow, self.plugins)
+        usage.value = 20
+        usage.save()
+        self.assertEqual(
+            get_fingerprint(self.tomorrow, self.plugins),
+            fingerprint,
+        )
+
+    def test_fingerprint_is_aggregated_in_database(self):
+        DailyUsageFactory.create_batch(3, date=self.today)
+        with CaptureQueriesContext(connection) as queries:
+            get_fingerprint(self.today, self.plugins)
+        # single query per input and queries of periods of prices and costs
+        self.assertEqual(len(queries), len(INPUTS) + 2)
+
+    def test_fingerprint_is_changed_with_usages_of_price_period(self):
+        usage_type = UsageTypeFactory(by_cost=True)
+        UsagePriceFactory(type=usage_type, cost=100)
+        usage = DailyUsageFactory(
+            date=self.tomorrow, type=usage_type, value=10
+        )
+        fingerprint = get_fingerprint(self.today, self.plugins)
+        # price of usage type (for every day of period) depends on usages of
+        # the whole period
+        usage.value = 20
+        usage.save()
+        self.assertNotEqual(
+            get_fingerprint(self.today, self.plugins),
+            fingerprint,
+        )
+
+    def test_fingerprint_is_changed_with_assets_of_team_cost_period(self):
+        TeamCostFactory(
+            team=TeamFactory(billing_type=TeamBillingType.assets),
+            start=self.today,
+            end=self.tomorrow,
+        )
+        fingerprint = get_fingerprint(self.today, self.plugins)
+        DailyPricingObjectFactory(
+            date=self.tomorrow,
+            pricing_object=PricingObjectFactory(
+                type_id=PRICING_OBJECT_TYPES.ASSET.id
+            ),
+        )
+        self.assertNotEqual(
+            get_fingerprint(self.today, self.plugins),
+            fingerprint,
+        )
+
+    @mock.patch('ralph_scrooge.plugins.cost.collector.get_fingerprint')
+    def test_fingerprint_calculated_once_for_both_forecasts(
+        self, get_fingerprint_mock
+    ):
+        get_fingerprint_mock.return_value = 'abc'
+        days = [self.today, self.tomorrow]
+        self.collector.get_unchanged_days(days, BOTH_FORECASTS, self.plugins)
+        self.assertEqual(get_fingerprint_mock.call_count, 2)
+        self.assertEqual(self.collector.get_fingerprint(
+            self.today, True, self.plugins
+        ), 'abc')
+        self.assertEqual(get_fingerprint_mock.call_count, 2)
+
+    def test_get_unchanged_days(self):
+        CostDateStatusFactory(
+            date=self.today,
+            calculated=True,
+            fingerprint=get_fingerprint(self.today, self.plugins),
+        )
+        CostDateStatusFactory(
+            date=self.tomorrow,
+            calculated=True,
+            fingerprint='abc',
+        )
+        days = [self.today, self.tomorrow, date(2014, 10, 12)]
+        unchanged = self.collector.get_unchanged_days(
+            days, False, self.plugins
+        )
+        self.assertEqual(list(unchanged), [self.today])
+        self.assertIn('inputs not changed', unchanged[self.today])
+        self.assertEqual(self.collector.skipped_days, unchanged)
+        # forecast costs were not calculated
+        self.assertEqual(
+            self.collector.get_unchanged_days(days, True, self.plugins),
+            {},
+        )
+
+    @override_settings(SKIP_UNCHANGED_DAYS=True)
+    @mock.patch.object(Collector, 'process')
+    def test_process_days_skips_unchanged_days(self, process_mock):
+        process_mock.return_value = {}
+        days = [self.today, self.tomorrow]
+        usage = DailyUsageFactory(date=self.tomorrow, value=10)
+        result = list(self.collector.process_days(
+            days, False, save=True, plugins=self.plugins
+        ))
+        self.assertEqual(result, [(day, True) for day in days])
+        self.assertEqual(
+            CostDateStatus.objects.get(date=self.today).fingerprint,
+            get_fingerprint(self.today, self.plugins),
+        )
+
+        usage.value = 20
+        usage.save()
+        collector = Collector()
+        result = list(collector.process_days(
+            days, False, save=True, plugins=self.plugins
+        ))
+        self.assertEqual(result, [(self.tomorrow, True)])
+        self.assertEqual(list(collector.skipped_days), [self.today])
+        self.assertEqual(process_mock.call_count, 3)
+
+    @override_settings(SKIP_UNCHANGED_DAYS=True)
+    @mock.patch.object(Collector, 'process')
+    def test_process_days_forced_recalculation_is_not_skipped(
+        self, process_mock
+    ):
+        process_mock.return_value = {}
+        list(self.collector.process_days(
+            [self.today], False, save=True, plugins=self.plugins
+        ))
+        collector = Collector()
+        result = list(collector.process_days(
+            [self.today], False, save=True, force=True, plugins=self.plugins
+        ))
+        self.assertEqual(result, [(self.today, True)])
+        self.assertEqual(collector.skipped_days, {})
+        self.assertEqual(process_mock.call_count, 2)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from datetime import date
+from decimal import Decimal as D
+import mock
+from multiprocessing.pool import ThreadPool
+
+from django.test.utils import override_settings
+
+from ralph_scrooge.models import ServiceUsageTypes
+from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.cost_tree import CostTree
+from ralph_scrooge.plugins.cost.pricing_service import PricingServicePlugin
+from ralph_scrooge.plugins.cost.pricing_service_engine import (
+    activate,
+    get_active_engine,
+    PricingServicesEngine,
+)
+from ralph_scrooge.plugins.cost.usage_type import UsageTypePlugin
+from ralph_scrooge.tests import ScroogeTestCase
+from ralph_scrooge.tests.utils.factory import (
+    DailyUsageFactory,
+    PricingServiceFactory,
+    ServiceEnvironmentFactory,
+    UsageTypeFactory,
+)
+from ralph_scrooge.utils.common import AttributeDict
+
+
+class TestPricingServicesEngine(ScroogeTestCase):
+    def setUp(self):
+        self.today = date(2014, 10, 11)
+        self.se1, self.se2 = ServiceEnvironmentFactory.create_batch(2)
+        # ps2 is charging ps1 (services of ps1 are using ps2)
+        self.ps1 = PricingServiceFactory()
+        self.ps1.services.add(self.se1.service)
+        self.ps2 = PricingServiceFactory()
+        self.ps2.services.add(self.se2.service)
+        self.usage_type = UsageTypeFactory()
+        ServiceUsageTypes.objects.create(
+            usage_type=self.usage_type,
+            pricing_service=self.ps2,
+            start=date.min,
+            end=date.max,
+        )
+        DailyUsageFactory(
+            type=self.usage_type,
+            service_environment=self.se1,
+            date=self.today,
+        )
+        self.engine = PricingServicesEngine(self.today, False)
+
+    def test_get_pricing_services_order(self):
+        self.assertEqual(
+            self.engine.get_pricing_services_order(),
+            [self.ps2.id, self.ps1.id],
+        )
+
+    def test_get_or_calculate(self):
+        func = mock.Mock(return_value=10)
+        self.assertEqual(self.engine.get_or_calculate('a', func, 1, b=2), 10)
+        self.assertEqual(self.engine.get_or_calculate('a', func, 1, b=2), 10)
+        func.assert_called_once_with(1, b=2)
+        self.assertIn('a', self.engine)
+
+    def test_get_active_engine(self):
+        self.assertIsNone(get_active_engine(self.today, False))
+        with activate(self.engine):
+            self.assertIs(get_active_engine(self.today, False), self.engine)
+            self.assertIsNone(get_active_engine(self.today, True))
+            self.assertIsNone(get_active_engine(date(2014, 10, 10), False))
+        self.assertIsNone(get_active_engine(self.today, False))
+
+    @mock.patch.object(type(PricingServicePlugin), '_calculate_costs')
+    def test_costs_calculated_once(self, calculate_costs_mock):
+        calculate_costs_mock.return_value = {}
+        with activate(self.engine):
+            for i in range(3):
+                PricingServicePlugin._costs(
+                    pricing_service=self.ps2,
+                    date=self.today,
+                )
+        self.assertEqual(calculate_costs_mock.call_count, 1)
+
+    @mock.patch.object(type(PricingServicePlugin), '_calculate_costs')
+    def test_costs_calculated_every_time_without_engine(
+        self, calculate_costs_mock
+    ):
+        calculate_costs_mock.return_value = {}
+        for i in range(3):
+            PricingServicePlugin._costs(
+                pricing_service=self.ps2,
+                date=self.today,
+            )
+        self.assertEqual(calculate_costs_mock.call_count, 3)
+
+    def test_collector_plugins_order(self):
+        plugins = [
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps1}),
+            AttributeDict(plugin_kwargs={'team': None}),
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps2}),
+            AttributeDict(plugin_kwargs={}),
+        ]
+        collector = Collector()
+        self.assertEqual(
+            collector._get_plugins_order(plugins, self.engine),
+            [1, 3, 2, 0],
+        )
+        self.assertEqual(collector._get_plugins_order(plugins), [0, 1, 2, 3])
+
+    def test_collector_plugins_levels(self):
+        plugins = [
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps1}),
+            AttributeDict(plugin_kwargs={'team': None}),
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps2}),
+            AttributeDict(plugin_kwargs={}),
+        ]
+        collector = Collector()
+        self.assertEqual(
+            collector._get_plugins_levels(plugins, self.engine),
+            [[1, 3], [2], [0]],
+        )
+        self.assertEqual(
+            collector._get_plugins_levels(plugins),
+            [[0, 1, 2, 3]],
+        )
+
+    @override_settings(SCROOGE_COSTS_PLUGINS_CONCURRENCY=3)
+    @mock.patch.object(Collector, '_run_plugin')
+    def test_collector_run_plugins_concurrently(self, run_plugin_mock):
+        plugins = [
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps1}, i=0),
+            AttributeDict(plugin_kwargs={'team': None}, i=1),
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps2}, i=2),
+            AttributeDict(plugin_kwargs={}, i=3),
+        ]
+        run_plugin_mock.side_effect = lambda date, forecast, plugin: (
+            CostTree.from_legacy({
+                self.se1.id: [{'type_id': plugin.i, 'cost': 1}],
+                self.se2.id: [{'type_id': plugin.i * 10, 'cost': 1}],
+            })
+        )
+        result = Collector()._run_plugins(
+            self.today, False, plugins, self.engine
+        )
+        self.assertEqual(
+            {
+                se: [cost['type_id'] for cost in costs]
+                for se, costs in result.to_legacy().items()
+            },
+            {
+                self.se1.id: [0, 1, 2, 3],
+                self.se2.id: [0, 10, 20, 30],
+            }
+        )
+        self.assertEqual(run_plugin_mock.call_count, 4)
+
+    @override_settings(SCROOGE_COSTS_PLUGINS_CONCURRENCY=2)
+    @mock.patch.object(Collector, '_run_plugin')
+    def test_engine_passed_to_plugins_threads(self, run_plugin_mock):
+        engines = []
+
+        def run_plugin(date, forecast, plugin):
+            engines.append(get_active_engine(date, forecast))
+            return CostTree()
+
+        run_plugin_mock.side_effect = run_plugin
+        with activate(self.engine):
+            Collector()._run_plugins(
+                self.today, False, [{'plugin_kwargs': {}}] * 2, self.engine
+            )
+        self.assertEqual(engines, [self.engine, self.engine])
+
+    def test_engine_active_only_in_current_thread(self):
+        pool = ThreadPool(1)
+        try:
+            with activate(self.engine):
+                self.assertIsNone(
+                    pool.apply(get_active_engine, (self.today, False))
+                )
+        finally:
+            pool.terminate()
+
+    def test_dump_and_load_results(self):
+        self.engine.get_or_calculate('a', mock.Mock(return_value={1: [2]}))
+        engine = PricingServicesEngine(self.today, False)
+        engine.load_results(self.engine.dump_results())
+        func = mock.Mock()
+        self.assertEqual(engine.get_or_calculate('a', func), {1: [2]})
+        self.assertFalse(func.called)
+        # loaded results are not dumped again
+        engine.get_or_calculate('b', mock.Mock(return_value=3))
+        other = PricingServicesEngine(self.today, False)
+        other.load_results(engine.dump_results())
+        self.assertNotIn('a', other)
+        self.assertIn('b', other)
+
+    @mock.patch.object(type(UsageTypePlugin), '_costs')
+    def test_costs_totals_shared_between_shards(self, costs_mock):
+        costs_mock.return_value = {
+            self.se1.id: [{'type_id': self.usage_type.id, 'cost': D(10)}],
+            self.se2.id: [{'type_id': self.usage_type.id, 'cost': D(5)}],
+        }
+        kwargs = {
+            'date': self.today,
+            'forecast': False,
+            'usage_type': self.usage_type,
+        }
+        with activate(self.engine):
+            UsageTypePlugin.costs(**kwargs)
+        engine = PricingServicesEngine(self.today, False)
+        engine.load_results(self.engine.dump_results())
+        with activate(engine):
+            self.assertEqual(
+                UsageTypePlugin.total_cost(
+                    service_environments=[self.se1], **kwargs
+                ),
+                D(10),
+            )
+            self.assertEqual(UsageTypePlugin.total_cost(**kwargs), D(15))
+        # costs are calculated only in the first shard
+        self.assertEqual(costs_mock.call_count, 1)
+
+    def test_collector_plugins_shards(self):
+        plugins = [
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps1}),
+            AttributeDict(plugin_kwargs={'team': None}),
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps2}),
+            AttributeDict(plugin_kwargs={}),
+        ]
+        self.assertEqual(
+            Collector().get_plugins_shards(self.today, False, 2, plugins),
+            [[[1], [3]], [[2]], [[0]]],
+        )
+        self.assertEqual(
+            Collector().get_plugins_shards(self.today, False, 1, plugins),
+            [[[1, 3]], [[2]], [[0]]],
+        )
+
+    @override_settings(SAVE_COSTS_CALCULATION_RUNS=False)
+    @mock.patch.object(Collector, '_run_plugin')
+    def test_collector_process_shard(self, run_plugin_mock):
+        plugins = [
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps1}, i=0),
+            AttributeDict(plugin_kwargs={'team': None}, i=1),
+            AttributeDict(plugin_kwargs={'pricing_service': self.ps2}, i=2),
+            AttributeDict(plugin_kwargs={}, i=3),
+        ]
+
+        def run_plugin(date, forecast, plugin):
+            get_active_engine(date, forecast).get_or_calculate(
+                plugin.i, lambda: plugin.i
+            )
+            return CostTree.from_legacy({
+                self.se1.id: [{'type_id': plugin.i, 'cost': 1}],
+            })
+
+        run_plugin_mock.side_effect = run_plugin
+        self.engine.get_or_calculate(1, lambda: 1)
+        costs, engine = Collector().process_shard(
+            self.today,
+            False,
+            level=0,
+            shard=1,
+            shards=2,
+            engine_results=[self.engine.dump_results()],
+            plugins=plugins,
+        )
+        self.assertEqual(list(costs.types), [3])
+        self.assertEqual(run_plugin_mock.call_count, 1)
+        self.assertIn(1, engine)
+        self.assertIn(3, engine)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+from datetime import date
+
+from django.db import connection
+
+from ralph_scrooge.models import CostCalculationRun, UsageType
+from ralph_scrooge.plugins.cost.profiling import (
+    CalculationProfile,
+    count_queries,
+    QueriesStats,
+)
+from ralph_scrooge.tests import ScroogeTestCase
+
+
+class TestProfiling(ScroogeTestCase):
+    def setUp(self):
+        self.today = date(2013, 10, 10)
+
+    def test_count_queries(self):
+        outer, inner = QueriesStats(), QueriesStats()
+        with count_queries(outer):
+            list(UsageType.objects.all())
+            with count_queries(inner, outer):
+                list(UsageType.objects.all())
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+        list(UsageType.objects.all())
+        self.assertEqual(outer.count, 3)
+        self.assertEqual(inner.count, 2)
+        self.assertGreaterEqual(outer.time, inner.time)
+        self.assertNotIn('cursor', connection.__dict__)
+
+    def test_calculation_profile(self):
+        profile = CalculationProfile(self.today, False)
+        with profile.total.measure():
+            with profile.measure_plugin('plugin1') as plugin_profile:
+                list(UsageType.objects.all())
+                plugin_profile.entries = 10
+            with profile.measure_plugin('plugin2'):
+                pass
+        self.assertEqual(profile.total.queries.count, 1)
+        self.assertEqual(
+            [p.name for p in profile.get_slowest_plugins(1)], ['plugin1']
+        )
+        run = profile.save()
+        self.assertEqual(CostCalculationRun.objects.get().pk, run.pk)
+        self.assertEqual(run.queries_count, 1)
+        self.assertEqual(
+            [
+                (p['name'], p['queries_count'], p['entries'])
+                for p in json.loads(run.plugins)
+            ],
+            [('plugin1', 1, 10), ('plugin2', 0, 0)],
+        )
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from datetime import date
+from decimal import Decimal as D
+
+import mock
+from django.db import connection
+from django.test.utils import override_settings
+
+from ralph_scrooge.models import CostDateStatus, DailyCost, DailyCostStaging
+from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.publishing import (
+    _check_whole_subpartitions,
+    dailycost_lock,
+    DailyCostLockError,
+    group_by_subpartition,
+    swap_staged_costs,
+    SwapNotSupportedError,
+)
+from ralph_scrooge.tests import ScroogeTestCase
+from ralph_scrooge.tests.utils.factory import (
+    DailyCostFactory,
+    ServiceEnvironmentFactory,
+    UsageTypeFactory,
+)
+
+
+class TestPublishing(ScroogeTestCase):
+    def setUp(self):
+        self.collector = Collector()
+        self.service_environment = ServiceEnvironmentFactory()
+        self.usage_type = UsageTypeFactory()
+        self.day = date(2013, 10, 10)
+        self.costs = {
+            self.service_environment.id: [
+                {'type_id': self.usage_type.id, 'cost': D(10)},
+            ],
+        }
+
+    @override_settings(DAILY_COSTS_PUBLISH_MODE='swap')
+    def test_publish_staged_costs_without_partitions(self):
+        kwargs = {
+            'service_environment': self.service_environment,
+            'type': self.usage_type,
+        }
+        kept_costs = [
+            DailyCostFactory(date=self.day, forecast=True, **kwargs),
+            DailyCostFactory(date=date(2013, 10, 11), **kwargs),
+        ]
+        DailyCostFactory(date=self.day, **kwargs)
+        self.collector.stage_costs(self.day, self.costs, False)
+        # DailyCost table is not partitioned - whole table is not copied,
+        # costs are inserted instead
+        with self.assertRaises(SwapNotSupportedError):
+            swap_staged_costs(self.day, self.day, False)
+
+        self.collector.publish_staged_costs(self.day, self.day, False)
+        self.assertEqual(DailyCostStaging.objects.count(), 0)
+        self.assertEqual(
+            set(DailyCost.objects_tree.exclude(date=self.day, forecast=False)),
+            set(kept_costs),
+        )
+        self.assertEqual(
+            list(DailyCost.objects_tree.filter(
+                date=self.day, forecast=False
+            ).values_list('service_environment', 'type', 'cost')),
+            [(self.service_environment.id, self.usage_type.id, D(10))],
+        )
+        self.assertTrue(CostDateStatus.objects.get(date=self.day).calculated)
+        self.assertNotIn(
+            DailyCost._meta.db_table + '_shadow',
+            connection.introspection.table_names(),
+        )
+        self.collector.save_period_costs(self.day, self.day, False, [])
+        self.assertEqual(
+            DailyCost.objects_tree.filter(
+                date=self.day, forecast=False
+            ).count(),
+            0,
+        )
+
+    @mock.patch('ralph_scrooge.plugins.cost.publishing.connection')
+    def test_dailycost_lock(self, connection_mock):
+        connection_mock.vendor = 'mysql'
+        connection_mock.settings_dict = {'NAME': 'scrooge'}
+        cursor = connection_mock.cursor.return_value
+        cursor.fetchone.return_value = (1,)
+        with dailycost_lock():
+            cursor.execute.assert_called_once_with(
+                'SELECT GET_LOCK(%s, %s)',
+                ['scrooge.ralph_scrooge_dailycost', 3600],
+            )
+        cursor.execute.assert_called_with(
+            'SELECT RELEASE_LOCK(%s)', ['scrooge.ralph_scrooge_dailycost']
+        )
+        cursor.fetchone.return_value = (0,)
+        with self.assertRaises(DailyCostLockError):
+            with dailycost_lock():
+                pass
+
+    def test_group_by_subpartition(self):
+        cursor = mock.Mock()
+        cursor.description = [('id',), ('partitions',)]
+        cursor.fetchone.side_effect = [
+            (1, 'p_20131101_p_20131101_0'),
+            (1, 'p_20131101_p_20131101_0'),
+            (1, 'p_20131201_p_20131201_0'),
+        ]
+        subpartitions = {
+            'p_20131101_p_20131101_0': 'p_20131101_0',
+            'p_20131101_p_20131101_1': 'p_20131101_1',
+            'p_20131201_p_20131201_0': 'p_20131201_0',
+        }
+        self.assertEqual(
+            group_by_subpartition(
+                cursor,
+                'ralph_scrooge_dailycost',
+                subpartitions,
+                date(2013, 10, 30),
+                date(2013, 11, 1),
+                False,
+            ).items(),
+            [
+                ('p_20131101_0', (date(2013, 10, 30), date(2013, 10, 31))),
+                ('p_20131201_0', (date(2013, 11, 1), date(2013, 11, 1))),
+            ]
+        )
+
+    def test_check_whole_subpartitions(self):
+        cursor = mock.Mock()
+        cursor.description = [('id',), ('partitions',)]
+        subpartitions = {
+            'p_20131101_p_20131101_0': 'p_20131101_0',
+            'p_20131101_p_20131101_1': 'p_20131101_1',
+            'p_20131201_p_20131201_0': 'p_20131201_0',
+        }
+        # day before, day after and other forecast flag are stored in other
+        # subpartitions
+        cursor.fetchone.side_effect = [
+            (1, 'p_20131001_p_20131001_0'),
+            (1, 'p_20131201_p_20131201_0'),
+            (1, 'p_20131101_p_20131101_1'),
+        ]
+        _check_whole_subpartitions(
+            cursor,
+            'ralph_scrooge_dailycost',
+            dict(subpartitions, p_20131001_p_20131001_0='p_20131001_0'),
+            {'p_20131101_0': (date(2013, 10, 1), date(2013, 10, 31))},
+            False,
+        )
+        # day after is stored in the same subpartition
+        cursor.fetchone.side_effect = [
+            (1, None),
+            (1, 'p_20131101_p_20131101_0'),
+        ]
+        with self.assertRaises(SwapNotSupportedError):
+            _check_whole_subpartitions(
+                cursor,
+                'ralph_scrooge_dailycost',
+                subpartitions,
+                {'p_20131101_0': (date(2013, 10, 1), date(2013, 10, 30))},
+                False,
+            )
+
+    @override_settings(DAILY_COSTS_PUBLISH_MODE='swap')
+    @mock.patch('ralph_scrooge.plugins.cost.collector.swap_staged_costs')
+    def test_save_period_costs_inserts_not_swappable_period(
+        self, swap_staged_costs_mock
+    ):
+        self.collector.save_period_costs(
+            self.day,
+            self.day,
+            False,
+            self.collector._create_daily_costs(self.day, self.costs, False),
+        )
+        self.assertFalse(swap_staged_costs_mock.called)
+        self.assertEqual(DailyCostStaging.objects.count(), 0)
+        self.assertEqual(
+            DailyCost.objects_tree.filter(date=self.day).count(), 1
+        )
@@ -17,6 +17,7 @@ from ralph_scrooge.tests.utils.factory import (
     TeamCostFactory,
     TeamFactory,
 )
+from ralph_scrooge.utils.calculation_context import calculation_context
 
 
 class TestTeamPlugin(ScroogeTestCase):
@@ -648,4 +649,81 @@ class TestTeamPlugin(ScroogeTestCase):
                 forecast=False,
             )
 
-    # TODO: test other methods
+    # =========================================================================
+    # TEAMS ENGINE
+    # =========================================================================
+    @mock.patch('ralph_scrooge.plugins.cost.team.TeamPlugin._get_total_assets_count')  # noqa
+    @mock.patch('ralph_scrooge.plugins.cost.team.TeamPlugin._get_assets_count_by_service_environment')  # noqa
+    def test_team_assets_costs_with_excluded_services(
+        self,
+        assets_count_mock,
+        total_assets_mock,
+    ):
+        assets_count_mock.return_value = {
+            self.service_environment1.id: 100,
+            self.service_environment2.id: 200,
+            self.service_environment3.id: 200,
+        }
+        total_assets_mock.return_value = 500
+        self.team_assets.excluded_services.add(
+            self.service_environment2.service
+        )
+        costs = TeamPlugin.costs(
+            date=self.today,
+            team=self.team_assets,
+            forecast=False,
+        )
+        # daily cost (30) is distributed between service environments 1 and 3
+        self.assertEquals(costs, {
+            self.service_environment1.id: [
+                {
+                    'cost': D('10'),  # 100 / 300 * 30
+                    'type': self.team_assets,
+                    'percent': D(10) / D(30),
+                }
+            ],
+            self.service_environment3.id: [
+                {
+                    'cost': D('20'),  # 200 / 300 * 30
+                    'type': self.team_assets,
+                    'percent': D(20) / D(30),
+                }
+            ],
+        })
+
+    @mock.patch('ralph_scrooge.plugins.cost.team.TeamPlugin._get_total_cores_count')  # noqa
+    @mock.patch('ralph_scrooge.plugins.cost.team.TeamPlugin._get_cores_count_by_service_environment')  # noqa
+    @mock.patch('ralph_scrooge.plugins.cost.team.TeamPlugin._get_total_assets_count')  # noqa
+    @mock.patch('ralph_scrooge.plugins.cost.team.TeamPlugin._get_assets_count_by_service_environment')  # noqa
+    def test_teams_costs_calculated_once_in_calculation_context(
+        self,
+        assets_count_mock,
+        total_assets_mock,
+        cores_count_mock,
+        total_cores_mock
+    ):
+        assets_count_mock.return_value = {self.service_environment1.id: 10}
+        total_assets_mock.return_value = 10
+        cores_count_mock.return_value = {self.service_environment1.id: 4}
+        total_cores_mock.return_value = 4
+        with calculation_context():
+            totals = [
+                TeamPlugin.total_cost(
+                    date=self.today,
+                    service_environments=self.service_environments_subset,
+                    team=team,
+                    forecast=False,
+                )
+                for team in self.teams
+            ]
+        # time: 3 + 4, assets & cores: 10, assets: 30, distribute: 3 * 10 /
+        # 50 * 100 + 40 + 40 = 94, average: 200 * (0.7 + 1 + 1 + 0.94) / 4
+        self.assertEqual(totals, [D(7), D(10), D(30), D(94), D(182)])
+        # resources are counted once for all teams
+        for count_mock in (
+            assets_count_mock,
+            total_assets_mock,
+            cores_count_mock,
+            total_cores_mock,
+        ):
+            self.assertEqual(count_mock.call_count, 1)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import mock
+from multiprocessing.pool import ThreadPool
+
+from django.test.utils import override_settings
+
+from ralph_scrooge import models
+from ralph_scrooge.plugins.cost.base import BaseCostPlugin
+from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.cost_tree import CostTree
+from ralph_scrooge.plugins.cost.usages_snapshot import (
+    activate,
+    DailyUsagesSnapshot,
+    get_active_snapshot,
+)
+from ralph_scrooge.tests import ScroogeTestCase
+from ralph_scrooge.tests.utils.factory import (
+    DailyPricingObjectFactory,
+    DailyUsageFactory,
+    ServiceEnvironmentFactory,
+    UsageTypeFactory,
+    WarehouseFactory,
+)
+
+
+class SampleCostPlugin(BaseCostPlugin):
+    def _costs(self, *args, **kwargs):
+        pass
+
+
+class TestDailyUsagesSnapshot(ScroogeTestCase):
+    def setUp(self):
+        self.plugin = SampleCostPlugin()
+        self.today = datetime.date(2014, 10, 11)
+        self.yesterday = datetime.date(2014, 10, 10)
+        self.usage_type1, self.usage_type2 = UsageTypeFactory.create_batch(2)
+        self.warehouse1, self.warehouse2 = WarehouseFactory.create_batch(2)
+        self.service_environments = ServiceEnvironmentFactory.create_batch(3)
+        for i, se in enumerate(self.service_environments, start=1):
+            for dpo in DailyPricingObjectFactory.create_batch(
+                2,
+                service_environment=se,
+            ):
+                for day, multiplier in [(self.yesterday, 2), (self.today, 1)]:
+                    for warehouse in [self.warehouse1, self.warehouse2]:
+                        DailyUsageFactory(
+                            date=day,
+                            type=self.usage_type1,
+                            service_environment=se,
+                            daily_pricing_object=dpo,
+                            warehouse=warehouse,
+                            value=10 * i * multiplier,
+                        )
+                DailyUsageFactory(
+                    date=self.today,
+                    type=self.usage_type2,
+                    service_environment=se,
+                    daily_pricing_object=dpo,
+                    warehouse=self.warehouse1,
+                    value=i,
+                )
+        self.snapshot = DailyUsagesSnapshot.load(self.today)
+
+    def _compare(self, method_name, **kwargs):
+        """
+        Compare result of plugin method using snapshot and using database.
+        """
+        kwargs.setdefault('date', self.today)
+        from_db = getattr(self.plugin, method_name)(**kwargs)
+        with activate(self.snapshot):
+            from_snapshot = getattr(self.plugin, method_name)(**kwargs)
+        return from_db, from_snapshot
+
+    def test_covers(self):
+        self.assertTrue(self.snapshot.covers(date=self.today))
+        self.assertTrue(
+            self.snapshot.covers(start=self.today, end=self.today)
+        )
+        self.assertFalse(self.snapshot.covers(date=self.yesterday))
+        self.assertFalse(
+            self.snapshot.covers(start=self.yesterday, end=self.today)
+        )
+
+    def test_activate(self):
+        self.assertIsNone(get_active_snapshot())
+        with activate(self.snapshot):
+            self.assertIs(get_active_snapshot(), self.snapshot)
+        self.assertIsNone(get_active_snapshot())
+
+    def test_snapshot_active_only_in_current_thread(self):
+        pool = ThreadPool(1)
+        try:
+            with activate(self.snapshot):
+                self.assertIsNone(pool.apply(get_active_snapshot))
+        finally:
+            pool.terminate()
+
+    @override_settings(SCROOGE_COSTS_PLUGINS_CONCURRENCY=2)
+    @mock.patch.object(Collector, '_run_plugin')
+    def test_snapshot_passed_to_plugins_threads(self, run_plugin_mock):
+        snapshots = []
+
+        def run_plugin(date, forecast, plugin):
+            snapshots.append(get_active_snapshot())
+            return CostTree()
+
+        run_plugin_mock.side_effect = run_plugin
+        with activate(self.snapshot):
+            Collector()._run_plugins(
+                self.today, False, [{'plugin_kwargs': {}}] * 2
+            )
+        self.assertEqual(snapshots, [self.snapshot, self.snapshot])
+
+    def test_get_total_usage(self):
+        from_db, from_snapshot = self._compare(
+            '_get_total_usage',
+            usage_type=self.usage_type1,
+        )
+        # 2 (warehouses) * 2 (dpo) * (10 + 20 + 30)
+        self.assertEqual(from_snapshot, 240)
+        self.assertEqual(from_snapshot, from_db)
+
+    def test_get_total_usage_with_filters(self):
+        from_db, from_snapshot = self._compare(
+            '_get_total_usage',
+            usage_type=self.usage_type1,
+            warehouse=self.warehouse2,
+            service_environments=models.ServiceEnvironment.objects.filter(
+                id__in=[se.id for se in self.service_environments[:2]]
+            ),
+            excluded_services=[self.service_environments[0].service],
+        )
+        # 2 (dpo) * 20
+        self.assertEqual(from_snapshot, 40)
+        self.assertEqual(from_snapshot, from_db)
+
+    def test_get_total_usage_with_warehouse(self):
+        from_db, from_snapshot = self._compare(
+            '_get_total_usage',
+            usage_type=self.usage_type1,
+            warehouse=self.warehouse1,
+        )
+        # 2 (dpo) * (10 + 20 + 30)
+        self.assertEqual(from_snapshot, 120)
+        self.assertEqual(from_snapshot, from_db)
+
+    def test_usages_indexed_by_service_environment_and_warehouse(self):
+        usages = self.snapshot._usages[self.usage_type1.id]
+        se = self.service_environments[1]
+        positions = usages.get_positions([se.id])
+        self.assertEqual(len(positions), 4)
+        self.assertEqual(
+            set(usages.service_environments[p] for p in positions),
+            {se.id}
+        )
+        positions = usages.get_positions([se.id], self.warehouse2.id)
+        self.assertEqual(
+            [(
+                usages.service_environments[p], usages.warehouses[p]
+            ) for p in positions],
+            [(se.id, self.warehouse2.id)] * 2
+        )
+        positions = usages.get_positions(warehouse_id=self.warehouse1.id)
+        self.assertEqual(len(positions), 6)
+        self.assertEqual(
+            set(usages.warehouses[p] for p in positions),
+            {self.warehouse1.id}
+        )
+        self.assertEqual(list(usages.get_positions([-1])), [])
+
+    def test_get_total_usage_with_excluded_services_environments(self):
+        from_db, from_snapshot = self._compare(
+            '_get_total_usage',
+            usage_type=self.usage_type2,
+            excluded_services_environments=self.service_environments[1:],
+        )
+        self.assertEqual(from_snapshot, 2)
+        self.assertEqual(from_snapshot, from_db)
+
+    def test_get_total_usage_without_usages(self):
+        from_db, from_snapshot = self._compare(
+            '_get_total_usage',
+            usage_type=UsageTypeFactory(),
+        )
+        self.assertEqual(from_snapshot, 0)
+        self.assertEqual(from_snapshot, from_db)
+
+    def test_get_usages_per_service_environment(self):
+        from_db, from_snapshot = self._compare(
+            '_get_usages_per_service_environment',
+            usage_type=self.usage_type1,
+            warehouse=self.warehouse1,
+        )
+        self.assertEqual(from_snapshot, [
+            {'service_environment': se.id, 'usage': 20.0 * i}
+            for i, se in enumerate(self.service_environments, start=1)
+        ])
+        self.assertEqual(from_snapshot, from_db)
+
+    def test_get_usages_per_service(self):
+        from_db, from_snapshot = self._compare(
+            '_get_usages_per_service',
+            usage_type=self.usage_type2,
+        )
+        self.assertEqual(from_snapshot, from_db)
+
+    def test_get_usages_per_pricing_object_and_service_environment(self):
+        from_db, from_snapshot = self._compare(
+            '_get_usages_per_pricing_object_and_service_environment',
+            usage_type=self.usage_type1,
+            excluded_services=[self.service_environments[2].service],
+        )
+        self.assertEqual(len(from_snapshot), 4)
+        self.assertItemsEqual(from_snapshot, from_db)
+
+    def test_get_pricing_objects_usages(self):
+        from_db, from_snapshot = self._compare(
+            '_get_pricing_objects_usages',
+            usage_type=self.usage_type1,
+        )
+        self.assertEqual(len(from_snapshot), 12)
+        self.assertItemsEqual(from_snapshot, from_db)
+
+    def test_snapshot_not_used_for_other_dates(self):
+        with activate(self.snapshot):
+            result = self.plugin._get_total_usage(
+                usage_type=self.usage_type1,
+                date=self.yesterday,
+            )
+        self.assertEqual(result, 480)
+
+    @mock.patch.object(SampleCostPlugin, '_get_daily_usages_in_period')
+    def test_snapshot_used_instead_of_database(self, daily_usages_mock):
+        with activate(self.snapshot):
+            result = self.plugin._get_total_usage(
+                usage_type=self.usage_type1,
+                date=self.today,
+                warehouse=self.warehouse1,
+                excluded_services=set([
+                    self.service_environments[0].service
+                ]),
+            )
+        self.assertEqual(result, 100)
+        self.assertFalse(daily_usages_mock.called)
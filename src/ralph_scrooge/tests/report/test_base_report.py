@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from ralph_scrooge.report.base_report import BaseReport
+from ralph_scrooge.tests import ScroogeTestCase
+from ralph_scrooge.utils.calculation_context import get_active_context
+
+
+class SampleReport(BaseReport):
+    contexts = []
+
+    @classmethod
+    def get_header(cls, **kwargs):
+        return [['a']]
+
+    @classmethod
+    def get_data(cls, **kwargs):
+        for i in range(3):
+            cls.contexts.append(get_active_context())
+            yield i == 2, i * 50, [[i]]
+
+
+class TestBaseReport(ScroogeTestCase):
+    def setUp(self):
+        SampleReport.contexts = []
+
+    def test_run(self):
+        self.assertEqual(
+            [progress for progress, _ in SampleReport.run()],
+            [0, 50, 99.0, 100],
+        )
+        self.assertEqual(len(set(SampleReport.contexts)), 1)
+        self.assertIsNotNone(SampleReport.contexts[0])
+        self.assertEqual(len(SampleReport.contexts[0]), 0)
+
+    def test_context_not_active_between_yields(self):
+        report = SampleReport.run()
+        next(report)
+        # abandoned report doesn't leave its context active
+        self.assertIsNone(get_active_context())
+        report.close()
+        self.assertIsNone(get_active_context())
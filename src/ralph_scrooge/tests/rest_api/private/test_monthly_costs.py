@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from datetime import date, datetime
+
+import mock
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.test.utils import override_settings
+
+from ralph_scrooge.models import (
+    CostRecalculationRun,
+    DailyCost,
+    DailyCostStaging,
+)
+from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.cost_tree import CostTree, PackedCostTree
+from ralph_scrooge.rest_api.private.monthly_costs import (
+    DailyCostsJob,
+    DailyCostsShardJob,
+    MonthlyCosts,
+)
+from ralph_scrooge.tests import ScroogeTestCase
+from ralph_scrooge.tests.utils.factory import (
+    DailyUsageFactory,
+    UsageTypeFactory,
+)
+from ralph_scrooge.utils.worker_job import BATCH, INTERACTIVE
+
+
+class TestMonthlyCosts(ScroogeTestCase):
+    def setUp(self):
+        self.start = datetime(2013, 10, 10)
+        self.end = datetime(2013, 10, 12)
+
+    @override_settings(SCROOGE_COSTS_INTERACTIVE_MAX_DAYS=3)
+    def test_get_lane(self):
+        self.assertEqual(
+            MonthlyCosts.get_lane(start=self.start, end=self.end), INTERACTIVE
+        )
+        self.assertEqual(
+            MonthlyCosts.get_lane(start=datetime(2013, 10, 9), end=self.end),
+            BATCH,
+        )
+
+    @mock.patch.object(DailyCostsJob, 'wait_for_done')
+    @mock.patch.object(DailyCostsJob, 'run_on_worker')
+    def test_wait_for_subjobs(self, run_on_worker_mock, wait_for_done_mock):
+        finished = set()
+
+        meta = {'lane': BATCH, 'enqueued_at': datetime(2013, 10, 13)}
+
+        def run_on_worker(day, forecast, lane=None):
+            if day == self.end and day in finished:
+                # job failed on worker - its meta has no result
+                return 100, None, None, meta
+            if day in finished:
+                return 100, True, None, dict(
+                    meta, collector_result={1: []}, validation_errors=[],
+                )
+            # meta of pending job
+            return 0, None, None, meta
+
+        def wait_for_done(kwargs_list, timeout):
+            if len(finished) == 1:
+                # no notification - all days are checked
+                finished.update(kwargs['day'] for kwargs in kwargs_list)
+                return None
+            day = kwargs_list[0]['day']
+            finished.add(day)
+            return dict(day=day, forecast=False)
+
+        run_on_worker_mock.side_effect = run_on_worker
+        wait_for_done_mock.side_effect = wait_for_done
+        job = mock.Mock(meta={})
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=job,
+        ):
+            progress = list(MonthlyCosts._wait_for_subjobs(
+                {}, self.start, self.end, forecast=False, lane=BATCH,
+            ))
+        self.assertEqual(
+            [(p, sorted(results)) for p, _, results in progress],
+            [
+                (0, []),
+                (100 / 3, [self.start]),
+                (100, [datetime(2013, 10, 11)]),
+            ],
+        )
+        self.assertEqual(progress[-1][1][self.end], None)
+        self.assertEqual(run_on_worker_mock.call_args[1]['lane'], 'batch')
+        # every day is checked once on start, once notified day is checked
+        # and then 2 days are checked after timeout
+        self.assertEqual(run_on_worker_mock.call_count, 3 + 1 + 2)
+        self.assertEqual(
+            [len(c[0][0]) for c in wait_for_done_mock.call_args_list], [3, 2]
+        )
+
+    @mock.patch.object(Collector, 'calculate_days', autospec=True)
+    def test_calculate_in_pool_reports_validation_errors(
+        self, calculate_days_mock
+    ):
+        def calculate_days(collector, days, forecast, **kwargs):
+            collector.validation_errors[self.end] = ['error']
+            return [(self.start, True, {}), (self.end, False, None)]
+
+        calculate_days_mock.side_effect = calculate_days
+        job = mock.Mock(meta={})
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=job,
+        ):
+            _, statuses, _ = list(MonthlyCosts._calculate_in_pool(
+                {}, self.start, self.end, False, 2
+            ))[-1]
+        self.assertEqual(statuses, {self.start: True, self.end: False})
+        self.assertEqual(job.meta['validation_errors'], {self.end: ['error']})
+
+    @mock.patch.object(MonthlyCosts, '_stage_daily_result')
+    @mock.patch.object(MonthlyCosts, '_wait_for_subjobs')
+    @mock.patch(
+        'ralph_scrooge.rest_api.private.monthly_costs.Collector.calculate_days'
+    )
+    @override_settings(SKIP_UNCHANGED_DAYS=False)
+    def test_run_locally_with_dummy_cache(
+        self, calculate_days_mock, wait_for_subjobs_mock, stage_mock
+    ):
+        calculate_days_mock.return_value = [
+            (self.start, True, {1: []}),
+            (self.end, False, None),
+        ]
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.dj_caches',
+            {DailyCostsJob.cache_name: DummyCache('', {})},
+        ):
+            progress, statuses = list(MonthlyCosts.run(
+                self.start, self.end, forecast=False,
+            ))[-1]
+        self.assertEqual(progress, 100)
+        self.assertEqual(statuses, {self.start: True, self.end: False})
+        self.assertFalse(wait_for_subjobs_mock.called)
+        stage_mock.assert_called_once_with(
+            {1: []}, self.start, False, mock.ANY, mock.ANY
+        )
+
+    def _run_with_failed_day(self, calculate_days_mock, days_results):
+        """
+        Run recalculation, in which calculation of last day fails, and then
+        calculate (the next time) days_results.
+        """
+        usage_type = UsageTypeFactory()
+        costs = {1: [{'type_id': usage_type.id, 'cost': 1}]}
+        days_results[:] = [
+            (self.start, True, costs),
+            (self.end, False, None),
+        ]
+
+        def calculate_days(collector, days, forecast, fingerprints, **kwargs):
+            for day, success, day_costs in days_results:
+                if fingerprints:
+                    # fingerprints are calculated together with costs
+                    collector.get_fingerprint(day, forecast)
+                yield day, success, day_costs
+
+        calculate_days_mock.side_effect = calculate_days
+        job = mock.Mock(meta={})
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=job,
+        ):
+            list(MonthlyCosts.run(self.start, self.end, forecast=False))
+        # costs are not published when some day failed
+        self.assertEqual(DailyCost.objects.count(), 0)
+        self.assertEqual(DailyCostStaging.objects.count(), 1)
+        self.assertEqual(job.meta['unpublished'], [self.end])
+        days_results[:] = [
+            (day, True, costs) for day in calculate_days_mock.call_args[0][1]
+        ]
+        return costs
+
+    @mock.patch(
+        'ralph_scrooge.rest_api.private.monthly_costs.dj_caches',
+        {DailyCostsJob.cache_name: DummyCache('', {})},
+    )
+    @mock.patch.object(Collector, 'calculate_days', autospec=True)
+    @override_settings(SKIP_UNCHANGED_DAYS=False, DAILY_COSTS_RESUME=True)
+    def test_forced_run_is_not_resumed(self, calculate_days_mock):
+        days_results = []
+        self._run_with_failed_day(calculate_days_mock, days_results)
+        # input of first (staged) day is changed
+        DailyUsageFactory(date=self.start)
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+        ):
+            calculate_days_mock.side_effect = lambda *args, **kwargs: [
+                (day, True, {}) for day in args[1]
+            ]
+            progress, statuses = list(MonthlyCosts.run(
+                self.start, self.end, forecast=False, force=True,
+            ))[-1]
+        # first day is calculated again
+        self.assertEqual(
+            calculate_days_mock.call_args[0][1],
+            [self.start, datetime(2013, 10, 11), self.end],
+        )
+        self.assertTrue(all(statuses.values()))
+        self.assertEqual(CostRecalculationRun.objects.count(), 1)
+        self.assertIsNotNone(CostRecalculationRun.objects.get().finished)
+
+    @mock.patch(
+        'ralph_scrooge.rest_api.private.monthly_costs.dj_caches',
+        {DailyCostsJob.cache_name: DummyCache('', {})},
+    )
+    @mock.patch.object(Collector, 'calculate_days', autospec=True)
+    @override_settings(SKIP_UNCHANGED_DAYS=False, DAILY_COSTS_RESUME=False)
+    def test_run_is_not_resumed_without_fingerprints(
+        self, calculate_days_mock
+    ):
+        days_results = []
+        self._run_with_failed_day(calculate_days_mock, days_results)
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+        ):
+            list(MonthlyCosts.run(self.start, self.end, forecast=False))
+        self.assertFalse(calculate_days_mock.call_args[1]['fingerprints'])
+        self.assertEqual(
+            calculate_days_mock.call_args[0][1],
+            [self.start, datetime(2013, 10, 11), self.end],
+        )
+
+    @mock.patch.object(Collector, 'calculate_days', autospec=True)
+    @override_settings(SKIP_UNCHANGED_DAYS=False, DAILY_COSTS_RESUME=True)
+    def test_run_resumes_recalculation(self, calculate_days_mock):
+        usage_type = UsageTypeFactory()
+        costs = {1: [{'type_id': usage_type.id, 'cost': 1}]}
+        days_results = [
+            (self.start, True, costs),
+            (self.end, False, None),
+        ]
+
+        def calculate_days(collector, days, forecast, fingerprints, **kwargs):
+            # fingerprints are calculated together with costs
+            self.assertTrue(fingerprints)
+            for day, success, day_costs in days_results:
+                collector.get_fingerprint(day, forecast)
+                yield day, success, day_costs
+
+        calculate_days_mock.side_effect = calculate_days
+        job = mock.Mock(meta={})
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.dj_caches',
+            {DailyCostsJob.cache_name: DummyCache('', {})},
+        ), mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=job,
+        ):
+            list(MonthlyCosts.run(self.start, self.end, forecast=False))
+            # costs are not published when some day failed
+            self.assertEqual(DailyCost.objects.count(), 0)
+            self.assertEqual(DailyCostStaging.objects.count(), 1)
+            self.assertEqual(job.meta['unpublished'], [self.end])
+            days_results[:] = [
+                (datetime(2013, 10, 11), True, costs),
+                (self.end, True, costs),
+            ]
+            progress, statuses = list(MonthlyCosts.run(
+                self.start, self.end, forecast=False,
+            ))[-1]
+        # first day is not calculated again
+        self.assertEqual(
+            calculate_days_mock.call_args[0][1],
+            [datetime(2013, 10, 11), self.end],
+        )
+        self.assertTrue(all(statuses.values()))
+        self.assertEqual(
+            sorted(DailyCost.objects.values_list('date', flat=True)),
+            [self.start.date(), date(2013, 10, 11), self.end.date()],
+        )
+        self.assertIsNotNone(CostRecalculationRun.objects.get().finished)
+
+    @mock.patch.object(MonthlyCosts, '_wait_for_shards')
+    @mock.patch.object(Collector, 'get_plugins_shards')
+    def test_calculate_sharded(self, get_plugins_shards_mock, wait_mock):
+        get_plugins_shards_mock.return_value = [[[0], [1]], [[2]]]
+
+        def wait_for_shards(lane, kwargs_list):
+            return [
+                (True, {
+                    'collector_result': PackedCostTree.pack({1: [{
+                        'type_id': kwargs['level'] * 10 + kwargs['shard'],
+                        'cost': 1,
+                    }]}),
+                    'validation_errors': [],
+                })
+                for kwargs in kwargs_list
+            ]
+
+        wait_mock.side_effect = wait_for_shards
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=mock.Mock(meta={}),
+        ):
+            progress = list(MonthlyCosts._calculate_sharded(
+                {}, self.start, False, 2
+            ))
+        self.assertEqual([p for p, _, _ in progress], [100 / 3, 200 / 3, 100])
+        _, statuses, results = progress[-1]
+        self.assertEqual(statuses, {self.start: True})
+        self.assertEqual(list(results[self.start].types), [0, 1, 10])
+        level0, level1 = [c[0][1] for c in wait_mock.call_args_list]
+        self.assertEqual([kwargs['shard'] for kwargs in level0], [0, 1])
+        self.assertEqual(level0[0]['run_id'], level1[0]['run_id'])
+
+    @mock.patch.object(MonthlyCosts, '_wait_for_shards')
+    @mock.patch.object(Collector, 'get_plugins_shards')
+    def test_calculate_sharded_with_shard_failed_on_worker(
+        self, get_plugins_shards_mock, wait_mock
+    ):
+        get_plugins_shards_mock.return_value = [[[0], [1]], [[2]]]
+        # meta of job failed on worker has no result
+        wait_mock.return_value = [
+            (None, {'lane': INTERACTIVE, 'enqueued_at': self.start}),
+            (True, {
+                'lane': INTERACTIVE,
+                'enqueued_at': self.start,
+                'collector_result': PackedCostTree.pack({}),
+                'validation_errors': [],
+            }),
+        ]
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=mock.Mock(meta={}),
+        ):
+            progress = list(MonthlyCosts._calculate_sharded(
+                {}, self.start, False, 2
+            ))
+        self.assertEqual(progress, [(100, {self.start: False}, {})])
+
+    @mock.patch.object(Collector, 'process_shard')
+    def test_shard_job(self, process_shard_mock):
+        cache = caches[DailyCostsShardJob.cache_name]
+        cache.set(
+            DailyCostsShardJob._get_engine_results_key('run', 0, 1), b'data'
+        )
+        engine = mock.Mock()
+        engine.dump_results.return_value = b'results'
+        process_shard_mock.return_value = (
+            CostTree.from_legacy({1: [{'type_id': 1, 'cost': 1}]}), engine
+        )
+        job = mock.Mock(meta={})
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=job,
+        ):
+            result = list(
+                DailyCostsShardJob.run(self.start, False, 1, 0, 2, 'run')
+            )
+        self.assertEqual(result, [(100, True)])
+        self.assertEqual(
+            process_shard_mock.call_args[1]['engine_results'], [b'data']
+        )
+        self.assertEqual(
+            cache.get(DailyCostsShardJob._get_engine_results_key('run', 1, 0)),
+            b'results',
+        )
+        self.assertEqual(len(job.meta['collector_result']), 1)
+
+    @mock.patch.object(Collector, 'get_fingerprint')
+    @mock.patch.object(Collector, 'process')
+    def test_daily_job_saves_fingerprint(
+        self, process_mock, get_fingerprint_mock
+    ):
+        process_mock.return_value = CostTree.from_legacy({})
+        get_fingerprint_mock.return_value = 'abc'
+        job = mock.Mock(meta={})
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=job,
+        ):
+            list(DailyCostsJob.run(self.start, False))
+            # fingerprint is calculated only to skip unchanged days
+            self.assertFalse(get_fingerprint_mock.called)
+            self.assertEqual(job.meta['fingerprint'], '')
+            with override_settings(SKIP_UNCHANGED_DAYS=True):
+                list(DailyCostsJob.run(self.start, False))
+        get_fingerprint_mock.assert_called_once_with(self.start, False)
+        self.assertEqual(job.meta['fingerprint'], 'abc')
+
+    @mock.patch.object(DailyCostsJob, 'run_on_worker')
+    def test_check_subjobs_remembers_fingerprints(self, run_on_worker_mock):
+        run_on_worker_mock.return_value = (100, True, None, {
+            'collector_result': {},
+            'validation_errors': [],
+            'fingerprint': 'abc',
+        })
+        collector = Collector()
+        with mock.patch(
+            'ralph_scrooge.rest_api.private.monthly_costs.get_current_job',
+            return_value=mock.Mock(meta={}),
+        ):
+            MonthlyCosts._check_subjobs(
+                {}, self.start, self.start, forecast=False,
+                collector=collector,
+            )
+        self.assertEqual(
+            collector._fingerprints, {(self.start.date(), False): 'abc'}
+        )
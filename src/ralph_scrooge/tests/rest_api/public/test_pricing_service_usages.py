@@ -13,18 +13,23 @@ from django.core.urlresolvers import reverse
 from rest_framework.test import APIClient
 
 from ralph_scrooge.models import (
+    DailyCost,
     DailyUsage,
+    DailyUsageTotal,
     Environment,
     PricingService,
+    PricingServicePlugin,
     Service,
     ServiceUsageTypes,
     UsageType,
 )
 from ralph_scrooge.tests import ScroogeTestCase
 from ralph_scrooge.tests.utils.factory import (
+    DailyCostFactory,
     DailyUsageFactory,
     PricingObjectFactory,
     PricingServiceFactory,
+    UsagePriceFactory,
     UsageTypeFactory,
 )
 
@@ -858,6 +863,13 @@ class TestPricingServiceUsages(ScroogeTestCase):
         self.assertEquals(daily_usages[0].date, self.date)
         self.assertEquals(daily_usages[0].type, self.usage_type)
         self.assertEquals(daily_usages[0].value, 50)
+        # totals of removed usages are refreshed
+        self.assertEquals(
+            list(DailyUsageTotal.objects.values_list(
+                'service_environment', 'value', 'count'
+            )),
+            [(self.service_environment1.id, 50, 1)],
+        )
 
     def test_usages_are_replaced_when_overwrite_values_only_opt_is_chosen(self):  # noqa
         # 1st POST (same day, same usage type):
@@ -1332,3 +1344,76 @@ class TestPricingServiceUsages(ScroogeTestCase):
             content_type='application/json',
         )
         self.assertEquals(resp.status_code, 201)
+
+    def test_only_costs_depending_on_usages_are_recalculated(self):
+        self.pricing_service.plugin_type = (
+            PricingServicePlugin.pricing_service_fixed_price_plugin.id
+        )
+        self.pricing_service.save()
+        UsagePriceFactory(
+            type=self.usage_type,
+            start=self.date,
+            end=self.date,
+            price=2,
+            forecast_price=3,
+        )
+        other_cost = DailyCostFactory(
+            date=self.date,
+            service_environment=self.service_environment2,
+            type=UsageTypeFactory(),
+            cost=100,
+        )
+        DailyCostFactory(
+            date=self.date,
+            service_environment=self.service_environment2,
+            type=self.pricing_service,
+            path=str(self.pricing_service.id),
+            cost=50,
+        )
+        pricing_service_usage = {
+            "pricing_service": self.pricing_service.name,
+            "date": self.date_as_str,
+            "usages": [
+                {
+                    "pricing_object": self.pricing_object1.name,
+                    "usages": [
+                        {
+                            "symbol": self.usage_type.symbol,
+                            "value": 40,
+                        },
+                    ],
+                },
+            ]
+        }
+
+        resp = self.client.post(
+            reverse('create_pricing_service_usages'),
+            json.dumps(pricing_service_usage),
+            content_type='application/json',
+        )
+        self.assertEquals(resp.status_code, 201)
+        self.assertEqual(
+            sorted(DailyCost.objects.values_list(
+                'service_environment', 'type', 'forecast', 'cost'
+            )),
+            sorted([
+                (
+                    self.service_environment2.id,
+                    other_cost.type_id,
+                    False,
+                    100,
+                ),
+                (
+                    self.service_environment1.id,
+                    self.pricing_service.id,
+                    False,
+                    80,
+                ),
+                (
+                    self.service_environment1.id,
+                    self.pricing_service.id,
+                    True,
+                    120,
+                ),
+            ])
+        )
@@ -5,17 +5,46 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from datetime import date
+from datetime import date, datetime
+from decimal import Decimal as D
+import threading
+import time
 
-from ralph_scrooge.models import ServiceUsageTypes
+import mock
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test.utils import CaptureQueriesContext, override_settings
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from ralph_scrooge.models import (
+    DailyCost,
+    DailyCostStaging,
+    DailyPricingServiceCost,
+    DailyPricingServiceCostStaging,
+    DailyUsage,
+    DailyUsageTotal,
+    ServiceEnvironment,
+    ServiceUsageTypes,
+)
 from ralph_scrooge.tests import ScroogeTestCase
 from ralph_scrooge.tests.utils.factory import (
     DailyUsageFactory,
     PricingServiceFactory,
     ServiceEnvironmentFactory,
-    UsageTypeFactory
+    UsageTypeFactory,
+    WarehouseFactory,
+)
+from ralph_scrooge.utils import (
+    benchmark,
+    bulk_writer,
+    calculation_context,
+    common,
+    costs_hierarchy,
+    cycle_detector,
+    money,
+    usage_totals,
+    worker_job,
 )
-from ralph_scrooge.utils import common, cycle_detector
 
 
 class TestRangesOverlap(ScroogeTestCase):
@@ -58,6 +87,489 @@ class TestRangesOverlap(ScroogeTestCase):
         )
 
 
+class TestCalculationContext(ScroogeTestCase):
+    def setUp(self):
+        self.calls = []
+
+        @calculation_context.cached
+        def func(*args, **kwargs):
+            self.calls.append((args, kwargs))
+            return len(self.calls)
+        self.func = func
+
+    def test_not_cached_without_context(self):
+        self.assertEqual(self.func(1), 1)
+        self.assertEqual(self.func(1), 2)
+
+    def test_cached_in_context(self):
+        with calculation_context.calculation_context() as context:
+            self.assertEqual(self.func(1, a=2), 1)
+            self.assertEqual(self.func(1, a=2), 1)
+            self.assertEqual(self.func(2, a=2), 2)
+            self.assertEqual(context.hits, 1)
+            self.assertEqual(context.misses, 2)
+            self.assertEqual(len(context), 2)
+        self.assertIsNone(calculation_context.get_active_context())
+        self.assertEqual(len(context), 0)
+        # cache is invalidated when context is closed
+        with calculation_context.calculation_context():
+            self.assertEqual(self.func(1, a=2), 3)
+
+    def test_nested_context(self):
+        with calculation_context.calculation_context() as context:
+            self.func(1)
+            with calculation_context.calculation_context() as context2:
+                self.assertIs(context, context2)
+                self.func(1)
+            self.assertIs(calculation_context.get_active_context(), context)
+            self.assertEqual(context.hits, 1)
+
+    def test_context_active_only_in_its_thread(self):
+        results = []
+
+        def run():
+            results.append(calculation_context.get_active_context())
+            self.func(1)
+
+        with calculation_context.calculation_context() as context:
+            self.func(1)
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+            with calculation_context.activate_context(None):
+                self.func(1)
+            self.assertIs(calculation_context.get_active_context(), context)
+        self.assertEqual(results, [None])
+        self.assertEqual(context.hits, 0)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_lru_eviction(self):
+        with calculation_context.calculation_context(max_size=2) as context:
+            self.func(1)
+            self.func(2)
+            self.func(1)  # hit - 1 is now most recently used
+            self.func(3)  # 2 is evicted
+            self.func(1)
+            self.func(2)
+            self.assertEqual(context.hits, 2)
+            self.assertEqual(context.misses, 4)
+            self.assertEqual(len(context), 2)
+
+    def test_make_key_for_models(self):
+        se1, se2 = ServiceEnvironmentFactory.create_batch(2)
+        key = ('ralph_scrooge.ServiceEnvironment', se1.pk)
+        self.assertEqual(calculation_context.make_key(se1), key)
+        queryset = ServiceEnvironment.objects.filter(pk__in=[se2.pk, se1.pk])
+        # key of not evaluated queryset is built without any query
+        with CaptureQueriesContext(connection) as queries:
+            queryset_key = calculation_context.make_key(queryset)
+        self.assertEqual(queries.captured_queries, [])
+        self.assertEqual(
+            queryset_key,
+            calculation_context.make_key(
+                ServiceEnvironment.objects.filter(pk__in=[se2.pk, se1.pk])
+            ),
+        )
+        self.assertNotEqual(
+            queryset_key,
+            calculation_context.make_key(
+                ServiceEnvironment.objects.filter(pk__in=[se1.pk])
+            ),
+        )
+        list(queryset)
+        self.assertEqual(
+            calculation_context.make_key(queryset),
+            ('ralph_scrooge.ServiceEnvironment', (se1.pk, se2.pk)),
+        )
+        self.assertEqual(
+            calculation_context.make_key({'a': [se1, 1], 'b': set([2])}),
+            frozenset([('a', (key, 1)), ('b', frozenset([2]))]),
+        )
+
+    def test_uncacheable_arguments(self):
+        with calculation_context.calculation_context() as context:
+            self.assertEqual(self.func(bytearray(b'a')), 1)
+            self.assertEqual(self.func(bytearray(b'a')), 2)
+            self.assertEqual(len(context), 0)
+
+
+class TestMoney(ScroogeTestCase):
+    def test_to_micro(self):
+        self.assertEqual(money.to_micro(D('1.2345675')), 1234568)
+        self.assertEqual(money.to_micro(D('-0.0000005')), -1)
+        self.assertEqual(money.to_micro(3), 3000000)
+        self.assertEqual(money.to_micro(0.5), 500000)
+
+    def test_from_micro(self):
+        self.assertEqual(money.from_micro(1234568), D('1.234568'))
+        self.assertEqual(money.from_micro(-1), D('-0.000001'))
+
+    def test_allocate(self):
+        self.assertEqual(money.allocate(100, [1, 1, 1]), [34, 33, 33])
+        self.assertEqual(money.allocate(100, [1, 2]), [33, 67])
+        self.assertEqual(money.allocate(-100, [1, 1, 1]), [-34, -33, -33])
+
+    def test_allocate_with_decimal_and_float_weights(self):
+        parts = money.allocate(1000001, [D('0.1'), 0.2, D('0.3333')])
+        self.assertEqual(sum(parts), 1000001)
+        self.assertEqual(parts, [157903, 315807, 526291])
+
+    def test_allocate_with_total_weight(self):
+        self.assertEqual(
+            money.allocate(100, [25, 25], total_weight=100),
+            [25, 25],
+        )
+        self.assertEqual(
+            money.allocate(100, [D('0.33'), D('0.33')], total_weight=1),
+            [33, 33],
+        )
+
+    def test_to_weights(self):
+        self.assertEqual(
+            money.to_weights([D('0.25'), 0.1, 1, D(1) / 3]),
+            [250000000000, 100000000000, 1000000000000, 333333333333],
+        )
+        self.assertEqual(
+            money.allocate(
+                100,
+                money.to_weights([D(1) / 3] * 3),
+                total_weight=money.WEIGHT_UNITS,
+            ),
+            [34, 33, 33],
+        )
+
+    def test_allocate_with_zero_weights(self):
+        self.assertEqual(money.allocate(100, [0, 0]), [0, 0])
+        self.assertEqual(money.allocate(100, []), [])
+
+
+class TestBulkWriter(ScroogeTestCase):
+    def setUp(self):
+        self.rows = [
+            DailyCost.namedtuple(
+                path='1',
+                depth=0,
+                service_environment_id=1,
+                type_id=1,
+                value=0,
+                cost=D('1.2345678'),
+                forecast=False,
+                date=date(2013, 10, 10),
+            ),
+            DailyCost.namedtuple(
+                path='1/2\t',
+                depth=1,
+                pricing_object_id=3,
+                service_environment_id=1,
+                type_id=2,
+                value=1.5,
+                cost=D(2),
+                forecast=True,
+                date=date(2013, 10, 10),
+            ),
+        ]
+
+    def _get_saved(self):
+        return list(DailyCostStaging.objects.order_by('depth').values_list(
+            'path', 'depth', 'pricing_object', 'service_environment', 'type',
+            'warehouse', 'value', 'cost', 'forecast', 'date',
+        ))
+
+    def test_raw_writer_saves_the_same_as_orm_writer(self):
+        writers = [
+            bulk_writer.get_bulk_writer(DailyCostStaging, name, batch_size=1)
+            for name in ('orm', 'raw')
+        ]
+        saved = []
+        for writer in writers:
+            self.assertEqual(writer.write(iter(self.rows)), 2)
+            saved.append(self._get_saved())
+            DailyCostStaging.objects.all().delete()
+        self.assertEqual(saved[0], saved[1])
+        self.assertEqual(saved[1][0][7], D('1.234568'))
+
+    def test_to_tsv(self):
+        writer = bulk_writer.RawBulkWriter(DailyCostStaging)
+        self.assertEqual(writer.to_tsv(self.rows).splitlines(), [
+            '1\t0\t\\N\t1\t1\t\\N\t0\t1.234568\t0\t2013-10-10',
+            '1/2\\t\t1\t3\t1\t2\t\\N\t1.5\t2.000000\t1\t2013-10-10',
+        ])
+
+
+class TestDailyUsageTotals(ScroogeTestCase):
+    def setUp(self):
+        self.today = date(2013, 10, 10)
+        self.usage_type = UsageTypeFactory()
+        self.service_environment = ServiceEnvironmentFactory()
+        self.warehouse = WarehouseFactory()
+
+    def _get_totals(self):
+        return sorted(DailyUsageTotal.objects.values_list(
+            'date', 'type', 'service_environment', 'value', 'count',
+        ))
+
+    def _get_expected_totals(self):
+        return sorted(
+            (
+                usage['date'],
+                usage['type'],
+                usage['service_environment'],
+                usage['total'],
+                usage['rows'],
+            )
+            for usage in DailyUsage.objects.values(
+                'date', 'type', 'service_environment', 'warehouse',
+            ).annotate(total=Sum('value'), rows=Count('id'))
+        )
+
+    def _create_usage(self, **kwargs):
+        params = dict(
+            date=self.today,
+            type=self.usage_type,
+            service_environment=self.service_environment,
+            warehouse=self.warehouse,
+            value=10,
+        )
+        params.update(kwargs)
+        return DailyUsageFactory(**params)
+
+    def test_totals_are_updated_on_save_and_delete(self):
+        usage1 = self._create_usage()
+        usage2 = self._create_usage(value=5)
+        self.assertEqual(self._get_totals(), [
+            (self.today, self.usage_type.id, self.service_environment.id,
+             15, 2),
+        ])
+        usage1 = DailyUsage.objects.get(pk=usage1.pk)
+        usage1.value = 20
+        usage1.date = date(2013, 10, 11)
+        usage1.save()
+        usage2.value = 7
+        usage2.save()
+        self.assertEqual(self._get_totals(), self._get_expected_totals())
+        DailyUsage.objects.filter(pk=usage1.pk).delete()
+        self.assertEqual(self._get_totals(), [
+            (self.today, self.usage_type.id, self.service_environment.id,
+             7, 1),
+        ])
+
+    def test_defer_daily_usage_totals(self):
+        with usage_totals.defer_daily_usage_totals():
+            self._create_usage()
+            DailyUsage.objects.bulk_create([DailyUsage(
+                date=self.today,
+                type=self.usage_type,
+                service_environment=self.service_environment,
+                warehouse=self.warehouse,
+                daily_pricing_object=DailyUsage.objects.get(
+                ).daily_pricing_object,
+                value=3,
+            )])
+            usage_totals.mark_changed(self.today, [self.usage_type])
+            self.assertEqual(self._get_totals(), [])
+        self.assertEqual(self._get_totals(), [
+            (self.today, self.usage_type.id, self.service_environment.id,
+             13, 2),
+        ])
+
+    def test_previous_state_not_fetched_in_deferred_context(self):
+        usage = self._create_usage()
+        with usage_totals.defer_daily_usage_totals():
+            usage.value = 3
+            with CaptureQueriesContext(connection) as queries:
+                usage.save()
+            self.assertEqual(len(queries), 1)
+            # deferred context is active only in current thread
+            changed = []
+            thread = threading.Thread(
+                target=lambda: changed.append(usage_totals._get_changed())
+            )
+            thread.start()
+            thread.join()
+            self.assertEqual(changed, [None])
+        self.assertEqual(self._get_totals(), self._get_expected_totals())
+
+    def test_delete_daily_usages(self):
+        other_type = UsageTypeFactory()
+        self._create_usage()
+        self._create_usage(value=5)
+        self._create_usage(type=other_type)
+        with usage_totals.defer_daily_usage_totals():
+            deleted = usage_totals.delete_daily_usages(
+                DailyUsage.objects.filter(type=self.usage_type)
+            )
+        self.assertEqual(deleted, 2)
+        self.assertEqual(self._get_totals(), [
+            (self.today, other_type.id, self.service_environment.id, 10, 1),
+        ])
+
+    def test_refresh_daily_usage_totals(self):
+        self._create_usage()
+        self._create_usage(type=UsageTypeFactory())
+        DailyUsageTotal.objects.all().delete()
+        usage_totals.refresh_daily_usage_totals(
+            self.today, [self.usage_type.id]
+        )
+        self.assertEqual(DailyUsageTotal.objects.count(), 1)
+        usage_totals.refresh_daily_usage_totals(self.today)
+        self.assertEqual(self._get_totals(), self._get_expected_totals())
+
+
+class TestCostsHierarchy(ScroogeTestCase):
+    def setUp(self):
+        self.today = date(2013, 10, 10)
+        self.ps1, self.ps2 = PricingServiceFactory.create_batch(2)
+        self.ut1, self.ut2 = [ut.id for ut in UsageTypeFactory.create_batch(2)]
+
+    def test_get_costs_depth(self):
+        with override_settings(SAVE_ONLY_FIRST_DEPTH_COSTS=True):
+            self.assertEqual(costs_hierarchy.get_costs_depth(self.ps1), 0)
+        with override_settings(SAVE_ONLY_FIRST_DEPTH_COSTS=False):
+            self.assertIsNone(costs_hierarchy.get_costs_depth(self.ps1))
+            self.ps1.costs_depth = 2
+            self.assertEqual(costs_hierarchy.get_costs_depth(self.ps1), 2)
+
+    def test_dump_and_load_hierarchy(self):
+        hierarchy = {
+            self.ut1: (D('60.5'), {}),
+            self.ps2.id: (D('40'), {self.ut2: (D('40'), {})}),
+        }
+        self.assertEqual(
+            costs_hierarchy.load_hierarchy(
+                costs_hierarchy.dump_hierarchy(hierarchy)
+            ),
+            hierarchy,
+        )
+
+    def test_get_subcosts(self):
+        costs_hierarchy.save_hierarchies(self.today, False, {
+            self.ps1.id: ({self.ps1.id: (D(100), {
+                self.ut1: (D(60), {}),
+                self.ps2.id: (D(40), {}),
+            })}, 0),
+            self.ps2.id: ({self.ps2.id: (D(50), {
+                self.ut2: (D(50), {}),
+            })}, 0),
+        })
+        costs_hierarchy.publish_hierarchies(self.today, self.today, False)
+        subcosts = costs_hierarchy.get_subcosts(
+            [
+                (self.today, [self.ps1.id], D(10)),
+                (self.today, [self.ps1.id, self.ps2.id], D(4)),
+                (self.today, [self.ps1.id, self.ut1], D(6)),
+            ],
+            forecast=False,
+        )
+        self.assertEqual(
+            {key: dict(value) for key, value in subcosts.items()},
+            {
+                (self.today, (self.ps1.id,)): {
+                    self.ut1: D(6), self.ps2.id: D(4),
+                },
+                # costs of ps2 are expanded using its own hierarchy
+                (self.today, (self.ps1.id, self.ps2.id)): {self.ut2: D(4)},
+            }
+        )
+
+    def test_save_hierarchies_deletes_not_truncated(self):
+        costs_hierarchy.save_hierarchies(self.today, False, {
+            self.ps1.id: ({self.ps1.id: (D(100), {
+                self.ut1: (D(100), {}),
+            })}, 0),
+        })
+        costs_hierarchy.publish_hierarchies(self.today, self.today, False)
+        costs_hierarchy.save_hierarchies(self.today, False, {
+            self.ps1.id: (None, None),
+        })
+        costs_hierarchy.publish_hierarchies(self.today, self.today, False)
+        self.assertEqual(
+            costs_hierarchy.get_subcosts(
+                [(self.today, [self.ps1.id], D(10))], forecast=False
+            ),
+            {},
+        )
+
+    def test_hierarchies_visible_only_when_published(self):
+        costs_hierarchy.save_hierarchies(self.today, False, {
+            self.ps1.id: ({self.ps1.id: (D(100), {
+                self.ut1: (D(100), {}),
+            })}, 0),
+        })
+        costs = [(self.today, [self.ps1.id], D(10))]
+        self.assertEqual(
+            costs_hierarchy.get_subcosts(costs, forecast=False), {}
+        )
+        costs_hierarchy.publish_hierarchies(self.today, self.today, False)
+        self.assertEqual(
+            costs_hierarchy.get_subcosts(costs, forecast=False),
+            {(self.today, (self.ps1.id,)): [(self.ut1, D(10))]},
+        )
+        self.assertFalse(DailyPricingServiceCostStaging.objects.exists())
+
+    def test_publish_hierarchies_of_pricing_services(self):
+        for ps in [self.ps1, self.ps2]:
+            costs_hierarchy.save_hierarchies(self.today, False, {
+                ps.id: ({ps.id: (D(100), {self.ut1: (D(100), {})})}, 0),
+            })
+        costs_hierarchy.publish_hierarchies(self.today, self.today, False)
+        # ps2 costs saved completely now
+        costs_hierarchy.save_hierarchies(self.today, False, {
+            self.ps2.id: (None, None),
+        })
+        costs_hierarchy.publish_hierarchies(
+            self.today, self.today, False, pricing_services=[self.ps2.id],
+        )
+        self.assertEqual(
+            list(DailyPricingServiceCost.objects.values_list(
+                'pricing_service', flat=True
+            )),
+            [self.ps1.id],
+        )
+
+
+class TestBenchmark(ScroogeTestCase):
+    def setUp(self):
+        self.dataset = benchmark.generate_dataset(
+            date(2013, 10, 10),
+            date(2013, 10, 11),
+            services=4,
+            pricing_objects=2,
+            usage_types=2,
+            pricing_services=3,
+            pricing_services_fanout=2,
+        )
+
+    def test_generate_dataset(self):
+        self.assertEqual(len(self.dataset.service_environments), 4)
+        # 4 service environments * 2 types * 2 pricing objects * 2 days
+        self.assertEqual(len(self.dataset.daily_pricing_objects), 32)
+        # pricing service 0 is using pricing services 1 and 2
+        self.assertEqual(
+            DailyUsage.objects.filter(
+                service_environment=self.dataset.service_environments[0],
+                type__in=self.dataset.service_usage_types,
+            ).values('type').distinct().count(),
+            2,
+        )
+        self.assertEqual(len(self.dataset.teams), 4)
+
+    def test_run_benchmark(self):
+        profiles = benchmark.run_benchmark(self.dataset)
+        self.assertEqual(
+            [profile.name for profile in profiles], list(benchmark.STAGES)
+        )
+        for profile in profiles:
+            self.assertGreater(profile.entries, 0)
+            self.assertGreater(profile.queries.count, 0)
+        self.assertEqual(
+            DailyCost.objects.filter(date=date(2013, 10, 10)).values(
+                'type'
+            ).distinct().count(),
+            # usage types, pricing services, teams and extra cost type
+            2 + 3 + 4 + 1,
+        )
+
+
 class TestCyclesDetector(ScroogeTestCase):
     @classmethod
     def setUpClass(cls):
@@ -148,3 +660,311 @@ class TestCyclesDetector(ScroogeTestCase):
         graph = cycle_detector._get_pricing_services_graph(self.today)
         cycles = cycle_detector._detect_cycles(self.ps1, graph, set(), [])
         self.assertEqual(cycles, [[self.ps1, self.ps2, self.ps3, self.ps1]])
+
+    def test_get_pricing_services_levels_when_graph_is_without_cycle(self):
+        levels = cycle_detector.get_pricing_services_levels(self.today)
+        self.assertEqual(levels, [[self.ps1], [self.ps2], [self.ps3]])
+
+    def test_get_pricing_services_levels_when_graph_is_with_cycle(self):
+        self._make_cycle()
+        levels = cycle_detector.get_pricing_services_levels(self.today)
+        self.assertEqual(levels, [[self.ps1, self.ps2, self.ps3]])
+
+
+class TestWorkerJob(ScroogeTestCase):
+    class Job(worker_job.WorkerJob):
+        cache_section = 'test'
+        notify_done = True
+
+        @classmethod
+        def run(cls, day):
+            yield 100, day
+
+    @mock.patch('ralph_scrooge.utils.worker_job.django_rq.get_connection')
+    def test_notify_done(self, get_connection_mock):
+        connection = get_connection_mock.return_value
+        self.Job._notify_done(day=1, forecast=False)
+        connection.pipeline.return_value.rpush.assert_called_once_with(
+            b'test:done?day=1&forecast=False', 1
+        )
+        connection.blpop.return_value = (b'test:done?day=1&forecast=False', 1)
+        self.assertEqual(
+            self.Job.wait_for_done(
+                [dict(day=2, forecast=False), dict(forecast=False, day=1)],
+                timeout=1,
+            ),
+            dict(day=1, forecast=False),
+        )
+        connection.blpop.return_value = None
+        self.assertIsNone(
+            self.Job.wait_for_done([dict(day=2, forecast=False)], timeout=1)
+        )
+        self.assertIsNone(self.Job.wait_for_done([], timeout=1))
+
+    @mock.patch.object(Job, '_notify_done')
+    def test_worker_func_notifies_done(self, notify_done_mock):
+        worker_job.dj_caches['default'].set(
+            worker_job._get_cache_key('test', day=1), (0, 'job-id', None)
+        )
+        self.assertEqual(self.Job._worker_func(day=1), 1)
+        notify_done_mock.assert_called_once_with(day=1)
+
+    def test_cache_key_does_not_depend_on_kwargs_order(self):
+        self.assertEqual(
+            worker_job._get_cache_key('test', start=1, end=2, forecast=True),
+            b'test?end=2&forecast=True&start=1',
+        )
+
+    @mock.patch('ralph_scrooge.utils.worker_job.django_rq.get_queue')
+    def test_run_on_worker_in_lane(self, get_queue_mock):
+        queue = get_queue_mock.return_value
+        queue.name = 'default'
+        queue.enqueue_call.return_value = mock.Mock(id='job1', meta={})
+        self.assertEqual(self.Job().run_on_worker(day=1), (0, None))
+        self.assertTrue(queue.enqueue_call.call_args[1]['at_front'])
+        self.assertEqual(
+            queue.enqueue_call.call_args[1]['meta']['lane'],
+            worker_job.INTERACTIVE,
+        )
+        queue.connection.sadd.assert_called_once_with(
+            'scrooge_jobs:classes', 'Job'
+        )
+        self.Job().run_on_worker(day=2, lane=worker_job.BATCH)
+        self.assertFalse(queue.enqueue_call.call_args[1]['at_front'])
+        # lane is served by its own queue, if it's configured
+        with override_settings(
+            RQ_QUEUES={'default': {}, 'default_batch': {}}
+        ):
+            self.Job().run_on_worker(day=3, lane=worker_job.BATCH)
+        get_queue_mock.assert_called_with('default_batch')
+
+    def test_admit(self):
+        job = mock.Mock(id='job1', meta={}, enqueued_at=datetime(2013, 1, 1))
+        script = job.connection.register_script.return_value
+        script.return_value = 1
+        self.assertTrue(self.Job._admit(job))
+        script.assert_called_once_with(
+            keys=['scrooge_jobs:running:Job'], args=['job1', 60, 0]
+        )
+        pipeline = job.connection.pipeline.return_value
+        self.assertGreater(pipeline.lpush.call_args[0][1], 0)
+        script.return_value = 0
+        with override_settings(SCROOGE_JOBS_MAX_RUNNING={'Job': 1}):
+            self.assertFalse(self.Job._admit(job))
+        script.assert_called_with(
+            keys=['scrooge_jobs:running:Job'], args=['job1', 60, 1]
+        )
+
+    @mock.patch.object(Job, '_defer')
+    @mock.patch.object(Job, '_admit')
+    @mock.patch('ralph_scrooge.utils.worker_job.get_current_job')
+    def test_worker_func_defers_job_when_limit_reached(
+        self, get_current_job_mock, admit_mock, defer_mock
+    ):
+        get_current_job_mock.return_value = mock.Mock(
+            meta={'lane': worker_job.BATCH}
+        )
+        admit_mock.return_value = False
+        defer_mock.return_value = mock.Mock(id='job2')
+        self.assertIsNone(self.Job._worker_func(day=1))
+        defer_mock.assert_called_once_with(
+            {'day': 1}, worker_job.BATCH, {'lane': worker_job.BATCH}
+        )
+        self.assertEqual(
+            worker_job.dj_caches['default'].get(
+                worker_job._get_cache_key('test', day=1)
+            ),
+            (0, 'job2', None),
+        )
+        job = get_current_job_mock.return_value
+        self.assertEqual(job.meta['deferred_to'], 'job2')
+        job.save.assert_called_once_with()
+
+    @mock.patch.object(Job, 'get_rq_job')
+    def test_run_on_worker_follows_deferred_job(self, get_rq_job_mock):
+        # client read cache before rejected job1 was replaced by job2
+        key = worker_job._get_cache_key('test', day=1)
+        worker_job.dj_caches['default'].set(key, (0, 'job1', None))
+        job1 = mock.Mock(
+            id='job1', is_finished=True, meta={'deferred_to': 'job2'}
+        )
+        job2 = mock.Mock(id='job2', is_finished=False, is_failed=False)
+        job2.get_status.return_value = worker_job.JobStatus.QUEUED
+        jobs = {'job1': job1, 'job2': job2}
+        get_rq_job_mock.side_effect = lambda job_id: jobs[job_id]
+        self.assertEqual(self.Job().run_on_worker(day=1), (0, None))
+        self.assertEqual(
+            worker_job.dj_caches['default'].get(key), (0, 'job2', None)
+        )
+        # result of deferred job is returned
+        job2.is_finished = True
+        job2.meta = {}
+        job2.result = 1
+        self.assertEqual(self.Job().run_on_worker(day=1), (100, 1))
+        self.assertEqual(
+            worker_job.dj_caches['default'].get(key), (100, 'job2', 1)
+        )
+
+    @mock.patch.object(Job, '_notify_done')
+    @mock.patch.object(Job, '_release')
+    @mock.patch.object(Job, '_admit')
+    @mock.patch('ralph_scrooge.utils.worker_job.Heartbeat')
+    @mock.patch('ralph_scrooge.utils.worker_job.get_current_job')
+    def test_worker_func_sends_heartbeats_while_running(
+        self, get_current_job_mock, heartbeat_mock, admit_mock, release_mock,
+        notify_done_mock,
+    ):
+        job = get_current_job_mock.return_value
+        admit_mock.return_value = True
+        self.assertEqual(self.Job._worker_func(day=1), 1)
+        heartbeat_mock.assert_called_once_with(
+            job.connection, 'scrooge_jobs:running:Job', job.id, 60,
+        )
+        heartbeat_mock.return_value.start.assert_called_once_with()
+        heartbeat_mock.return_value.stop.assert_called_once_with()
+        release_mock.assert_called_once_with(job)
+
+    def test_heartbeat(self):
+        connection = mock.Mock()
+        heartbeat = worker_job.Heartbeat(
+            connection, 'scrooge_jobs:running:Job', 'job1', 0.03
+        )
+        heartbeat.start()
+        time.sleep(0.05)
+        heartbeat.stop()
+        self.assertFalse(heartbeat.is_alive())
+        connection.register_script.return_value.assert_called_with(
+            keys=['scrooge_jobs:running:Job'], args=['job1', 0.03]
+        )
+
+    @mock.patch('ralph_scrooge.utils.worker_job.Job.fetch')
+    @mock.patch('ralph_scrooge.utils.worker_job.django_rq.get_queue')
+    def test_enqueue_deferred(self, get_queue_mock, fetch_mock):
+        queue = get_queue_mock.return_value
+        queue.name = 'default'
+        connection = mock.Mock()
+        connection.zrange.return_value = [b'job2']
+        connection.zrem.return_value = 1
+        job = fetch_mock.return_value
+        job.meta = {'lane': worker_job.BATCH}
+        script = connection.register_script.return_value
+        with override_settings(SCROOGE_JOBS_MAX_RUNNING={'Job': 2}):
+            # limit of running jobs is still reached
+            script.return_value = 2
+            self.Job._enqueue_deferred(connection)
+            self.assertFalse(connection.zrange.called)
+            script.return_value = 1
+            self.Job._enqueue_deferred(connection)
+        connection.zrange.assert_called_once_with(
+            'scrooge_jobs:deferred:Job', 0, 0
+        )
+        fetch_mock.assert_called_once_with('job2', connection)
+        queue.enqueue_job.assert_called_once_with(job, at_front=False)
+
+    @mock.patch('ralph_scrooge.utils.worker_job.django_rq.get_queue')
+    def test_get_jobs_stats(self, get_queue_mock):
+        get_queue_mock.return_value.count = 3
+        connection = mock.Mock()
+        connection.smembers.return_value = {b'Job'}
+        connection.zcard.return_value = 1
+        connection.lrange.return_value = [b'3.0', b'1.0', b'2.0']
+        with override_settings(RQ_QUEUES={'default': {}}):
+            queues, jobs = worker_job.get_jobs_stats(connection)
+        self.assertEqual(queues, {'default': 3})
+        self.assertEqual(jobs, {'Job': {
+            'running': 1,
+            'count': 3,
+            'wait_avg': 2.0,
+            'wait_median': 2.0,
+            'wait_max': 3.0,
+        }})
+
+
+class TestWorkerJobRedis(ScroogeTestCase):
+    """
+    Running jobs limits against real Redis (the one configured in
+    `RQ_QUEUES`).
+    """
+    class Job(worker_job.WorkerJob):
+        cache_section = 'test_redis'
+
+    def setUp(self):
+        self.connection = worker_job.django_rq.get_connection()
+        try:
+            self.connection.ping()
+        except RedisConnectionError:
+            self.skipTest('Redis is not available')
+        self.running_key = 'scrooge_jobs:running:Job'
+        self.deferred_key = 'scrooge_jobs:deferred:Job'
+        self.connection.delete(self.running_key, self.deferred_key)
+        self.addCleanup(
+            self.connection.delete, self.running_key, self.deferred_key
+        )
+
+    def _job(self, job_id):
+        return mock.Mock(
+            id=job_id,
+            meta={},
+            enqueued_at=datetime(2013, 1, 1),
+            connection=self.connection,
+        )
+
+    def _server_time(self):
+        seconds, microseconds = self.connection.time()
+        return seconds + microseconds / 1000000
+
+    @override_settings(SCROOGE_JOBS_MAX_RUNNING={'Job': 2})
+    def test_admit_respects_limit(self):
+        self.assertTrue(self.Job._admit(self._job('job1')))
+        self.assertTrue(self.Job._admit(self._job('job2')))
+        self.assertFalse(self.Job._admit(self._job('job3')))
+        self.assertEqual(
+            set(self.connection.zrange(self.running_key, 0, -1)),
+            {b'job1', b'job2'},
+        )
+        self.Job._release(self._job('job1'))
+        self.assertTrue(self.Job._admit(self._job('job3')))
+
+    @override_settings(SCROOGE_JOBS_MAX_RUNNING={'Job': 1})
+    def test_admit_ignores_clock_of_running_job(self):
+        # heartbeat of running job is ahead of the (Redis) clock
+        self.connection.execute_command(
+            'ZADD', self.running_key, self._server_time() + 1000, 'job1'
+        )
+        self.assertFalse(self.Job._admit(self._job('job2')))
+
+    @override_settings(SCROOGE_JOBS_MAX_RUNNING={'Job': 1})
+    def test_admit_prunes_jobs_without_heartbeat(self):
+        self.connection.execute_command(
+            'ZADD', self.running_key, self._server_time() - 61, 'job1'
+        )
+        self.assertTrue(self.Job._admit(self._job('job2')))
+        self.assertEqual(
+            self.connection.zrange(self.running_key, 0, -1), [b'job2']
+        )
+        self.assertGreater(self.connection.ttl(self.running_key), 0)
+
+    def test_heartbeat_refreshes_score(self):
+        self.connection.execute_command('ZADD', self.running_key, 0, 'job1')
+        heartbeat = worker_job.Heartbeat(
+            self.connection, self.running_key, 'job1', 0.03
+        )
+        heartbeat.start()
+        time.sleep(0.05)
+        heartbeat.stop()
+        self.assertGreater(
+            self.connection.zscore(self.running_key, 'job1'),
+            self._server_time() - 1,
+        )
+
+    @mock.patch.object(Job, '_enqueue_deferred')
+    @mock.patch('ralph_scrooge.utils.worker_job.Job.create')
+    @mock.patch('ralph_scrooge.utils.worker_job.django_rq.get_queue')
+    def test_defer(self, get_queue_mock, create_mock, enqueue_deferred_mock):
+        get_queue_mock.return_value.connection = self.connection
+        create_mock.return_value.id = 'job1'
+        self.Job._defer({'day': 1}, worker_job.BATCH, {})
+        self.assertEqual(
+            self.connection.zrange(self.deferred_key, 0, -1), [b'job1']
+        )
+        enqueue_deferred_mock.assert_called_once_with(self.connection)
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic-scale benchmark of costs calculation pipeline.
+
+`generate_dataset` creates synthetic dataset of configurable size: services
+(each with single environment), pricing objects of every type per service
+environment, usage types (with daily usages of every pricing object),
+pricing services with dependency graph (services of every pricing service
+use services of next pricing services) and teams of selected billing types.
+
+`run_benchmark` runs every stage of costs calculation pipeline for the whole
+dataset and profiles it (see `ralph_scrooge.plugins.cost.profiling`): wall
+time, number of processed items (and throughput), SQL queries and growth of
+peak memory. Stages:
+* `collector` - calculate costs of every day (`Collector.process`),
+* `distribute` - distribute costs of every pricing service (alone),
+* `save` - save calculated costs,
+* `report` - generate services costs report,
+* `api` - fetch costs of every service environment (v0.10 costs API).
+
+Benchmark could be run using `scrooge_benchmark` command.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+from collections import OrderedDict
+from decimal import Decimal as D
+
+from dateutil import rrule
+
+from ralph_scrooge.models import (
+    BusinessLine,
+    DailyCost,
+    DailyPricingObject,
+    DailyUsage,
+    Environment,
+    ExtraCost,
+    ExtraCostType,
+    PRICING_OBJECT_TYPES,
+    PricingObject,
+    PricingObjectType,
+    PricingService,
+    ProfitCenter,
+    Service,
+    ServiceEnvironment,
+    ServiceUsageTypes,
+    Team,
+    TeamBillingType,
+    TeamCost,
+    TeamServiceEnvironmentPercent,
+    UsagePrice,
+    UsageType,
+    Warehouse,
+)
+from ralph_scrooge.plugins.cost.collector import Collector
+from ralph_scrooge.plugins.cost.pricing_service import PricingServicePlugin
+from ralph_scrooge.plugins.cost.profiling import Profile
+from ralph_scrooge.report.report_services_costs import ServicesCostsReport
+from ralph_scrooge.rest_api.public.v0_10.service_environment_costs import (
+    fetch_costs,
+    get_valid_types,
+)
+from ralph_scrooge.utils.cache import clear_memoize_caches
+from ralph_scrooge.utils.calculation_context import calculation_context
+from ralph_scrooge.utils.common import AttributeDict
+from ralph_scrooge.utils.usage_totals import mark_changed
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+DEFAULT_PRICING_OBJECT_TYPES = ('ASSET', 'VIRTUAL')
+DEFAULT_TEAMS = OrderedDict([
+    ('time', 1),
+    ('assets', 1),
+    ('distribute', 1),
+    ('average', 1),
+])
+# max number of service environments between which time of single team is
+# divided
+TEAM_SERVICE_ENVIRONMENTS = 10
+
+
+def _bulk_create(model, objects, **filters):
+    """
+    Create objects (using `bulk_create`) and returns them (fetched again by
+    filters, so they have primary keys on every database).
+
+    :rtype: list
+    """
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+    return list(model.objects.filter(**filters).order_by('id'))
+
+
+def _create_services(dataset, services, prefix):
+    business_line = BusinessLine.objects.create(name=prefix)
+    profit_center = ProfitCenter.objects.create(name=prefix)
+    environment = Environment.objects.get_or_create(name=prefix)[0]
+    dataset.services = _bulk_create(
+        Service,
+        [
+            Service(
+                ci_uid='{}-{}'.format(prefix, i),
+                name='{} service {}'.format(prefix, i),
+                symbol='{}_service_{}'.format(prefix, i),
+                business_line=business_line,
+                profit_center=profit_center,
+            )
+            for i in range(services)
+        ],
+        ci_uid__startswith='{}-'.format(prefix),
+    )
+    dataset.service_environments = _bulk_create(
+        ServiceEnvironment,
+        [
+            ServiceEnvironment(service=service, environment=environment)
+            for service in dataset.services
+        ],
+        environment=environment,
+    )
+
+
+def _create_usage_types(dataset, usage_types, prefix):
+    """
+    Create base usage types (priced by cost) and regular usage types (priced
+    by price) alternately.
+    """
+    dataset.usage_types = []
+    for i in range(usage_types):
+        by_cost = i % 2 == 0
+        usage_type = UsageType.objects.create(
+            name='{} usage type {}'.format(prefix, i),
+            symbol='{}_ut_{}'.format(prefix, i),
+            usage_type='BU' if by_cost else 'RU',
+            by_cost=by_cost,
+        )
+        UsagePrice.objects.create(
+            type=usage_type,
+            start=dataset.start,
+            end=dataset.end,
+            cost=1000 * len(dataset.days) if by_cost else 0,
+            forecast_cost=1500 * len(dataset.days) if by_cost else 0,
+            price=0 if by_cost else D('0.1'),
+            forecast_price=0 if by_cost else D('0.2'),
+        )
+        dataset.usage_types.append(usage_type)
+
+
+def _create_pricing_services(dataset, pricing_services, fanout, prefix):
+    """
+    Create pricing services (each with single service usage type). Pricing
+    service i is owning service i and this service uses next fanout
+    pricing services (so pricing services form acyclic dependency graph).
+    Other services use single pricing service (round-robin).
+
+    :returns: dict with service environment as key and list of service
+        usage types used by service environment as value
+    """
+    dataset.pricing_services = []
+    dataset.service_usage_types = []
+    for i in range(pricing_services):
+        pricing_service = PricingService.objects.create(
+            name='{} pricing service {}'.format(prefix, i),
+            symbol='{}_ps_{}'.format(prefix, i),
+        )
+        service_usage_type = UsageType.objects.create(
+            name='{} service usage type {}'.format(prefix, i),
+            symbol='{}_sut_{}'.format(prefix, i),
+            usage_type='SU',
+        )
+        ServiceUsageTypes.objects.create(
+            usage_type=service_usage_type,
+            pricing_service=pricing_service,
+            start=dataset.start,
+            end=dataset.end,
+            percent=100,
+        )
+        dataset.pricing_services.append(pricing_service)
+        dataset.service_usage_types.append(service_usage_type)
+    used = {}
+    for i, service_environment in enumerate(dataset.service_environments):
+        if i < pricing_services:
+            service = service_environment.service
+            service.pricing_service = dataset.pricing_services[i]
+            service.save(update_fields=['pricing_service'])
+            used[service_environment] = dataset.service_usage_types[
+                i + 1:i + 1 + fanout
+            ]
+        elif pricing_services:
+            used[service_environment] = [
+                dataset.service_usage_types[i % pricing_services]
+            ]
+        else:
+            used[service_environment] = []
+    return used
+
+
+def _create_pricing_objects(dataset, pricing_objects, types, prefix):
+    for type_name in types:
+        type_ = getattr(PRICING_OBJECT_TYPES, type_name)
+        PricingObjectType.objects.get_or_create(
+            id=type_.id, defaults=dict(name=type_.raw)
+        )
+    PricingObject.objects.bulk_create(
+        [
+            PricingObject(
+                name='{} {} {}'.format(prefix, se.id, i),
+                type_id=getattr(PRICING_OBJECT_TYPES, type_name).id,
+                service_environment=se,
+            )
+            for se in dataset.service_environments
+            for type_name in types
+            for i in range(pricing_objects)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    pricing_objects = PricingObject.objects.filter(
+        name__startswith='{} '.format(prefix)
+    ).values_list('id', 'service_environment_id')
+    dataset.daily_pricing_objects = _bulk_create(
+        DailyPricingObject,
+        [
+            DailyPricingObject(
+                date=day,
+                pricing_object_id=pricing_object_id,
+                service_environment_id=se_id,
+            )
+            for day in dataset.days
+            for pricing_object_id, se_id in pricing_objects
+        ],
+        pricing_object__name__startswith='{} '.format(prefix),
+    )
+
+
+def _create_daily_usages(dataset, used_service_usage_types):
+    """
+    Create daily usages of every usage type (and service usage types of
+    used pricing services) for every daily pricing object.
+    """
+    warehouse = Warehouse.objects.get_or_create(name=dataset.prefix)[0]
+    used = {
+        se.id: service_usage_types
+        for se, service_usage_types in used_service_usage_types.items()
+    }
+    usages = []
+    for dpo in dataset.daily_pricing_objects:
+        types = dataset.usage_types + used[dpo.service_environment_id]
+        for i, usage_type in enumerate(types):
+            usages.append(DailyUsage(
+                date=dpo.date,
+                service_environment_id=dpo.service_environment_id,
+                daily_pricing_object=dpo,
+                type=usage_type,
+                warehouse=warehouse,
+                value=(dpo.id * 7 + i * 13) % 10 + 1,
+            ))
+        if len(usages) >= BATCH_SIZE:
+            DailyUsage.objects.bulk_create(usages)
+            usages = []
+    DailyUsage.objects.bulk_create(usages)
+    # daily usages created without signals (see `DailyUsageTotal`)
+    for day in dataset.days:
+        mark_changed(day, dataset.usage_types + dataset.service_usage_types)
+
+
+def _create_teams(dataset, teams, prefix):
+    dataset.teams = []
+    service_environments = dataset.service_environments[
+        :TEAM_SERVICE_ENVIRONMENTS
+    ]
+    for billing_type_name, count in teams.items():
+        billing_type = getattr(TeamBillingType, billing_type_name)
+        for i in range(count):
+            team = Team.objects.create(
+                name='{} team {} {}'.format(prefix, billing_type_name, i),
+                symbol='{}_team_{}_{}'.format(prefix, billing_type_name, i),
+                billing_type=billing_type.id,
+            )
+            team_cost = TeamCost.objects.create(
+                team=team,
+                members_count=i + 1,
+                cost=100 * len(dataset.days),
+                forecast_cost=150 * len(dataset.days),
+                start=dataset.start,
+                end=dataset.end,
+            )
+            if billing_type == TeamBillingType.time:
+                TeamServiceEnvironmentPercent.objects.bulk_create([
+                    TeamServiceEnvironmentPercent(
+                        team_cost=team_cost,
+                        service_environment=se,
+                        percent=100 / len(service_environments),
+                    )
+                    for se in service_environments
+                ])
+            dataset.teams.append(team)
+
+
+def _create_extra_costs(dataset, prefix):
+    extra_cost_type = ExtraCostType.objects.create(
+        name='{} extra cost'.format(prefix),
+        symbol='{}_extra_cost'.format(prefix),
+    )
+    ExtraCost.objects.bulk_create([
+        ExtraCost(
+            extra_cost_type=extra_cost_type,
+            service_environment=se,
+            start=dataset.start,
+            end=dataset.end,
+            cost=10 * len(dataset.days),
+            forecast_cost=15 * len(dataset.days),
+        )
+        for se in dataset.service_environments
+    ])
+
+
+def generate_dataset(
+    start,
+    end,
+    services=10,
+    pricing_objects=5,
+    pricing_object_types=DEFAULT_PRICING_OBJECT_TYPES,
+    usage_types=3,
+    pricing_services=2,
+    pricing_services_fanout=1,
+    teams=DEFAULT_TEAMS,
+    prefix='benchmark',
+):
+    """
+    Generate synthetic dataset between start and end (see module docstring).
+
+    :param services: number of services (and service environments)
+    :param pricing_objects: number of pricing objects of every type (names
+        of `PRICING_OBJECT_TYPES`) in pricing_object_types per service
+        environment
+    :param usage_types: number of usage types (used by every pricing
+        object)
+    :param pricing_services: number of pricing services (every pricing
+        service is owning single service)
+    :param pricing_services_fanout: number of pricing services used by
+        every pricing service
+    :param teams: dict with team billing type (name of `TeamBillingType`)
+        as key and number of teams as value
+    :param prefix: prefix of names (and symbols) of generated objects
+    :rtype: AttributeDict
+    """
+    dataset = AttributeDict(
+        start=start,
+        end=end,
+        prefix=prefix,
+        days=[d.date() for d in rrule.rrule(
+            rrule.DAILY, dtstart=start, until=end
+        )],
+    )
+    _create_services(dataset, services, prefix)
+    _create_usage_types(dataset, usage_types, prefix)
+    used_service_usage_types = _create_pricing_services(
+        dataset, pricing_services, pricing_services_fanout, prefix
+    )
+    _create_pricing_objects(
+        dataset, pricing_objects, pricing_object_types, prefix
+    )
+    _create_daily_usages(dataset, used_service_usage_types)
+    _create_teams(dataset, teams, prefix)
+    _create_extra_costs(dataset, prefix)
+    logger.info(
+        '{} service environments, {} daily pricing objects and {} daily '
+        'usages generated'.format(
+            len(dataset.service_environments),
+            len(dataset.daily_pricing_objects),
+            DailyUsage.objects.filter(
+                daily_pricing_object__in=dataset.daily_pricing_objects
+            ).count(),
+        )
+    )
+    return dataset
+
+
+def _run_collector(dataset, forecast):
+    collector = Collector()
+    dataset.costs = OrderedDict()
+    for day in dataset.days:
+        dataset.costs[day] = collector.process(day, forecast)
+    return sum(len(costs) for costs in dataset.costs.values())
+
+
+def _run_distribute(dataset, forecast):
+    count = 0
+    for day in dataset.days:
+        with calculation_context():
+            for pricing_service in dataset.pricing_services:
+                hierarchy = {pricing_service.id: (D(1000), OrderedDict(
+                    (usage_type.id, (D(1000) / len(dataset.usage_types), {}))
+                    for usage_type in dataset.usage_types
+                ))}
+                count += len(PricingServicePlugin._distribute_costs(
+                    date=day,
+                    pricing_service=pricing_service,
+                    costs_hierarchy=hierarchy,
+                    service_usage_types=(
+                        pricing_service.serviceusagetypes_set.all()
+                    ),
+                    excluded_services=set(),
+                ))
+    return count
+
+
+def _run_save(dataset, forecast):
+    collector = Collector()
+    for day, costs in dataset.get('costs', {}).items():
+        collector.save_period_costs(
+            day,
+            day,
+            forecast,
+            collector._create_daily_costs(day, costs, forecast),
+        )
+    return DailyCost.objects_tree.filter(
+        date__gte=dataset.start,
+        date__lte=dataset.end,
+        forecast=forecast,
+    ).count()
+
+
+def _run_report(dataset, forecast):
+    for finished, progress, data in ServicesCostsReport.get_data(
+        dataset.start, dataset.end, forecast=forecast,
+    ):
+        pass
+    return len(data)
+
+
+def _run_api(dataset, forecast):
+    types = get_valid_types()
+    for service_environment in dataset.service_environments:
+        fetch_costs(
+            service_environment,
+            None,
+            types,
+            dataset.start,
+            dataset.end,
+            'day',
+            forecast=forecast,
+        )
+    return len(dataset.service_environments)
+
+
+# stages in order of running (every stage is returning number of processed
+# items)
+STAGES = OrderedDict([
+    ('collector', _run_collector),
+    ('distribute', _run_distribute),
+    ('save', _run_save),
+    ('report', _run_report),
+    ('api', _run_api),
+])
+
+
+def run_benchmark(dataset, stages=None, forecast=False):
+    """
+    Run (and profile) every stage (in order of `STAGES`; stages `save`,
+    `report` and `api` require results of `collector` stage) for dataset.
+    Number of items processed by stage is saved in `entries` of profile.
+
+    :rtype: list
+    :returns: list of profiles (`Profile`) of stages
+    """
+    stages = stages or list(STAGES)
+    profiles = []
+    clear_memoize_caches()
+    for name, func in STAGES.items():
+        if name not in stages:
+            continue
+        profile = Profile(name)
+        with profile.measure():
+            profile.entries = func(dataset, forecast)
+        logger.info('Stage {} finished in {:.2f}s'.format(
+            name, profile.wall_time
+        ))
+        profiles.append(profile)
+    return profiles
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk writers - save many rows (model instances or namedtuples with model
+fields, ex. built by `MultiPathNode._build_tree`) in database.
+
+* `orm` - Django `bulk_create`
+* `raw` - values are read directly from rows (without ORM per-object field
+  preparation) and loaded using `LOAD DATA LOCAL INFILE` (from TSV buffer) on
+  MySQL (requires `local_infile` option enabled for database connection)
+  or raw `executemany` on other backends.
+
+Writer is selected by `DAILY_COST_BULK_WRITER` setting (see
+`get_bulk_writer`).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import tempfile
+from datetime import datetime
+from decimal import Decimal, Context
+
+from django.conf import settings
+from django.db import connection, models as db
+
+from ralph_scrooge.utils.common import chunks
+
+logger = logging.getLogger(__name__)
+
+TSV_NULL = '\\N'
+TSV_ESCAPES = [('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n')]
+
+
+class BulkWriter(object):
+    """
+    Base bulk writer - saves rows in table of model in batches of batch_size
+    rows.
+    """
+    def __init__(self, model, batch_size=None):
+        self.model = model
+        self.batch_size = batch_size or settings.DAILY_COST_CREATE_BATCH_SIZE
+
+    def write(self, rows):
+        """
+        Save rows (iterable) in database.
+
+        :returns: number of saved rows
+        :rtype: int
+        """
+        count = 0
+        for batch in chunks(rows, self.batch_size):
+            self._write_batch(batch)
+            count += len(batch)
+        return count
+
+    def _write_batch(self, batch):
+        raise NotImplementedError()
+
+
+class OrmBulkWriter(BulkWriter):
+    def _write_batch(self, batch):
+        self.model.objects.bulk_create(batch)
+
+
+class RawBulkWriter(BulkWriter):
+    def __init__(self, *args, **kwargs):
+        super(RawBulkWriter, self).__init__(*args, **kwargs)
+        self.fields = [
+            f for f in self.model._meta.concrete_fields if not f.primary_key
+        ]
+        self.columns = ', '.join(
+            connection.ops.quote_name(f.column) for f in self.fields
+        )
+        self.converters = [self._get_converter(f) for f in self.fields]
+
+    def _get_converter(self, field):
+        """
+        Returns function converting value of field to value passed to
+        database.
+        """
+        if isinstance(field, db.DecimalField):
+            quantum = Decimal(1).scaleb(-field.decimal_places)
+            context = Context(prec=field.max_digits)
+
+            def convert_decimal(value):
+                if value is None:
+                    return None
+                return Decimal(value).quantize(quantum, context=context)
+            return convert_decimal
+        if isinstance(field, db.DateField):
+            adapt = connection.ops.adapt_datefield_value
+
+            def convert_date(value):
+                if isinstance(value, datetime):
+                    value = value.date()
+                return adapt(value)
+            return convert_date
+        return None
+
+    def get_values(self, row):
+        """
+        Returns tuple of values of all (non-pk) fields of row.
+        """
+        return tuple(
+            converter(getattr(row, field.attname)) if converter
+            else getattr(row, field.attname)
+            for field, converter in zip(self.fields, self.converters)
+        )
+
+    def to_tsv(self, batch):
+        """
+        Serialize batch of rows to TSV (in format expected by MySQL
+        `LOAD DATA`).
+
+        :rtype: unicode
+        """
+        lines = []
+        for values in map(self.get_values, batch):
+            line = []
+            for value in values:
+                if value is None:
+                    value = TSV_NULL
+                elif isinstance(value, bool):
+                    value = '1' if value else '0'
+                else:
+                    value = unicode(value)
+                    for char, escaped in TSV_ESCAPES:
+                        value = value.replace(char, escaped)
+                line.append(value)
+            lines.append('\t'.join(line))
+        return '\n'.join(lines) + '\n'
+
+    def _write_batch(self, batch):
+        cursor = connection.cursor()
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        if connection.vendor == 'mysql':
+            with tempfile.NamedTemporaryFile(suffix='.tsv') as f:
+                f.write(self.to_tsv(batch).encode('utf-8'))
+                f.flush()
+                cursor.execute(
+                    """
+                    LOAD DATA LOCAL INFILE %s INTO TABLE {}
+                    CHARACTER SET utf8 ({})
+                    """.format(table, self.columns),
+                    [f.name]
+                )
+        else:
+            cursor.executemany(
+                'INSERT INTO {} ({}) VALUES ({})'.format(
+                    table,
+                    self.columns,
+                    ', '.join(['%s'] * len(self.fields)),
+                ),
+                map(self.get_values, batch)
+            )
+
+
+BULK_WRITERS = {
+    'orm': OrmBulkWriter,
+    'raw': RawBulkWriter,
+}
+
+
+def get_bulk_writer(model, name=None, batch_size=None):
+    """
+    Returns bulk writer for model selected by name (`DAILY_COST_BULK_WRITER`
+    setting by default).
+    """
+    name = name or settings.DAILY_COST_BULK_WRITER
+    return BULK_WRITERS[name](model, batch_size=batch_size)
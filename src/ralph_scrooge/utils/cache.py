@@ -43,11 +43,15 @@ from __future__ import unicode_literals
 
 import cPickle as pickle
 import sys
+import threading
 from functools import wraps
 from time import time
 
 from django.conf import settings
 
+# buffers of all memoized functions (see `clear_memoize_caches`)
+_memoize_caches = []
+
 
 def _memoize(func=None, update_interval=300, max_size=256, skip_first=False):
     """Memoization decorator.
@@ -77,6 +81,11 @@ def _memoize(func=None, update_interval=300, max_size=256, skip_first=False):
 
     cached_values = {'MAX_INDEX': 0}
     lru_indices = {}
+    _memoize_caches.append((cached_values, lru_indices))
+    # buffers could be shared by many threads (ex. cost plugins run
+    # concurrently by collector) - lock is held only when buffers are
+    # accessed (not during calling func)
+    lock = threading.Lock()
 
     @wraps(func)
     def wrapper_standard(*args, **kwargs):
@@ -85,45 +94,65 @@ def _memoize(func=None, update_interval=300, max_size=256, skip_first=False):
         else:
             key = pickle.dumps((args, kwargs))
 
-        max_index = cached_values['MAX_INDEX'] + 1
-        lru_indices[key] = max_index
-
-        if key in cached_values:
-            # get the buffered values and check whether they are up-to-date
-            result, acquisition_time = cached_values[key]
-            if update_interval and time() - acquisition_time > update_interval:
-                del cached_values[key]
-
-        if key not in cached_values:
-            try:
-                result = func(*args, **kwargs)
-            except:
-                del lru_indices[key]
-                raise
+        with lock:
+            if key in cached_values:
+                # get the buffered values and check whether they are
+                # up-to-date
+                result, acquisition_time = cached_values[key]
+                if (
+                    update_interval and
+                    time() - acquisition_time > update_interval
+                ):
+                    del cached_values[key]
+            cached = key in cached_values
+
+        if not cached:
+            result = func(*args, **kwargs)
             acquisition_time = time()
-            cached_values[key] = (result, acquisition_time)
-
-            # clear the least recently used value if the maximum size
-            # of the buffer is exceeded
-            if max_size and len(lru_indices) > max_size:
-                lru_key, _ = min(lru_indices.iteritems(), key=lambda x: x[1])
-                del lru_indices[lru_key]
-                del cached_values[lru_key]
 
-        if max_index == sys.maxint:
-            # renumber indices to avoid hurting performance by using bigints
-            max_index = 0
-            for key, _ in sorted(lru_indices.iteritems(), key=lambda x: x[1]):
-                lru_indices[key] = max_index
-                max_index += 1
-
-        cached_values['MAX_INDEX'] = max_index
+        with lock:
+            max_index = cached_values['MAX_INDEX'] + 1
+            lru_indices[key] = max_index
+            if not cached:
+                cached_values[key] = (result, acquisition_time)
+
+                # clear the least recently used value if the maximum size
+                # of the buffer is exceeded
+                if max_size and len(lru_indices) > max_size:
+                    lru_key, _ = min(
+                        lru_indices.iteritems(), key=lambda x: x[1]
+                    )
+                    del lru_indices[lru_key]
+                    cached_values.pop(lru_key, None)
+
+            if max_index == sys.maxint:
+                # renumber indices to avoid hurting performance by using
+                # bigints
+                max_index = 0
+                for key, _ in sorted(
+                    lru_indices.iteritems(), key=lambda x: x[1]
+                ):
+                    lru_indices[key] = max_index
+                    max_index += 1
+
+            cached_values['MAX_INDEX'] = max_index
 
         return result
 
     return wrapper_standard
 
 
+def clear_memoize_caches():
+    """
+    Clear buffers of all memoized functions (ex. in newly forked worker
+    process, to not use values cached by parent process).
+    """
+    for cached_values, lru_indices in _memoize_caches:
+        cached_values.clear()
+        cached_values['MAX_INDEX'] = 0
+        lru_indices.clear()
+
+
 def memoize_proxy(func=None, *rargs, **rkwargs):
     """
     Memoize decorator proxy (not-caching)
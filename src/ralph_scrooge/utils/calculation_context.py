@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Calculation context - cache living as long as single calculation (ex. costs
+of single day or single report run).
+
+Functions decorated with `cached` are caching their results only in active
+calculation context (see `calculation_context`). When there is no active
+context, they're simply called. Context is active only in the thread which
+opened it (other threads, ex. running cost plugins concurrently, have to
+activate it explicitly) and all cached values are dropped when context is
+closed, so results are never reused between unrelated calculations (no
+timeouts needed) and memory usage of long-living workers is predictable.
+
+Cache keys are built from primitive values, primary keys of model instances
+and SQL of (not evaluated) querysets, which is much cheaper than pickling
+them.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import threading
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Model
+from django.db.models.query import QuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_missing = object()
+
+
+class UncacheableArgumentError(TypeError):
+    pass
+
+
+def make_key(value):
+    """
+    Returns hashable (and cheap to compare) key for value.
+
+    Model instances are represented by model label and primary key, evaluated
+    querysets by model label and primary keys of all objects and not
+    evaluated querysets by model label and SQL query (with params), so no
+    query is made to build the key. Containers (lists, tuples, sets, dicts)
+    are converted recursively.
+    """
+    if isinstance(value, Model):
+        return (value._meta.label, value.pk)
+    if isinstance(value, QuerySet):
+        if value._result_cache is not None:
+            return (value.model._meta.label, tuple(sorted(
+                obj.pk for obj in value._result_cache
+            )))
+        try:
+            sql, params = value.query.get_compiler(value.db).as_sql()
+        except EmptyResultSet:
+            return (value.model._meta.label, ())
+        return (value.model._meta.label, sql, make_key(tuple(params)))
+    if isinstance(value, (list, tuple)):
+        return tuple(make_key(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(make_key(v) for v in value)
+    if isinstance(value, dict):
+        return frozenset((k, make_key(v)) for k, v in value.items())
+    try:
+        hash(value)
+    except TypeError:
+        raise UncacheableArgumentError(
+            'Could not build cache key for {}'.format(type(value))
+        )
+    return value
+
+
+class CalculationContext(object):
+    """
+    Cache (with LRU eviction) for single calculation.
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._counters = defaultdict(lambda: [0, 0])
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get_or_call(self, name, key, func, *args, **kwargs):
+        """
+        Returns value cached for key. If there is no value for key, func is
+        called and it's result is cached.
+
+        :param name: name of function (used in statistics)
+        """
+        with self._lock:
+            value = self._values.pop(key, _missing)
+            if value is not _missing:
+                # move key to the end (most recently used)
+                self._values[key] = value
+                self.hits += 1
+                self._counters[name][0] += 1
+                return value
+            self.misses += 1
+            self._counters[name][1] += 1
+        value = func(*args, **kwargs)
+        with self._lock:
+            self._values[key] = value
+            if self.max_size and len(self._values) > self.max_size:
+                # drop least recently used value
+                self._values.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def get_stats(self):
+        """
+        Returns cache statistics - total hits and misses, current size and
+        hits and misses per function.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._values),
+            'functions': dict(
+                (name, tuple(counters))
+                for name, counters in self._counters.items()
+            ),
+        }
+
+
+def get_active_context():
+    """
+    Returns calculation context active in current thread (or None if there is
+    no active context).
+    """
+    return getattr(_local, 'context', None)
+
+
+@contextmanager
+def activate_context(context):
+    """
+    Make context active in current thread (ex. in thread running cost plugin
+    or while report generator is running). Context is not closed on exit -
+    previously active context is restored.
+    """
+    previous = get_active_context()
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = previous
+
+
+@contextmanager
+def calculation_context(max_size=None):
+    """
+    Open calculation context in current thread (if there is already active
+    context, it's used instead). Cached values are invalidated when
+    (outermost) context is closed.
+    """
+    active = get_active_context()
+    if active is not None:
+        yield active
+        return
+    context = CalculationContext(
+        max_size or settings.CALCULATION_CONTEXT_MAX_SIZE
+    )
+    try:
+        with activate_context(context):
+            yield context
+    finally:
+        close_context(context)
+
+
+def close_context(context):
+    """
+    Drop all values cached in context (and log its statistics).
+    """
+    stats = context.get_stats()
+    logger.info(
+        'Calculation context closed (hits: {}, misses: {}, size: {})'
+        .format(stats['hits'], stats['misses'], stats['size'])
+    )
+    context.clear()
+
+
+def cached(func=None, skip_first=False):
+    """
+    Cache result of func in active calculation context.
+
+    :param skip_first: if True, the first argument (ex. self) won't be added
+        to the cache key (only its class is)
+    """
+    if func is None:
+        def wrapper(f):
+            return cached(func=f, skip_first=skip_first)
+        return wrapper
+
+    name = '{}.{}'.format(func.__module__, func.__name__)
+
+    @wraps(func)
+    def wrapper_standard(*args, **kwargs):
+        context = get_active_context()
+        if context is None:
+            return func(*args, **kwargs)
+        try:
+            if skip_first:
+                owner = args[0]
+                if not isinstance(owner, type):
+                    owner = type(owner)
+                key_args = (owner,) + make_key(args[1:])
+            else:
+                key_args = make_key(args)
+            key = (name, key_args, make_key(kwargs))
+        except UncacheableArgumentError:
+            return func(*args, **kwargs)
+        return context.get_or_call(name, key, func, *args, **kwargs)
+
+    return wrapper_standard
@@ -13,6 +13,7 @@ from datetime import datetime
 from decimal import Decimal
 
 from functools import wraps
+from itertools import islice
 
 from django.conf import settings
 from django.db import connection
@@ -135,6 +136,44 @@ def normalize_decimal(d):
     return d.quantize(Decimal(1)) if d == d.to_integral() else d.normalize()
 
 
+def chunks(iterable, size):
+    """
+    Split iterable into lists of (at most) size elements. Iterable is
+    consumed lazily, so only single chunk is kept in memory at once.
+
+    >>> list(chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def group_consecutive_days(days):
+    """
+    Group (sorted) days into ranges of consecutive days.
+
+    >>> from datetime import date
+    >>> group_consecutive_days([date(2014, 1, 1), date(2014, 1, 2),
+    ...     date(2014, 1, 4)])  # doctest: +NORMALIZE_WHITESPACE
+    [(datetime.date(2014, 1, 1), datetime.date(2014, 1, 2)),
+     (datetime.date(2014, 1, 4), datetime.date(2014, 1, 4))]
+
+    :returns: list of (first day, last day) of every range
+    :rtype: list
+    """
+    ranges = []
+    for day in days:
+        if ranges and (day - ranges[-1][1]).days == 1:
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
 def validate_date(date_):
     try:
         return datetime.strptime(date_, "%Y-%m-%d").date()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Pricing services costs hierarchies saved once per day.
+
+Costs of pricing service are distributed with the whole hierarchy of its
+costs (base usage types, teams, dependent pricing services and their costs
+etc.), so saving every level as daily costs multiplies number of saved rows
+by the depth of pricing services dependency chain. Daily costs of pricing
+service are then saved only up to its costs depth (see `get_costs_depth`),
+and the hierarchy (total cost and children, as calculated by
+`_get_pricing_service_costs` of pricing service plugin) is saved once per
+day (see `DailyPricingServiceCost`). Hierarchies are staged when costs of
+day are calculated and published together with daily costs (see
+`publish_hierarchies`).
+
+Every pricing object gets the same fraction of every node of hierarchy, so
+subcosts of any saved daily cost of pricing service are children of the
+corresponding node of hierarchy, scaled by ratio of the cost to the cost of
+the node (see `get_subcosts`).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import logging
+from collections import OrderedDict
+from decimal import Decimal as D
+
+from django.conf import settings
+from django.db import transaction
+
+from ralph_scrooge.models import (
+    DailyPricingServiceCost,
+    DailyPricingServiceCostStaging,
+)
+from ralph_scrooge.utils.money import from_micro, to_micro
+
+logger = logging.getLogger(__name__)
+
+
+def get_costs_depth(pricing_service):
+    """
+    Returns maximum depth of saved daily costs of pricing service (or other
+    base usage distributed as pricing service, ex. dynamic extra cost type);
+    None if the whole hierarchy of costs should be saved. By default only
+    first level (pricing service cost) is saved, if
+    `SAVE_ONLY_FIRST_DEPTH_COSTS` is enabled.
+
+    :rtype: int
+    """
+    costs_depth = getattr(pricing_service, 'costs_depth', None)
+    if costs_depth is not None:
+        return costs_depth
+    return 0 if settings.SAVE_ONLY_FIRST_DEPTH_COSTS else None
+
+
+def dump_hierarchy(hierarchy):
+    """
+    Returns costs hierarchy (dict with type id as key and tuple (cost,
+    children hierarchy) as value) as JSON.
+
+    :rtype: str
+    """
+    def _dump(hierarchy):
+        return [
+            [type_id, str(cost), _dump(children or {})]
+            for type_id, (cost, children) in hierarchy.items()
+        ]
+    return json.dumps(_dump(hierarchy))
+
+
+def load_hierarchy(data):
+    """
+    Returns costs hierarchy dumped to JSON by `dump_hierarchy`.
+
+    :rtype: OrderedDict
+    """
+    def _load(nodes):
+        return OrderedDict(
+            (type_id, (D(cost), _load(children)))
+            for type_id, cost, children in nodes
+        )
+    return _load(json.loads(data))
+
+
+@transaction.atomic
+def save_hierarchies(date, forecast, hierarchies):
+    """
+    Save hierarchies of pricing services costs calculated for date in
+    staging area. Staged hierarchies are not visible until they're published
+    together with daily costs (see `publish_hierarchies`).
+
+    :param hierarchies: dict with pricing service id as key and tuple
+        (hierarchy, max depth) as value - hierarchy of pricing service costs
+        (as returned by `_get_pricing_service_costs`) and depth to which its
+        daily costs are saved. If hierarchy is None, daily costs of pricing
+        service were saved completely and nothing is staged (previously
+        saved hierarchy is deleted when costs are published).
+    """
+    DailyPricingServiceCostStaging.objects.filter(
+        date=date,
+        forecast=forecast,
+        pricing_service__in=list(hierarchies),
+    ).delete()
+    costs = []
+    for pricing_service_id, (hierarchy, max_depth) in hierarchies.items():
+        if hierarchy is None:
+            continue
+        cost, children = hierarchy[pricing_service_id]
+        costs.append(DailyPricingServiceCostStaging(
+            pricing_service_id=pricing_service_id,
+            date=date,
+            forecast=forecast,
+            cost=cost,
+            max_depth=max_depth,
+            hierarchy=dump_hierarchy(children),
+        ))
+    DailyPricingServiceCostStaging.objects.bulk_create(costs)
+    logger.debug('{} pricing services hierarchies staged for {}'.format(
+        len(costs), date,
+    ))
+
+
+def clear_staged_hierarchies(start, end, forecast):
+    """
+    Delete hierarchies staged between start and end (including forecast
+    flag).
+    """
+    DailyPricingServiceCostStaging.objects.filter(
+        date__gte=start,
+        date__lte=end,
+        forecast=forecast,
+    ).delete()
+
+
+def publish_hierarchies(start, end, forecast, pricing_services=None):
+    """
+    Replace hierarchies saved between start and end with staged ones. Should
+    be called in the same transaction in which staged daily costs are
+    published.
+
+    :param pricing_services: ids of pricing services which hierarchies are
+        replaced (besides the staged ones); all hierarchies of period are
+        replaced if not passed
+    """
+    staged = DailyPricingServiceCostStaging.objects.filter(
+        date__gte=start,
+        date__lte=end,
+        forecast=forecast,
+    )
+    saved = DailyPricingServiceCost.objects.filter(
+        date__gte=start,
+        date__lte=end,
+        forecast=forecast,
+    )
+    if pricing_services is not None:
+        saved = saved.filter(pricing_service__in=set(pricing_services) | set(
+            staged.values_list('pricing_service_id', flat=True)
+        ))
+    saved.delete()
+    costs = [
+        DailyPricingServiceCost(
+            pricing_service_id=ps_cost.pricing_service_id,
+            date=ps_cost.date,
+            forecast=ps_cost.forecast,
+            cost=ps_cost.cost,
+            max_depth=ps_cost.max_depth,
+            hierarchy=ps_cost.hierarchy,
+        )
+        for ps_cost in staged
+    ]
+    DailyPricingServiceCost.objects.bulk_create(costs)
+    staged.delete()
+    logger.debug('{} pricing services hierarchies published for {}-{}'.format(
+        len(costs), start, end,
+    ))
+
+
+def get_subcosts(costs, forecast):
+    """
+    Returns subcosts of daily costs of pricing services, which were not
+    saved (because they're deeper than depth to which daily costs of pricing
+    service were saved).
+
+    :param costs: list of (date, path, cost) - path is list of types ids of
+        daily cost and its ancestors, starting with pricing service
+    :returns: dict with (date, path) as key and list of (type id, cost) of
+        subcosts as value (only for costs which subcosts were not saved)
+    :rtype: dict
+    """
+    costs = [(date, tuple(path), cost) for date, path, cost in costs]
+    saved = {
+        (ps_cost.date, ps_cost.pricing_service_id): ps_cost
+        for ps_cost in DailyPricingServiceCost.objects.filter(
+            date__in=set(date for date, _, _ in costs),
+            pricing_service__in=set(
+                type_id for _, path, _ in costs for type_id in path
+            ),
+            forecast=forecast,
+        )
+    }
+    hierarchies = {}
+
+    def get_node(date, type_id):
+        ps_cost = saved.get((date, type_id))
+        if ps_cost is None:
+            return 0, {}
+        if (date, type_id) not in hierarchies:
+            hierarchies[(date, type_id)] = load_hierarchy(ps_cost.hierarchy)
+        return ps_cost.cost, hierarchies[(date, type_id)]
+
+    result = {}
+    for date, path, cost in costs:
+        ps_cost = saved.get((date, path[0]))
+        # children of cost with such path (at depth len(path)) are saved
+        if ps_cost is None or len(path) <= ps_cost.max_depth:
+            continue
+        node_cost, children = get_node(date, path[0])
+        for type_id in path[1:]:
+            node_cost, children = children.get(type_id, (0, {}))
+            if not children:
+                # costs of dependent pricing service are included in
+                # hierarchy only to its own costs depth - use its own
+                # hierarchy then
+                node_cost, children = get_node(date, type_id)
+        if not children or not node_cost:
+            continue
+        ratio = D(cost) / node_cost
+        result[(date, path)] = [
+            (type_id, from_micro(to_micro(child_cost * ratio)))
+            for type_id, (child_cost, _) in children.items()
+        ]
+    return result
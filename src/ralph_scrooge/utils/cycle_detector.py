@@ -63,3 +63,39 @@ def detect_cycles(date):
     for node in graph.keys():
         cycles.extend(_detect_cycles(node, graph, visited, ps_stack))
     return cycles
+
+
+def get_pricing_services_levels(date):
+    """
+    Returns PricingServices grouped in levels of charging graph for given date
+    (topological order). PricingServices from every level are charged only by
+    PricingServices from previous levels, so level could be calculated when
+    all previous levels are already calculated.
+
+    PricingServices which are part of cycle (if there is any) are put together
+    on last level.
+
+    Returns:
+        list of lists of PricingServices
+    """
+    graph = _get_pricing_services_graph(date)
+    pricing_services = list(PricingService.objects.order_by('id'))
+    in_degree = dict((ps, 0) for ps in pricing_services)
+    for dependants in graph.values():
+        for ps in dependants:
+            in_degree[ps] = in_degree.get(ps, 0) + 1
+    levels = []
+    current = [ps for ps in pricing_services if in_degree[ps] == 0]
+    while current:
+        levels.append(current)
+        next_level = set()
+        for node in current:
+            for ps in graph.get(node, []):
+                in_degree[ps] -= 1
+                if in_degree[ps] == 0:
+                    next_level.add(ps)
+        current = [ps for ps in pricing_services if ps in next_level]
+    remaining = [ps for ps in pricing_services if in_degree[ps] > 0]
+    if remaining:
+        levels.append(remaining)
+    return levels
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-point money arithmetic.
+
+Money is represented as integer number of micro-units (1 / 10 ^ PRICE_PLACES,
+which is the precision in which costs are stored in database). Integer
+arithmetic is much faster than `Decimal` and (together with `allocate`) allows
+to split costs without any rounding drift - parts are always summing up
+exactly to the split total.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from decimal import Decimal as D, ROUND_HALF_UP
+from fractions import gcd
+
+from ralph_scrooge.models.extra_cost import PRICE_PLACES
+
+MICRO_UNITS = 10 ** PRICE_PLACES
+# precision of weights quantised by `to_weights` (fractions of total are
+# stored as integer number of 1 / 10 ^ WEIGHT_PLACES)
+WEIGHT_PLACES = 12
+WEIGHT_UNITS = 10 ** WEIGHT_PLACES
+
+
+def to_micro(value):
+    """
+    Returns value (Decimal, float or int) as (rounded) number of micro-units.
+
+    :rtype: int
+    """
+    if isinstance(value, (int, long)):
+        return value * MICRO_UNITS
+    return int((D(value) * MICRO_UNITS).to_integral_value(ROUND_HALF_UP))
+
+
+def from_micro(micro):
+    """
+    Returns number of micro-units as Decimal (with PRICE_PLACES decimal
+    places).
+
+    :rtype: Decimal
+    """
+    # parsing exponent notation is much faster than `Decimal.scaleb`
+    return D('{}e-{}'.format(micro, PRICE_PLACES))
+
+
+def to_weights(values):
+    """
+    Returns values (ints, floats or Decimals, ex. fractions of total) as
+    (rounded) integer number of 1 / WEIGHT_UNITS. Such weights could be
+    passed to `allocate` (with total_weight in the same units) any number of
+    times without converting them again.
+
+    :rtype: list of ints
+    """
+    return [
+        int((D(value) * WEIGHT_UNITS).to_integral_value(ROUND_HALF_UP))
+        for value in values
+    ]
+
+
+def _as_integer_ratio(value):
+    """
+    Returns exact (numerator, denominator) of value (int, float or Decimal).
+    """
+    if isinstance(value, (int, long)):
+        return value, 1
+    if isinstance(value, float):
+        return value.as_integer_ratio()
+    sign, digits, exponent = D(value).as_tuple()
+    numerator = 0
+    for digit in digits:
+        numerator = numerator * 10 + digit
+    if sign:
+        numerator = -numerator
+    if exponent >= 0:
+        return numerator * 10 ** exponent, 1
+    return numerator, 10 ** -exponent
+
+
+def _to_integers(values):
+    """
+    Returns values (ints, floats or Decimals) scaled to integers by the same
+    (common) factor.
+    """
+    if all(isinstance(value, (int, long)) for value in values):
+        return values
+    ratios = [_as_integer_ratio(value) for value in values]
+    denominator = 1
+    for _, d in ratios:
+        denominator = denominator * d // gcd(denominator, d)
+    return [n * (denominator // d) for n, d in ratios]
+
+
+def allocate(total, weights, total_weight=None):
+    """
+    Split total (in micro-units) into parts proportional to weights, using
+    largest remainder method - every part is rounded down and remaining
+    micro-units are given to parts with largest remainders (first ones, if
+    remainders are equal).
+
+    By default whole total is allocated (parts are summing up exactly to
+    total). If total_weight is passed, every part is equal to
+    `total * weight / total_weight` (ex. to allocate only some fraction of
+    total when weights are not summing up to total_weight) - then parts are
+    summing up to such (rounded) fraction of total.
+
+    :param total: total to split (in micro-units)
+    :type total: int
+    :param weights: list of (non-negative) weights (ints, floats or Decimals)
+    :param total_weight: weight of the whole total (defaults to sum of
+        weights)
+    :rtype: list of ints
+    """
+    if total < 0:
+        return [-part for part in allocate(-total, weights, total_weight)]
+    values = list(weights)
+    if total_weight is not None:
+        values.append(total_weight)
+    values = _to_integers(values)
+    if total_weight is not None:
+        total_weight = values.pop()
+        # total * sum(weights) / total_weight rounded half up
+        target = (
+            (2 * total * sum(values) + total_weight) // (2 * total_weight)
+            if total_weight else 0
+        )
+    else:
+        total_weight = sum(values)
+        target = total if total_weight else 0
+    if not total_weight:
+        return [0] * len(values)
+    parts = []
+    remainders = []
+    for i, weight in enumerate(values):
+        part, remainder = divmod(total * weight, total_weight)
+        parts.append(part)
+        remainders.append((-remainder, i))
+    remaining = target - sum(parts)
+    if remaining > 0:
+        for _, i in sorted(remainders)[:remaining]:
+            parts[i] += 1
+    return parts
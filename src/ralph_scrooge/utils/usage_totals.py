@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Maintenance of daily usages totals (see `DailyUsageTotal`).
+
+Totals are updated incrementally on every save and delete of single daily
+usage (using model signals - ex. collect plugins or admin). Previous state of
+updated daily usage is fetched only when it's saved (not when it's loaded,
+so reading daily usages is not slowed down). Changes which don't send
+signals (ex. `bulk_create` or `update`) should be registered using
+`mark_changed`. Daily usages could be deleted in bulk (without fetching them
+and sending signals) using `delete_daily_usages`.
+
+For bulk changes (ex. collect plugins or usages posted through API) updating
+totals after every single change could be replaced by recalculation of
+totals of every changed usage type and day (once) at the end of
+`defer_daily_usage_totals` context. Previous state of daily usage is not
+fetched in this context - only date and usage type of updated daily usage
+are registered (so changes of date or usage type of existing daily usage
+have to be registered using `mark_changed`).
+
+Totals could be rebuilt using `scrooge_rebuild_usage_totals` command.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import sys
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import six
+
+from ralph_scrooge.models import DailyUsage, DailyUsageTotal
+from ralph_scrooge.utils.common import chunks
+
+logger = logging.getLogger(__name__)
+
+# (date, usage type id) pairs changed in deferred context active in current
+# thread are kept in `changed` attribute (None if there is no active context)
+_local = threading.local()
+
+_KEY_FIELDS = ('date', 'type_id', 'warehouse_id', 'service_environment_id')
+_STATE_FIELDS = _KEY_FIELDS + ('value',)
+
+
+def _get_state(daily_usage):
+    """
+    Returns key of total (date, type, warehouse and service environment) and
+    value of daily usage or None if any of them is unknown (ex. deferred).
+    Values are read directly from instance dict, so deferred fields are
+    never fetched from database.
+    """
+    return _as_state(tuple(
+        daily_usage.__dict__.get(field) for field in _STATE_FIELDS
+    ))
+
+
+def _as_state(values):
+    if values is None or None in values:
+        return None
+    return values[:-1], values[-1]
+
+
+def _add_to_total(key, value, count):
+    """
+    Add value and count to total of key (creating or deleting total if
+    needed).
+    """
+    filters = dict(zip(_KEY_FIELDS, key))
+    updated = DailyUsageTotal.objects.filter(**filters).update(
+        value=F('value') + value,
+        count=F('count') + count,
+    )
+    if updated:
+        if count < 0:
+            DailyUsageTotal.objects.filter(count__lte=0, **filters).delete()
+        return
+    if count <= 0:
+        return
+    try:
+        with transaction.atomic():
+            DailyUsageTotal.objects.create(
+                value=value, count=count, **filters
+            )
+    except IntegrityError:
+        # total created in the meantime
+        _add_to_total(key, value, count)
+
+
+def _get_changed():
+    return getattr(_local, 'changed', None)
+
+
+def _refresh_or_mark(date, usage_type_id):
+    changed = _get_changed()
+    if changed is not None:
+        changed.add((date, usage_type_id))
+    else:
+        refresh_daily_usage_totals(date, [usage_type_id])
+
+
+@receiver(pre_save, sender=DailyUsage)
+def _remember_state(sender, instance, raw=False, **kwargs):
+    """
+    Remember state of daily usage stored in database, before it's updated
+    (totals are updated incrementally only outside of deferred context).
+    """
+    instance._usage_total_state = None
+    if (
+        raw or
+        instance._state.adding or
+        instance.pk is None or
+        _get_changed() is not None
+    ):
+        return
+    instance._usage_total_state = _as_state(
+        DailyUsage.objects.filter(pk=instance.pk).values_list(
+            *_STATE_FIELDS
+        ).first()
+    )
+
+
+@receiver(post_save, sender=DailyUsage)
+def _update_total_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changed = _get_changed()
+    if changed is not None:
+        changed.add((instance.date, instance.type_id))
+        return
+    old_state = None if created else instance._usage_total_state
+    new_state = _get_state(instance)
+    if old_state == new_state and not created:
+        return
+    if new_state is None or (old_state is None and not created):
+        # previous (or current) state is unknown - recalculate totals
+        _refresh_or_mark(instance.date, instance.type_id)
+        return
+    if old_state:
+        _add_to_total(old_state[0], -old_state[1], -1)
+    _add_to_total(new_state[0], new_state[1], 1)
+
+
+@receiver(post_delete, sender=DailyUsage)
+def _update_total_on_delete(sender, instance, **kwargs):
+    state = _get_state(instance)
+    changed = _get_changed()
+    if state is None:
+        _refresh_or_mark(instance.date, instance.type_id)
+    elif changed is not None:
+        changed.add(state[0][:2])
+    else:
+        _add_to_total(state[0], -state[1], -1)
+
+
+def mark_changed(date, usage_types):
+    """
+    Register change of daily usages of usage_types (usage types or their
+    ids) in date, which was made without sending signals (ex. using
+    `bulk_create`). Totals are recalculated immediately or at the end of
+    active `defer_daily_usage_totals` context.
+    """
+    for usage_type in usage_types:
+        _refresh_or_mark(date, getattr(usage_type, 'id', usage_type))
+
+
+@transaction.atomic
+def delete_daily_usages(daily_usages, chunk_size=1000):
+    """
+    Delete daily usages (queryset) without fetching them and sending signals
+    (using raw delete of chunks of their ids) and register change of totals of
+    their usage types (see `mark_changed`).
+
+    :returns: number of deleted daily usages
+    :rtype: int
+    """
+    changed = set(
+        daily_usages.order_by().values_list('date', 'type_id').distinct()
+    )
+    ids = list(daily_usages.order_by().values_list('pk', flat=True))
+    cursor = connection.cursor()
+    deleted = 0
+    for chunk in chunks(ids, chunk_size):
+        cursor.execute(
+            'DELETE FROM {table} WHERE {pk} IN ({ids})'.format(
+                table=connection.ops.quote_name(DailyUsage._meta.db_table),
+                pk=connection.ops.quote_name(DailyUsage._meta.pk.column),
+                ids=', '.join(['%s'] * len(chunk)),
+            ),
+            chunk,
+        )
+        deleted += cursor.rowcount
+    for date, usage_type_id in changed:
+        mark_changed(date, [usage_type_id])
+    return deleted
+
+
+@contextmanager
+def defer_daily_usage_totals():
+    """
+    Defer maintenance of daily usages totals - totals of every usage type and
+    day changed in context are recalculated once, at the end of context.
+
+    Context is active only in current thread.
+    """
+    if _get_changed() is not None:
+        yield
+        return
+    _local.changed = set()
+    try:
+        yield
+    except:
+        exc_info = sys.exc_info()
+        changed, _local.changed = _local.changed, None
+        # changes made before error could be already saved
+        try:
+            _refresh_changed(changed)
+        except Exception:
+            logger.exception('Could not refresh daily usages totals')
+        six.reraise(*exc_info)
+    else:
+        changed, _local.changed = _local.changed, None
+        _refresh_changed(changed)
+
+
+def _refresh_changed(changed):
+    per_date = defaultdict(set)
+    for date, usage_type_id in changed:
+        per_date[date].add(usage_type_id)
+    for date, usage_types_ids in sorted(per_date.items()):
+        refresh_daily_usage_totals(date, usage_types_ids)
+
+
+def _insert_totals(start, end, usage_types_ids=None):
+    """
+    Insert totals of daily usages between start and end (for usage_types_ids
+    only, if passed) calculated in database (in single query).
+    """
+    conditions = ['date>=%s', 'date<=%s']
+    params = [start, end]
+    if usage_types_ids is not None:
+        conditions.append('type_id IN ({})'.format(
+            ', '.join(['%s'] * len(usage_types_ids))
+        ))
+        params.extend(usage_types_ids)
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        INSERT INTO {totals}
+            (date, type_id, warehouse_id, service_environment_id, value,
+            count)
+        SELECT date, type_id, warehouse_id, service_environment_id,
+            SUM(value), COUNT(*)
+        FROM {usages}
+        WHERE {conditions}
+        GROUP BY date, type_id, warehouse_id, service_environment_id
+        """.format(
+            totals=DailyUsageTotal._meta.db_table,
+            usages=DailyUsage._meta.db_table,
+            conditions=' AND '.join(conditions),
+        ),
+        params
+    )
+
+
+@transaction.atomic
+def refresh_daily_usage_totals(date, usage_types_ids=None):
+    """
+    Recalculate totals of daily usages of date (of usage_types_ids only, if
+    passed).
+    """
+    totals = DailyUsageTotal.objects.filter(date=date)
+    if usage_types_ids is not None:
+        usage_types_ids = sorted(usage_types_ids)
+        if not usage_types_ids:
+            return
+        totals = totals.filter(type_id__in=usage_types_ids)
+    totals.delete()
+    _insert_totals(date, date, usage_types_ids)
+
+
+def get_usages_model():
+    """
+    Returns model which should be used to calculate sums of usages (grouped
+    by date, usage type, warehouse or service environment) -
+    `DailyUsageTotal` if `USE_DAILY_USAGE_TOTALS` is enabled or
+    `DailyUsage` otherwise. Both models have the same fields used for
+    grouping and `value` field.
+    """
+    if settings.USE_DAILY_USAGE_TOTALS:
+        return DailyUsageTotal
+    return DailyUsage
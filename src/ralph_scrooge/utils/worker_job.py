@@ -6,19 +6,156 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import logging
+import threading
 import urllib
+from collections import OrderedDict
 
 import django_rq
+from django.conf import settings
 from django.core.cache import caches as dj_caches
 from django.core.cache.backends.dummy import DummyCache
-from rq.job import Job
+from redis import RedisError
+from rq import get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.utils import utcnow
+
+from ralph_scrooge.utils.common import get_queue_name
 
 
 logger = logging.getLogger(__name__)
 
+# priority lanes of jobs (see `WorkerJob.lane`)
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+# Redis keys of jobs statistics (see `get_jobs_stats`): names of job classes,
+# ids of running jobs of class (sorted set, scored by time of last heartbeat)
+# and recent wait times of jobs of class (from enqueuing to start, in seconds)
+_JOB_CLASSES_KEY = 'scrooge_jobs:classes'
+_RUNNING_JOBS_KEY = 'scrooge_jobs:running:{}'
+# ids of jobs of class deferred until one of running jobs of class is
+# finished (sorted set, scored by time of deferring - see `WorkerJob._defer`)
+_DEFERRED_JOBS_KEY = 'scrooge_jobs:deferred:{}'
+_WAIT_TIMES_KEY = 'scrooge_jobs:wait:{}'
+# number of recent wait times kept for every job class
+WAIT_TIMES_COUNT = 100
+
+# Lua scripts updating sorted sets of jobs - jobs are scored by time of Redis
+# server (not of worker host), so clock skew between hosts of workers doesn't
+# change order of jobs or pruning of running jobs without heartbeat.
+# `redis.replicate_commands` allows writes after (non deterministic) `TIME`
+# in Redis 3.2 - 4 (it's the default since Redis 5).
+_NOW_LUA = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+"""
+# KEYS: sorted set; ARGV: job id, expire of sorted set (in seconds, 0 means
+# no expire)
+_ZADD_NOW_SCRIPT = _NOW_LUA + """
+redis.call('ZADD', KEYS[1], now, ARGV[1])
+local expire = math.ceil(tonumber(ARGV[2]))
+if expire > 0 then
+    redis.call('EXPIRE', KEYS[1], expire)
+end
+"""
+# KEYS: running jobs; ARGV: heartbeat timeout (in seconds); returns number of
+# running jobs (without jobs with no heartbeat for timeout)
+_PRUNE_RUNNING_SCRIPT = _NOW_LUA + """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - tonumber(ARGV[1]))
+return redis.call('ZCARD', KEYS[1])
+"""
+# KEYS: running jobs; ARGV: job id, heartbeat timeout (in seconds), limit of
+# running jobs (0 means no limit); returns 1 if job is admitted, 0 otherwise
+_ADMIT_SCRIPT = _NOW_LUA + """
+local timeout = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - timeout)
+if limit > 0 and redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(timeout))
+return 1
+"""
+
 
 def _get_cache_key(cache_section, **kwargs):
-    return b'{}?{}'.format(cache_section, urllib.urlencode(kwargs))
+    # kwargs are sorted, so the same job is found (and not calculated again)
+    # regardless of order of kwargs
+    return b'{}?{}'.format(
+        cache_section, urllib.urlencode(sorted(kwargs.items()))
+    )
+
+
+def get_jobs_stats(connection=None):
+    """
+    Returns statistics of jobs: depth of every queue and number of running
+    jobs and wait times (from enqueuing to start) of recent jobs of every job
+    class.
+
+    :returns: dicts with queues depths (queue name as key) and jobs
+        statistics (job class name as key)
+    :rtype: tuple
+    """
+    connection = connection or django_rq.get_connection()
+    queues = OrderedDict(
+        (name, django_rq.get_queue(name).count)
+        for name in sorted(settings.RQ_QUEUES)
+    )
+    jobs = OrderedDict()
+    for name in sorted(connection.smembers(_JOB_CLASSES_KEY)):
+        name = name.decode('utf-8')
+        wait_times = sorted(
+            float(wait_time) for wait_time in
+            connection.lrange(_WAIT_TIMES_KEY.format(name), 0, -1)
+        )
+        jobs[name] = {
+            'running': connection.zcard(_RUNNING_JOBS_KEY.format(name)),
+            'count': len(wait_times),
+            'wait_avg': (
+                sum(wait_times) / len(wait_times) if wait_times else 0
+            ),
+            'wait_median': (
+                wait_times[len(wait_times) // 2] if wait_times else 0
+            ),
+            'wait_max': wait_times[-1] if wait_times else 0,
+        }
+    return queues, jobs
+
+
+class Heartbeat(threading.Thread):
+    """
+    Thread refreshing score (time of last heartbeat, by clock of Redis server)
+    of running job in sorted set of running jobs (see `WorkerJob._admit`)
+    until it's stopped.
+    """
+    def __init__(self, connection, key, job_id, timeout):
+        super(Heartbeat, self).__init__(name='heartbeat-{}'.format(job_id))
+        self.daemon = True
+        self.connection = connection
+        self.key = key
+        self.job_id = job_id
+        self.timeout = timeout
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.timeout / 3):
+            try:
+                self.connection.register_script(_ZADD_NOW_SCRIPT)(
+                    keys=[self.key], args=[self.job_id, self.timeout]
+                )
+            except RedisError as e:
+                logger.warning('Heartbeat of job {} failed: {}'.format(
+                    self.job_id, e
+                ))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
 
 
 class WorkerJob(object):
@@ -33,6 +170,17 @@ class WorkerJob(object):
     cache_final_result_timeout = 60 * 10  # 10 minutes for final result
     progress_update = 5  # update cache every 5% of progress
     _return_job_meta = False  # if True return job metadata in _worker_func too
+    # if True, job pushes to Redis list (see `_get_done_key`) when it's done,
+    # so it could be awaited without polling (see `wait_for_done`)
+    notify_done = False
+    # priority lane of job (see `get_lane`) - interactive jobs are put at the
+    # front of queue, batch jobs at its end; if queue `<queue_name>_<lane>`
+    # is configured, jobs of lane are put there instead (so lanes could be
+    # served by separate workers)
+    lane = INTERACTIVE
+    # max number of jobs of this class running at the same time (None means
+    # no limit) - could be changed by `SCROOGE_JOBS_MAX_RUNNING` setting
+    max_running_jobs = None
 
     @classmethod
     def _clear_cache(cls, **kwargs):
@@ -40,6 +188,185 @@ class WorkerJob(object):
         key = _get_cache_key(cls.cache_section, **kwargs)
         cache.set(key, None)
 
+    @classmethod
+    def _get_done_key(cls, **kwargs):
+        return _get_cache_key(cls.cache_section + ':done', **kwargs)
+
+    @classmethod
+    def get_lane(cls, **kwargs):
+        """
+        Returns priority lane of job with kwargs (`INTERACTIVE` or `BATCH`).
+        """
+        return cls.lane
+
+    @classmethod
+    def get_max_running_jobs(cls):
+        return settings.SCROOGE_JOBS_MAX_RUNNING.get(
+            cls.__name__, cls.max_running_jobs
+        )
+
+    @classmethod
+    def _get_queue(cls, lane):
+        return django_rq.get_queue(get_queue_name(
+            '{}_{}'.format(cls.queue_name, lane), cls.queue_name
+        ))
+
+    @classmethod
+    def _at_front(cls, queue, lane):
+        return lane == INTERACTIVE and queue.name == cls.queue_name
+
+    @classmethod
+    def _enqueue(cls, kwargs, lane, meta=None):
+        """
+        Enqueue job with kwargs in priority lane.
+        """
+        queue = cls._get_queue(lane)
+        meta = dict(meta or {}, lane=lane)
+        # time of the first enqueuing (job could be deferred, when limit of
+        # running jobs is reached)
+        meta.setdefault('enqueued_at', utcnow())
+        job = queue.enqueue_call(
+            func=cls._worker_func,
+            kwargs=kwargs,
+            timeout=cls.work_timeout,
+            result_ttl=cls.cache_final_result_timeout,
+            at_front=cls._at_front(queue, lane),
+            meta=meta,
+        )
+        queue.connection.sadd(_JOB_CLASSES_KEY, cls.__name__)
+        return job
+
+    @classmethod
+    def _defer(cls, kwargs, lane, meta):
+        """
+        Create job with kwargs, which is enqueued (in priority lane) when one
+        of running jobs of this class is finished (see `_enqueue_deferred`).
+        """
+        queue = cls._get_queue(lane)
+        job = Job.create(
+            func=cls._worker_func,
+            kwargs=kwargs,
+            connection=queue.connection,
+            timeout=cls.work_timeout,
+            result_ttl=cls.cache_final_result_timeout,
+            status=JobStatus.DEFERRED,
+            origin=queue.name,
+            meta=dict(meta, lane=lane),
+        )
+        job.save()
+        queue.connection.register_script(_ZADD_NOW_SCRIPT)(
+            keys=[_DEFERRED_JOBS_KEY.format(cls.__name__)], args=[job.id, 0]
+        )
+        # running job could be finished in the meantime
+        cls._enqueue_deferred(queue.connection)
+        return job
+
+    @classmethod
+    def _enqueue_deferred(cls, connection):
+        """
+        Enqueue (in their lanes) the oldest deferred jobs of this class - as
+        many as limit of running jobs allows.
+        """
+        limit = cls.get_max_running_jobs()
+        end = -1
+        if limit:
+            running = connection.register_script(_PRUNE_RUNNING_SCRIPT)(
+                keys=[_RUNNING_JOBS_KEY.format(cls.__name__)],
+                args=[settings.SCROOGE_JOBS_HEARTBEAT_TIMEOUT],
+            )
+            end = limit - running - 1
+            if end < 0:
+                return
+        key = _DEFERRED_JOBS_KEY.format(cls.__name__)
+        for job_id in connection.zrange(key, 0, end):
+            # job could be enqueued by another worker in the meantime
+            if not connection.zrem(key, job_id):
+                continue
+            try:
+                job = Job.fetch(job_id.decode('utf-8'), connection)
+            except NoSuchJobError:
+                continue
+            lane = job.meta.get('lane', cls.lane)
+            queue = cls._get_queue(lane)
+            queue.enqueue_job(job, at_front=cls._at_front(queue, lane))
+
+    @classmethod
+    def _admit(cls, job):
+        """
+        Register job as running. Returns False (and unregisters job), if
+        limit of running jobs of this class is reached (see
+        `get_max_running_jobs`).
+
+        Jobs are registered in Redis sorted set (by time of last heartbeat -
+        see `Heartbeat`) - jobs without heartbeat for
+        `SCROOGE_JOBS_HEARTBEAT_TIMEOUT` seconds (ex. killed together with
+        worker) are removed from it. Pruning, counting of running jobs and
+        registering of job are done atomically (in Lua script), so
+        concurrently started jobs never exceed the limit.
+        """
+        admitted = job.connection.register_script(_ADMIT_SCRIPT)(
+            keys=[_RUNNING_JOBS_KEY.format(cls.__name__)],
+            args=[
+                job.id,
+                settings.SCROOGE_JOBS_HEARTBEAT_TIMEOUT,
+                cls.get_max_running_jobs() or 0,
+            ],
+        )
+        if not admitted:
+            return False
+        wait_time = (utcnow() - job.meta.get(
+            'enqueued_at', job.enqueued_at
+        )).total_seconds()
+        key = _WAIT_TIMES_KEY.format(cls.__name__)
+        pipeline = job.connection.pipeline()
+        pipeline.lpush(key, wait_time)
+        pipeline.ltrim(key, 0, WAIT_TIMES_COUNT - 1)
+        pipeline.execute()
+        return True
+
+    @classmethod
+    def _release(cls, job):
+        """
+        Unregister running job (see `_admit`) and enqueue job deferred in
+        the meantime (if any).
+        """
+        job.connection.zrem(_RUNNING_JOBS_KEY.format(cls.__name__), job.id)
+        cls._enqueue_deferred(job.connection)
+
+    @classmethod
+    def _notify_done(cls, **kwargs):
+        """
+        Push to Redis list of job (with given kwargs) that it's done. List
+        (unlike pubsub) keeps notification even if no one is waiting for it
+        yet.
+        """
+        key = cls._get_done_key(**kwargs)
+        pipeline = django_rq.get_connection(cls.queue_name).pipeline()
+        pipeline.rpush(key, 1)
+        pipeline.expire(key, cls.cache_final_result_timeout)
+        pipeline.execute()
+
+    @classmethod
+    def wait_for_done(cls, kwargs_list, timeout):
+        """
+        Block until one of jobs (every job is identified by its kwargs) is
+        done (see `notify_done`) or until timeout (in seconds) is reached.
+
+        Every notification is received only once, so if the same job is
+        awaited by many clients, only one of them is notified.
+
+        :returns: kwargs of finished job or None if timeout was reached
+        :rtype: dict
+        """
+        keys = OrderedDict(
+            (cls._get_done_key(**kwargs), kwargs) for kwargs in kwargs_list
+        )
+        if not keys:
+            return None
+        connection = django_rq.get_connection(cls.queue_name)
+        popped = connection.blpop(list(keys), timeout=timeout)
+        return keys[popped[0]] if popped else None
+
     def get_rq_job(self, job_id):
         """
         Return RQ Job
@@ -50,7 +377,30 @@ class WorkerJob(object):
         connection = django_rq.get_connection(self.queue_name)
         return Job.fetch(job_id, connection)
 
-    def run_on_worker(self, **kwargs):
+    def _follow_deferred(self, job):
+        """
+        Returns job deferred by job (and by job deferred by it etc.) when
+        limit of running jobs was reached (see `_worker_func`) - such job is
+        finished (without result), but its work is done by deferred job.
+        """
+        while job.is_finished:
+            # meta could be saved after job was fetched
+            job.refresh()
+            deferred_to = job.meta.get('deferred_to')
+            if not deferred_to:
+                break
+            job = self.get_rq_job(deferred_to)
+        return job
+
+    def run_on_worker(self, lane=None, **kwargs):
+        """
+        Run job with kwargs on worker (in priority lane - see `get_lane` by
+        default) or return its progress and result, if it's already
+        running (or finished).
+
+        Jobs are deduplicated by cache section and kwargs (regardless of
+        their order).
+        """
         cache = dj_caches[self.cache_name]
         if isinstance(cache, DummyCache):
             # No caching or queues with dummy cache.
@@ -62,7 +412,18 @@ class WorkerJob(object):
             progress, job_id, data = cached
             job = self.get_rq_job(job_id)
             if progress < 100 and job_id is not None:
-                if job.is_finished:
+                job = self._follow_deferred(job)
+                if job.id != job_id:
+                    job_id = job.id
+                    cache.set(
+                        key,
+                        (progress, job_id, data),
+                        timeout=self.cache_timeout,
+                    )
+                if job.get_status() == JobStatus.DEFERRED:
+                    # running job could be killed without releasing its slot
+                    self._enqueue_deferred(job.connection)
+                elif job.is_finished:
                     data = job.result
                     progress = 100
                     cache.set(
@@ -75,13 +436,7 @@ class WorkerJob(object):
                     progress = 100
                     cache.delete(key)
         else:
-            queue = django_rq.get_queue(self.queue_name)
-            job = queue.enqueue_call(
-                func=self._worker_func,
-                kwargs=kwargs,
-                timeout=self.work_timeout,
-                result_ttl=self.cache_final_result_timeout,
-            )
+            job = self._enqueue(kwargs, lane or self.get_lane(**kwargs))
             progress = 0
             data = None
             cache.set(
@@ -101,6 +456,41 @@ class WorkerJob(object):
         """
         cache = dj_caches[cls.cache_name]
         key = _get_cache_key(cls.cache_section, **kwargs)
+        job = get_current_job()
+        if job is None:
+            return cls._run_and_cache(cache, key, **kwargs)
+        if not cls._admit(job):
+            # limit of running jobs is reached - job is deferred until one of
+            # running jobs is finished (worker is not blocked) and clients
+            # are following the new one
+            logger.info('Limit of running {} jobs reached'.format(
+                cls.__name__
+            ))
+            new_job = cls._defer(
+                kwargs, job.meta.get('lane', cls.lane), dict(job.meta)
+            )
+            # job is finished when it returns - clients which have not seen
+            # new job in cache yet are following it from this job (see
+            # `_follow_deferred`)
+            job.meta['deferred_to'] = new_job.id
+            job.save()
+            cache.set(key, (0, new_job.id, None), timeout=cls.cache_timeout)
+            return None
+        heartbeat = Heartbeat(
+            job.connection,
+            _RUNNING_JOBS_KEY.format(cls.__name__),
+            job.id,
+            settings.SCROOGE_JOBS_HEARTBEAT_TIMEOUT,
+        )
+        heartbeat.start()
+        try:
+            return cls._run_and_cache(cache, key, **kwargs)
+        finally:
+            heartbeat.stop()
+            cls._release(job)
+
+    @classmethod
+    def _run_and_cache(cls, cache, key, **kwargs):
         cached = cache.get(key)
         if cached is not None:
             job_id = cached[1]
@@ -127,6 +517,10 @@ class WorkerJob(object):
             (progress, job_id, data),
             timeout=cls.cache_final_result_timeout,
         )
+        # notify when final result is already in cache (failed jobs are not
+        # notified - they're found by clients checking jobs periodically)
+        if cls.notify_done and job_id is not None:
+            cls._notify_done(**kwargs)
         return data
 
     @classmethod